@@ -1,13 +1,15 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from core.admin_mixins import RelatedLabelsMixin
 from .models import User
 
 
 @admin.register(User)
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(RelatedLabelsMixin, UserAdmin):
     list_display = ('username', 'email', 'role', 'is_verified', 'is_active', 'date_joined')
     list_filter = ('role', 'is_verified', 'is_active', 'date_joined')
     search_fields = ('username', 'email', 'first_name', 'last_name')
+    autocomplete_search_fields = ('^username', '^email', '^first_name', '^last_name')
     ordering = ('-date_joined',)
     
     fieldsets = UserAdmin.fieldsets + (
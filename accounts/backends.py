@@ -0,0 +1,13 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .cache import get_cached_user
+
+
+class CachedModelBackend(ModelBackend):
+    """Model backend that loads the session user from a cached snapshot"""
+
+    def get_user(self, user_id):
+        user = get_cached_user(user_id)
+        if user is None:
+            return None
+        return user if self.user_can_authenticate(user) else None
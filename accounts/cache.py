@@ -0,0 +1,147 @@
+"""
+Cached user snapshots for authentication.
+
+Every authenticated request needs the ``User`` row and artisan pages also
+need to know whether the user has an ``ArtisanProfile``. Both are kept in
+the cache as one compact tuple of field values and rebuilt from a single
+query on a miss.
+
+A snapshot holds the session auth hash instead of the password hash, so
+a cache hit needs no query: the password stays deferred and the session is
+checked against the stored hash.
+
+Saves, deletes and logouts drop the snapshot, which only reaches other
+workers when the cache is shared (``REDIS_URL``). With a process-local
+cache snapshots expire after ``USER_SNAPSHOT_LOCAL_TIMEOUT`` instead, so a
+deactivated user or a changed password takes effect in the other workers
+within that time, like a logout does for sessions.
+"""
+
+import zlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+
+from artisan_marketplace import sharding
+
+User = get_user_model()
+
+USER_SNAPSHOT_TIMEOUT = getattr(settings, 'USER_SNAPSHOT_TIMEOUT', 60 * 15)
+USER_SNAPSHOT_LOCAL_TIMEOUT = getattr(settings, 'USER_SNAPSHOT_LOCAL_TIMEOUT', 60)
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Field layout of a snapshot: every column but the password, then the
+# session auth hash and the artisan profile id. The checksum is part of the
+# cache key, so adding or removing a column never reads back a tuple with
+# the old layout.
+SNAPSHOT_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields if field.attname != 'password'
+)
+SNAPSHOT_VERSION = zlib.crc32(','.join(SNAPSHOT_FIELDS + ('session_auth_hash',)).encode())
+
+_MISSING = object()
+
+
+def is_process_local(alias='default'):
+    """Whether each process has its own cache ``alias``, so its deletes reach no other worker"""
+    return settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_CACHES
+
+
+def user_snapshot_key(user_id):
+    return f'accounts:user:{SNAPSHOT_VERSION}:{user_id}'
+
+
+def _snapshot(row, profile_id):
+    """``row`` of ``SNAPSHOT_FIELDS`` and the password as a snapshot"""
+    *values, password = row
+    return (*values, User(password=password).get_session_auth_hash(), profile_id)
+
+
+def _load_snapshot(user_id):
+    """Fetch the user and its artisan profile id in one query"""
+    if sharding.is_enabled():
+        return _load_sharded_snapshot(user_id)
+    rows = User._default_manager.filter(pk=user_id).values_list(
+        *SNAPSHOT_FIELDS, 'password', 'artisan_profile__id'
+    )
+    for *row, profile_id in rows:
+        return _snapshot(row, profile_id)
+    return None
+
+
+def _load_sharded_snapshot(user_id):
+    """The profile may live on any shard, so it is looked up there"""
+    from artisans.models import ArtisanProfile
+
+    row = User._default_manager.filter(pk=user_id).values_list(*SNAPSHOT_FIELDS, 'password').first()
+    if row is None:
+        return None
+    profile_id = ArtisanProfile.objects.filter(user_id=user_id).values_list('pk', flat=True).first()
+    return _snapshot(row, profile_id)
+
+
+def get_cached_user(user_id):
+    """Return a ``User`` for ``user_id`` from the cache, or None"""
+    try:
+        user_id = User._meta.pk.to_python(user_id)
+    except Exception:
+        return None
+
+    key = user_snapshot_key(user_id)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = _load_snapshot(user_id)
+        if snapshot is None:
+            cache.delete(key)
+            return None
+        cache.set(
+            key, snapshot, USER_SNAPSHOT_LOCAL_TIMEOUT if is_process_local() else USER_SNAPSHOT_TIMEOUT
+        )
+
+    # The password is left deferred; User.get_session_auth_hash uses the stored hash
+    *values, session_auth_hash, profile_id = snapshot
+    user = User.from_db(router.db_for_read(User), SNAPSHOT_FIELDS, values)
+    user._session_auth_hash = session_auth_hash
+    user._artisan_profile_id = profile_id
+    return user
+
+
+def invalidate_user(user_id):
+    """Drop the cached snapshot for a user"""
+    if user_id is not None:
+        cache.delete(user_snapshot_key(user_id))
+
+
+def get_artisan_profile(user, queryset=None):
+    """
+    Return the artisan profile of ``user`` or None.
+
+    Users loaded through the cached backend already know their profile id,
+    so users without a profile cost no query and the profile itself is a
+    primary key lookup.
+    """
+    from artisans.models import ArtisanProfile
+
+    if queryset is None:
+        queryset = ArtisanProfile.objects.select_related('category', 'state', 'city')
+
+    profile_id = getattr(user, '_artisan_profile_id', _MISSING)
+    if profile_id is None:
+        return None
+
+    try:
+        if profile_id is _MISSING:
+            profile = queryset.get(user=user)
+        else:
+            profile = queryset.get(pk=profile_id)
+    except ArtisanProfile.DoesNotExist:
+        return None
+
+    user.artisan_profile = profile
+    return profile
@@ -1,9 +1,16 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from artisan_marketplace.sharding import GlobalQuerySet
+from core.tracking import DirtyFieldsMixin
 
-class User(AbstractUser):
+
+class UserManager(BaseUserManager.from_queryset(GlobalQuerySet)):
+    """Default user manager whose bulk updates reach the shard copies of users"""
+
+
+class User(DirtyFieldsMixin, AbstractUser):
     """Custom User model with role-based permissions"""
     
     USER_ROLES = [
@@ -32,6 +39,8 @@ class User(AbstractUser):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = UserManager()
+    
     def __str__(self):
         return f"{self.username} ({self.get_role_display()})"
     
@@ -46,3 +55,9 @@ class User(AbstractUser):
     @property
     def is_admin_user(self):
         return self.role == 'admin' or self.is_superuser
+    
+    def get_session_auth_hash(self):
+        # Users loaded from a cached snapshot carry the hash, not the password
+        if 'password' not in self.__dict__ and hasattr(self, '_session_auth_hash'):
+            return self._session_auth_hash
+        return super().get_session_auth_hash()
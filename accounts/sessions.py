@@ -0,0 +1,87 @@
+"""
+Cached sessions with deferred database writes.
+
+Sessions are read from the cache and only fall back to the database on a
+miss. New sessions are written through immediately; later changes to an
+existing session update the cache on every save but reach the database at
+most once per ``SESSION_DB_WRITE_INTERVAL`` seconds. If the cache entry is
+evicted in between, the session falls back to its last database copy.
+
+Deferring writes and trusting cached copies only works when every worker
+shares the cache. With a process-local cache every save is written through
+and cached copies expire after ``SESSION_LOCAL_CACHE_TIMEOUT`` seconds, so
+a logout in one worker ends the session in the others within that time.
+"""
+
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+from .cache import is_process_local
+
+KEY_PREFIX = 'accounts.sessions'
+
+SESSION_DB_WRITE_INTERVAL = getattr(settings, 'SESSION_DB_WRITE_INTERVAL', 60)
+SESSION_LOCAL_CACHE_TIMEOUT = getattr(settings, 'SESSION_LOCAL_CACHE_TIMEOUT', 30)
+
+
+class SessionStore(CachedDBStore):
+    """Cached session store that writes behind to the database"""
+
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self.process_local = is_process_local(settings.SESSION_CACHE_ALIAS)
+
+    @property
+    def synced_key(self):
+        return self.cache_key + ':synced'
+
+    def _cache_timeout(self, expiry_age):
+        return min(expiry_age, SESSION_LOCAL_CACHE_TIMEOUT) if self.process_local else expiry_age
+
+    def load(self):
+        try:
+            data = self._cache.get(self.cache_key)
+        except Exception:
+            # Invalid cache keys raise on some backends; reset the session
+            data = None
+
+        if data is None:
+            session = self._get_session_from_db()
+            if session:
+                data = self.decode(session.session_data)
+                self._cache.set(
+                    self.cache_key, data, self._cache_timeout(self.get_expiry_age(expiry=session.expire_date))
+                )
+            else:
+                data = {}
+        return data
+
+    def save(self, must_create=False):
+        if self.process_local:
+            super().save(must_create=must_create)
+            self._cache.touch(self.cache_key, self._cache_timeout(self.get_expiry_age()))
+            return
+
+        if must_create or self.session_key is None:
+            super().save(must_create=must_create)
+            self._cache.set(self.synced_key, time.time(), self.get_expiry_age())
+            return
+
+        synced_at = self._cache.get(self.synced_key)
+        now = time.time()
+        if synced_at is None or now - synced_at >= SESSION_DB_WRITE_INTERVAL:
+            super().save()
+            self._cache.set(self.synced_key, now, self.get_expiry_age())
+        else:
+            self._cache.set(self.cache_key, self._session, self.get_expiry_age())
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+        super().delete(session_key)
+        if session_key is not None:
+            self._cache.delete(self.cache_key_prefix + session_key + ':synced')
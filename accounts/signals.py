@@ -0,0 +1,30 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from artisans.models import ArtisanProfile
+from .cache import invalidate_user
+from .models import User
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_snapshot(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def user_logged_out_snapshot(sender, user, **kwargs):
+    if user is not None:
+        invalidate_user(user.pk)
+
+
+@receiver(post_save, sender=ArtisanProfile)
+def artisan_profile_saved(sender, instance, created, **kwargs):
+    # The snapshot only records whether the user has a profile
+    if created:
+        invalidate_user(instance.user_id)
+
+
+@receiver(post_delete, sender=ArtisanProfile)
+def artisan_profile_deleted(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
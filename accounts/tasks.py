@@ -0,0 +1,35 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from core.jobs import task
+from .models import User
+
+PROFILE_PICTURE_SIZE = 600
+
+
+@task
+def optimize_profile_picture(user_id):
+    """Downscale an uploaded profile picture and store it as JPEG"""
+    user = User.objects.filter(pk=user_id).first()
+    if user is None or not user.profile_picture:
+        return
+
+    with user.profile_picture.open('rb') as picture:
+        image = Image.open(picture)
+        image.load()
+    if max(image.size) <= PROFILE_PICTURE_SIZE:
+        return
+
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((PROFILE_PICTURE_SIZE, PROFILE_PICTURE_SIZE))
+    buffer = BytesIO()
+    image.convert('RGB').save(buffer, 'JPEG', quality=85, optimize=True)
+
+    original = user.profile_picture.name
+    name = os.path.splitext(os.path.basename(original))[0] + '.jpg'
+    user.profile_picture.save(name, ContentFile(buffer.getvalue()), save=False)
+    user.save(update_fields=['profile_picture'])
+    user.profile_picture.storage.delete(original)
@@ -1,3 +1,116 @@
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
-# Create your tests here.
+from artisans.models import ArtisanDailyStats, ArtisanProfile, Category, City, State
+from artisans.rollups import refresh_rank_percentiles
+from .backends import CachedModelBackend
+from .cache import get_cached_user, user_snapshot_key
+from .models import User
+
+
+class CachedUserTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('ada', password='old-password', role='client')
+
+    def test_hit_runs_no_queries(self):
+        get_cached_user(self.user.pk)
+        with self.assertNumQueries(0):
+            user = get_cached_user(self.user.pk)
+            self.assertEqual(user.username, 'ada')
+            self.assertEqual(user.get_session_auth_hash(), self.user.get_session_auth_hash())
+
+    def test_snapshot_has_no_password_hash(self):
+        get_cached_user(self.user.pk)
+        self.assertNotIn(self.user.password, cache.get(user_snapshot_key(self.user.pk)))
+
+    def test_password_change_invalidates(self):
+        old_hash = get_cached_user(self.user.pk).get_session_auth_hash()
+        self.user.set_password('new-password')
+        self.user.save()
+        new_hash = get_cached_user(self.user.pk).get_session_auth_hash()
+        self.assertNotEqual(new_hash, old_hash)
+        self.assertEqual(new_hash, self.user.get_session_auth_hash())
+
+    def test_deactivation_invalidates(self):
+        backend = CachedModelBackend()
+        self.assertIsNotNone(backend.get_user(self.user.pk))
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(backend.get_user(self.user.pk))
+
+    def test_logout_invalidates(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('core:about'))
+        self.assertIsNotNone(cache.get(user_snapshot_key(self.user.pk)))
+        self.client.post(reverse('accounts:logout'))
+        self.assertIsNone(cache.get(user_snapshot_key(self.user.pk)))
+
+    def test_authenticated_requests_skip_the_users_table(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('core:about'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('core:about'))
+        self.assertEqual(response.context['user'].pk, self.user.pk)
+        self.assertFalse([query for query in queries if 'accounts_user' in query['sql']])
+
+
+class DashboardTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Plumbing')
+        cls.state = State.objects.create(name='Lagos', code='LA')
+        cls.city = City.objects.create(name='Ikeja', state=cls.state)
+        cls.ada = cls.make_artisan('ada')
+        cls.bola = cls.make_artisan('bola')
+
+    @classmethod
+    def make_artisan(cls, username):
+        with cls.captureOnCommitCallbacks(execute=True):
+            return ArtisanProfile.objects.create(
+                user=User.objects.create_user(username, role='artisan'),
+                category=cls.category,
+                bio='Pipes and drains',
+                hourly_rate=5000,
+                state=cls.state,
+                city=cls.city,
+                is_verified=True,
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_only_artisans_get_a_dashboard(self):
+        url = reverse('accounts:dashboard')
+        self.assertRedirects(self.client.get(url), f"{reverse('accounts:login')}?next={url}")
+        self.client.force_login(User.objects.create_user('client', role='client'))
+        self.assertRedirects(self.client.get(url), reverse('accounts:profile'), fetch_redirect_response=False)
+
+    def test_numbers_come_from_the_rollups(self):
+        ArtisanDailyStats.objects.create(
+            artisan=self.ada, day=timezone.localdate(), views=7, new_reviews=2, rating_sum=9, rating_4=1, rating_5=1
+        )
+        self.client.force_login(self.ada.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('accounts:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['windows'][7]['views'], 7)
+        self.assertEqual(response.context['windows'][30]['avg_rating'], 4.5)
+        self.assertEqual(response.context['histogram'][:2], [(5, 1), (4, 1)])
+        self.assertFalse([query for query in queries if 'reviews_review' in query['sql']])
+
+    def test_ranks_are_read_once_computed(self):
+        ArtisanDailyStats.objects.create(artisan=self.ada, day=timezone.localdate(), views=3)
+        self.client.force_login(self.ada.user)
+        self.assertIsNone(self.client.get(reverse('accounts:dashboard')).context['ranks'])
+
+        refresh_rank_percentiles()
+        ranks = self.client.get(reverse('accounts:dashboard')).context['ranks']
+        self.assertEqual(ranks['category']['views'], {'position': 1, 'total': 2, 'top_percent': 50})
+        self.assertEqual(ranks['city']['views']['position'], 1)
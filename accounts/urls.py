@@ -2,7 +2,7 @@ from django.urls import path
 from django.contrib.auth.views import LogoutView
 from .views import (
     CustomLoginView, ClientRegistrationView, ArtisanRegistrationView,
-    profile_view, edit_profile_view, get_cities_ajax
+    profile_view, dashboard_view, edit_profile_view, get_cities_ajax
 )
 
 app_name = 'accounts'
@@ -13,6 +13,7 @@ urlpatterns = [
     path('register/client/', ClientRegistrationView.as_view(), name='client_register'),
     path('register/artisan/', ArtisanRegistrationView.as_view(), name='artisan_register'),
     path('profile/', profile_view, name='profile'),
+    path('dashboard/', dashboard_view, name='dashboard'),
     path('profile/edit/', edit_profile_view, name='edit_profile'),
     path('ajax/cities/', get_cities_ajax, name='get_cities'),
 ]
\ No newline at end of file
@@ -1,4 +1,4 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import LoginView, LogoutView
@@ -6,10 +6,17 @@ from django.contrib import messages
 from django.views.generic import CreateView, UpdateView
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from .models import User
 from .forms import ClientRegistrationForm, ArtisanRegistrationForm
-from artisans.models import ArtisanProfile, Category, State, City
+from .cache import get_artisan_profile
+from .tasks import optimize_profile_picture
+from artisan_marketplace.sharding import relocate
+from artisans.rollups import daily_series, rank_percentiles, rating_histogram, rolling_stats, weekly_series
+from artisans.tasks import schedule_similar_artisans_update
+from artisans.models import ArtisanProfile
+from reviews.models import Review
+from core import reference
 
 
 class CustomLoginView(LoginView):
@@ -19,7 +26,7 @@ class CustomLoginView(LoginView):
     
     def get_success_url(self):
         if self.request.user.is_artisan:
-            return reverse_lazy('accounts:artisan_profile')
+            return reverse_lazy('accounts:profile')
         return reverse_lazy('core:home')
 
 
@@ -47,8 +54,9 @@ class ArtisanRegistrationView(CreateView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.all()
-        context['states'] = State.objects.all()
+        data = reference.get()
+        context['categories'] = data.categories
+        context['states'] = data.states
         return context
     
     def form_valid(self, form):
@@ -63,15 +71,18 @@ class ArtisanRegistrationView(CreateView):
         years_experience = self.request.POST.get('years_experience', 0)
         
         if category_id and state_id and city_id:
-            category = get_object_or_404(Category, id=category_id)
-            state = get_object_or_404(State, id=state_id)
-            city = get_object_or_404(City, id=city_id)
+            data = reference.get()
+            category = data.lookup('category', category_id)
+            state = data.lookup('state', state_id)
+            city = data.lookup('city', city_id)
+            if category is None or state is None or city is None:
+                raise Http404('Unknown category or location')
             
             artisan_profile = ArtisanProfile.objects.create(
                 user=user,
-                category=category,
-                state=state,
-                city=city,
+                category_id=category.id,
+                state_id=state.id,
+                city_id=city.id,
                 bio=bio,
                 hourly_rate=hourly_rate or 0,
                 years_of_experience=years_experience or 0
@@ -94,20 +105,51 @@ class ArtisanRegistrationView(CreateView):
 def profile_view(request):
     """User profile view"""
     if request.user.is_artisan:
-        try:
-            artisan_profile = request.user.artisan_profile
-            return render(request, 'accounts/artisan_profile.html', {
-                'artisan': artisan_profile
-            })
-        except ArtisanProfile.DoesNotExist:
+        artisan_profile = get_artisan_profile(request.user)
+        if artisan_profile is None:
             messages.error(request, 'Artisan profile not found.')
             return redirect('core:home')
+        return render(request, 'accounts/artisan_profile.html', {
+            'artisan': artisan_profile
+        })
     else:
+        # Reviews are stored on the shards of their artisans, and read from each
+        reviews = Review.objects.filter(client=request.user).select_related(
+            'artisan__user'
+        ).order_by('-created_at')
         return render(request, 'accounts/client_profile.html', {
-            'user': request.user
+            'user': request.user,
+            'recent_reviews': reviews[:5],
+            'review_count': reviews.count(),
         })
 
 
+@login_required
+def dashboard_view(request):
+    """Performance dashboard for artisans, built from the daily rollups"""
+    artisan = get_artisan_profile(request.user) if request.user.is_artisan else None
+    if artisan is None:
+        messages.error(request, 'The dashboard is only available to artisans.')
+        return redirect('accounts:profile')
+    
+    daily = daily_series(artisan, 30)
+    weekly = weekly_series(artisan, 12)
+    histogram = rating_histogram(artisan)
+    total_ratings = sum(histogram.values())
+    
+    return render(request, 'accounts/artisan_dashboard.html', {
+        'artisan': artisan,
+        'windows': rolling_stats(artisan),
+        'daily': daily,
+        'max_daily_views': max(stats['views'] for _, stats in daily) or 1,
+        'weekly': weekly,
+        'max_weekly_reviews': max(stats['new_reviews'] for _, stats in weekly) or 1,
+        'histogram': [(stars, histogram[stars]) for stars in range(5, 0, -1)],
+        'total_ratings': total_ratings or 1,
+        'ranks': rank_percentiles(artisan),
+    })
+
+
 @login_required
 def edit_profile_view(request):
     """Edit user profile"""
@@ -118,58 +160,69 @@ def edit_profile_view(request):
         request.user.email = request.POST.get('email', '')
         request.user.phone_number = request.POST.get('phone_number', '')
         
-        if 'profile_picture' in request.FILES:
+        picture_uploaded = 'profile_picture' in request.FILES
+        if picture_uploaded:
             request.user.profile_picture = request.FILES['profile_picture']
         
+        # Writes only the changed columns, or nothing
         request.user.save()
+        if picture_uploaded:
+            optimize_profile_picture.delay(user_id=request.user.pk)
         
         # Update artisan profile if applicable
-        if request.user.is_artisan:
-            try:
-                artisan = request.user.artisan_profile
-                artisan.bio = request.POST.get('bio', artisan.bio)
-                artisan.hourly_rate = request.POST.get('hourly_rate', artisan.hourly_rate)
-                artisan.years_of_experience = request.POST.get('years_experience', artisan.years_of_experience)
-                artisan.availability = request.POST.get('availability', artisan.availability)
-                
-                # Update location if provided
-                state_id = request.POST.get('state')
-                city_id = request.POST.get('city')
-                if state_id and city_id:
-                    artisan.state = get_object_or_404(State, id=state_id)
-                    artisan.city = get_object_or_404(City, id=city_id)
-                
-                artisan.save()
-                
-                # Update skills
-                skill_ids = request.POST.getlist('skills')
-                if skill_ids:
-                    artisan.skills.set(skill_ids)
-                    
-            except ArtisanProfile.DoesNotExist:
-                pass
+        artisan = get_artisan_profile(request.user) if request.user.is_artisan else None
+        if artisan is not None:
+            artisan.bio = request.POST.get('bio', artisan.bio)
+            artisan.hourly_rate = request.POST.get('hourly_rate', artisan.hourly_rate)
+            artisan.years_of_experience = request.POST.get('years_experience', artisan.years_of_experience)
+            artisan.availability = request.POST.get('availability', artisan.availability)
+            
+            # Update location if provided
+            state_id = request.POST.get('state')
+            city_id = request.POST.get('city')
+            if state_id and city_id:
+                data = reference.get()
+                state = data.lookup('state', state_id)
+                city = data.lookup('city', city_id)
+                if state is None or city is None:
+                    raise Http404('Unknown location')
+                artisan.state_id = state.id
+                artisan.city_id = city.id
+            
+            # Writes only the changed columns, or nothing
+            artisan.save()
+            
+            # A state on another shard moves the profile there; its id stays the same
+            relocated = relocate(artisan)
+            if relocated is not artisan:
+                artisan = relocated
+                schedule_similar_artisans_update()
+            
+            # Update skills
+            skill_ids = request.POST.getlist('skills')
+            if skill_ids and artisan.set_skills(skill_ids):
+                schedule_similar_artisans_update()
         
         messages.success(request, 'Profile updated successfully!')
         return redirect('accounts:profile')
     
     context = {}
-    if request.user.is_artisan:
-        try:
-            context['artisan'] = request.user.artisan_profile
-            context['categories'] = Category.objects.all()
-            context['states'] = State.objects.all()
-            context['cities'] = City.objects.all()
-        except ArtisanProfile.DoesNotExist:
-            pass
+    artisan = get_artisan_profile(request.user) if request.user.is_artisan else None
+    if artisan is not None:
+        data = reference.get()
+        context['artisan'] = artisan
+        context['categories'] = data.categories
+        context['states'] = data.states
+        context['cities'] = data.cities
     
     return render(request, 'accounts/edit_profile.html', context)
 
 
 def get_cities_ajax(request):
     """AJAX view to get cities for a state"""
-    from django.http import JsonResponse
-    state_id = request.GET.get('state_id')
-    if state_id:
-        cities = City.objects.filter(state_id=state_id).values('id', 'name')
-        return JsonResponse(list(cities), safe=False)
+    data = reference.get()
+    state = data.lookup('state', request.GET.get('state_id'))
+    if state is not None:
+        cities = data.cities_by_state.get(state.id, ())
+        return JsonResponse([{'id': city.id, 'name': city.name} for city in cities], safe=False)
     return JsonResponse([], safe=False)
@@ -0,0 +1,131 @@
+from datetime import timedelta
+
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from accounts.models import User
+from artisans.models import ArtisanListing, ArtisanProfile, Category, City, Skill, State
+from .utils import ApiError, encode_cursor, keyset_page
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for index, icon in enumerate(['b', 'a', 'b', 'a', 'b', 'c', 'a']):
+            Category.objects.create(name=f'Category {index}', icon=icon)
+
+    def pages(self, ordering, limit=2):
+        factory = RequestFactory()
+        queryset = Category.objects.values('pk', 'icon', 'name')
+        request = factory.get('/api/v1/categories/', {'limit': limit})
+        rows = []
+        while request is not None:
+            page, next_url = keyset_page(queryset, ordering, request)
+            rows.extend(page)
+            request = factory.get(next_url) if next_url else None
+        return rows
+
+    def test_pages_cover_every_row_once_in_order(self):
+        rows = self.pages(['icon', 'pk'])
+        expected = list(Category.objects.order_by('icon', 'pk').values_list('pk', flat=True))
+        self.assertEqual([row['pk'] for row in rows], expected)
+
+    def test_descending_keys(self):
+        rows = self.pages(['-icon', '-pk'], limit=3)
+        expected = list(Category.objects.order_by('-icon', '-pk').values_list('pk', flat=True))
+        self.assertEqual([row['pk'] for row in rows], expected)
+
+    def test_last_page_has_no_next_url(self):
+        request = RequestFactory().get('/', {'limit': 50})
+        rows, next_url = keyset_page(Category.objects.values('pk', 'name'), ['name', 'pk'], request)
+        self.assertEqual(len(rows), 7)
+        self.assertIsNone(next_url)
+
+    def test_invalid_cursors_are_rejected(self):
+        queryset = Category.objects.values('pk', 'icon')
+        for cursor in ('not base64!', encode_cursor(['a']), encode_cursor(['a', 'x']), encode_cursor([None, 1])):
+            request = RequestFactory().get('/', {'cursor': cursor})
+            with self.assertRaises(ApiError):
+                keyset_page(queryset, ['icon', 'pk'], request)
+
+
+class ArtisanApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Plumbing')
+        cls.drains = Skill.objects.create(name='Drain clearing', category=category)
+        state = State.objects.create(name='Lagos', code='LA')
+        city = City.objects.create(name='Ikeja', state=state)
+        cls.artisans = []
+        with cls.captureOnCommitCallbacks(execute=True):
+            for index in range(7):
+                artisan = ArtisanProfile.objects.create(
+                    user=User.objects.create_user(f'artisan{index}', first_name=f'Artisan{index}', role='artisan'),
+                    category=category,
+                    bio='Pipes and taps',
+                    hourly_rate=1000 * (index % 3 + 1),
+                    state=state,
+                    city=city,
+                    is_verified=index != 6,
+                )
+                cls.artisans.append(artisan)
+            cls.artisans[2].skills.add(cls.drains)
+        # Ties and missing ratings, as the review counter would leave them
+        for index, (rating, count) in enumerate([(4.5, 2), (None, 0), (4.5, 2), (3.0, 1), (None, 0), (4.5, 5)]):
+            ArtisanListing.objects.filter(pk=cls.artisans[index].pk).update(
+                avg_rating=rating, review_count=count,
+                created_at=cls.artisans[0].created_at - timedelta(minutes=index % 2),
+            )
+
+    def pages(self, **params):
+        params.setdefault('limit', 2)
+        url = reverse('api:artisan_list')
+        ids = []
+        while url:
+            data = self.client.get(url, params).json()
+            ids.extend(item['id'] for item in data['results'])
+            url, params = data['next'], {}
+        return ids
+
+    def test_every_sort_pages_through_the_listings(self):
+        listed = ArtisanListing.objects.filter(is_listed=True)
+        sorts = {
+            'newest': ('-created_at', '-pk'),
+            'rating': ('-avg_rating', '-review_count', '-pk'),
+            'price_low': ('hourly_rate', 'pk'),
+            'price_high': ('-hourly_rate', '-pk'),
+        }
+        for sort_by, ordering in sorts.items():
+            with self.subTest(sort_by=sort_by):
+                expected = list(listed.order_by(*ordering).values_list('pk', flat=True))
+                self.assertEqual(len(expected), 6)
+                self.assertEqual(self.pages(sort_by=sort_by), expected)
+
+    def test_rating_pages_end_with_unrated_artisans(self):
+        ids = self.pages(sort_by='rating')
+        self.assertEqual(ids[-2:], [self.artisans[4].pk, self.artisans[1].pk])
+
+    def test_search_matches_the_list_page(self):
+        data = self.client.get(reverse('api:artisan_list'), {'search': 'drain', 'fields': 'id,username,skills'}).json()
+        self.assertEqual(data['results'], [{
+            'id': self.artisans[2].pk,
+            'username': 'artisan2',
+            'skills': [{'id': self.drains.pk, 'name': 'Drain clearing'}],
+        }])
+        page = self.client.get(reverse('core:artisan_list'), {'search': 'drain'})
+        self.assertEqual([card.pk for card in page.context['artisans']], [self.artisans[2].pk])
+
+    def test_unlisted_artisans_are_not_found(self):
+        hidden = self.artisans[6].pk
+        self.assertNotIn(hidden, self.pages())
+        self.assertEqual(self.client.get(reverse('api:artisan_detail', args=[hidden])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('api:artisan_reviews', args=[hidden])).status_code, 404)
+
+    def test_detail_reads_the_listing_and_the_profile(self):
+        data = self.client.get(reverse('api:artisan_detail', args=[self.artisans[0].pk])).json()
+        self.assertEqual(data['name'], 'Artisan0')
+        self.assertEqual(data['bio'], 'Pipes and taps')
+        self.assertEqual(data['average_rating'], 4.5)
+        self.assertIsNone(data['profile_picture'])
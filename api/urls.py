@@ -0,0 +1,14 @@
+from django.urls import path
+from . import views
+
+app_name = 'api'
+
+urlpatterns = [
+    path('artisans/', views.artisan_list, name='artisan_list'),
+    path('artisans/<int:pk>/', views.artisan_detail, name='artisan_detail'),
+    path('artisans/<int:pk>/reviews/', views.artisan_reviews, name='artisan_reviews'),
+    path('categories/', views.category_list, name='category_list'),
+    path('states/', views.state_list, name='state_list'),
+    path('cities/', views.city_list, name='city_list'),
+    path('suggest/', views.suggest, name='suggest'),
+]
@@ -0,0 +1,223 @@
+"""
+Building blocks of the JSON API: sparse fieldsets over ``values()``
+projections, keyset (cursor) pagination and cached, conditional responses.
+"""
+
+import base64
+import datetime
+import hashlib
+import json
+from decimal import Decimal
+from functools import wraps
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_safe
+
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_AGE = 30
+
+
+class ApiError(Exception):
+    """Rendered as ``{"error": message}`` with ``status``"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class Field:
+    """
+    An output field read from one or more ``values()`` lookups, or loaded
+    for a whole page at once with ``loader(ids) -> {id: value}``.
+    """
+
+    def __init__(self, *lookups, transform=None, loader=None):
+        self.lookups = lookups
+        self.transform = transform
+        self.loader = loader
+
+    def value(self, row):
+        values = [row[lookup] for lookup in self.lookups]
+        if self.transform is not None:
+            return self.transform(*values)
+        return values[0]
+
+
+class Fieldset:
+    """The fields a resource can return and the ones returned by default"""
+
+    def __init__(self, fields, default):
+        self.fields = fields
+        self.default = default
+
+    def select(self, request):
+        """Return the names requested with ``?fields=a,b``"""
+        requested = request.GET.get('fields')
+        if not requested:
+            return list(self.default)
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ApiError(f'Unknown field(s): {", ".join(unknown)}. '
+                           f'Available: {", ".join(self.fields)}')
+        return list(dict.fromkeys(names))
+
+    def lookups(self, names):
+        lookups = {'pk': None}
+        for name in names:
+            lookups.update(dict.fromkeys(self.fields[name].lookups))
+        return list(lookups)
+
+    def render(self, rows, names):
+        """Turn ``values()`` rows into output dicts with only ``names``"""
+        loaded = {
+            name: self.fields[name].loader([row['pk'] for row in rows])
+            for name in names if self.fields[name].loader is not None
+        }
+        results = []
+        for row in rows:
+            item = {}
+            for name in names:
+                if name in loaded:
+                    item[name] = loaded[name].get(row['pk'], [])
+                else:
+                    item[name] = self.fields[name].value(row)
+            results.append(item)
+        return results
+
+
+def get_limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError('limit must be a number')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        # Full precision; DjangoJSONEncoder drops microseconds
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values):
+    data = json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ApiError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ApiError('Invalid cursor')
+    return values
+
+
+def _cursor_values(queryset, keys, values):
+    """Convert decoded cursor ``values`` with the fields of ``keys``; ApiError if one does not fit"""
+    converted = []
+    for key, value in zip(keys, values):
+        field = queryset.query.resolve_ref(key).output_field
+        if value is None and field.null:
+            converted.append(None)
+            continue
+        if value is None or isinstance(value, (dict, list)):
+            raise ApiError('Invalid cursor')
+        try:
+            converted.append(field.to_python(value))
+        except (ValidationError, TypeError, ValueError):
+            raise ApiError('Invalid cursor')
+    return converted
+
+
+def _equal(key, value):
+    return Q(**{f'{key}__isnull': True}) if value is None else Q(**{key: value})
+
+
+def _beyond(key, value, descending):
+    """Rows past ``value`` on ``key``, with NULL as the smallest value; None if there are none"""
+    if descending:
+        if value is None:
+            return None
+        return Q(**{f'{key}__lt': value}) | Q(**{f'{key}__isnull': True})
+    if value is None:
+        return Q(**{f'{key}__isnull': False})
+    return Q(**{f'{key}__gt': value})
+
+
+def keyset_page(queryset, ordering, request):
+    """
+    Return ``(rows, next_url)`` for the page after ``?cursor=``. ``queryset``
+    is a ``values()`` queryset that includes every key of ``ordering``, the
+    last of which must be unique. Nullable keys sort NULL as the smallest
+    value, as SQLite does, so ordering on indexed nullable columns works.
+    """
+    keys = [key.lstrip('-') for key in ordering]
+    limit = get_limit(request)
+    queryset = queryset.order_by(*ordering)
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        values = _cursor_values(queryset, keys, decode_cursor(cursor, len(keys)))
+        after = Q()
+        for index, key in enumerate(keys):
+            condition = _beyond(key, values[index], ordering[index].startswith('-'))
+            if condition is None:
+                continue
+            for previous in range(index):
+                condition &= _equal(keys[previous], values[previous])
+            after |= condition
+        queryset = queryset.filter(after)
+
+    # Pages of unrouted sharded querysets are merged from every shard
+    rows = list(queryset[:limit + 1])
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        params = request.GET.copy()
+        params['cursor'] = encode_cursor([rows[-1][key] for key in keys])
+        next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+    return rows, next_url
+
+
+def api_view(view):
+    """
+    Serialize the dict or list returned by ``view`` as JSON with an ETag,
+    answer matching ``If-None-Match`` with 304, and gzip the body.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            data = view(request, *args, **kwargs)
+        except ApiError as error:
+            return HttpResponse(
+                json.dumps({'error': error.message}),
+                status=error.status,
+                content_type='application/json',
+            )
+
+        content = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+        etag = quote_etag(hashlib.md5(content, usedforsecurity=False).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=MAX_AGE)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    return gzip_page(require_safe(wrapper))
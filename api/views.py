@@ -0,0 +1,168 @@
+from artisan_marketplace import sharding
+from artisans.models import ArtisanProfile
+from core import reference, typeahead
+from core.filters import SORTS, listed_cards, search_artisans
+from reviews.models import Review
+from .utils import ApiError, Field, Fieldset, api_view, keyset_page
+
+
+def _url(value):
+    return value or None
+
+
+def _full_name(first_name, last_name, username=None):
+    return f'{first_name} {last_name}'.strip() or username
+
+
+def _rating(value):
+    return round(value, 2) if value is not None else None
+
+
+def _skills(skill_ids):
+    skill_by_id = reference.get().skill_by_id
+    skills = sorted(
+        (skill_by_id[skill_id] for skill_id in skill_ids if skill_id in skill_by_id),
+        key=lambda skill: skill.name,
+    )
+    return [{'id': skill.id, 'name': skill.name} for skill in skills]
+
+
+def _profile_values(lookup):
+    """Loader of ``lookup`` for a page of artisans, read from the profiles on their shards"""
+    def load(ids):
+        values = {}
+        for alias, shard_ids in sharding.group_ids(ArtisanProfile, ids).items():
+            values.update(ArtisanProfile.objects.using(alias).filter(
+                pk__in=shard_ids
+            ).values_list('pk', lookup))
+        return values
+    return load
+
+
+# Read from ArtisanListing; fields it does not copy are loaded per page
+ARTISAN_FIELDS = Fieldset({
+    'id': Field('pk'),
+    'name': Field('display_name'),
+    'username': Field(loader=_profile_values('user__username')),
+    'profile_picture': Field('avatar_url', transform=_url),
+    'category': Field('category_name'),
+    'category_id': Field('category_id'),
+    'state': Field('state_name'),
+    'state_id': Field('state_id'),
+    'city': Field('city_name'),
+    'city_id': Field('city_id'),
+    'bio': Field(loader=_profile_values('bio')),
+    'hourly_rate': Field('hourly_rate'),
+    'years_of_experience': Field(loader=_profile_values('years_of_experience')),
+    'availability': Field('availability'),
+    'is_verified': Field('is_verified'),
+    'average_rating': Field('avg_rating', transform=_rating),
+    'review_count': Field('review_count'),
+    'skills': Field('skill_ids', transform=_skills),
+    'created_at': Field('created_at'),
+}, default=(
+    'id', 'name', 'profile_picture', 'category', 'state', 'city',
+    'hourly_rate', 'availability', 'average_rating', 'review_count',
+))
+
+ARTISAN_DETAIL_DEFAULT = ARTISAN_FIELDS.default + (
+    'bio', 'years_of_experience', 'skills', 'created_at',
+)
+
+REVIEW_FIELDS = Fieldset({
+    'id': Field('pk'),
+    'rating': Field('rating'),
+    'title': Field('title'),
+    'comment': Field('comment'),
+    'would_recommend': Field('would_recommend'),
+    'client_name': Field(
+        'client__first_name', 'client__last_name', 'client__username',
+        transform=_full_name
+    ),
+    'created_at': Field('created_at'),
+}, default=('id', 'rating', 'title', 'comment', 'would_recommend', 'client_name', 'created_at'))
+
+
+@api_view
+def artisan_list(request):
+    """Search listed artisans with the filters and sorts of the artisan list page"""
+    names = ARTISAN_FIELDS.select(request)
+    # Every sort follows an index of ArtisanListing and ends with its primary key
+    ordering = SORTS.get(request.GET.get('sort_by'), SORTS['newest'])
+    keys = [key.lstrip('-') for key in ordering]
+
+    artisans, corrected_search = search_artisans(listed_cards(), request.GET)
+    rows, next_url = keyset_page(
+        artisans.values(*dict.fromkeys(ARTISAN_FIELDS.lookups(names) + keys)),
+        ordering,
+        request,
+    )
+    data = {'results': ARTISAN_FIELDS.render(rows, names), 'next': next_url}
+    if corrected_search:
+        data['corrected_search'] = corrected_search
+    return data
+
+
+@api_view
+def artisan_detail(request, pk):
+    names = ARTISAN_FIELDS.select(request) if request.GET.get('fields') else list(ARTISAN_DETAIL_DEFAULT)
+    row = listed_cards().filter(pk=pk).values(*ARTISAN_FIELDS.lookups(names)).first()
+    if row is None:
+        raise ApiError('Artisan not found', status=404)
+    return ARTISAN_FIELDS.render([row], names)[0]
+
+
+@api_view
+def artisan_reviews(request, pk):
+    """Visible reviews of a listed artisan, newest first"""
+    if not listed_cards().filter(pk=pk).exists():
+        raise ApiError('Artisan not found', status=404)
+    names = REVIEW_FIELDS.select(request)
+    ordering = ('-created_at', '-pk')
+    reviews = Review.objects.filter(artisan_id=pk, is_hidden=False)
+    rows, next_url = keyset_page(
+        reviews.values(*dict.fromkeys(REVIEW_FIELDS.lookups(names) + ['created_at'])),
+        ordering,
+        request,
+    )
+    return {'results': REVIEW_FIELDS.render(rows, names), 'next': next_url}
+
+
+@api_view
+def category_list(request):
+    """Categories with their skills"""
+    data = reference.get()
+    return {'results': [
+        dict(category._asdict(), skills=[
+            {'id': skill.id, 'name': skill.name} for skill in data.skills_by_category.get(category.id, ())
+        ])
+        for category in data.categories
+    ]}
+
+
+@api_view
+def state_list(request):
+    return {'results': [state._asdict() for state in reference.get().states]}
+
+
+@api_view
+def city_list(request):
+    """Cities, optionally of one ``?state=``"""
+    data = reference.get()
+    cities = data.cities
+    state = request.GET.get('state')
+    if state:
+        if not state.isdigit():
+            raise ApiError('state must be an id')
+        cities = data.cities_by_state.get(int(state), ())
+    return {'results': [city._asdict() for city in cities]}
+
+
+@api_view
+def suggest(request):
+    """Search-box suggestions for ``?q=`` from the in-process prefix index"""
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 8)), 20))
+    except ValueError:
+        raise ApiError('limit must be a number')
+    return {'results': typeahead.suggest(request.GET.get('q', '')[:100], limit)}
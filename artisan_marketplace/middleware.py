@@ -0,0 +1,33 @@
+from django.conf import settings
+
+from .routers import begin_request, end_request
+
+PIN_COOKIE = 'pin_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class ReplicaPinningMiddleware:
+    """Keep a client on the primary database for a while after it writes"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = begin_request(
+            pinned=PIN_COOKIE in request.COOKIES,
+            sticky=request.method not in SAFE_METHODS,
+        )
+        try:
+            response = self.get_response(request)
+        finally:
+            pin = end_request(token)
+
+        if pin:
+            response.set_cookie(
+                PIN_COOKIE,
+                '1',
+                max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -0,0 +1,91 @@
+"""
+Primary/replica database routing with read-your-writes stickiness.
+
+Inside a request handled by ``ReplicaPinningMiddleware``, reads of models
+from ``REPLICA_APPS`` go to a random alias in ``settings.DATABASE_REPLICAS``
+and every write goes to the primary. Once an unsafe (POST, ...) request
+has written, the rest of it reads from the primary too, and the client is
+pinned to the primary for ``REPLICA_PIN_SECONDS`` so the next pages show
+their own changes. Writes made by GET requests, such as profile view
+counters, pin nothing. Outside requests (management commands, workers) all
+queries use the primary.
+
+``core`` is left out: its job queue, outbox and query log are read to
+decide what to claim, send or insert next, so a stale replica could run a
+job twice or lose an email.
+"""
+
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_APPS = {'artisans', 'reviews'}
+
+_routing_state = ContextVar('replica_routing_state', default=None)
+
+
+class RoutingState:
+    """Per-request routing flags"""
+
+    __slots__ = ('pinned', 'sticky', 'wrote')
+
+    def __init__(self, pinned=False, sticky=False):
+        self.pinned = pinned
+        self.sticky = sticky
+        self.wrote = False
+
+    @property
+    def use_primary(self):
+        return self.pinned or (self.sticky and self.wrote)
+
+
+def begin_request(pinned=False, sticky=False):
+    """
+    Start routing for a request and return the token for ``end_request``.
+
+    ``pinned`` sends every read to the primary, ``sticky`` does so once the
+    request has written.
+    """
+    return _routing_state.set(RoutingState(pinned, sticky))
+
+
+def end_request(token):
+    """Finish routing for a request and return whether it should pin"""
+    state = _routing_state.get()
+    _routing_state.reset(token)
+    return state is not None and state.sticky and state.wrote
+
+
+def record_write():
+    """Note that the current request wrote, for routers that handle writes first"""
+    state = _routing_state.get()
+    if state is not None:
+        state.wrote = True
+
+
+class PrimaryReplicaRouter:
+    """Send replica-safe reads to replicas and everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not replicas or model._meta.app_label not in REPLICA_APPS:
+            return None
+        state = _routing_state.get()
+        if state is None or state.use_primary:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        record_write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, 'DATABASE_REPLICAS', [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,14 +43,18 @@ INSTALLED_APPS = [
     'artisans',
     'reviews',
     'core',
+    'api',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.querylog.QueryLogMiddleware',
+    'artisan_marketplace.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -77,14 +82,150 @@ WSGI_APPLICATION = 'artisan_marketplace.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# artisan_marketplace.sqlite enables WAL and retries on lock errors so several
+# gunicorn workers can share the database file.
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'artisan_marketplace.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
 
+# Read replicas. DATABASE_REPLICA_NAMES is a comma separated list of
+# database files; copies of db.sqlite3 work as stand-ins for local testing.
+# Listing, detail and review reads go to a replica, writes to 'default', and
+# a client that wrote is kept on 'default' for REPLICA_PIN_SECONDS.
+
+DATABASE_REPLICAS = []
+for index, name in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_NAMES', '').split(','))):
+    alias = f'replica{index + 1}'
+    DATABASES[alias] = {
+        'ENGINE': DATABASES['default']['ENGINE'],
+        'NAME': name.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+REPLICA_PIN_SECONDS = 5
+
+# Shards. DATABASE_SHARD_NAMES is a comma separated list of database files;
+# with it, artisans and their reviews are spread over 'default' and those
+# shards by state, see artisan_marketplace.sharding. DATABASE_SHARD_STATES
+# places states explicitly, e.g. "LA=shard1,AB=shard2"; other states are
+# placed by a hash of their code. Run `manage.py setup_shards` after adding
+# a shard.
+
+DATABASE_SHARDS = []
+for index, name in enumerate(filter(None, os.environ.get('DATABASE_SHARD_NAMES', '').split(','))):
+    alias = f'shard{index + 1}'
+    DATABASES[alias] = {
+        'ENGINE': DATABASES['default']['ENGINE'],
+        'NAME': name.strip(),
+    }
+    DATABASE_SHARDS.append(alias)
+if DATABASE_SHARDS:
+    DATABASE_SHARDS.insert(0, 'default')
+
+DATABASE_SHARD_STATES = dict(
+    pair.strip().split('=', 1)
+    for pair in os.environ.get('DATABASE_SHARD_STATES', '').split(',') if '=' in pair
+)
+
+DATABASE_ROUTERS = [
+    'artisan_marketplace.sharding.ShardRouter',
+    'artisan_marketplace.routers.PrimaryReplicaRouter',
+]
+
+# Adds the extra SQLite test databases the routing tests need
+TEST_RUNNER = 'artisan_marketplace.test_runner.TestRunner'
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Set REDIS_URL (requires the redis package) to share the cache between
+# gunicorn workers; otherwise each process keeps its own local memory cache.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'artisan-marketplace',
+        }
+    }
+
+
+# Sessions and authentication
+# Sessions live in the cache and are written behind to the database; the
+# session user is loaded from a cached snapshot instead of the users table.
+# Without a shared cache (REDIS_URL) sessions are written through and both
+# are kept only briefly, see accounts.sessions and accounts.cache.
+
+SESSION_ENGINE = 'accounts.sessions'
+SESSION_DB_WRITE_INTERVAL = 60
+
+AUTHENTICATION_BACKENDS = ['accounts.backends.CachedModelBackend']
+USER_SNAPSHOT_TIMEOUT = 60 * 15
+
+
+# Background jobs
+# Deferred work is stored in core.Job and run by `manage.py run_jobs`.
+# JOBS_EAGER runs it inline instead, e.g. when no worker is running.
+
+JOBS_EAGER = False
+
+# Email
+# Notifications are written to the core.OutboxEmail table with the change
+# that causes them, in that change's database, and sent by the
+# core.tasks.send_outbox job or `manage.py send_emails`, EMAIL_BATCH_SIZE
+# per SMTP connection and at most EMAIL_RATE_PER_SECOND. The default server
+# is a local stub, e.g. `python -m aiosmtpd -n -l localhost:1025`.
+
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 1025))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '').strip().lower() in ('1', 'true', 'yes', 'on')
+EMAIL_TIMEOUT = 10
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'ArtisanConnect <no-reply@artisanconnect.ng>')
+EMAIL_BATCH_SIZE = 50
+EMAIL_RATE_PER_SECOND = 5
+EMAIL_RETRY_DELAY = 60
+
+# Slow-query log (core.querylog): every SELECT, INSERT, UPDATE and DELETE is
+# counted per fingerprint; ones slower than SLOW_QUERY_MS are kept with their
+# plan. Off unless QUERY_LOG_ENABLED is set in the environment.
+# `manage.py slow_queries` prints the top offenders.
+
+QUERY_LOG_ENABLED = os.environ.get('QUERY_LOG_ENABLED', '').strip().lower() in ('1', 'true', 'yes', 'on')
+SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 100))
+QUERY_LOG_FLUSH_SECONDS = 30
+
+# Reviews with this many open reports are hidden until a moderator acts
+REVIEW_HIDE_THRESHOLD = 3
+
+
+# Logging
+# Worker warm-up and first-request timings (core.warmup) go to stderr.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.warmup': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -128,6 +269,13 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploaded partner imports; not served
+IMPORTS_ROOT = BASE_DIR / 'private' / 'imports'
+
+# Request profiles saved for staff (?_profile=1, see core.profiling); not served
+PROFILES_ROOT = BASE_DIR / 'private' / 'profiles'
+PROFILE_KEEP = 100
+
 # Custom User Model
 AUTH_USER_MODEL = 'accounts.User'
 
@@ -0,0 +1,1199 @@
+"""
+Horizontal sharding of artisan data by state.
+
+With ``settings.DATABASE_SHARDS`` set, the ``default`` database is shard 0
+and every further alias is one more shard. An artisan profile lives on the
+shard of its state (``DATABASE_SHARD_STATES`` maps state codes to aliases,
+other states are spread by a hash of their code), and its skills, gallery
+images and reviews with their votes and reports live beside it.
+``SHARDED_MODELS`` names each model's parent field. Users and the reference
+tables (categories, skills, states and cities) stay on ``default`` and are
+copied to the other shards once the transaction that changed them commits,
+whether it used ``save()``, ``delete()``, ``update()`` or the bulk methods,
+so joins such as ``user__is_active`` work on every shard. Everything else,
+including the rows derived from artisans and reviews (listings, rollups,
+similar artisans, recommendations and duplicate fingerprints), uses
+``default`` only.
+
+Ids of sharded rows come from counters on ``default`` (``ShardSequence``),
+so they are unique across shards and rows keep them when they move.
+``ShardLocation`` records the shard of every artisan and review. Routing
+follows from that:
+
+* ``ShardRouter`` sends an instance's queries to its own shard and a new
+  instance to the shard of its state or its parent;
+* ``ShardedQuerySet.filter()`` picks the shard for lookups on a state or
+  city, an artisan or review id or a relation to a sharded row, e.g.
+  ``filter(state_id=...)``, ``get(pk=...)`` or ``filter(artisan=...)``;
+* any other ``ShardedQuerySet`` reads every shard, merge-sorting the rows by
+  its ordering and adding up ``count()`` and ``aggregate()``, and its
+  ``update()``, ``delete()`` and bulk writes run on each shard inside
+  ``atomic()``. Only grouped ``values().annotate()`` queries, whose groups
+  would repeat per shard, and queries that bypass ``ShardedQuerySet`` (raw
+  SQL, base managers) raise ``ShardingError`` rather than reading
+  ``default`` alone; ``count_by()`` groups over every shard;
+* code that works through a whole table in batches, such as background
+  jobs, can run once per shard with ``per_shard()`` or inside
+  ``each_shard()``, or inside ``on_shard()`` for one.
+
+``atomic()`` holds a transaction on each shard it covers and commits them in
+a fixed order once the whole block succeeded; an exception anywhere rolls
+all of them back. Only a crash between two of the commits leaves a partial
+write, and the orders are chosen so that what is left is rows that
+``repair()`` (run by ``setup_shards``) cleans up: ids and locations commit
+on ``default`` before the rows using them, a move commits the copies, then
+the new location, then the deletion of the originals, and global rows are
+copied after ``default`` commits. Without shards every function here is a
+no-op and all queries use the usual routing.
+"""
+
+import functools
+import heapq
+import itertools
+import zlib
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, models, router, transaction
+from django.db.models import Avg, Count, F, Max, Min, Sum
+from django.db.models.deletion import Collector
+from django.db.models.expressions import OrderBy
+from django.db.models.query import (
+    FlatValuesListIterable, NamedValuesListIterable, ValuesIterable, ValuesListIterable,
+)
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .routers import record_write
+from .sqlite.base import immediate
+
+# Sharded model -> field that decides its shard: the artisan's state or the
+# parent row it is stored under
+SHARDED_MODELS = {
+    'artisans.artisanprofile': 'state',
+    'artisans.artisanprofile_skills': 'artisanprofile',
+    'artisans.artisangallery': 'artisan',
+    'reviews.review': 'artisan',
+    'reviews.reviewhelpful': 'review',
+    'reviews.reviewreport': 'review',
+}
+
+# Sharded models found by id through ShardLocation; every parent is one
+LOCATED_MODELS = ('artisans.artisanprofile', 'reviews.review')
+
+# Kept on default and mirrored to every other shard
+GLOBAL_MODELS = ('accounts.user', 'artisans.category', 'artisans.skill', 'artisans.state', 'artisans.city')
+
+_pinned = ContextVar('pinned_shard', default=None)
+
+
+class ShardingError(Exception):
+    """A query of a sharded model that does not say which shard to use"""
+
+
+def shards():
+    """Database aliases of all shards, ``default`` first; empty without sharding"""
+    return getattr(settings, 'DATABASE_SHARDS', [])
+
+
+def is_enabled():
+    return len(shards()) > 1
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+def is_global(model):
+    return model._meta.label_lower in GLOBAL_MODELS
+
+
+def sharded_models():
+    return [model for model in apps.get_models(include_auto_created=True) if is_sharded(model)]
+
+
+def global_models():
+    return [model for model in apps.get_models() if is_global(model)]
+
+
+# Locations and ids
+
+def _locations():
+    return apps.get_model('core', 'ShardLocation')._base_manager.using(DEFAULT_DB_ALIAS)
+
+
+def _record(label, locations):
+    """Store ``{pk: alias}`` as the shards of rows of the model ``label``"""
+    if not locations:
+        return
+    Location = apps.get_model('core', 'ShardLocation')
+    options = {'update_conflicts': True, 'update_fields': ['shard']}
+    if connections[DEFAULT_DB_ALIAS].features.supports_update_conflicts_with_target:
+        options['unique_fields'] = ['model', 'object_id']
+    _locations().bulk_create([
+        Location(model=label, object_id=pk, shard=alias) for pk, alias in locations.items()
+    ], batch_size=1000, **options)
+
+
+def locate_many(model, pks):
+    """``{pk: alias}`` for ids of artisans or reviews; ids stored nowhere are left out"""
+    label = model._meta.label_lower
+    pks = set(pks)
+    found = dict(_locations().filter(model=label, object_id__in=pks).values_list('object_id', 'shard'))
+    missing = pks.difference(found)
+    if missing:
+        # Rows whose location was never recorded, e.g. stored before sharding
+        recovered = {}
+        for alias in shards():
+            for pk in model._base_manager.using(alias).filter(pk__in=missing).values_list('pk', flat=True):
+                recovered[pk] = alias
+        _record(label, recovered)
+        found.update(recovered)
+    return found
+
+
+def locate(model, pk):
+    """Shard holding the artisan or review ``pk``, or None if there is none"""
+    return locate_many(model, [pk]).get(pk)
+
+
+def _highest_id(model):
+    return max(
+        (model._base_manager.using(alias).aggregate(top=Max('pk'))['top'] or 0 for alias in shards()),
+        default=0,
+    )
+
+
+def allocate_ids(model, count):
+    """``count`` new primary keys for a sharded model, unique across shards"""
+    Sequence = apps.get_model('core', 'ShardSequence')
+    sequences = Sequence._base_manager.using(DEFAULT_DB_ALIAS)
+    name = model._meta.label_lower
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        if not sequences.filter(name=name).update(last_id=F('last_id') + count):
+            try:
+                with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                    sequences.create(name=name, last_id=_highest_id(model) + count)
+            except IntegrityError:
+                # Created by another process meanwhile
+                sequences.filter(name=name).update(last_id=F('last_id') + count)
+        last = sequences.get(name=name).last_id
+    return list(range(last - count + 1, last + 1))
+
+
+def _assign_ids(model, instances, alias):
+    """Give new ``instances`` ids and record where the located ones are stored"""
+    new = [instance for instance in instances if instance.pk is None]
+    if not new:
+        return
+    label = model._meta.label_lower
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        for instance, pk in zip(new, allocate_ids(model, len(new))):
+            instance.pk = pk
+        if label in LOCATED_MODELS:
+            _record(label, {instance.pk: alias for instance in new})
+
+
+def init_sequences():
+    """Start the id counters of sharded models above every id already stored"""
+    Sequence = apps.get_model('core', 'ShardSequence')
+    for model in sharded_models():
+        if model._meta.auto_created:
+            # Link rows keep the ids their shard gives them
+            continue
+        highest = _highest_id(model)
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            sequence, _ = Sequence._base_manager.using(DEFAULT_DB_ALIAS).get_or_create(
+                name=model._meta.label_lower
+            )
+            if sequence.last_id < highest:
+                sequence.last_id = highest
+                sequence.save(update_fields=['last_id'])
+
+
+# Shard selection
+
+def shard_for_state(state_id):
+    """Shard holding the artisans of a state"""
+    from core import reference
+
+    aliases = shards()
+    state = reference.get().lookup('state', state_id) if len(aliases) > 1 else None
+    if state is None:
+        return DEFAULT_DB_ALIAS
+    placement = getattr(settings, 'DATABASE_SHARD_STATES', {})
+    return placement.get(state.code) or aliases[zlib.crc32(state.code.encode()) % len(aliases)]
+
+
+def shard_for_city(city_id):
+    from core import reference
+
+    city = reference.get().lookup('city', city_id)
+    return shard_for_state(city.state_id) if city is not None else DEFAULT_DB_ALIAS
+
+
+def _pinned_or_raise(model):
+    alias = _pinned.get()
+    if alias is None:
+        raise ShardingError(
+            f'A query of {model._meta.label} that bypasses ShardedQuerySet does not say which '
+            f'shard to use; use {model.__name__}.objects, on_shard() or each_shard()'
+        )
+    return alias
+
+
+def _instance_shard(instance):
+    # Assigning a related object sets ``_state.db`` of a new instance too
+    if instance._state.db is not None and not instance._state.adding:
+        return instance._state.db
+    parent = SHARDED_MODELS[instance._meta.label_lower]
+    if parent == 'state':
+        return shard_for_state(instance.state_id) if instance.state_id is not None else None
+    field = instance._meta.get_field(parent)
+    if field.is_cached(instance):
+        related = field.get_cached_value(instance)
+        if related is not None and related._state.db is not None and not related._state.adding:
+            return related._state.db
+    parent_id = getattr(instance, field.attname)
+    if parent_id is not None:
+        return locate(field.related_model, parent_id) or DEFAULT_DB_ALIAS
+    return None
+
+
+def shard_of(instance):
+    """Shard that holds, or will hold, an instance of a sharded model"""
+    return _instance_shard(instance) or _pinned_or_raise(instance.__class__)
+
+
+@contextmanager
+def on_shard(alias):
+    """Route queries of sharded models that name no shard to ``alias``"""
+    token = _pinned.set(alias)
+    try:
+        yield alias
+    finally:
+        _pinned.reset(token)
+
+
+def current():
+    """Alias unscoped queries of sharded models go to"""
+    return _pinned.get() or DEFAULT_DB_ALIAS
+
+
+def each_shard():
+    """Yield every shard alias with queries pinned to it; once, with None, without sharding"""
+    if not is_enabled():
+        yield None
+        return
+    for alias in shards():
+        with on_shard(alias):
+            yield alias
+
+
+# Lookup routing
+
+def _lookup_target(model, parts):
+    """Model whose primary key the lookup path ``parts`` compares against, or None"""
+    opts = model._meta
+    field = None
+    for index, part in enumerate(parts):
+        try:
+            field = opts.pk if part == 'pk' else opts.get_field(part)
+        except FieldDoesNotExist:
+            # ``state_id`` style attnames
+            if not part.endswith('_id'):
+                return None
+            try:
+                field = opts.get_field(part[:-3])
+            except FieldDoesNotExist:
+                return None
+            if not field.many_to_one and not field.one_to_one:
+                return None
+        if index < len(parts) - 1:
+            if not field.is_relation:
+                return None
+            opts = field.related_model._meta
+    if field is None:
+        return None
+    if field.is_relation:
+        return field.related_model
+    return field.model if field.primary_key else None
+
+
+def _value_shards(target, values):
+    """Shards of the rows of ``target`` that ``values`` (instances or ids) name, or None"""
+    aliases, ids = set(), []
+    for value in values:
+        if isinstance(value, models.Model):
+            if is_sharded(value.__class__) and value._state.db is not None and not value._state.adding:
+                aliases.add(value._state.db)
+                continue
+            value = value.pk
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            return None
+    label = target._meta.label_lower
+    if label == 'artisans.state':
+        aliases.update(shard_for_state(pk) for pk in ids)
+    elif label == 'artisans.city':
+        aliases.update(shard_for_city(pk) for pk in ids)
+    elif label in LOCATED_MODELS:
+        # Ids stored nowhere match nothing on any shard
+        aliases.update(locate_many(target, ids).values())
+        if not aliases:
+            aliases.add(DEFAULT_DB_ALIAS)
+    elif ids:
+        return None
+    return aliases
+
+
+def shard_for_lookups(model, lookups):
+    """Shard implied by keyword lookups on ``model``, or None"""
+    for key, value in lookups.items():
+        parts = key.split('__')
+        many = parts[-1] == 'in'
+        if parts[-1] in ('exact', 'in'):
+            parts = parts[:-1]
+        target = _lookup_target(model, parts)
+        if target is None:
+            continue
+        if many:
+            if not isinstance(value, (list, tuple, set, frozenset)):
+                continue
+            if not value:
+                # Matches nothing, wherever it runs
+                return DEFAULT_DB_ALIAS
+            aliases = _value_shards(target, value)
+        else:
+            aliases = _value_shards(target, [value])
+        if aliases is not None and len(aliases) == 1:
+            return aliases.pop()
+    return None
+
+
+class ShardedQuerySet(models.QuerySet):
+    """
+    QuerySet that routes itself to a shard when its filters name one, and
+    otherwise reads from every shard and writes on each.
+    """
+
+    def filter(self, *args, **kwargs):
+        clone = super().filter(*args, **kwargs)
+        if clone._db is None and kwargs and is_enabled():
+            clone._db = shard_for_lookups(self.model, kwargs)
+        return clone
+
+    def _routed(self, lookups):
+        if self._db is None and is_enabled():
+            alias = shard_for_lookups(self.model, lookups)
+            if alias is not None:
+                return self.using(alias)
+        return self
+
+    def _on_shards(self):
+        return [self.using(alias) for alias in shards()]
+
+    # Reads
+
+    def _fetch_all(self):
+        if self._result_cache is None and _unrouted(self):
+            self._result_cache = _gather(self)
+            # Each shard's part prefetched for its own rows
+            self._prefetch_done = True
+        super()._fetch_all()
+
+    def iterator(self, chunk_size=None):
+        if not _unrouted(self):
+            return super().iterator(chunk_size=chunk_size)
+        return iter(_gather(self))
+
+    def count(self):
+        if self._result_cache is not None or not _unrouted(self):
+            return super().count()
+        if self.query.is_sliced or (self.query.distinct and self._fields is not None):
+            # Rows from different shards may be equal or cut by the slice
+            return len(self)
+        return sum(part.count() for part in self._on_shards())
+
+    def exists(self):
+        if self._result_cache is not None or not _unrouted(self):
+            return super().exists()
+        return any(part.exists() for part in self._on_shards())
+
+    def aggregate(self, *args, **kwargs):
+        if not _unrouted(self):
+            return super().aggregate(*args, **kwargs)
+        for function in args:
+            kwargs[function.default_alias] = function
+        return aggregate(self, **kwargs)
+
+    def get_or_create(self, defaults=None, **kwargs):
+        queryset = self._routed(kwargs)
+        if _unrouted(queryset):
+            try:
+                return queryset.get(**kwargs), False
+            except self.model.DoesNotExist:
+                params = queryset._extract_model_params(defaults, **kwargs)
+                queryset = queryset.using(shard_of(self.model(**params)))
+        return super(ShardedQuerySet, queryset).get_or_create(defaults, **kwargs)
+
+    def update_or_create(self, defaults=None, **kwargs):
+        queryset = self._routed(kwargs)
+        if _unrouted(queryset):
+            try:
+                alias = queryset.get(**kwargs)._state.db
+            except self.model.DoesNotExist:
+                alias = shard_of(self.model(**queryset._extract_model_params(defaults, **kwargs)))
+            queryset = queryset.using(alias)
+        return super(ShardedQuerySet, queryset).update_or_create(defaults, **kwargs)
+
+    # Writes
+
+    def create(self, **kwargs):
+        # ``create()`` saves with ``using=self.db``, which has no instance to route by
+        if self._db is None and is_enabled():
+            return self.using(shard_of(self.model(**kwargs))).create(**kwargs)
+        return super().create(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if not is_enabled():
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        if _unrouted(self):
+            with atomic():
+                for alias, group in group_by_shard(objs).items():
+                    self.using(alias).bulk_create(group, *args, **kwargs)
+            return objs
+        _assign_ids(self.model, objs, self.db)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    bulk_create.alters_data = True
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        if not _unrouted(self):
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+        groups = {}
+        for obj in objs:
+            groups.setdefault(shard_of(obj), []).append(obj)
+        with atomic():
+            return sum(
+                self.using(alias).bulk_update(group, fields, batch_size=batch_size)
+                for alias, group in groups.items()
+            )
+
+    bulk_update.alters_data = True
+
+    def update(self, **kwargs):
+        if not _unrouted(self):
+            return super().update(**kwargs)
+        with atomic():
+            return sum(part.update(**kwargs) for part in self._on_shards())
+
+    update.alters_data = True
+
+    def delete(self):
+        if not _unrouted(self):
+            return super().delete()
+        deleted, counts = 0, Counter()
+        with atomic():
+            for part in self._on_shards():
+                part_deleted, part_counts = part.delete()
+                deleted += part_deleted
+                counts.update(part_counts)
+        return deleted, dict(counts)
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+ShardedManager = models.Manager.from_queryset(ShardedQuerySet)
+
+
+def _shard_by_reference(model, instance):
+    """Shard of the located ``model`` row that a foreign key of ``instance`` points to"""
+    if model._meta.label_lower not in LOCATED_MODELS:
+        return None
+    aliases = {
+        locate(model, value) or DEFAULT_DB_ALIAS
+        for field in instance._meta.concrete_fields
+        if field.is_relation and field.related_model is model
+        and (value := getattr(instance, field.attname)) is not None
+    }
+    return aliases.pop() if len(aliases) == 1 else None
+
+
+class ShardRouter:
+    """Route sharded models to their shard; everything else falls through"""
+
+    def _route(self, model, hints, write=False):
+        if not is_enabled():
+            return None
+        instance = hints.get('instance')
+        if not is_sharded(model):
+            # Rows derived from a sharded row, e.g. ``artisan.listing``, are on default
+            if instance is not None and is_sharded(instance.__class__) and not is_global(model):
+                return DEFAULT_DB_ALIAS
+            return None
+        if instance is not None:
+            if is_sharded(instance.__class__):
+                if write:
+                    # Validating a new instance before its parent is set
+                    return _instance_shard(instance) or _pinned.get()
+                return shard_of(instance)
+            # ``listing.artisan`` and the like
+            alias = _shard_by_reference(model, instance)
+            if alias is not None:
+                return alias
+            if write:
+                # Assigning ``profile.user = user`` asks for a database too;
+                # the instance routes itself when it is saved
+                return _pinned.get()
+        return _pinned_or_raise(model)
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        alias = self._route(model, hints, write=True)
+        if alias is not None:
+            record_write()
+        return alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not is_enabled():
+            return None
+        if is_sharded(obj1.__class__) and is_sharded(obj2.__class__):
+            # Only saved instances are known to live on a shard
+            db1 = None if obj1._state.adding else obj1._state.db
+            db2 = None if obj2._state.adding else obj2._state.db
+            return db1 is None or db2 is None or db1 == db2
+        # Global rows exist on every shard; default-only rows refer to any shard
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+# Scatter-gather
+
+@functools.total_ordering
+class _MergeKey:
+    __slots__ = ('values', 'terms')
+
+    def __init__(self, values, terms):
+        self.values = values
+        self.terms = terms
+
+    def __eq__(self, other):
+        return self.values == other.values
+
+    def __lt__(self, other):
+        for a, b, (_, descending, none_largest) in zip(self.values, other.values, self.terms):
+            if a == b:
+                continue
+            if a is None or b is None:
+                less = (b is None) == none_largest
+            else:
+                less = a < b
+            return less != descending
+        return False
+
+
+def _ordering_terms(queryset):
+    query = queryset.query
+    ordering = query.order_by or (query.get_meta().ordering if query.default_ordering else ())
+    nulls_largest = connections[shards()[0]].features.nulls_order_largest
+    terms = []
+    for term in ordering:
+        nulls_first = nulls_last = False
+        if isinstance(term, str) and term != '?':
+            name, descending = term.lstrip('-'), term.startswith('-')
+        elif isinstance(term, F):
+            name, descending = term.name, False
+        elif isinstance(term, OrderBy) and isinstance(term.expression, F):
+            name, descending = term.expression.name, term.descending
+            nulls_first, nulls_last = term.nulls_first, term.nulls_last
+        else:
+            raise ValueError(f'Cannot merge shard results ordered by {term!r}')
+        if nulls_first:
+            none_largest = descending
+        elif nulls_last:
+            none_largest = not descending
+        else:
+            none_largest = nulls_largest
+        terms.append((name, descending, none_largest))
+    return terms
+
+
+def _ordering_value(row, name):
+    if isinstance(row, dict):
+        return row[name]
+    for part in name.split('__'):
+        try:
+            # Compare foreign keys by id rather than loading the related row
+            part = row._meta.get_field(part).attname
+        except (AttributeError, FieldDoesNotExist):
+            pass
+        row = getattr(row, part)
+        if row is None:
+            break
+    return row
+
+
+def _ordering_getter(queryset, name):
+    """Function reading the value ``name`` is ordered by from a result row"""
+    if queryset._iterable_class not in (ValuesListIterable, FlatValuesListIterable, NamedValuesListIterable):
+        return lambda row: _ordering_value(row, name)
+    fields = list(queryset._fields)
+    if name == 'pk' or name == queryset.model._meta.pk.name:
+        names = {'pk', queryset.model._meta.pk.name, queryset.model._meta.pk.attname}
+        name = next((field for field in fields if field in names), name)
+    if name not in fields:
+        raise ValueError(f'Cannot merge shard results ordered by {name!r} without selecting it')
+    if queryset._iterable_class is FlatValuesListIterable:
+        return lambda row: row
+    index = fields.index(name)
+    return lambda row: row[index]
+
+
+class ShardedResults:
+    """
+    One query over every shard, merge-sorted by its ordering.
+
+    Supports what pagination, templates and the admin change list use:
+    iteration, ``count()``, ``exists()``, slicing, ``aggregate()`` and
+    ``dates()``. A slice ``[start:stop]`` reads at most ``stop`` rows from
+    each shard.
+    """
+
+    ordered = True
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+        self.model = queryset.model
+        terms = _ordering_terms(queryset)
+        getters = [_ordering_getter(queryset, name) for name, _, _ in terms]
+        self._key = (
+            (lambda row: _MergeKey(tuple(get(row) for get in getters), terms))
+            if terms else None
+        )
+        self._count = None
+
+    def _parts(self, stop=None):
+        parts = [self.queryset.using(alias) for alias in shards()]
+        if stop is not None:
+            parts = [part[:stop] for part in parts]
+        if self._key is None:
+            return itertools.chain.from_iterable(parts)
+        return heapq.merge(*parts, key=self._key)
+
+    def _clone(self):
+        return ShardedResults(self.queryset)
+
+    def __iter__(self):
+        return iter(self._parts())
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            if item.step is not None or (item.start or 0) < 0 or (item.stop or 0) < 0:
+                raise ValueError('Only forward slices without a step are supported')
+            start = item.start or 0
+            return list(itertools.islice(self._parts(item.stop), start, item.stop))
+        rows = self[item:item + 1]
+        if not rows:
+            raise IndexError(item)
+        return rows[0]
+
+    def count(self):
+        if self._count is None:
+            self._count = sum(self.queryset.using(alias).count() for alias in shards())
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __bool__(self):
+        return self.exists()
+
+    def exists(self):
+        return any(self.queryset.using(alias).exists() for alias in shards())
+
+    def aggregate(self, **aggregates):
+        return aggregate(self.queryset, **aggregates)
+
+    def dates(self, field_name, kind, order='ASC'):
+        values = {value for alias in shards() for value in self.queryset.using(alias).dates(field_name, kind)}
+        return sorted(values, reverse=order == 'DESC')
+
+    def datetimes(self, field_name, kind, order='ASC', **kwargs):
+        values = {
+            value for alias in shards()
+            for value in self.queryset.using(alias).datetimes(field_name, kind, **kwargs)
+        }
+        return sorted(values, reverse=order == 'DESC')
+
+
+def _spans_shards(queryset):
+    return is_enabled() and is_sharded(queryset.model) and queryset._db is None
+
+
+def _unrouted(queryset):
+    """Whether the router would find no shard for ``queryset`` either"""
+    if not _spans_shards(queryset) or _pinned.get() is not None:
+        return False
+    # Related managers, e.g. ``artisan.reviews``, route by their instance
+    instance = queryset._hints.get('instance')
+    return instance is None or not (
+        is_sharded(instance.__class__) or _shard_by_reference(queryset.model, instance)
+    )
+
+
+def _distinct(rows):
+    seen = set()
+    for row in rows:
+        key = tuple(row.items()) if isinstance(row, dict) else row
+        if key not in seen:
+            seen.add(key)
+            yield row
+
+
+def _selecting_ordering(queryset):
+    """
+    ``(queryset, strip)``: a ``values()`` or ``values_list()`` queryset that
+    also selects the columns it is ordered by, so that shard results can be
+    merged, and a function that drops them from each row again, or None.
+    """
+    iterable = queryset._iterable_class
+    if queryset._fields is None or iterable is NamedValuesListIterable:
+        return queryset, None
+    fields = list(queryset._fields)
+    if iterable is ValuesIterable and not fields:
+        # Every column is selected
+        return queryset, None
+    try:
+        terms = _ordering_terms(queryset)
+    except ValueError:
+        return queryset, None
+    pk = queryset.model._meta.pk
+    selected = set(fields)
+    if selected & {'pk', pk.name, pk.attname}:
+        selected |= {'pk', pk.name}
+    missing = [name for name, _, _ in terms if name not in selected]
+    if not missing:
+        return queryset, None
+    if iterable is ValuesIterable:
+        return queryset.values(*fields, *missing), lambda row: {name: row[name] for name in fields}
+    wider = queryset.values_list(*fields, *missing)
+    if iterable is FlatValuesListIterable:
+        return wider, lambda row: row[0]
+    return wider, lambda row: row[:len(fields)]
+
+
+def _gather(queryset):
+    """The rows of an unrouted ``queryset`` from every shard, in its order"""
+    query = queryset.query
+    if queryset._fields is not None and query.group_by is not None:
+        raise ShardingError(
+            f'Groups of {queryset.model._meta.label} rows repeat on every shard; use count_by() '
+            f'or group each part of per_shard()'
+        )
+    low, high = query.low_mark, query.high_mark
+    whole = queryset._chain()
+    whole.query.clear_limits()
+    whole, strip = _selecting_ordering(whole)
+    try:
+        rows = ShardedResults(whole)._parts(high)
+    except ValueError:
+        if query.is_sliced:
+            raise
+        # Not mergeable, e.g. ordered by an expression: each shard's rows
+        # stay in order, one shard after another
+        rows = itertools.chain.from_iterable(whole.using(alias) for alias in shards())
+    if strip is not None:
+        rows = map(strip, rows)
+    if query.distinct:
+        rows = _distinct(rows)
+    return list(itertools.islice(rows, low, high))
+
+
+def per_shard(queryset):
+    """
+    ``queryset`` once per shard, in shard order, or just ``queryset`` when
+    it is routed to one shard or its model is not sharded.
+    """
+    if not _spans_shards(queryset):
+        return [queryset]
+    return [queryset.using(alias) for alias in shards()]
+
+
+def scatter(queryset):
+    """``queryset`` over every shard unless it is routed to one, or sharding is off"""
+    if not _spans_shards(queryset):
+        return queryset
+    return ShardedResults(queryset)
+
+
+def aggregate(queryset, **aggregates):
+    """``queryset.aggregate()`` combined over every shard for Count, Sum, Min, Max and Avg"""
+    if not _spans_shards(queryset):
+        return queryset.aggregate(**aggregates)
+
+    parts = {}
+    for name, function in aggregates.items():
+        if isinstance(function, Avg):
+            expression = function.get_source_expressions()[0]
+            parts[f'{name}__sum'] = Sum(expression, filter=function.filter)
+            parts[f'{name}__count'] = Count(expression, filter=function.filter)
+        elif isinstance(function, (Count, Sum, Min, Max)):
+            parts[name] = function
+        else:
+            raise TypeError(f'Cannot combine {type(function).__name__} over shards')
+    results = [queryset.using(alias).aggregate(**parts) for alias in shards()]
+
+    combined = {}
+    for name, function in aggregates.items():
+        if isinstance(function, Avg):
+            total = sum(result[f'{name}__sum'] or 0 for result in results)
+            count = sum(result[f'{name}__count'] for result in results)
+            combined[name] = total / count if count else None
+            continue
+        values = [result[name] for result in results if result[name] is not None]
+        if isinstance(function, Count):
+            combined[name] = sum(values)
+        elif not values:
+            combined[name] = None
+        else:
+            combined[name] = {Sum: sum, Min: min, Max: max}[type(function)](values)
+    return combined
+
+
+def count_by(queryset, field):
+    """``{value of field: row count}`` over every shard"""
+    counts = {}
+    for part in per_shard(queryset):
+        for value, count in part.order_by().values_list(field).annotate(n=Count('pk')):
+            counts[value] = counts.get(value, 0) + count
+    return counts
+
+
+@contextmanager
+def atomic(*aliases):
+    """
+    A transaction on each of ``aliases``, or on every shard, that commits
+    only if the whole block succeeds. Each starts with ``BEGIN IMMEDIATE``,
+    so no commit has to wait for another writer, and they commit in the
+    order given; by default ``default`` first, so the ids, locations and
+    users written there are in place before the rows on other shards that
+    use them.
+    """
+    aliases = list(dict.fromkeys(aliases)) if aliases else shards() or [DEFAULT_DB_ALIAS]
+    with ExitStack() as stack:
+        # The innermost block commits first
+        for alias in reversed(aliases):
+            stack.enter_context(immediate(using=alias))
+        yield
+
+
+def group_ids(model, ids):
+    """``{alias: [ids]}`` for ids of artisans or reviews; ``{None: ids}`` without sharding"""
+    ids = list(ids)
+    if not is_enabled():
+        return {None: ids}
+    found = locate_many(model, ids)
+    groups = {}
+    for pk in ids:
+        # Ids stored nowhere go to default, where they match nothing
+        groups.setdefault(found.get(pk, DEFAULT_DB_ALIAS), []).append(pk)
+    return groups
+
+
+def group_by_shard(instances):
+    """``{alias: [instances]}`` for new instances of a sharded model"""
+    groups = {}
+    for instance in instances:
+        groups.setdefault(shard_of(instance) if is_enabled() else DEFAULT_DB_ALIAS, []).append(instance)
+    return groups
+
+
+# Copies of rows
+
+def _copy(model, rows, alias, replace=False, keep_ids=True):
+    """
+    Insert copies of ``rows`` on ``alias`` with their column values as they
+    are, timestamps included. ``replace`` overwrites rows with the same id.
+    """
+    if not rows:
+        return []
+    fields = model._meta.concrete_fields
+    copies = [
+        model(**{
+            field.attname: getattr(row, field.attname)
+            for field in fields if keep_ids or not field.primary_key
+        })
+        for row in rows
+    ]
+    # Inserting sets auto_now and auto_now_add columns; put the originals back
+    stamped = [
+        field.attname for field in fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    stamps = [[getattr(copy, name) for name in stamped] for copy in copies]
+
+    options = {}
+    if replace:
+        options = {
+            'update_conflicts': True,
+            'update_fields': [field.name for field in fields if not field.primary_key],
+        }
+        if connections[alias].features.supports_update_conflicts_with_target:
+            options['unique_fields'] = [model._meta.pk.name]
+    manager = model._base_manager.using(alias)
+    manager.bulk_create(copies, batch_size=1000, **options)
+    if stamped:
+        for copy, values in zip(copies, stamps):
+            for name, value in zip(stamped, values):
+                setattr(copy, name, value)
+        manager.bulk_update(copies, stamped, batch_size=1000)
+    return copies
+
+
+# Mirrors of global tables
+
+def mirror(model, pks):
+    """Make the rows ``pks`` of a global model on every other shard equal to default's"""
+    if not is_enabled():
+        return
+    pks = set(pks)
+    rows = list(model._base_manager.using(DEFAULT_DB_ALIAS).filter(pk__in=pks))
+    gone = pks.difference(row.pk for row in rows)
+    for alias in shards()[1:]:
+        with transaction.atomic(using=alias):
+            if gone:
+                # Cascades to the artisans, reviews, ... on that shard
+                model._base_manager.using(alias).filter(pk__in=gone).delete()
+            _copy(model, rows, alias, replace=True)
+
+
+def mirror_on_commit(model, pks):
+    """``mirror()`` once the current transaction on default commits"""
+    if is_enabled() and pks:
+        transaction.on_commit(functools.partial(mirror, model, list(pks)), using=DEFAULT_DB_ALIAS)
+
+
+class GlobalQuerySet(models.QuerySet):
+    """QuerySet of a global model that also mirrors rows changed in bulk"""
+
+    def _mirrored(self):
+        return is_enabled() and (self._db or router.db_for_write(self.model)) == DEFAULT_DB_ALIAS
+
+    def update(self, **kwargs):
+        if not self._mirrored():
+            return super().update(**kwargs)
+        with immediate(using=DEFAULT_DB_ALIAS):
+            pks = list(self.using(DEFAULT_DB_ALIAS).values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            mirror_on_commit(self.model, pks)
+        return rows
+
+    update.alters_data = True
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        rows = super().bulk_update(objs, fields, batch_size=batch_size)
+        if self._mirrored():
+            mirror_on_commit(self.model, [obj.pk for obj in objs])
+        return rows
+
+    bulk_update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if self._mirrored():
+            # Backends that return no ids leave new rows to repair()
+            mirror_on_commit(self.model, [obj.pk for obj in objs if obj.pk is not None])
+        return objs
+
+    bulk_create.alters_data = True
+
+
+GlobalManager = models.Manager.from_queryset(GlobalQuerySet)
+
+
+def sync_global_tables(alias, batch_size=1000):
+    """Make the global tables on ``alias`` equal to default's; returns the rows removed"""
+    removed = 0
+    for model in global_models():
+        source = model._base_manager.using(DEFAULT_DB_ALIAS).order_by('pk')
+        target = model._base_manager.using(alias)
+        extra = list(set(target.values_list('pk', flat=True)).difference(source.values_list('pk', flat=True)))
+        with transaction.atomic(using=alias):
+            for start in range(0, len(extra), batch_size):
+                target.filter(pk__in=extra[start:start + batch_size]).delete()
+            rows = iter(source.iterator(chunk_size=batch_size))
+            while batch := list(itertools.islice(rows, batch_size)):
+                _copy(model, batch, alias, replace=True)
+        removed += len(extra)
+    return removed
+
+
+# Signal receivers
+
+def _saving(sender, instance, raw=False, using=None, **kwargs):
+    if not raw and instance._state.adding and is_sharded(sender) and is_enabled():
+        _assign_ids(sender, [instance], using)
+
+
+def _saved(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    # An empty update_fields wrote nothing
+    if update_fields is not None and not update_fields:
+        return
+    if not raw and using == DEFAULT_DB_ALIAS and is_global(sender):
+        mirror_on_commit(sender, [instance.pk])
+
+
+def _deleted(sender, instance, using=None, **kwargs):
+    if not is_enabled():
+        return
+    if is_global(sender):
+        if using == DEFAULT_DB_ALIAS:
+            mirror_on_commit(sender, [instance.pk])
+        return
+    label = sender._meta.label_lower
+    if label not in LOCATED_MODELS:
+        return
+    _locations().filter(model=label, object_id=instance.pk).delete()
+    if using == DEFAULT_DB_ALIAS:
+        return
+    # The deletion collected rows on ``using``, but derived rows are on default
+    for relation in sender._meta.related_objects:
+        related = relation.related_model
+        if relation.many_to_many or is_sharded(related) or is_global(related):
+            continue
+        if relation.on_delete is models.CASCADE:
+            related._base_manager.using(DEFAULT_DB_ALIAS).filter(
+                **{relation.field.attname: instance.pk}
+            ).delete()
+
+
+def install():
+    """Connect the id, location and mirroring receivers; called from ``CoreConfig.ready``"""
+    pre_save.connect(_saving, dispatch_uid='sharding_saving')
+    post_save.connect(_saved, dispatch_uid='sharding_saved')
+    post_delete.connect(_deleted, dispatch_uid='sharding_deleted')
+
+
+# Shard maintenance
+
+class _CopyCollector(Collector):
+    # Fast deletes skip instances; moving needs every row
+    def can_fast_delete(self, *args, **kwargs):
+        return False
+
+
+def _collect(artisan_id, alias):
+    """``[(model, rows)]`` of an artisan and the sharded rows under it on ``alias``, parents first"""
+    model = apps.get_model('artisans', 'ArtisanProfile')
+    collector = _CopyCollector(using=alias)
+    collector.collect(list(model._base_manager.using(alias).filter(pk=artisan_id)))
+    collector.sort()
+    # Deletion order lists dependents first
+    return [
+        (related, sorted(collector.data[related], key=lambda row: row.pk))
+        for related in reversed(list(collector.data)) if is_sharded(related)
+    ]
+
+
+def _purge(collected, alias):
+    """Delete collected rows from ``alias`` without signals, dependents first"""
+    with transaction.atomic(using=alias):
+        for related, rows in reversed(collected):
+            related._base_manager.using(alias).filter(pk__in=[row.pk for row in rows])._raw_delete(alias)
+
+
+def relocate(artisan):
+    """
+    Move ``artisan`` and its rows to the shard of its state if it lives on
+    another one; they keep their ids. Returns the artisan as stored on its
+    shard.
+    """
+    target = shard_for_state(artisan.state_id)
+    source = artisan._state.db or DEFAULT_DB_ALIAS
+    if not is_enabled() or target == source:
+        return artisan
+
+    # The copies commit first, then the new locations, then the deletion
+    with atomic(target, DEFAULT_DB_ALIAS, source):
+        collected = _collect(artisan.pk, source)
+        for related, rows in collected:
+            # Link rows are not looked up by id, so the target numbers them
+            _copy(related, rows, target, keep_ids=not related._meta.auto_created)
+        for related, rows in collected:
+            label = related._meta.label_lower
+            if label in LOCATED_MODELS:
+                _record(label, {row.pk: target for row in rows})
+        _purge(collected, source)
+    return type(artisan)._base_manager.using(target).get(pk=artisan.pk)
+
+
+def rebalance(stdout=None):
+    """Move every artisan stored on the wrong shard, e.g. after adding one; returns the number moved"""
+    model = apps.get_model('artisans', 'ArtisanProfile')
+    moved = 0
+    for alias in shards():
+        misplaced = [
+            pk for pk, state_id in model._base_manager.using(alias).values_list('pk', 'state_id')
+            if shard_for_state(state_id) != alias
+        ]
+        for pk in misplaced:
+            relocate(model._base_manager.using(alias).get(pk=pk))
+            moved += 1
+        if stdout is not None and misplaced:
+            stdout.write(f'Moved {len(misplaced)} artisan(s) off {alias}')
+    return moved
+
+
+def repair(stdout=None):
+    """
+    Clean up after cross-database writes that stopped part-way: copy the
+    global tables again, delete the copies of artisans left on two shards by
+    an interrupted move (the recorded shard keeps its copy), and make
+    ``ShardLocation`` match the rows that exist. Returns the number of rows
+    fixed.
+    """
+    fixed = 0
+    for alias in shards()[1:]:
+        removed = sync_global_tables(alias)
+        if stdout is not None and removed:
+            stdout.write(f'Removed {removed} stale global row(s) from {alias}')
+        fixed += removed
+
+    for label in LOCATED_MODELS:
+        model = apps.get_model(label)
+        stored = {}
+        for alias in shards():
+            for pk in model._base_manager.using(alias).values_list('pk', flat=True).iterator(chunk_size=10000):
+                stored.setdefault(pk, []).append(alias)
+        recorded = dict(_locations().filter(model=label).values_list('object_id', 'shard'))
+
+        for pk, aliases in stored.items():
+            if len(aliases) > 1 and label == 'artisans.artisanprofile':
+                keep = recorded.get(pk) if recorded.get(pk) in aliases else aliases[0]
+                for alias in aliases:
+                    if alias != keep:
+                        _purge(_collect(pk, alias), alias)
+                        fixed += 1
+                stored[pk] = [keep]
+
+        wrong = {pk: aliases[0] for pk, aliases in stored.items() if recorded.get(pk) != aliases[0]}
+        _record(label, wrong)
+        dangling = [pk for pk in recorded if pk not in stored]
+        for start in range(0, len(dangling), 1000):
+            _locations().filter(model=label, object_id__in=dangling[start:start + 1000]).delete()
+        fixed += len(wrong) + len(dangling)
+        if stdout is not None and (wrong or dangling):
+            stdout.write(f'{label}: {len(wrong)} location(s) set, {len(dangling)} removed')
+    return fixed
@@ -0,0 +1,123 @@
+"""
+SQLite backend tuned for several gunicorn workers sharing one database file.
+
+On top of Django's SQLite backend this:
+
+- enables WAL journaling and the pragmas in ``PRAGMAS`` on every new
+  connection (override or extend them with ``OPTIONS['pragmas']``);
+- starts the transactions of ``immediate()`` blocks with ``BEGIN
+  IMMEDIATE``, so a transaction that reads before it writes takes the write
+  lock up front instead of failing with "database is locked" when it tries
+  to upgrade. Other transactions start with a plain ``BEGIN`` and do not
+  hold the write lock while they only read;
+- retries statements that run outside a transaction with exponential
+  backoff when the database is still locked after ``busy_timeout``.
+
+Use it with ``'ENGINE': 'artisan_marketplace.sqlite'``.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.backends.sqlite3 import base as sqlite3_base
+
+Database = sqlite3_base.Database
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,  # KiB when negative, i.e. 64 MB
+    'mmap_size': 268435456,  # 256 MB
+    'temp_store': 'MEMORY',
+}
+
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 0.05
+
+
+def is_lock_error(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+class SQLiteCursorWrapper(sqlite3_base.SQLiteCursorWrapper):
+    """Cursor that retries statements failing on a locked database"""
+
+    retries = LOCK_RETRIES
+    retry_delay = LOCK_RETRY_DELAY
+
+    def _retry(self, method, *args):
+        attempt = 0
+        while True:
+            try:
+                return method(*args)
+            except Database.OperationalError as exc:
+                # Inside a transaction the statement cannot simply be run
+                # again; let the caller roll back.
+                if (
+                    attempt >= self.retries
+                    or self.connection.in_transaction
+                    or not is_lock_error(exc)
+                ):
+                    raise
+                delay = self.retry_delay * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+                attempt += 1
+
+    def execute(self, query, params=None):
+        return self._retry(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        return self._retry(super().executemany, query, list(param_list))
+
+
+@contextmanager
+def immediate(using=None):
+    """
+    ``transaction.atomic()`` for a block that reads and then writes. As the
+    outermost block it starts with ``BEGIN IMMEDIATE``; nested in another
+    transaction it is a savepoint, and that transaction decides.
+    """
+    connection = transaction.get_connection(using)
+    # Other backends never read the flag
+    connection.begin_immediate = not connection.in_atomic_block
+    try:
+        with transaction.atomic(using=using):
+            connection.begin_immediate = False
+            yield
+    finally:
+        connection.begin_immediate = False
+
+
+class DatabaseWrapper(sqlite3_base.DatabaseWrapper):
+
+    begin_immediate = False
+
+    def get_connection_params(self):
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = {**PRAGMAS, **options.get('pragmas', {})}
+        self.lock_retries = options.get('lock_retries', LOCK_RETRIES)
+        self.lock_retry_delay = options.get('lock_retry_delay', LOCK_RETRY_DELAY)
+
+        kwargs = super().get_connection_params()
+        for key in ('pragmas', 'lock_retries', 'lock_retry_delay'):
+            kwargs.pop(key, None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.retries = self.lock_retries
+        cursor.retry_delay = self.lock_retry_delay
+        return cursor
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE' if self.begin_immediate else 'BEGIN')
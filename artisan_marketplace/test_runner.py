@@ -0,0 +1,47 @@
+"""
+Test runner that adds the extra SQLite databases the routing tests use.
+
+``TEST_REPLICA`` is a second SQLite file, created, migrated and destroyed
+with the default test database but never mirrored from it, so a test can
+tell which database served a read. It only exists while the tests run;
+tests that use it list it in ``databases`` and turn on routing to it with
+``override_settings(DATABASE_REPLICAS=[TEST_REPLICA])``.
+
+``TEST_SHARD`` is created the same way for the sharding tests, which turn
+it into a shard with ``override_settings(DATABASE_SHARDS=[DEFAULT_DB_ALIAS,
+TEST_SHARD])``.
+"""
+
+import os
+import tempfile
+
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+TEST_REPLICA = 'test_replica'
+TEST_SHARD = 'test_shard'
+
+EXTRA_DATABASES = (TEST_REPLICA, TEST_SHARD)
+
+
+class TestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        default = connections.settings['default']
+        for alias in EXTRA_DATABASES:
+            connections.settings[alias] = {
+                **default,
+                'TEST': {
+                    **default['TEST'],
+                    'NAME': os.path.join(tempfile.gettempdir(), f'{alias}_{os.getpid()}.sqlite3'),
+                    'MIRROR': None,
+                },
+            }
+
+    def teardown_test_environment(self, **kwargs):
+        for alias in EXTRA_DATABASES:
+            if alias in connections:
+                connections[alias].close()
+            connections.settings.pop(alias, None)
+        super().teardown_test_environment(**kwargs)
@@ -25,6 +25,7 @@ urlpatterns = [
     path('accounts/', include('accounts.urls')),
     path('reviews/', include('reviews.urls')),
     path('artisans/', include('artisans.urls')),
+    path('api/v1/', include('api.urls')),
 ]
 
 # Serve media files during development
@@ -11,6 +11,13 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from core import warmup
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'artisan_marketplace.settings')
 
 application = get_wsgi_application()
+
+# Compile templates and fill caches and search indexes before the first request
+warmup.warm_up()
+
+application = warmup.FirstRequestReporter(application)
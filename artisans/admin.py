@@ -1,5 +1,20 @@
+import csv
+from itertools import chain
+
 from django.contrib import admin
-from .models import Category, Skill, State, City, ArtisanProfile, ArtisanGallery
+from django.db import transaction
+from django.db.models import Avg, Count, Q
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from .models import (
+    Category, Skill, State, City, ArtisanProfile, ArtisanGallery, ArtisanDailyStats,
+    ArtisanImport, ArtisanImportError
+)
+from .tasks import process_artisan_import, schedule_similar_artisans_update
+from artisan_marketplace.sharding import relocate
+from core.admin_mixins import RelatedLabelsMixin, ShardedAdminMixin, is_autocomplete
+from core.exports import export_action
+from core.outbox import queue_email
 
 
 @admin.register(Category)
@@ -10,10 +25,12 @@ class CategoryAdmin(admin.ModelAdmin):
 
 
 @admin.register(Skill)
-class SkillAdmin(admin.ModelAdmin):
+class SkillAdmin(RelatedLabelsMixin, admin.ModelAdmin):
     list_display = ('name', 'category', 'created_at')
     list_filter = ('category', 'created_at')
     search_fields = ('name', 'category__name')
+    list_select_related = ('category',)
+    label_related = ('category',)
 
 
 @admin.register(State)
@@ -27,6 +44,7 @@ class CityAdmin(admin.ModelAdmin):
     list_display = ('name', 'state')
     list_filter = ('state',)
     search_fields = ('name', 'state__name')
+    list_select_related = ('state',)
 
 
 class ArtisanGalleryInline(admin.TabularInline):
@@ -35,7 +53,7 @@ class ArtisanGalleryInline(admin.TabularInline):
 
 
 @admin.register(ArtisanProfile)
-class ArtisanProfileAdmin(admin.ModelAdmin):
+class ArtisanProfileAdmin(ShardedAdminMixin, RelatedLabelsMixin, admin.ModelAdmin):
     list_display = (
         'user', 'category', 'state', 'city', 'hourly_rate', 
         'availability', 'is_verified', 'average_rating', 'total_reviews'
@@ -48,9 +66,13 @@ class ArtisanProfileAdmin(admin.ModelAdmin):
         'user__username', 'user__first_name', 'user__last_name',
         'user__email', 'bio'
     )
-    filter_horizontal = ('skills',)
+    autocomplete_fields = ('user', 'skills')
     readonly_fields = ('average_rating', 'total_reviews', 'profile_views', 'created_at', 'updated_at')
     inlines = [ArtisanGalleryInline]
+    list_select_related = ('user', 'category', 'state', 'city__state')
+    label_related = ('user', 'category')
+    autocomplete_search_fields = ('^user__username', '^user__first_name', '^user__last_name', '^user__email')
+    choice_related = {'city': ('state',), 'skills': ('category',)}
     
     fieldsets = (
         ('User Information', {
@@ -75,33 +97,155 @@ class ArtisanProfileAdmin(admin.ModelAdmin):
         }),
     )
     
-    actions = ['approve_artisans', 'reject_artisans']
+    actions = ['approve_artisans', 'reject_artisans', export_action('artisans')]
+    
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if is_autocomplete(request):
+            return queryset
+        # Rating columns come from one aggregate instead of a query per row
+        return queryset.annotate(
+            _avg_rating=Avg('reviews__rating', filter=Q(reviews__is_hidden=False)),
+            _review_count=Count('reviews', filter=Q(reviews__is_hidden=False))
+        )
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            # A new state may belong to another shard
+            relocate(form.instance)
+    
+    def average_rating(self, obj):
+        return round(obj._avg_rating, 1) if obj._avg_rating is not None else 0.0
+    average_rating.short_description = 'Average rating'
+    average_rating.admin_order_field = '_avg_rating'
+    
+    def total_reviews(self, obj):
+        return obj._review_count
+    total_reviews.short_description = 'Total reviews'
+    total_reviews.admin_order_field = '_review_count'
     
     def approve_artisans(self, request, queryset):
-        """Approve selected artisans"""
-        for artisan in queryset:
+        """Approve selected artisans and notify the newly approved ones"""
+        profile_url = request.build_absolute_uri(reverse('accounts:profile'))
+        for artisan in queryset.select_related('user'):
+            newly_approved = not artisan.is_verified
             artisan.is_verified = True
             artisan.user.is_active = True
-            artisan.user.save()
-            artisan.save()
+            # The email is stored in the artisan's transaction, on its shard
+            with transaction.atomic(using=artisan._state.db):
+                artisan.user.save()
+                artisan.save()
+                if newly_approved:
+                    queue_email('artisan_approved', artisan.user.email, {
+                        'artisan': artisan,
+                        'profile_url': profile_url,
+                    }, using=artisan._state.db)
+        schedule_similar_artisans_update()
         count = queryset.count()
         self.message_user(request, f'{count} artisan(s) approved successfully.')
     approve_artisans.short_description = "Approve selected artisans"
     
     def reject_artisans(self, request, queryset):
         """Reject selected artisans"""
-        for artisan in queryset:
+        for artisan in queryset.select_related('user'):
             artisan.is_verified = False
             artisan.user.is_active = False
             artisan.user.save()
             artisan.save()
+        schedule_similar_artisans_update()
         count = queryset.count()
         self.message_user(request, f'{count} artisan(s) rejected.')
     reject_artisans.short_description = "Reject selected artisans"
 
 
 @admin.register(ArtisanGallery)
-class ArtisanGalleryAdmin(admin.ModelAdmin):
+class ArtisanGalleryAdmin(ShardedAdminMixin, RelatedLabelsMixin, admin.ModelAdmin):
     list_display = ('artisan', 'title', 'created_at')
     list_filter = ('created_at', 'artisan__category')
     search_fields = ('title', 'artisan__user__username')
+    autocomplete_fields = ('artisan',)
+    list_select_related = ('artisan__user', 'artisan__category')
+    choice_related = {'artisan': ('user', 'category')}
+
+
+@admin.register(ArtisanDailyStats)
+class ArtisanDailyStatsAdmin(admin.ModelAdmin):
+    # Stats are on default and artisans on their shards, so nothing joins them
+    list_display = ('artisan_id', 'day', 'views', 'new_reviews', 'rating_sum', 'helpful_votes')
+    list_filter = ('day',)
+    search_fields = ('artisan__id',)
+    search_help_text = 'Artisan id'
+    date_hierarchy = 'day'
+    
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if not search_term.isdigit():
+            return queryset.none(), False
+        return queryset.filter(artisan_id=int(search_term)), False
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+@admin.register(ArtisanImport)
+class ArtisanImportAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'file', 'status', 'rows_processed', 'created_count',
+        'error_count', 'created_by', 'created_at'
+    )
+    list_filter = ('status', 'created_at')
+    readonly_fields = (
+        'status', 'rows_processed', 'created_count', 'error_count',
+        'message', 'created_by', 'created_at', 'finished_at'
+    )
+    
+    actions = ['download_errors', 'resume_imports']
+    
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None:
+            return ('file', 'approve') + self.readonly_fields
+        return self.readonly_fields
+    
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.created_by = request.user
+        super().save_model(request, obj, form, change)
+        if not change:
+            process_artisan_import.delay(import_id=obj.pk)
+            self.message_user(request, 'The file was queued for import.')
+    
+    def download_errors(self, request, queryset):
+        """Stream the rejected rows of the selected imports as CSV"""
+        writer = csv.writer(_Echo())
+        errors = ArtisanImportError.objects.filter(
+            artisan_import__in=queryset
+        ).order_by('artisan_import', 'row').values_list('artisan_import_id', 'row', 'message')
+        lines = chain(
+            [writer.writerow(['import', 'row', 'error'])],
+            (writer.writerow(row) for row in errors.iterator(chunk_size=2000)),
+        )
+        response = StreamingHttpResponse(lines, content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="import_errors.csv"'
+        return response
+    download_errors.short_description = "Download error report"
+    
+    def resume_imports(self, request, queryset):
+        """Queue unfinished imports again; they continue after the last committed chunk"""
+        count = 0
+        for artisan_import in queryset.exclude(status='done'):
+            process_artisan_import.delay(import_id=artisan_import.pk)
+            count += 1
+        self.message_user(request, f'{count} import(s) queued again.')
+    resume_imports.short_description = "Resume selected imports"
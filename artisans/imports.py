@@ -0,0 +1,313 @@
+"""
+Bulk import of artisans from partner CSV files.
+
+Rows are validated in chunks against in-memory maps of categories, skills,
+states and cities, with one query per chunk to find usernames and emails
+that are already taken. Each chunk is written with three ``bulk_create``
+calls (users, profiles, skill links) and the profiles' list page listings
+in one transaction per database.
+Invalid rows are skipped and reported with their spreadsheet row number.
+
+Imports resume from a row offset: rows before it are read but not
+processed. The ``checkpoint`` callback runs inside the chunk's transaction,
+so progress stored in the database is exactly what was committed.
+"""
+
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db.models import F, Q
+from django.utils import timezone
+
+from artisan_marketplace import sharding
+
+from .listings import refresh_listings
+from .models import ArtisanImport, ArtisanImportError, ArtisanProfile, Category, City, Skill, State
+
+User = get_user_model()
+
+CHUNK_SIZE = 500
+REQUIRED_COLUMNS = (
+    'email', 'first_name', 'last_name', 'category', 'state', 'city', 'bio', 'hourly_rate',
+)
+OPTIONAL_COLUMNS = ('username', 'phone_number', 'skills', 'years_of_experience', 'availability')
+AVAILABILITY = dict(ArtisanProfile.AVAILABILITY_CHOICES)
+
+
+class ImportFormatError(ValueError):
+    """The file cannot be imported at all"""
+
+
+class ReferenceData:
+    """Case-insensitive lookups of categories, skills, states and cities"""
+
+    def __init__(self):
+        self.categories = {name.lower(): pk for pk, name in Category.objects.values_list('pk', 'name')}
+        self.skills = {
+            (category_id, name.lower()): pk
+            for pk, category_id, name in Skill.objects.values_list('pk', 'category_id', 'name')
+        }
+        self.states = {}
+        for pk, name, code in State.objects.values_list('pk', 'name', 'code'):
+            self.states[name.lower()] = pk
+            self.states[code.lower()] = pk
+        self.cities = {
+            (state_id, name.lower()): pk
+            for pk, state_id, name in City.objects.values_list('pk', 'state_id', 'name')
+        }
+
+
+def _text(row, column):
+    return (row.get(column) or '').strip()
+
+
+def parse_row(row, refs):
+    """
+    Validate one CSV row; returns ``(user_fields, profile_fields, skill_ids)``
+    or raises ``ValidationError`` with every problem found.
+    """
+    errors = []
+    for column in REQUIRED_COLUMNS:
+        if not _text(row, column):
+            errors.append(f'{column} is required')
+
+    email = _text(row, 'email').lower()
+    if email:
+        try:
+            validate_email(email)
+        except ValidationError:
+            errors.append(f'invalid email "{email}"')
+
+    username = _text(row, 'username') or email.split('@')[0]
+    try:
+        User.username_validator(username)
+        if len(username) > 150:
+            raise ValidationError('too long')
+    except ValidationError:
+        errors.append(f'invalid username "{username}"')
+
+    phone_number = _text(row, 'phone_number')
+    if len(phone_number) > 15:
+        errors.append('phone_number is longer than 15 characters')
+
+    bio = _text(row, 'bio')
+    if len(bio) > 1000:
+        errors.append('bio is longer than 1000 characters')
+
+    category_id = refs.categories.get(_text(row, 'category').lower())
+    if _text(row, 'category') and category_id is None:
+        errors.append(f'unknown category "{_text(row, "category")}"')
+
+    skill_ids = []
+    for name in filter(None, (name.strip() for name in _text(row, 'skills').split(';'))):
+        skill_id = refs.skills.get((category_id, name.lower()))
+        if skill_id is None:
+            errors.append(f'unknown skill "{name}" for this category')
+        else:
+            skill_ids.append(skill_id)
+
+    state_id = refs.states.get(_text(row, 'state').lower())
+    if _text(row, 'state') and state_id is None:
+        errors.append(f'unknown state "{_text(row, "state")}"')
+    city_id = refs.cities.get((state_id, _text(row, 'city').lower()))
+    if _text(row, 'city') and state_id is not None and city_id is None:
+        errors.append(f'unknown city "{_text(row, "city")}" in this state')
+
+    hourly_rate = None
+    if _text(row, 'hourly_rate'):
+        try:
+            hourly_rate = Decimal(_text(row, 'hourly_rate').replace(',', ''))
+            if not Decimal('0.01') <= hourly_rate < Decimal('1000000'):
+                raise InvalidOperation
+            hourly_rate = hourly_rate.quantize(Decimal('0.01'))
+        except InvalidOperation:
+            errors.append(f'invalid hourly_rate "{_text(row, "hourly_rate")}"')
+
+    years = _text(row, 'years_of_experience') or '0'
+    if not years.isdigit() or int(years) > 50:
+        errors.append('years_of_experience must be a whole number from 0 to 50')
+
+    availability = _text(row, 'availability').lower() or 'available'
+    if availability not in AVAILABILITY:
+        errors.append(f'availability must be one of {", ".join(AVAILABILITY)}')
+
+    if errors:
+        raise ValidationError(errors)
+
+    user_fields = {
+        'username': username,
+        'email': email,
+        'first_name': _text(row, 'first_name')[:150],
+        'last_name': _text(row, 'last_name')[:150],
+        'phone_number': phone_number,
+    }
+    profile_fields = {
+        'category_id': category_id,
+        'state_id': state_id,
+        'city_id': city_id,
+        'bio': bio,
+        'hourly_rate': hourly_rate,
+        'years_of_experience': int(years),
+        'availability': availability,
+    }
+    return user_fields, profile_fields, skill_ids
+
+
+def read_rows(fileobj, start_row=0):
+    """Yield ``(row_number, row)`` from a text file, skipping rows before ``start_row``"""
+    reader = csv.DictReader(fileobj)
+    columns = {(name or '').strip().lower() for name in reader.fieldnames or ()}
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ImportFormatError(f'Missing column(s): {", ".join(missing)}')
+
+    for index, row in enumerate(reader):
+        if index < start_row:
+            continue
+        # Spreadsheet numbering: the header is row 1
+        yield index + 2, {(key or '').strip().lower(): value for key, value in row.items()}
+
+
+class ArtisanImporter:
+    """Validates and stores CSV rows chunk by chunk"""
+
+    def __init__(self, approve=False, chunk_size=CHUNK_SIZE):
+        self.approve = approve
+        self.chunk_size = chunk_size
+        self.refs = ReferenceData()
+        self.password = make_password(None)
+
+    def run(self, fileobj, start_row=0, checkpoint=None):
+        """
+        Import every row from ``start_row`` on. ``checkpoint(rows_done,
+        created, errors)`` is called inside each chunk's transaction with the
+        total number of data rows processed so far and the chunk's results.
+        Returns the numbers of artisans created and rows rejected.
+        """
+        created_total = errors_total = 0
+        rows_done = start_row
+        chunk = []
+        for number, row in read_rows(fileobj, start_row):
+            chunk.append((number, row))
+            if len(chunk) < self.chunk_size:
+                continue
+            rows_done += len(chunk)
+            created, errors = self.import_chunk(chunk, rows_done, checkpoint)
+            created_total += created
+            errors_total += len(errors)
+            chunk = []
+        if chunk:
+            rows_done += len(chunk)
+            created, errors = self.import_chunk(chunk, rows_done, checkpoint)
+            created_total += created
+            errors_total += len(errors)
+        return created_total, errors_total
+
+    def import_chunk(self, chunk, rows_done, checkpoint=None):
+        """Store the valid rows of ``chunk``; returns ``(created, [(row, message)])``"""
+        errors = []
+        parsed = []
+        usernames, emails = set(), set()
+        for number, row in chunk:
+            try:
+                user_fields, profile_fields, skill_ids = parse_row(row, self.refs)
+            except ValidationError as error:
+                errors.append((number, '; '.join(error.messages)))
+                continue
+            username, email = user_fields['username'].lower(), user_fields['email']
+            if username in usernames or email in emails:
+                errors.append((number, 'duplicate username or email earlier in the file'))
+                continue
+            usernames.add(username)
+            emails.add(email)
+            parsed.append((number, user_fields, profile_fields, skill_ids))
+
+        taken_usernames, taken_emails = set(), set()
+        lookup = Q(username__in=[fields['username'] for _, fields, _, _ in parsed])
+        lookup |= Q(email__in=list(emails))
+        for username, email in User.objects.filter(lookup).values_list('username', 'email'):
+            taken_usernames.add(username.lower())
+            taken_emails.add((email or '').lower())
+
+        rows = []
+        for number, user_fields, profile_fields, skill_ids in parsed:
+            if user_fields['username'].lower() in taken_usernames:
+                errors.append((number, f'username "{user_fields["username"]}" already exists'))
+            elif user_fields['email'] in taken_emails:
+                errors.append((number, f'email "{user_fields["email"]}" already exists'))
+            else:
+                rows.append((user_fields, profile_fields, skill_ids))
+        errors.sort()
+
+        with sharding.atomic():
+            users = User.objects.bulk_create([
+                User(
+                    role='artisan',
+                    password=self.password,
+                    is_active=self.approve,
+                    **user_fields
+                )
+                for user_fields, _, _ in rows
+            ])
+            # Users are copied to every shard now, as the profiles need them,
+            # and profiles go to the shard of their state
+            sharding.mirror(User, [user.pk for user in users])
+            profiles = [
+                ArtisanProfile(user=user, is_verified=self.approve, **profile_fields)
+                for user, (_, profile_fields, _) in zip(users, rows)
+            ]
+            for alias, group in sharding.group_by_shard(profiles).items():
+                ArtisanProfile.objects.using(alias).bulk_create(group)
+            Through = ArtisanProfile.skills.through
+            links = {}
+            for profile, (_, _, skill_ids) in zip(profiles, rows):
+                links.setdefault(profile._state.db, []).extend(
+                    Through(artisanprofile_id=profile.pk, skill_id=skill_id)
+                    for skill_id in dict.fromkeys(skill_ids)
+                )
+            for alias, group in links.items():
+                Through.objects.using(alias).bulk_create(group, batch_size=1000)
+            # bulk_create sends no signals
+            refresh_listings([profile.pk for profile in profiles])
+            if checkpoint is not None:
+                checkpoint(rows_done, len(rows), errors)
+        return len(rows), errors
+
+
+def run_import(artisan_import, chunk_size=CHUNK_SIZE):
+    """Process an ``ArtisanImport``, continuing after its last committed chunk"""
+    ArtisanImport.objects.filter(pk=artisan_import.pk).update(status='running')
+
+    def checkpoint(rows_done, created, errors):
+        ArtisanImport.objects.filter(pk=artisan_import.pk).update(
+            rows_processed=rows_done,
+            created_count=F('created_count') + created,
+            error_count=F('error_count') + len(errors),
+        )
+        ArtisanImportError.objects.bulk_create([
+            ArtisanImportError(artisan_import=artisan_import, row=row, message=message)
+            for row, message in errors
+        ])
+
+    importer = ArtisanImporter(approve=artisan_import.approve, chunk_size=chunk_size)
+    try:
+        with artisan_import.file.open('rb') as raw:
+            text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+            importer.run(text, start_row=artisan_import.rows_processed, checkpoint=checkpoint)
+    except (ImportFormatError, UnicodeDecodeError, csv.Error) as error:
+        ArtisanImport.objects.filter(pk=artisan_import.pk).update(
+            status='failed',
+            message=str(error),
+            finished_at=timezone.now(),
+        )
+        return
+    ArtisanImport.objects.filter(pk=artisan_import.pk).update(
+        status='done',
+        message='',
+        finished_at=timezone.now(),
+    )
@@ -0,0 +1,120 @@
+"""
+Flat read model behind the artisan list page.
+
+A card needs the profile joined to its user, category, state and city, a
+reviews aggregate and, for searches, the skills. ``ArtisanListing`` keeps
+one row per artisan with exactly those values already resolved: names,
+avatar URL, location names and ids, rate, availability, rating stats,
+skill ids, a ``search_text`` column for the search box and ``is_listed``
+for verified artisans with an active user. The list page reads only that
+table.
+
+Rows are never edited in place. ``refresh_listings()`` recomputes the rows
+of some artisans from the source tables, called after commit by the
+signals in ``core.signals`` and by the import; ``rebuild_listings()`` (the
+``rebuild_listings`` command) recomputes all of them. Listings of every
+shard are kept on ``default``, so the list page runs one query. A refresh
+also updates the copies of the cards kept in ``SimilarArtisan``.
+"""
+
+from collections import defaultdict
+
+from django.db.models import Avg, Count, Q
+from django.utils.text import Truncator
+
+from artisan_marketplace import sharding
+
+from .models import ArtisanListing, ArtisanProfile
+from .similarity import refresh_similar_cards
+
+BATCH_SIZE = 500
+BIO_EXCERPT_WORDS = 20
+
+LISTING_FIELDS = [
+    field.name for field in ArtisanListing._meta.concrete_fields if not field.primary_key
+]
+
+
+def _build(profile, skills):
+    user = profile.user
+    display_name = user.get_full_name()
+    return ArtisanListing(
+        artisan_id=profile.pk,
+        display_name=display_name,
+        avatar_url=user.profile_picture.url if user.profile_picture else '',
+        category_id=profile.category_id,
+        category_name=profile.category.name,
+        state_id=profile.state_id,
+        state_name=profile.state.name,
+        city_id=profile.city_id,
+        city_name=profile.city.name,
+        hourly_rate=profile.hourly_rate,
+        availability=profile.availability,
+        bio_excerpt=Truncator(profile.bio).words(BIO_EXCERPT_WORDS),
+        is_verified=profile.is_verified,
+        is_listed=profile.is_verified and user.is_active,
+        avg_rating=profile.avg_rating,
+        review_count=profile.review_count,
+        skill_ids=[skill_id for skill_id, _ in skills],
+        # One field per line, so a search cannot match across two of them
+        search_text='\n'.join(
+            [display_name, profile.category.name] + [name for _, name in skills] + [profile.bio]
+        ).lower(),
+        created_at=profile.created_at,
+    )
+
+
+def _refresh(alias, artisan_ids):
+    profiles = ArtisanProfile.objects.using(alias).filter(pk__in=artisan_ids).select_related(
+        'user', 'category', 'state', 'city'
+    ).annotate(
+        avg_rating=Avg('reviews__rating', filter=Q(reviews__is_hidden=False)),
+        review_count=Count('reviews', filter=Q(reviews__is_hidden=False))
+    ).order_by()
+
+    skills = defaultdict(list)
+    for artisan_id, skill_id, name in ArtisanProfile.skills.through.objects.using(alias).filter(
+        artisanprofile_id__in=artisan_ids
+    ).order_by('skill__name').values_list('artisanprofile_id', 'skill_id', 'skill__name'):
+        skills[artisan_id].append((skill_id, name))
+
+    listings = [_build(profile, skills[profile.pk]) for profile in profiles]
+    if listings:
+        ArtisanListing.objects.bulk_create(
+            listings,
+            update_conflicts=True,
+            unique_fields=['artisan'],
+            update_fields=LISTING_FIELDS,
+        )
+    # Artisans deleted since
+    ArtisanListing.objects.filter(pk__in=artisan_ids).exclude(
+        pk__in=[listing.artisan_id for listing in listings]
+    ).delete()
+    refresh_similar_cards(artisan_ids)
+    return len(listings)
+
+
+def refresh_listings(artisan_ids, batch_size=BATCH_SIZE):
+    """Recompute the listings of ``artisan_ids``; returns the number written"""
+    written = 0
+    for alias, ids in sharding.group_ids(ArtisanProfile, dict.fromkeys(artisan_ids)).items():
+        for start in range(0, len(ids), batch_size):
+            written += _refresh(alias, ids[start:start + batch_size])
+    return written
+
+
+def refresh_listings_of(queryset):
+    """Recompute the listings of the artisans in ``queryset`` on every shard"""
+    return refresh_listings(queryset.order_by().values_list('pk', flat=True))
+
+
+def rebuild_listings(batch_size=BATCH_SIZE, stdout=None):
+    """Recompute every listing; returns the number written"""
+    written = 0
+    for alias in sharding.each_shard():
+        ids = list(ArtisanProfile.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(ids), batch_size):
+            written += _refresh(alias, ids[start:start + batch_size])
+        if stdout is not None and alias is not None:
+            stdout.write(f'{alias}: {len(ids)} listing(s)')
+    return written
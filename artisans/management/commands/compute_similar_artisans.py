@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from artisans.similarity import BATCH_SIZE, TOP_K, compute_similar_artisans
+
+
+class Command(BaseCommand):
+    help = 'Precompute similar artisans from their skill sets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K,
+                            help='Neighbours to keep per artisan')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Artisans compared per batch')
+
+    def handle(self, *args, **options):
+        total = compute_similar_artisans(
+            k=options['top_k'],
+            batch_size=options['batch_size'],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Computed similar artisans for {total} artisans'))
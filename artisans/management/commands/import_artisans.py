@@ -0,0 +1,60 @@
+import csv
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from artisans.imports import CHUNK_SIZE, ArtisanImporter, ImportFormatError
+from artisans.tasks import schedule_similar_artisans_update
+
+
+class Command(BaseCommand):
+    help = 'Import artisans and their skills from a partner CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header row')
+        parser.add_argument('--approve', action='store_true',
+                            help='Activate and verify the imported artisans')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Rows validated and stored per transaction')
+        parser.add_argument('--errors', help='Error report (default: <path>.errors.csv)')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue after the last chunk committed by a previous run')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        progress_path = f'{path}.progress'
+        errors_path = options['errors'] or f'{path}.errors.csv'
+
+        start_row = 0
+        if options['resume'] and os.path.exists(progress_path):
+            with open(progress_path) as progress:
+                start_row = int(progress.read().strip() or 0)
+            self.stdout.write(f'Resuming after row {start_row + 1}')
+
+        with open(path, encoding='utf-8-sig', newline='') as source, \
+                open(errors_path, 'a' if start_row else 'w', newline='') as report:
+            writer = csv.writer(report)
+            if not start_row:
+                writer.writerow(['row', 'error'])
+
+            def checkpoint(rows_done, created, errors):
+                def save():
+                    writer.writerows(errors)
+                    report.flush()
+                    with open(progress_path, 'w') as progress:
+                        progress.write(str(rows_done))
+                    self.stdout.write(f'{rows_done} rows processed')
+                transaction.on_commit(save)
+
+            importer = ArtisanImporter(approve=options['approve'], chunk_size=options['chunk_size'])
+            try:
+                created, rejected = importer.run(source, start_row=start_row, checkpoint=checkpoint)
+            except ImportFormatError as error:
+                raise CommandError(str(error))
+
+        if options['approve'] and created:
+            schedule_similar_artisans_update()
+        self.stdout.write(self.style.SUCCESS(f'Imported {created} artisan(s), rejected {rejected} row(s)'))
+        if rejected:
+            self.stdout.write(f'Rejected rows are listed in {errors_path}')
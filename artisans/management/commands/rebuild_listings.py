@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from artisans.listings import BATCH_SIZE, rebuild_listings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the flat artisan listings behind the artisan list page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Artisans rebuilt per query')
+
+    def handle(self, *args, **options):
+        total = rebuild_listings(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} artisan listings'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from artisans.rollups import update_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        'Fold new profile views, reviews and helpful votes into the daily artisan rollups. '
+        'run_jobs also does this every few minutes.'
+    )
+
+    def handle(self, *args, **options):
+        buckets = update_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Updated {buckets} daily bucket(s)'))
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artisans', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarArtisan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('artisan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_artisans', to='artisans.artisanprofile')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='artisans.artisanprofile')),
+            ],
+            options={
+                'ordering': ['artisan', 'rank'],
+                'indexes': [models.Index(fields=['artisan', 'rank'], name='artisans_si_artisan_c8cf69_idx')],
+                'unique_together': {('artisan', 'similar')},
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:31
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+
+
+def backfill_rating_counts(apps, schema_editor):
+    """Fill star counts for reviews already folded into the rollups"""
+    ArtisanDailyStats = apps.get_model('artisans', 'ArtisanDailyStats')
+    RollupWatermark = apps.get_model('artisans', 'RollupWatermark')
+    Review = apps.get_model('reviews', 'Review')
+
+    watermark = RollupWatermark.objects.filter(name='reviews').first()
+    if watermark is None:
+        return
+    rows = Review.objects.filter(pk__lte=watermark.last_id).annotate(
+        day=TruncDate('created_at')
+    ).order_by().values('artisan_id', 'day').annotate(**{
+        f'rating_{stars}': Count('pk', filter=Q(rating=stars)) for stars in range(1, 6)
+    })
+    for row in rows:
+        ArtisanDailyStats.objects.filter(artisan_id=row.pop('artisan_id'), day=row.pop('day')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artisans', '0003_rollups'),
+        ('reviews', '0004_review_moderation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artisandailystats',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artisandailystats',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artisandailystats',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artisandailystats',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artisandailystats',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_counts, migrations.RunPython.noop),
+    ]
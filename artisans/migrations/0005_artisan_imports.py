@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:34
+
+import artisans.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('artisans', '0004_rollup_rating_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArtisanImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(storage=artisans.models.import_storage, upload_to='artisans/')),
+                ('approve', models.BooleanField(default=False, help_text='Activate and verify imported artisans immediately')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('rows_processed', models.PositiveIntegerField(default=0)),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('error_count', models.PositiveIntegerField(default=0)),
+                ('message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArtisanImportError',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.PositiveIntegerField()),
+                ('message', models.TextField()),
+                ('artisan_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='errors', to='artisans.artisanimport')),
+            ],
+            options={
+                'ordering': ['artisan_import', 'row'],
+            },
+        ),
+    ]
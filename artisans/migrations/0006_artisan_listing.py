@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artisans', '0005_artisan_imports'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArtisanListing',
+            fields=[
+                ('artisan', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='artisans.artisanprofile')),
+                ('display_name', models.CharField(blank=True, max_length=301)),
+                ('avatar_url', models.CharField(blank=True, max_length=500)),
+                ('category_name', models.CharField(max_length=100)),
+                ('state_name', models.CharField(max_length=100)),
+                ('city_name', models.CharField(max_length=100)),
+                ('hourly_rate', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('availability', models.CharField(choices=[('available', 'Available'), ('busy', 'Busy'), ('unavailable', 'Unavailable')], max_length=12)),
+                ('bio_excerpt', models.TextField(blank=True)),
+                ('is_verified', models.BooleanField(default=False)),
+                ('is_listed', models.BooleanField(default=False, help_text='Verified with an active user')),
+                ('avg_rating', models.FloatField(null=True)),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('skill_ids', models.JSONField(default=list)),
+                ('search_text', models.TextField(blank=True, help_text='Lowercased name, category, skills and bio')),
+                ('created_at', models.DateTimeField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='artisans.category')),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='artisans.city')),
+                ('state', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='artisans.state')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['is_listed', '-created_at'], name='artisans_ar_is_list_691bc9_idx'), models.Index(fields=['is_listed', '-avg_rating', '-review_count'], name='artisans_ar_is_list_5eba12_idx'), models.Index(fields=['is_listed', 'hourly_rate'], name='artisans_ar_is_list_984152_idx')],
+            },
+        ),
+    ]
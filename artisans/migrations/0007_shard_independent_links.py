@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artisans', '0006_artisan_listing'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='artisandailystats',
+            options={'ordering': ['artisan_id', 'day'], 'verbose_name_plural': 'Artisan daily stats'},
+        ),
+        migrations.AlterModelOptions(
+            name='similarartisan',
+            options={'ordering': ['artisan_id', 'rank']},
+        ),
+        migrations.AlterField(
+            model_name='artisandailystats',
+            name='artisan',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='artisans.artisanprofile'),
+        ),
+        migrations.AlterField(
+            model_name='artisanlisting',
+            name='artisan',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='artisans.artisanprofile'),
+        ),
+        migrations.AlterField(
+            model_name='profileview',
+            name='artisan',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='view_events', to='artisans.artisanprofile'),
+        ),
+        migrations.AlterField(
+            model_name='similarartisan',
+            name='artisan',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='similar_artisans', to='artisans.artisanprofile'),
+        ),
+        migrations.AlterField(
+            model_name='similarartisan',
+            name='similar',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='artisans.artisanprofile'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artisans', '0007_shard_independent_links'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArtisanRank',
+            fields=[
+                ('artisan', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rank', serialize=False, to='artisans.artisanprofile')),
+                ('ranks', models.JSONField(default=dict)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
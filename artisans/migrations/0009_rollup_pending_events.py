@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artisans', '0008_artisan_ranks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupwatermark',
+            name='pending',
+            field=models.JSONField(blank=True, default=dict, help_text='Ids below last_id not seen yet, with when they were first missed'),
+        ),
+    ]
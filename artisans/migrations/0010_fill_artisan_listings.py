@@ -0,0 +1,74 @@
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS, migrations
+from django.db.models import Avg, Count, Q
+from django.utils.text import Truncator
+
+BATCH_SIZE = 500
+
+
+def fill_listings(apps, schema_editor):
+    """Build the listings of the artisans stored in the database being migrated"""
+    ArtisanProfile = apps.get_model('artisans', 'ArtisanProfile')
+    ArtisanListing = apps.get_model('artisans', 'ArtisanListing')
+    Through = ArtisanProfile.skills.through
+    # Each shard is migrated on its own; listings of every shard are on default
+    db = schema_editor.connection.alias
+
+    ids = list(ArtisanProfile.objects.using(db).order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start + BATCH_SIZE]
+        profiles = ArtisanProfile.objects.using(db).filter(pk__in=batch).select_related(
+            'user', 'category', 'state', 'city'
+        ).annotate(
+            avg_rating=Avg('reviews__rating', filter=Q(reviews__is_hidden=False)),
+            review_count=Count('reviews', filter=Q(reviews__is_hidden=False))
+        ).order_by()
+        skills = defaultdict(list)
+        for artisan_id, skill_id, name in Through.objects.using(db).filter(
+            artisanprofile_id__in=batch
+        ).order_by('skill__name').values_list('artisanprofile_id', 'skill_id', 'skill__name'):
+            skills[artisan_id].append((skill_id, name))
+
+        listings = []
+        for profile in profiles:
+            user = profile.user
+            display_name = f'{user.first_name} {user.last_name}'.strip()
+            names = [name for _, name in skills[profile.pk]]
+            listings.append(ArtisanListing(
+                artisan_id=profile.pk,
+                display_name=display_name,
+                avatar_url=user.profile_picture.url if user.profile_picture else '',
+                category_id=profile.category_id,
+                category_name=profile.category.name,
+                state_id=profile.state_id,
+                state_name=profile.state.name,
+                city_id=profile.city_id,
+                city_name=profile.city.name,
+                hourly_rate=profile.hourly_rate,
+                availability=profile.availability,
+                bio_excerpt=Truncator(profile.bio).words(20),
+                is_verified=profile.is_verified,
+                is_listed=profile.is_verified and user.is_active,
+                avg_rating=profile.avg_rating,
+                review_count=profile.review_count,
+                skill_ids=[skill_id for skill_id, _ in skills[profile.pk]],
+                search_text='\n'.join(
+                    [display_name, profile.category.name] + names + [profile.bio]
+                ).lower(),
+                created_at=profile.created_at,
+            ))
+        ArtisanListing.objects.using(DEFAULT_DB_ALIAS).bulk_create(listings, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artisans', '0009_rollup_pending_events'),
+        ('accounts', '0002_user_manager'),
+        ('reviews', '0005_shard_independent_links'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-19 19:02
+
+from django.db import DEFAULT_DB_ALIAS, migrations, models
+from django.db.models import OuterRef, Subquery
+
+CARD_FIELDS = ('display_name', 'avatar_url', 'hourly_rate', 'avg_rating')
+
+
+def fill_cards(apps, schema_editor):
+    """Copy the listings into the similar-artisan rows, both kept on default"""
+    if schema_editor.connection.alias != DEFAULT_DB_ALIAS:
+        return
+    SimilarArtisan = apps.get_model('artisans', 'SimilarArtisan')
+    ArtisanListing = apps.get_model('artisans', 'ArtisanListing')
+    listing = ArtisanListing.objects.filter(pk=OuterRef('similar_id'))
+    SimilarArtisan.objects.update(**{
+        field: Subquery(listing.values(field)) for field in CARD_FIELDS
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artisans', '0010_fill_artisan_listings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='similarartisan',
+            name='avatar_url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='similarartisan',
+            name='avg_rating',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='similarartisan',
+            name='display_name',
+            field=models.CharField(blank=True, max_length=301),
+        ),
+        migrations.AddField(
+            model_name='similarartisan',
+            name='hourly_rate',
+            field=models.DecimalField(decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.RunPython(fill_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 4.2.7 on 2026-10-19 19:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def mark_review_days_stale(apps, schema_editor):
+    """Have the next rollup run recount every day with reviews or votes, leaving hidden reviews out"""
+    alias = schema_editor.connection.alias
+    ArtisanDailyStats = apps.get_model('artisans', 'ArtisanDailyStats')
+    StaleRollup = apps.get_model('artisans', 'StaleRollup')
+    days = ArtisanDailyStats.objects.using(alias).filter(
+        models.Q(new_reviews__gt=0) | models.Q(helpful_votes__gt=0)
+    ).values_list('artisan_id', 'day')
+    StaleRollup.objects.using(alias).bulk_create(
+        (StaleRollup(artisan_id=artisan_id, day=day) for artisan_id, day in days.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artisans', '0011_similar_artisan_cards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('marked_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='artisandailystats',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='artisandailystats',
+            name='helpful_votes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='artisandailystats',
+            name='new_reviews',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='artisandailystats',
+            name='rating_1',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='artisandailystats',
+            name='rating_2',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='artisandailystats',
+            name='rating_3',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='artisandailystats',
+            name='rating_4',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='artisandailystats',
+            name='rating_5',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='artisandailystats',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='artisandailystats',
+            name='views',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='artisandailystats',
+            index=models.Index(fields=['artisan', 'day'], name='artisans_ar_artisan_b3110a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='artisandailystats',
+            index=models.Index(fields=['day'], name='artisans_ar_day_3482c2_idx'),
+        ),
+        migrations.AddField(
+            model_name='stalerollup',
+            name='artisan',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='artisans.artisanprofile'),
+        ),
+        migrations.RunPython(mark_review_days_stale, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-19 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artisans', '0012_append_only_rollups'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='artisanlisting',
+            name='artisans_ar_is_list_691bc9_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='artisanlisting',
+            name='artisans_ar_is_list_5eba12_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='artisanlisting',
+            name='artisans_ar_is_list_984152_idx',
+        ),
+        migrations.AddIndex(
+            model_name='artisanlisting',
+            index=models.Index(condition=models.Q(('is_listed', True)), fields=['-created_at', '-artisan'], name='listing_newest'),
+        ),
+        migrations.AddIndex(
+            model_name='artisanlisting',
+            index=models.Index(condition=models.Q(('is_listed', True)), fields=['-avg_rating', '-review_count', '-artisan'], name='listing_rating'),
+        ),
+        migrations.AddIndex(
+            model_name='artisanlisting',
+            index=models.Index(condition=models.Q(('is_listed', True)), fields=['hourly_rate', 'artisan'], name='listing_price'),
+        ),
+    ]
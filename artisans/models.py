@@ -1,11 +1,28 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.core.files.storage import FileSystemStorage
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 
+from artisan_marketplace.sharding import GlobalManager, ShardedManager
+from artisan_marketplace.sqlite.base import immediate
+from core import reference
+from core.tracking import DirtyFieldsMixin
+
 User = get_user_model()
 
 
+def _parent_name(instance, kind):
+    """Name of the category or state of ``instance``, from the reference registry unless loaded"""
+    field = instance._meta.get_field(kind)
+    if not field.is_cached(instance):
+        row = reference.get().lookup(kind, getattr(instance, field.attname))
+        if row is not None:
+            return row.name
+    return getattr(instance, kind).name
+
+
 class Category(models.Model):
     """Categories for artisan services"""
     name = models.CharField(max_length=100, unique=True)
@@ -13,6 +30,8 @@ class Category(models.Model):
     icon = models.CharField(max_length=50, blank=True, help_text="Font Awesome icon class")
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = GlobalManager()
+    
     class Meta:
         verbose_name_plural = "Categories"
         ordering = ['name']
@@ -28,12 +47,14 @@ class Skill(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = GlobalManager()
+    
     class Meta:
         ordering = ['category', 'name']
         unique_together = ['name', 'category']
     
     def __str__(self):
-        return f"{self.category.name} - {self.name}"
+        return f"{_parent_name(self, 'category')} - {self.name}"
 
 
 class State(models.Model):
@@ -41,6 +62,8 @@ class State(models.Model):
     name = models.CharField(max_length=50, unique=True)
     code = models.CharField(max_length=3, unique=True)
     
+    objects = GlobalManager()
+    
     class Meta:
         ordering = ['name']
     
@@ -53,16 +76,18 @@ class City(models.Model):
     name = models.CharField(max_length=100)
     state = models.ForeignKey(State, on_delete=models.CASCADE, related_name='cities')
     
+    objects = GlobalManager()
+    
     class Meta:
         verbose_name_plural = "Cities"
         ordering = ['state', 'name']
         unique_together = ['name', 'state']
     
     def __str__(self):
-        return f"{self.name}, {self.state.name}"
+        return f"{self.name}, {_parent_name(self, 'state')}"
 
 
-class ArtisanProfile(models.Model):
+class ArtisanProfile(DirtyFieldsMixin, models.Model):
     """Extended profile for artisan users"""
     
     AVAILABILITY_CHOICES = [
@@ -104,6 +129,8 @@ class ArtisanProfile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ShardedManager()
+    
     class Meta:
         ordering = ['-created_at']
     
@@ -112,8 +139,8 @@ class ArtisanProfile(models.Model):
     
     @property
     def average_rating(self):
-        """Calculate average rating from reviews"""
-        reviews = self.reviews.all()
+        """Calculate average rating from visible reviews"""
+        reviews = self.reviews.filter(is_hidden=False)
         if reviews:
             total_rating = sum([review.rating for review in reviews])
             return round(total_rating / len(reviews), 1)
@@ -121,18 +148,33 @@ class ArtisanProfile(models.Model):
     
     @property
     def total_reviews(self):
-        """Get total number of reviews"""
-        return self.reviews.count()
+        """Get total number of visible reviews"""
+        return self.reviews.filter(is_hidden=False).count()
     
     @property
     def is_top_rated(self):
         """Check if artisan is top rated (4.5+ stars with 5+ reviews)"""
         return self.average_rating >= 4.5 and self.total_reviews >= 5
     
+    def set_skills(self, skill_ids):
+        """Replace the skills with ``skill_ids``; return whether they changed"""
+        wanted = {int(skill_id) for skill_id in skill_ids}
+        current = set(self.skills.values_list('id', flat=True))
+        if wanted == current:
+            return False
+        with immediate(using=self._state.db):
+            if current - wanted:
+                self.skills.remove(*(current - wanted))
+            if wanted - current:
+                self.skills.add(*(wanted - current))
+        return True
+    
     def increment_views(self):
-        """Increment profile views"""
+        """Count a profile view now and log it for the daily rollups"""
+        ArtisanProfile.objects.filter(pk=self.pk).update(profile_views=models.F('profile_views') + 1)
         self.profile_views += 1
-        self.save(update_fields=['profile_views'])
+        self._remember_values(['profile_views'])
+        ProfileView.objects.create(artisan=self)
 
 
 class ArtisanGallery(models.Model):
@@ -143,9 +185,214 @@ class ArtisanGallery(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = ShardedManager()
+    
     class Meta:
         verbose_name_plural = "Artisan Galleries"
         ordering = ['-created_at']
     
     def __str__(self):
         return f"{self.artisan.user.get_full_name()} - {self.title or 'Gallery Image'}"
+
+
+class SimilarArtisan(models.Model):
+    """Precomputed nearest neighbours of an artisan by skill set"""
+    artisan = models.ForeignKey(
+        ArtisanProfile, on_delete=models.CASCADE, related_name='similar_artisans', db_constraint=False
+    )
+    similar = models.ForeignKey(
+        ArtisanProfile, on_delete=models.CASCADE, related_name='similar_to', db_constraint=False
+    )
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+    # Card of ``similar``, copied from its listing
+    display_name = models.CharField(max_length=301, blank=True)
+    avatar_url = models.CharField(max_length=500, blank=True)
+    hourly_rate = models.DecimalField(max_digits=8, decimal_places=2, null=True)
+    avg_rating = models.FloatField(null=True)
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['artisan_id', 'rank']
+        unique_together = ['artisan', 'similar']
+        indexes = [
+            models.Index(fields=['artisan', 'rank']),
+        ]
+    
+    def __str__(self):
+        return f"{self.artisan_id} ~ {self.similar_id} ({self.score:.2f})"
+
+
+class ArtisanListing(models.Model):
+    """Flat copy of what an artisan card shows, maintained by artisans.listings"""
+    artisan = models.OneToOneField(
+        ArtisanProfile, on_delete=models.CASCADE, primary_key=True, related_name='listing',
+        db_constraint=False
+    )
+    display_name = models.CharField(max_length=301, blank=True)
+    avatar_url = models.CharField(max_length=500, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    category_name = models.CharField(max_length=100)
+    state = models.ForeignKey(State, on_delete=models.CASCADE, related_name='+')
+    state_name = models.CharField(max_length=100)
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='+')
+    city_name = models.CharField(max_length=100)
+    hourly_rate = models.DecimalField(max_digits=8, decimal_places=2)
+    availability = models.CharField(max_length=12, choices=ArtisanProfile.AVAILABILITY_CHOICES)
+    bio_excerpt = models.TextField(blank=True)
+    is_verified = models.BooleanField(default=False)
+    is_listed = models.BooleanField(default=False, help_text="Verified with an active user")
+    avg_rating = models.FloatField(null=True)
+    review_count = models.PositiveIntegerField(default=0)
+    skill_ids = models.JSONField(default=list)
+    search_text = models.TextField(blank=True, help_text="Lowercased name, category, skills and bio")
+    created_at = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['-created_at']
+        # One per sort of core.filters.SORTS, ending with the primary key
+        # for keyset pagination; only listed rows are searched
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-artisan'], condition=models.Q(is_listed=True), name='listing_newest'
+            ),
+            models.Index(
+                fields=['-avg_rating', '-review_count', '-artisan'], condition=models.Q(is_listed=True),
+                name='listing_rating'
+            ),
+            models.Index(fields=['hourly_rate', 'artisan'], condition=models.Q(is_listed=True), name='listing_price'),
+        ]
+    
+    def __str__(self):
+        return f"Listing of {self.artisan_id}"
+
+
+class ProfileView(models.Model):
+    """Append-only log of profile views, consumed by the daily rollups"""
+    artisan = models.ForeignKey(
+        ArtisanProfile, on_delete=models.CASCADE, related_name='view_events', db_constraint=False
+    )
+    viewed_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"View of {self.artisan_id} at {self.viewed_at:%Y-%m-%d %H:%M}"
+
+
+class ArtisanDailyStats(models.Model):
+    """
+    Signed change to the activity of an artisan on one day, appended by
+    update_rollups; the activity of a day is the sum of its rows
+    """
+    artisan = models.ForeignKey(
+        ArtisanProfile, on_delete=models.CASCADE, related_name='daily_stats', db_constraint=False
+    )
+    day = models.DateField()
+    views = models.IntegerField(default=0)
+    new_reviews = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    helpful_votes = models.IntegerField(default=0)
+    rating_1 = models.IntegerField(default=0)
+    rating_2 = models.IntegerField(default=0)
+    rating_3 = models.IntegerField(default=0)
+    rating_4 = models.IntegerField(default=0)
+    rating_5 = models.IntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = "Artisan daily stats"
+        ordering = ['artisan_id', 'day']
+        indexes = [
+            models.Index(fields=['artisan', 'day']),
+            models.Index(fields=['day']),
+        ]
+    
+    def __str__(self):
+        return f"{self.artisan_id} on {self.day}"
+
+
+class StaleRollup(models.Model):
+    """A day of an artisan whose review and vote totals the rollup job must recount"""
+    artisan = models.ForeignKey(
+        ArtisanProfile, on_delete=models.CASCADE, related_name='+', db_constraint=False
+    )
+    day = models.DateField()
+    marked_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.artisan_id} on {self.day}"
+
+
+class ArtisanRank(models.Model):
+    """Category and city rank percentiles of a listed artisan, maintained by the rollup job"""
+    artisan = models.OneToOneField(
+        ArtisanProfile, on_delete=models.CASCADE, primary_key=True, related_name='rank',
+        db_constraint=False
+    )
+    ranks = models.JSONField(default=dict)
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Ranks of {self.artisan_id}"
+
+
+class RollupWatermark(models.Model):
+    """Last event id folded into the daily rollups, per event source"""
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.PositiveBigIntegerField(default=0)
+    pending = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Ids below last_id not seen yet, with when they were first missed"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+
+def import_storage():
+    """Partner spreadsheets contain contact details; keep them out of MEDIA_ROOT"""
+    return FileSystemStorage(location=settings.IMPORTS_ROOT)
+
+
+class ArtisanImport(models.Model):
+    """A partner CSV of artisans, imported in resumable chunks"""
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    file = models.FileField(upload_to='artisans/', storage=import_storage)
+    approve = models.BooleanField(
+        default=False,
+        help_text="Activate and verify imported artisans immediately"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    rows_processed = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    message = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Import #{self.pk} ({self.get_status_display()})"
+
+
+class ArtisanImportError(models.Model):
+    """A rejected row of an artisan import"""
+    artisan_import = models.ForeignKey(ArtisanImport, on_delete=models.CASCADE, related_name='errors')
+    row = models.PositiveIntegerField()
+    message = models.TextField()
+    
+    class Meta:
+        ordering = ['artisan_import', 'row']
+    
+    def __str__(self):
+        return f"Row {self.row}: {self.message}"
@@ -0,0 +1,429 @@
+"""
+Daily per-artisan activity rollups.
+
+``ArtisanDailyStats`` is append-only: each row is a signed change to the
+view, review, rating and helpful-vote totals of an artisan on one day, and
+the activity of a day is the sum of its rows. ``update_rollups`` runs as a
+periodic job and appends one row per changed day in one transaction:
+
+- Profile view events are a queue: every visible event is added to its day,
+  then exactly those events are deleted. Events committed meanwhile wait
+  for the next run. ``ArtisanProfile.profile_views`` is counted when the
+  view happens; the events only feed the daily rows.
+- Reviews and helpful votes are read above the ``RollupWatermark`` of their
+  source. Ids below the watermark that were not visible yet, e.g. from a
+  transaction that committed late, are kept in ``pending`` and picked up
+  once they appear, or given up after ``ROLLUP_PENDING_TIMEOUT`` seconds
+  (deleted rows look the same).
+- Edits, deletions and hiding do not add ids, so they mark the day of the
+  review or vote in ``StaleRollup`` through ``mark_stale``.
+
+Review and vote totals are not added up event by event. The days of new
+events and of marks are recounted from the reviews and votes (hidden
+reviews left out), and the difference from their rows is appended, so a
+late or repeated recount is harmless. Once a day is over, its rows are
+replaced by their sum, which keeps rolling windows to about ``days`` rows
+per artisan, whatever the number of reviews.
+
+Category and city rank percentiles are computed for all listed artisans at
+once from the rollups by the rollup job and stored in ``ArtisanRank``; the
+dashboard only reads that table.
+"""
+
+import bisect
+import functools
+import math
+import operator
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from artisan_marketplace import sharding
+from artisan_marketplace.sqlite.base import immediate
+
+from .models import (
+    ArtisanDailyStats, ArtisanListing, ArtisanRank, ProfileView, RollupWatermark, StaleRollup
+)
+
+STARS = range(1, 6)
+STAR_FIELDS = tuple(f'rating_{stars}' for stars in STARS)
+COUNTER_FIELDS = ('views', 'new_reviews', 'rating_sum', 'helpful_votes')
+STAT_FIELDS = COUNTER_FIELDS + STAR_FIELDS
+# Recounted from reviews and votes; views are only ever added
+RECOUNTED_FIELDS = ('new_reviews', 'rating_sum', 'helpful_votes') + STAR_FIELDS
+WINDOWS = (7, 30, 90)
+RANK_VIEWS_DAYS = 30
+BATCH_SIZE = 500
+DAY_CHUNK = 100
+# Days this far back are merged even when no event touched them
+COMPACT_DAYS = 2
+PENDING_TIMEOUT = getattr(settings, 'ROLLUP_PENDING_TIMEOUT', 60 * 60)
+MAX_PENDING = 500
+
+
+def _sources():
+    from reviews.models import Review, ReviewHelpful
+
+    # Unhelpful votes are read too, so their ids do not look missing
+    return {
+        'reviews': (Review.objects.all(), 'artisan_id'),
+        'helpful_votes': (ReviewHelpful.objects.all(), 'review__artisan_id'),
+    }
+
+
+def _new_deltas():
+    return defaultdict(lambda: dict.fromkeys(STAT_FIELDS, 0))
+
+
+def _chunks(items, size):
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1) - timedelta.resolution
+
+
+def _created_on(days, artisan_field):
+    """Q for rows of the ``(artisan_id, day)`` pairs in ``days`` by creation time"""
+    return functools.reduce(operator.or_, (
+        Q(**{artisan_field: artisan_id}, created_at__range=_day_bounds(day))
+        for artisan_id, day in days
+    ))
+
+
+def _stats_of(days):
+    return ArtisanDailyStats.objects.filter(functools.reduce(operator.or_, (
+        Q(artisan_id=artisan_id, day=day) for artisan_id, day in days
+    ))).order_by()
+
+
+def mark_stale(rows, using=None):
+    """
+    Have the next rollup run recount the days of ``rows``, the
+    ``(artisan_id, created_at)`` pairs of changed reviews or votes, once
+    ``using`` commits.
+    """
+    stale = [
+        StaleRollup(artisan_id=artisan_id, day=day)
+        for artisan_id, day in {(artisan_id, timezone.localdate(created_at)) for artisan_id, created_at in rows}
+    ]
+    if stale:
+        # Marks are on default; write them once the row's shard commits
+        transaction.on_commit(lambda: StaleRollup.objects.bulk_create(stale), using=using)
+
+
+def update_rollups():
+    """Append the changes of new events to the daily rows; returns the number of days changed"""
+    # Rollups, marks and watermarks are on default; review events are read
+    # from every shard. Ids are unique across shards, so one watermark
+    # covers them.
+    with immediate():
+        views = _take_profile_views()
+        stale = _take_stale()
+        for name, (queryset, artisan_field) in _sources().items():
+            watermark, _ = RollupWatermark.objects.get_or_create(name=name)
+            watermark = RollupWatermark.objects.select_for_update().get(pk=watermark.pk)
+            stale |= _new_event_days(watermark, queryset, artisan_field)
+
+        deltas = _recount(stale)
+        for day, count in views.items():
+            deltas[day]['views'] += count
+        ArtisanDailyStats.objects.bulk_create([
+            ArtisanDailyStats(artisan_id=artisan_id, day=day, **values)
+            for (artisan_id, day), values in deltas.items()
+        ], batch_size=1000)
+        _compact(deltas.keys())
+    return len(deltas)
+
+
+def _gaps(after, last_id, ids, limit):
+    """The newest ``limit`` ids in ``(after, last_id]`` missing from the ascending ``ids``"""
+    gaps = []
+    upper = last_id
+    for pk in reversed(ids):
+        if pk <= after:
+            break
+        gaps.extend(range(upper, pk, -1)[:limit - len(gaps)])
+        upper = pk - 1
+    gaps.extend(range(upper, after, -1)[:limit - len(gaps)])
+    return gaps
+
+
+def _new_event_days(watermark, queryset, artisan_field):
+    """The days of the events above ``watermark`` or pending below it"""
+    parts = sharding.per_shard(queryset)
+    last_id = max(
+        queryset.model.objects.using(part._db).aggregate(last=Max('pk'))['last'] or 0
+        for part in parts
+    )
+    pending = {int(pk): parse_datetime(since) for pk, since in watermark.pending.items()}
+    if last_id <= watermark.last_id and not pending:
+        return set()
+
+    days, seen = set(), set()
+    for part in parts:
+        rows = part.filter(
+            Q(pk__gt=watermark.last_id, pk__lte=last_id) | Q(pk__in=list(pending))
+        ).order_by().values_list('pk', artisan_field, 'created_at')
+        for pk, artisan_id, created_at in rows.iterator():
+            seen.add(pk)
+            days.add((artisan_id, timezone.localdate(created_at)))
+
+    now = timezone.now()
+    # Only the newest gaps can still be in flight
+    for pk in _gaps(watermark.last_id, last_id, sorted(seen), MAX_PENDING):
+        pending[pk] = now
+    expired = now - timedelta(seconds=PENDING_TIMEOUT)
+    waiting = sorted(pk for pk, since in pending.items() if pk not in seen and since > expired)
+    watermark.pending = {str(pk): pending[pk].isoformat() for pk in waiting[-MAX_PENDING:]}
+    watermark.last_id = max(last_id, watermark.last_id)
+    watermark.save(update_fields=['last_id', 'pending', 'updated_at'])
+    return days
+
+
+def _take_profile_views():
+    """Count the visible view events per day, then drop them"""
+    views = Counter()
+    after = 0
+    while True:
+        events = list(ProfileView.objects.filter(pk__gt=after).order_by('pk').values_list(
+            'pk', 'artisan_id', 'viewed_at'
+        )[:BATCH_SIZE])
+        if not events:
+            break
+        for _, artisan_id, viewed_at in events:
+            views[artisan_id, timezone.localdate(viewed_at)] += 1
+        ProfileView.objects.filter(pk__in=[pk for pk, _, _ in events]).delete()
+        after = events[-1][0]
+    return views
+
+
+def _take_stale():
+    """The visible marked days, then drop the marks"""
+    days = set()
+    after = 0
+    while True:
+        marks = list(StaleRollup.objects.filter(pk__gt=after).order_by('pk').values_list(
+            'pk', 'artisan_id', 'day'
+        )[:BATCH_SIZE])
+        if not marks:
+            break
+        days.update((artisan_id, day) for _, artisan_id, day in marks)
+        StaleRollup.objects.filter(pk__in=[pk for pk, _, _ in marks]).delete()
+        after = marks[-1][0]
+    return days
+
+
+def _recount(days):
+    """Recount the review and vote totals of ``days``; return the changes from their rows"""
+    from reviews.models import Review, ReviewHelpful
+
+    deltas = _new_deltas()
+    for chunk in _chunks(sorted(days), DAY_CHUNK):
+        counted = _new_deltas()
+        reviews = Review.objects.filter(_created_on(chunk, 'artisan_id'), is_hidden=False)
+        for artisan_id, created_at, rating in reviews.order_by().values_list('artisan_id', 'created_at', 'rating'):
+            totals = counted[artisan_id, timezone.localdate(created_at)]
+            totals['new_reviews'] += 1
+            totals['rating_sum'] += rating
+            totals[f'rating_{rating}'] += 1
+        votes = ReviewHelpful.objects.filter(_created_on(chunk, 'review__artisan_id'), is_helpful=True)
+        for artisan_id, created_at in votes.order_by().values_list('review__artisan_id', 'created_at'):
+            counted[artisan_id, timezone.localdate(created_at)]['helpful_votes'] += 1
+
+        stored = {
+            (row.pop('artisan_id'), row.pop('day')): row
+            for row in _stats_of(chunk).values('artisan_id', 'day').annotate(
+                **{field: Sum(field) for field in RECOUNTED_FIELDS}
+            )
+        }
+        for day in chunk:
+            before = stored.get(day, {})
+            changes = {
+                field: counted[day][field] - before.get(field, 0)
+                for field in RECOUNTED_FIELDS
+            }
+            if any(changes.values()):
+                deltas[day].update(changes)
+    return deltas
+
+
+def _compact(days):
+    """Replace the rows of each past day in ``days`` and of recent past days by their sum"""
+    today = timezone.localdate()
+    candidates = {(artisan_id, day) for artisan_id, day in days if day < today}
+    candidates.update(
+        ArtisanDailyStats.objects.filter(
+            day__gte=today - timedelta(days=COMPACT_DAYS),
+            day__lt=today
+        ).order_by().values('artisan_id', 'day').annotate(rows=Count('pk')).filter(
+            rows__gt=1
+        ).values_list('artisan_id', 'day')
+    )
+    for chunk in _chunks(sorted(candidates), DAY_CHUNK):
+        merged = list(_stats_of(chunk).values('artisan_id', 'day').annotate(
+            rows=Count('pk'), **{field: Sum(field) for field in STAT_FIELDS}
+        ).filter(rows__gt=1))
+        if not merged:
+            continue
+        _stats_of([(row['artisan_id'], row['day']) for row in merged]).delete()
+        ArtisanDailyStats.objects.bulk_create([
+            ArtisanDailyStats(
+                artisan_id=row['artisan_id'],
+                day=row['day'],
+                **{field: row[field] for field in STAT_FIELDS}
+            )
+            for row in merged
+            if any(row[field] for field in STAT_FIELDS)
+        ], batch_size=1000)
+
+
+def rolling_stats(artisan, windows=WINDOWS):
+    """
+    Return ``{days: {stat: total, 'avg_rating': ...}}`` for each window,
+    computed in one query over the last ``max(windows)`` daily rows.
+    """
+    today = timezone.localdate()
+    aggregates = {}
+    for days in windows:
+        recent = Q(day__gt=today - timedelta(days=days))
+        for field in COUNTER_FIELDS:
+            aggregates[f'{field}_{days}'] = Sum(field, filter=recent, default=0)
+
+    totals = ArtisanDailyStats.objects.filter(
+        artisan=artisan,
+        day__gt=today - timedelta(days=max(windows))
+    ).aggregate(**aggregates)
+
+    result = {}
+    for days in windows:
+        window = {field: totals[f'{field}_{days}'] for field in COUNTER_FIELDS}
+        window['avg_rating'] = (
+            round(window['rating_sum'] / window['new_reviews'], 1)
+            if window['new_reviews'] else None
+        )
+        result[days] = window
+    return result
+
+
+def daily_series(artisan, days=30):
+    """Return ``[(day, stats)]`` for the last ``days`` days, zero-filled"""
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    rows = {
+        row.pop('day'): row
+        for row in ArtisanDailyStats.objects.filter(
+            artisan=artisan,
+            day__gte=start
+        ).order_by().values('day').annotate(**{field: Sum(field) for field in COUNTER_FIELDS})
+    }
+    empty = dict.fromkeys(COUNTER_FIELDS, 0)
+    return [
+        (day, rows.get(day, empty))
+        for day in (start + timedelta(days=offset) for offset in range(days))
+    ]
+
+
+def weekly_series(artisan, weeks=12):
+    """Return ``[(week_start, stats)]`` summed from the daily series"""
+    series = daily_series(artisan, weeks * 7)
+    result = []
+    for start in range(0, len(series), 7):
+        week = series[start:start + 7]
+        result.append((week[0][0], {
+            field: sum(stats[field] for _, stats in week)
+            for field in COUNTER_FIELDS
+        }))
+    return result
+
+
+def rating_histogram(artisan):
+    """Return ``{stars: count}`` over the artisan's whole rollup history"""
+    totals = ArtisanDailyStats.objects.filter(artisan=artisan).aggregate(
+        **{field: Sum(field, default=0) for field in STAR_FIELDS}
+    )
+    return {stars: totals[f'rating_{stars}'] for stars in STARS}
+
+
+def _rank(values, value):
+    """1-based position of ``value`` among the ascending ``values``, and its top percentile"""
+    position = 1 + len(values) - bisect.bisect_right(values, value)
+    return {
+        'position': position,
+        'total': len(values),
+        'top_percent': math.ceil(100 * position / len(values)),
+    }
+
+
+def refresh_rank_percentiles():
+    """
+    Rank every listed artisan by average rating and recent views within its
+    category and city, and store the result in ``ArtisanRank``. Returns the
+    number of artisans ranked.
+    """
+    since = timezone.localdate() - timedelta(days=RANK_VIEWS_DAYS)
+    listed = ArtisanListing.objects.filter(is_listed=True)
+    profiles = {
+        pk: (category_id, city_id)
+        for pk, category_id, city_id in listed.values_list('artisan_id', 'category_id', 'city_id')
+    }
+    totals = ArtisanDailyStats.objects.filter(artisan_id__in=listed.values('artisan_id')).order_by().values(
+        'artisan_id'
+    ).annotate(
+        reviews=Sum('new_reviews'),
+        ratings=Sum('rating_sum'),
+        recent_views=Sum('views', filter=Q(day__gt=since), default=0),
+    )
+    scores = dict.fromkeys(profiles, (0.0, 0))
+    for row in totals:
+        rating = row['ratings'] / row['reviews'] if row['reviews'] else 0.0
+        scores[row['artisan_id']] = (rating, row['recent_views'])
+
+    groups = defaultdict(lambda: ([], []))
+    for pk, (category_id, city_id) in profiles.items():
+        rating, views = scores[pk]
+        for group in (('category', category_id), ('city', city_id)):
+            groups[group][0].append(rating)
+            groups[group][1].append(views)
+    for ratings, views_list in groups.values():
+        ratings.sort()
+        views_list.sort()
+
+    ranks = []
+    for pk, (category_id, city_id) in profiles.items():
+        rating, views = scores[pk]
+        entry = {'average_rating': round(rating, 1), 'recent_views': views}
+        for scope, group_id in (('category', category_id), ('city', city_id)):
+            ratings, views_list = groups[scope, group_id]
+            entry[scope] = {
+                'rating': _rank(ratings, rating),
+                'views': _rank(views_list, views),
+            }
+        ranks.append(ArtisanRank(artisan_id=pk, ranks=entry))
+
+    with transaction.atomic():
+        ArtisanRank.objects.bulk_create(
+            ranks,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['artisan'],
+            update_fields=['ranks', 'computed_at'],
+        )
+        # Artisans no longer listed
+        ArtisanRank.objects.exclude(artisan_id__in=listed.values('artisan_id')).delete()
+    return len(ranks)
+
+
+def rank_percentiles(artisan):
+    """Return the stored ranks of ``artisan``, or None until the rollup job has ranked it"""
+    rank = ArtisanRank.objects.filter(artisan_id=artisan.pk).values_list('ranks', flat=True).first()
+    return rank or None
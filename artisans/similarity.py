@@ -0,0 +1,147 @@
+"""
+Offline "similar artisans" computation.
+
+Artisans are rows of a sparse binary artisan x skill matrix. For a batch of
+rows the intersection sizes with every other artisan come from one sparse
+matrix product, which turns into Jaccard similarity:
+
+    |A & B| / (|A| + |B| - |A & B|)
+
+Artisans in the same state get a small bonus so local matches rank first
+among equally similar ones. Only the top ``k`` neighbours of each row are
+kept and written to ``SimilarArtisan``, so memory depends on the batch size
+rather than on the number of artisans. Skill sets come from the listings on
+``default``, so artisans are compared across all shards.
+
+Each row also carries the card of the neighbour (name, avatar, rate and
+rating), so the detail page reads its related artisans from this table
+alone. ``refresh_similar_cards()`` copies refreshed listings into the rows
+that show them and drops neighbours that are no longer listed.
+"""
+
+import numpy as np
+from scipy import sparse
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from .models import ArtisanListing, SimilarArtisan
+
+TOP_K = 8
+BATCH_SIZE = 500
+SAME_STATE_BONUS = 0.05
+
+CARD_FIELDS = ('display_name', 'avatar_url', 'hourly_rate', 'avg_rating')
+
+
+def build_skill_matrix():
+    """
+    Return ``(artisan_ids, state_ids, matrix)`` for verified, active
+    artisans, where ``matrix`` is a CSR artisan x skill matrix.
+    """
+    rows = ArtisanListing.objects.filter(is_listed=True).order_by('pk').values_list(
+        'pk', 'state_id', 'skill_ids'
+    )
+    artisan_ids, state_list, row_index, skill_ids = [], [], [], []
+    for artisan_id, state_id, skills in rows.iterator(chunk_size=10000):
+        row = len(artisan_ids)
+        artisan_ids.append(artisan_id)
+        state_list.append(state_id)
+        row_index.extend([row] * len(skills))
+        skill_ids.extend(skills)
+    artisan_ids = np.asarray(artisan_ids, dtype=np.int64)
+    state_ids = np.asarray(state_list, dtype=np.int64)
+
+    columns, column_index = np.unique(np.asarray(skill_ids, dtype=np.int64), return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (
+            np.ones(len(row_index), dtype=np.float32),
+            (np.asarray(row_index, dtype=np.int64), column_index),
+        ),
+        shape=(len(artisan_ids), len(columns)),
+    )
+    return artisan_ids, state_ids, matrix
+
+
+def top_neighbours(matrix, sizes, state_ids, start, stop, k=TOP_K):
+    """
+    Yield ``(row, neighbour_rows, scores)`` for rows ``start:stop`` of
+    ``matrix``, best match first. ``sizes`` holds the skill count per row.
+    """
+    intersections = (matrix[start:stop] @ matrix.T).tocsr()
+    intersections.sort_indices()
+
+    for offset in range(stop - start):
+        row = start + offset
+        begin, end = intersections.indptr[offset], intersections.indptr[offset + 1]
+        columns = intersections.indices[begin:end]
+        shared = intersections.data[begin:end]
+
+        keep = columns != row
+        columns, shared = columns[keep], shared[keep]
+        if not len(columns):
+            continue
+
+        scores = shared / (sizes[row] + sizes[columns] - shared)
+        scores = scores + SAME_STATE_BONUS * (state_ids[columns] == state_ids[row])
+
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            columns, scores = columns[best], scores[best]
+        order = np.lexsort((columns, -scores))
+        yield row, columns[order], scores[order]
+
+
+def compute_similar_artisans(k=TOP_K, batch_size=BATCH_SIZE, stdout=None):
+    """Recompute ``SimilarArtisan`` for all verified, active artisans"""
+    artisan_ids, state_ids, matrix = build_skill_matrix()
+    sizes = np.asarray(matrix.sum(axis=1)).ravel()
+    total = len(artisan_ids)
+
+    for start in range(0, total, batch_size):
+        stop = min(start + batch_size, total)
+        neighbours = [
+            (int(artisan_ids[row]), int(artisan_ids[column]), float(score), rank)
+            for row, columns, scores in top_neighbours(matrix, sizes, state_ids, start, stop, k)
+            for rank, (column, score) in enumerate(zip(columns, scores), start=1)
+        ]
+        cards = {
+            row[0]: dict(zip(CARD_FIELDS, row[1:]))
+            for row in ArtisanListing.objects.filter(
+                pk__in={similar_id for _, similar_id, _, _ in neighbours}
+            ).values_list('pk', *CARD_FIELDS)
+        }
+        similar = [
+            SimilarArtisan(
+                artisan_id=artisan_id,
+                similar_id=similar_id,
+                score=score,
+                rank=rank,
+                **cards[similar_id],
+            )
+            for artisan_id, similar_id, score, rank in neighbours
+        ]
+        with transaction.atomic():
+            SimilarArtisan.objects.filter(
+                artisan_id__in=artisan_ids[start:stop].tolist()
+            ).delete()
+            SimilarArtisan.objects.bulk_create(similar, batch_size=1000)
+        if stdout is not None:
+            stdout.write(f'Processed {stop}/{total} artisans')
+
+    # Drop rows of artisans that are no longer listed
+    SimilarArtisan.objects.exclude(
+        artisan_id__in=ArtisanListing.objects.filter(is_listed=True).values('pk')
+    ).delete()
+    return total
+
+
+def refresh_similar_cards(artisan_ids):
+    """Copy the listings of ``artisan_ids`` into the rows showing them as similar"""
+    shown = SimilarArtisan.objects.filter(similar_id__in=artisan_ids)
+    shown.exclude(
+        similar_id__in=ArtisanListing.objects.filter(pk__in=artisan_ids, is_listed=True).values('pk')
+    ).delete()
+    listing = ArtisanListing.objects.filter(pk=OuterRef('similar_id'))
+    return shown.update(**{
+        field: Subquery(listing.values(field)) for field in CARD_FIELDS
+    })
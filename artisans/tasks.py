@@ -0,0 +1,34 @@
+from core.jobs import task
+from .imports import run_import
+from .models import ArtisanImport
+from .rollups import refresh_rank_percentiles, update_rollups
+from .similarity import compute_similar_artisans
+
+
+@task(priority=-1)
+def update_similar_artisans():
+    """Recompute the similar artisans table"""
+    compute_similar_artisans()
+
+
+def schedule_similar_artisans_update():
+    """Coalesce skill and listing changes into one recomputation"""
+    update_similar_artisans.schedule(countdown=600, dedup_key='artisans.update_similar_artisans')
+
+
+@task(priority=-1, every=300)
+def update_artisan_rollups():
+    """Fold new views, reviews and votes into the daily rollups and re-rank"""
+    update_rollups()
+    refresh_rank_percentiles()
+
+
+@task(max_attempts=5)
+def process_artisan_import(import_id):
+    """Import a partner CSV, resuming after the last committed chunk on retry"""
+    artisan_import = ArtisanImport.objects.filter(pk=import_id).first()
+    if artisan_import is None or artisan_import.status == 'done':
+        return
+    run_import(artisan_import)
+    if artisan_import.approve:
+        schedule_similar_artisans_update()
@@ -1,3 +1,486 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import re
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_save, pre_save
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import User
+from reviews.models import Review, ReviewHelpful
+from reviews.moderation import report_filed
+from . import rollups
+from .imports import ArtisanImporter, ImportFormatError
+from .listings import rebuild_listings
+from .models import (
+    ArtisanDailyStats, ArtisanListing, ArtisanProfile, Category, City, SimilarArtisan, Skill, State
+)
+from .similarity import compute_similar_artisans
+
+
+class ListingProjectionTests(TestCase):
+    """ArtisanListing rows follow the tables they are built from"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Plumbing')
+        cls.pipes = Skill.objects.create(name='Pipe fitting', category=cls.category)
+        cls.drains = Skill.objects.create(name='Drain cleaning', category=cls.category)
+        cls.state = State.objects.create(name='Lagos', code='LA')
+        cls.city = City.objects.create(name='Ikeja', state=cls.state)
+        cls.client_user = User.objects.create_user('client', role='client')
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user('ada', first_name='Ada', last_name='Obi', role='artisan')
+            self.artisan = ArtisanProfile.objects.create(
+                user=self.user,
+                category=self.category,
+                bio='Twenty years of fixing leaks',
+                hourly_rate=5000,
+                state=self.state,
+                city=self.city,
+                is_verified=True,
+            )
+
+    def listing(self):
+        return ArtisanListing.objects.get(pk=self.artisan.pk)
+
+    def review(self, client, rating, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Review.objects.create(
+                client=client, artisan=self.artisan, rating=rating, title='Review', comment='Good', **kwargs
+            )
+
+    def test_new_artisan_gets_a_listing(self):
+        listing = self.listing()
+        self.assertEqual(listing.display_name, 'Ada Obi')
+        self.assertEqual(listing.category_name, 'Plumbing')
+        self.assertEqual(listing.state_name, 'Lagos')
+        self.assertEqual(listing.city_name, 'Ikeja')
+        self.assertTrue(listing.is_listed)
+        self.assertEqual(listing.review_count, 0)
+        self.assertIsNone(listing.avg_rating)
+
+    def test_profile_changes_are_copied(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.artisan.hourly_rate = 7500
+            self.artisan.availability = 'busy'
+            self.artisan.save()
+        listing = self.listing()
+        self.assertEqual(listing.hourly_rate, 7500)
+        self.assertEqual(listing.availability, 'busy')
+
+    def test_user_changes_are_copied(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Adaeze'
+            self.user.save()
+        self.assertEqual(self.listing().display_name, 'Adaeze Obi')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertFalse(self.listing().is_listed)
+
+    def test_skills_are_searchable(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.artisan.skills.add(self.pipes, self.drains)
+        listing = self.listing()
+        self.assertEqual(sorted(listing.skill_ids), sorted([self.pipes.pk, self.drains.pk]))
+        self.assertIn('pipe fitting', listing.search_text)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pipes.name = 'Pipe laying'
+            self.pipes.save()
+        self.assertIn('pipe laying', self.listing().search_text)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drains.delete()
+        self.assertEqual(self.listing().skill_ids, [self.pipes.pk])
+
+    def test_rating_stats_skip_hidden_reviews(self):
+        other = User.objects.create_user('other', role='client')
+        self.review(self.client_user, 5)
+        hidden = self.review(other, 1)
+        listing = self.listing()
+        self.assertEqual(listing.review_count, 2)
+        self.assertEqual(listing.avg_rating, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            hidden.is_hidden = True
+            hidden.save()
+        listing = self.listing()
+        self.assertEqual(listing.review_count, 1)
+        self.assertEqual(listing.avg_rating, 5)
+
+    def test_deleted_artisan_loses_its_listing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.artisan.delete()
+        self.assertFalse(ArtisanListing.objects.filter(pk=self.artisan.pk).exists())
+
+    def test_rebuild_matches_incremental_refreshes(self):
+        self.review(self.client_user, 4)
+        before = ArtisanListing.objects.values().get(pk=self.artisan.pk)
+        ArtisanListing.objects.all().delete()
+        self.assertEqual(rebuild_listings(), 1)
+        self.assertEqual(ArtisanListing.objects.values().get(pk=self.artisan.pk), before)
+
+
+class SimilarArtisanCardTests(TestCase):
+    """SimilarArtisan rows carry the card of the artisan they point to"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Plumbing')
+        cls.pipes = Skill.objects.create(name='Pipe fitting', category=cls.category)
+        cls.state = State.objects.create(name='Lagos', code='LA')
+        cls.city = City.objects.create(name='Ikeja', state=cls.state)
+
+    def setUp(self):
+        self.ada = self.make_artisan('ada', 'Ada', 5000)
+        self.bola = self.make_artisan('bola', 'Bola', 4000)
+
+    def make_artisan(self, username, first_name, hourly_rate):
+        with self.captureOnCommitCallbacks(execute=True):
+            artisan = ArtisanProfile.objects.create(
+                user=User.objects.create_user(username, first_name=first_name, last_name='Obi', role='artisan'),
+                category=self.category,
+                bio='Pipes and drains',
+                hourly_rate=hourly_rate,
+                state=self.state,
+                city=self.city,
+                is_verified=True,
+            )
+            artisan.skills.add(self.pipes)
+        return artisan
+
+    def test_compute_stores_the_cards(self):
+        compute_similar_artisans()
+        card = SimilarArtisan.objects.get(artisan=self.bola)
+        self.assertEqual(card.similar_id, self.ada.pk)
+        self.assertEqual(card.display_name, 'Ada Obi')
+        self.assertEqual(card.hourly_rate, 5000)
+
+    def test_cards_follow_the_listing(self):
+        SimilarArtisan.objects.create(artisan=self.bola, similar=self.ada, score=1, rank=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ada.user.first_name = 'Adaeze'
+            self.ada.user.save()
+        self.assertEqual(SimilarArtisan.objects.get(artisan=self.bola).display_name, 'Adaeze Obi')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ada.is_verified = False
+            self.ada.save()
+        self.assertFalse(SimilarArtisan.objects.filter(artisan=self.bola).exists())
+
+
+class RollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Plumbing')
+        state = State.objects.create(name='Lagos', code='LA')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.artisan = ArtisanProfile.objects.create(
+                user=User.objects.create_user('ada', role='artisan'),
+                category=category,
+                bio='Pipes and drains',
+                hourly_rate=5000,
+                state=state,
+                city=City.objects.create(name='Ikeja', state=state),
+                is_verified=True,
+            )
+        cls.clients = [User.objects.create_user(f'client{index}', role='client') for index in range(3)]
+
+    def review(self, client, rating, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Review.objects.create(
+                client=client, artisan=self.artisan, rating=rating, title='Review', comment='Good', **kwargs
+            )
+
+    def change(self, action):
+        with self.captureOnCommitCallbacks(execute=True):
+            action()
+        rollups.update_rollups()
+
+    def today(self):
+        return rollups.daily_series(self.artisan, 1)[0][1]
+
+    def test_new_reviews_and_votes_are_counted(self):
+        first = self.review(self.clients[0], 5)
+        self.review(self.clients[1], 3)
+        self.review(self.clients[2], 1, is_hidden=True)
+        ReviewHelpful.objects.create(review=first, user=self.clients[1])
+        ReviewHelpful.objects.create(review=first, user=self.clients[2], is_helpful=False)
+        rollups.update_rollups()
+
+        self.assertEqual(self.today(), {'views': 0, 'new_reviews': 2, 'rating_sum': 8, 'helpful_votes': 1})
+        self.assertEqual(rollups.rating_histogram(self.artisan), {1: 0, 2: 0, 3: 1, 4: 0, 5: 1})
+        self.assertEqual(rollups.rolling_stats(self.artisan)[7]['avg_rating'], 4.0)
+        # Nothing new, nothing appended
+        self.assertEqual(rollups.update_rollups(), 0)
+
+    def test_edits_hiding_and_deletion_are_corrected(self):
+        review = self.review(self.clients[0], 5)
+        other = self.review(self.clients[1], 4)
+        rollups.update_rollups()
+
+        review.rating = 2
+        self.change(review.save)
+        self.assertEqual(rollups.rating_histogram(self.artisan), {1: 0, 2: 1, 3: 0, 4: 1, 5: 0})
+        self.change(lambda: Review.objects.get(pk=other.pk).delete())
+        self.assertEqual(self.today()['new_reviews'], 1)
+        review.is_hidden = True
+        self.change(review.save)
+        self.assertEqual(self.today(), dict.fromkeys(rollups.COUNTER_FIELDS, 0))
+        self.assertEqual(rollups.rating_histogram(self.artisan), dict.fromkeys(rollups.STARS, 0))
+        # Corrections are appended, never written over
+        self.assertEqual(ArtisanDailyStats.objects.count(), 4)
+
+    def test_moderation_hides_reviews_from_the_ranks(self):
+        review = self.review(self.clients[0], 5)
+        rollups.update_rollups()
+        for _ in range(3):
+            self.change(lambda: report_filed(review.pk))
+        rollups.refresh_rank_percentiles()
+        self.assertEqual(rollups.rank_percentiles(self.artisan)['average_rating'], 0.0)
+
+    def test_views_count_at_once_and_by_day_later(self):
+        self.artisan.increment_views()
+        self.artisan.increment_views()
+        self.assertEqual(self.artisan.profile_views, 2)
+        self.assertEqual(ArtisanProfile.objects.get(pk=self.artisan.pk).profile_views, 2)
+        self.assertEqual(self.today()['views'], 0)
+
+        rollups.update_rollups()
+        self.assertEqual(self.today()['views'], 2)
+        self.assertEqual(ArtisanProfile.objects.get(pk=self.artisan.pk).profile_views, 2)
+
+    def test_past_days_are_merged_into_one_row(self):
+        review = self.review(self.clients[0], 5)
+        yesterday = timezone.now() - timedelta(days=1)
+        Review.objects.filter(pk=review.pk).update(created_at=yesterday)
+        rollups.update_rollups()
+        review.refresh_from_db()
+        review.rating = 4
+        with self.captureOnCommitCallbacks(execute=True):
+            review.save()
+        ArtisanDailyStats.objects.create(artisan=self.artisan, day=yesterday.date(), views=3)
+
+        rollups.update_rollups()
+        self.assertEqual(
+            list(ArtisanDailyStats.objects.values_list('day', 'views', 'new_reviews', 'rating_sum', 'rating_4')),
+            [(yesterday.date(), 3, 1, 4, 1)],
+        )
+
+    def test_gaps_come_from_the_ids_read(self):
+        self.assertEqual(rollups._gaps(10, 20, [4, 11, 12, 15, 20], 100), [19, 18, 17, 16, 14, 13])
+        self.assertEqual(rollups._gaps(10, 20, [12, 15], 3), [20, 19, 18])
+        self.assertEqual(rollups._gaps(0, 10 ** 9, [], 2), [10 ** 9, 10 ** 9 - 1])
+
+
+IMPORT_COLUMNS = ['email', 'first_name', 'last_name', 'category', 'state', 'city', 'bio', 'hourly_rate', 'skills']
+
+
+def import_csv(*rows, columns=IMPORT_COLUMNS):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(columns)
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def import_row(name, **changes):
+    row = {
+        'email': f'{name}@example.com', 'first_name': name.title(), 'last_name': 'Obi',
+        'category': 'plumbing', 'state': 'LA', 'city': 'Ikeja', 'bio': 'Pipes',
+        'hourly_rate': '5,000', 'skills': 'Pipe fitting; Drains',
+    }
+    row.update(changes)
+    return [row[column] for column in IMPORT_COLUMNS]
+
+
+class ArtisanImportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Plumbing')
+        cls.skills = [Skill.objects.create(name=name, category=cls.category) for name in ('Pipe fitting', 'Drains')]
+        state = State.objects.create(name='Lagos', code='LA')
+        City.objects.create(name='Ikeja', state=state)
+        User.objects.create_user('taken', email='taken@example.com')
+
+    def run_import(self, text, chunk_size=2, approve=True):
+        progress = []
+        created, rejected = ArtisanImporter(approve=approve, chunk_size=chunk_size).run(
+            io.StringIO(text), checkpoint=lambda *args: progress.append(args)
+        )
+        return created, rejected, progress
+
+    def test_valid_rows_are_created_in_bulk(self):
+        with CaptureQueriesContext(connection) as queries:
+            created, rejected, _ = self.run_import(import_csv(import_row('ada'), import_row('bola')))
+        self.assertEqual((created, rejected), (2, 0))
+        # Users, profiles, skill links and listings, one statement each
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 4)
+        ada = ArtisanProfile.objects.get(user__username='ada')
+        self.assertEqual(ada.hourly_rate, 5000)
+        self.assertTrue(ada.is_verified and ada.user.is_active)
+        self.assertEqual(set(ada.skills.all()), set(self.skills))
+        self.assertTrue(ArtisanListing.objects.get(pk=ada.pk).is_listed)
+
+    def test_invalid_rows_are_reported_by_row_number(self):
+        created, rejected, progress = self.run_import(import_csv(
+            import_row('ada'),
+            import_row('bola', category='Tiling', email='not-an-email'),
+            import_row('ada2', email='ada@example.com'),
+            import_row('taken'),
+            import_row('chidi', city='Abuja', hourly_rate='free'),
+        ), chunk_size=10)
+        self.assertEqual((created, rejected), (1, 4))
+        errors = dict(progress[0][2])
+        self.assertEqual(sorted(errors), [3, 4, 5, 6])
+        self.assertIn('unknown category "Tiling"', errors[3])
+        self.assertIn('invalid email', errors[3])
+        self.assertEqual(errors[4], 'duplicate username or email earlier in the file')
+        self.assertEqual(errors[5], 'username "taken" already exists')
+        self.assertIn('unknown city', errors[6])
+        self.assertIn('invalid hourly_rate', errors[6])
+
+    def test_missing_columns_reject_the_file(self):
+        with self.assertRaises(ImportFormatError):
+            self.run_import(import_csv(['ada@example.com'], columns=['email']))
+
+    def test_checkpoints_count_the_rows_done(self):
+        rows = [import_row(name) for name in ('ada', 'bola', 'chidi', 'dayo', 'emeka')]
+        _, _, progress = self.run_import(import_csv(*rows))
+        self.assertEqual([rows_done for rows_done, _, _ in progress], [2, 4, 5])
+
+
+class ImportCommandTests(TransactionTestCase):
+    """Chunks commit one by one, so the progress file can be tested"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Plumbing')
+        for name in ('Pipe fitting', 'Drains'):
+            Skill.objects.create(name=name, category=category)
+        City.objects.create(name='Ikeja', state=State.objects.create(name='Lagos', code='LA'))
+
+    def test_resumes_after_the_last_committed_chunk(self):
+        rows = [import_row(name) for name in ('ada', 'bola', 'chidi', 'dayo', 'emeka')]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'partners.csv')
+        with open(path, 'w', newline='') as source:
+            source.write(import_csv(*rows[:2], import_row('bola'), *rows[2:]))
+        import_chunk = ArtisanImporter.import_chunk
+
+        def crash_on_second_chunk(importer, chunk, *args):
+            if chunk[0][0] > 3:
+                raise RuntimeError('worker killed')
+            return import_chunk(importer, chunk, *args)
+
+        with mock.patch.object(ArtisanImporter, 'import_chunk', crash_on_second_chunk), \
+                self.assertRaises(RuntimeError):
+            call_command('import_artisans', path, '--chunk-size', '2', stdout=io.StringIO())
+        self.assertEqual(ArtisanProfile.objects.count(), 2)
+
+        call_command('import_artisans', path, '--chunk-size', '2', '--resume', stdout=io.StringIO())
+        self.assertEqual(
+            sorted(ArtisanProfile.objects.values_list('user__username', flat=True)),
+            ['ada', 'bola', 'chidi', 'dayo', 'emeka'],
+        )
+        with open(f'{path}.errors.csv') as report:
+            self.assertEqual(list(csv.reader(report)), [
+                ['row', 'error'], ['4', 'username "bola" already exists'],
+            ])
+
+
+class DirtyFieldsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Plumbing')
+        cls.pipes, cls.drains, cls.taps = (
+            Skill.objects.create(name=name, category=category) for name in ('Pipes', 'Drains', 'Taps')
+        )
+        state = State.objects.create(name='Lagos', code='LA')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.artisan = ArtisanProfile.objects.create(
+                user=User.objects.create_user('ada', role='artisan'),
+                category=category,
+                bio='Pipes',
+                hourly_rate=5000,
+                state=state,
+                city=City.objects.create(name='Ikeja', state=state),
+            )
+            cls.artisan.skills.add(cls.pipes, cls.drains)
+
+    def setUp(self):
+        self.saves = []
+        for signal in (pre_save, post_save):
+            signal.connect(self.record, sender=ArtisanProfile)
+            self.addCleanup(signal.disconnect, self.record, sender=ArtisanProfile)
+
+    def record(self, signal, update_fields, **kwargs):
+        self.saves.append((signal, update_fields))
+
+    def updated_columns(self, queries):
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "artisans_artisanprofile"')]
+        self.assertEqual(len(updates), 1)
+        assignments = updates[0].split(' SET ', 1)[1].rsplit(' WHERE ', 1)[0]
+        return re.findall(r'"(\w+)" = ', assignments)
+
+    def test_only_changed_fields_are_written(self):
+        artisan = ArtisanProfile.objects.get(pk=self.artisan.pk)
+        artisan.bio = 'Pipes and drains'
+        artisan.hourly_rate = '5000'
+        artisan.address = None
+        with CaptureQueriesContext(connection) as queries:
+            artisan.save()
+        self.assertEqual(self.updated_columns(queries), ['bio', 'updated_at'])
+        self.assertEqual(self.saves[-1], (post_save, frozenset({'bio', 'updated_at'})))
+        self.assertEqual(artisan.get_dirty_fields(), [])
+
+    def test_unchanged_save_runs_no_queries_but_sends_signals(self):
+        artisan = ArtisanProfile.objects.get(pk=self.artisan.pk)
+        artisan.hourly_rate = 5000
+        with self.assertNumQueries(0), self.captureOnCommitCallbacks() as callbacks:
+            artisan.save()
+        self.assertEqual(self.saves, [(pre_save, frozenset()), (post_save, frozenset())])
+        self.assertEqual(callbacks, [])
+
+    def test_fields_changed_by_other_code_are_not_overwritten(self):
+        artisan = ArtisanProfile.objects.get(pk=self.artisan.pk)
+        artisan.increment_views()
+        ArtisanProfile.objects.filter(pk=artisan.pk).update(is_verified=True)
+        artisan.bio = 'Taps'
+        artisan.save()
+        stored = ArtisanProfile.objects.get(pk=artisan.pk)
+        self.assertEqual((stored.bio, stored.profile_views, stored.is_verified), ('Taps', 1, True))
+
+    def test_new_instances_and_explicit_update_fields_save_as_usual(self):
+        artisan = ArtisanProfile.objects.get(pk=self.artisan.pk)
+        with CaptureQueriesContext(connection) as queries:
+            artisan.save(update_fields=['bio', 'city'])
+        self.assertEqual(self.updated_columns(queries), ['bio', 'city_id'])
+        self.assertIsNone(ArtisanProfile(user=artisan.user).get_dirty_fields())
+
+    def test_set_skills_writes_only_the_difference(self):
+        artisan = ArtisanProfile.objects.get(pk=self.artisan.pk)
+        with self.assertNumQueries(1):
+            self.assertFalse(artisan.set_skills([str(self.drains.pk), self.pipes.pk]))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(artisan.set_skills([self.drains.pk, self.taps.pk]))
+        statements = [query['sql'].split()[0] for query in queries]
+        self.assertEqual((statements.count('INSERT'), statements.count('DELETE')), (1, 1))
+        self.assertEqual(set(artisan.skills.values_list('pk', flat=True)), {self.drains.pk, self.taps.pk})
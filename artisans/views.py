@@ -1,6 +1,7 @@
 from django.shortcuts import render, get_object_or_404
 from django.http import JsonResponse
-from .models import ArtisanProfile, Skill
+from core import reference
+from .models import ArtisanProfile
 
 
 def artisan_profile_view(request, pk):
@@ -11,8 +12,9 @@ def artisan_profile_view(request, pk):
 
 def get_skills_ajax(request):
     """AJAX view to get skills for a category"""
-    category_id = request.GET.get('category_id')
-    if category_id:
-        skills = Skill.objects.filter(category_id=category_id).values('id', 'name')
-        return JsonResponse(list(skills), safe=False)
+    data = reference.get()
+    category = data.lookup('category', request.GET.get('category_id'))
+    if category is not None:
+        skills = data.skills_by_category.get(category.id, ())
+        return JsonResponse([{'id': skill.id, 'name': skill.name} for skill in skills], safe=False)
     return JsonResponse([], safe=False)
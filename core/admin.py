@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import ContactMessage, FAQ
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import ContactMessage, FAQ, Job, OutboxEmail
+from .exports import export_action
+from .outbox import schedule_delivery
 
 
 @admin.register(ContactMessage)
@@ -10,7 +14,7 @@ class ContactMessageAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
     date_hierarchy = 'created_at'
     
-    actions = ['mark_as_read', 'mark_as_unread']
+    actions = ['mark_as_read', 'mark_as_unread', export_action('contact_messages')]
     
     def mark_as_read(self, request, queryset):
         queryset.update(is_read=True)
@@ -30,3 +34,56 @@ class FAQAdmin(admin.ModelAdmin):
     search_fields = ('question', 'answer')
     list_editable = ('is_active', 'order')
     ordering = ('order', 'created_at')
+
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'priority', 'attempts', 'run_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'dedup_key', 'last_error')
+    readonly_fields = ('created_at', 'finished_at', 'locked_by', 'locked_at', 'last_error')
+    date_hierarchy = 'created_at'
+    
+    actions = ['retry_jobs']
+    
+    def retry_jobs(self, request, queryset):
+        """Queue failed jobs again, except where a job with the same dedup key is queued"""
+        retry = dict(status=Job.QUEUED, attempts=0, run_at=timezone.now(), finished_at=None)
+        failed = queryset.filter(status=Job.FAILED)
+        count = failed.filter(dedup_key__isnull=True).update(**retry)
+        covered = 0
+        for job_id in failed.filter(dedup_key__isnull=False).order_by('-created_at').values_list('pk', flat=True):
+            try:
+                with transaction.atomic():
+                    count += Job.objects.filter(pk=job_id, status=Job.FAILED).update(**retry)
+            except IntegrityError:
+                covered += 1
+        message = f'{count} job(s) queued again.'
+        if covered:
+            message += f' {covered} job(s) skipped: a job with the same dedup key is already queued.'
+        self.message_user(request, message)
+    retry_jobs.short_description = "Retry selected failed jobs"
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'to', 'subject', 'status', 'attempts', 'send_after', 'sent_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('to', 'subject', 'last_error')
+    readonly_fields = ('created_at', 'sent_at', 'locked_by', 'locked_at', 'last_error')
+    date_hierarchy = 'created_at'
+    
+    actions = ['retry_emails']
+    
+    def retry_emails(self, request, queryset):
+        """Queue failed emails again"""
+        count = queryset.filter(status=OutboxEmail.FAILED).update(
+            status=OutboxEmail.QUEUED,
+            attempts=0,
+            send_after=timezone.now()
+        )
+        if count:
+            schedule_delivery()
+        self.message_user(request, f'{count} email(s) queued again.')
+    retry_emails.short_description = "Retry selected failed emails"
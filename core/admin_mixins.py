@@ -0,0 +1,173 @@
+"""
+Admin helpers for relations to large tables and for sharded models.
+
+Change forms use autocomplete widgets for users, artisans and reviews
+instead of a ``<select>`` with every row. ``RelatedLabelsMixin`` keeps the
+labels of those widgets, and of the small selects that remain, to a fixed
+number of queries: the ``__str__`` of reviews, artisans, skills and cities
+follows foreign keys, so the querysets that are rendered as labels load
+those relations with ``select_related``.
+
+``ShardedAdminMixin`` makes the admin of a model in
+``artisan_marketplace.sharding.SHARDED_MODELS`` work across shards: change
+lists, autocomplete results and ``delete_selected`` cover every shard, and
+the add, change, delete and history views run on the object's shard.
+"""
+from collections import Counter
+
+from django.contrib import admin
+from django.contrib.admin.actions import delete_selected
+from django.contrib.admin.utils import model_ngettext
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS
+
+from artisan_marketplace import sharding
+
+
+
+def is_autocomplete(request):
+    return request.path.endswith('/autocomplete/')
+
+
+class RelatedLabelsMixin:
+    # Relations followed by this model's __str__, loaded for autocomplete results
+    label_related = ()
+    # Prefix lookups for autocomplete; they can use indexes, unlike icontains
+    autocomplete_search_fields = ()
+    # Form field name -> relations followed by the __str__ of its choices
+    choice_related = {}
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.label_related and is_autocomplete(request):
+            queryset = queryset.select_related(*self.label_related)
+        return queryset
+
+    def get_search_fields(self, request):
+        if self.autocomplete_search_fields and is_autocomplete(request):
+            return self.autocomplete_search_fields
+        return super().get_search_fields(request)
+
+    def _choice_queryset(self, db_field, kwargs):
+        related = self.choice_related.get(db_field.name)
+        if related and 'queryset' not in kwargs:
+            kwargs['queryset'] = db_field.remote_field.model._default_manager.select_related(*related)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        self._choice_queryset(db_field, kwargs)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        self._choice_queryset(db_field, kwargs)
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
+
+class ShardedChangeList(ChangeList):
+    def get_results(self, request):
+        # The date hierarchy reads ``queryset`` afterwards, so it stays merged;
+        # actions filter ``root_queryset`` again, so it is only swapped here
+        root_queryset = self.root_queryset
+        self.queryset = sharding.scatter(self.queryset)
+        self.root_queryset = sharding.scatter(root_queryset)
+        try:
+            super().get_results(request)
+        finally:
+            self.root_queryset = root_queryset
+    
+    def get_filters(self, request):
+        filters = super().get_filters(request)
+        for spec in filters[0]:
+            if isinstance(spec, admin.AllValuesFieldListFilter):
+                # Values found on any shard
+                spec.lookup_choices = list(dict.fromkeys(sharding.scatter(spec.lookup_choices)))
+        return filters
+
+
+def delete_selected_on_shards(modeladmin, request, queryset):
+    """``delete_selected`` run on each shard, with one confirmation page"""
+    pages = []
+    for part in sharding.per_shard(queryset):
+        with sharding.on_shard(part.db):
+            page = delete_selected(modeladmin, request, part)
+        if page is not None:
+            pages.append(page)
+    if not pages:
+        return None
+
+    context = pages[0].context_data
+    for page in pages[1:]:
+        other = page.context_data
+        context['deletable_objects'][0].extend(other['deletable_objects'][0])
+        context['model_count'] = (Counter(dict(context['model_count'])) + Counter(dict(other['model_count']))).items()
+        context['perms_lacking'] = set(context['perms_lacking']) | set(other['perms_lacking'])
+        context['protected'] = list(context['protected']) + list(other['protected'])
+    context['queryset'] = sharding.scatter(queryset)
+    context['objects_name'] = str(model_ngettext(modeladmin.opts, context['queryset'].count()))
+    return pages[0]
+
+
+delete_selected_on_shards.allowed_permissions = delete_selected.allowed_permissions
+delete_selected_on_shards.short_description = delete_selected.short_description
+
+
+class ShardedAdminMixin:
+    def get_changelist(self, request, **kwargs):
+        return ShardedChangeList
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if 'delete_selected' in actions:
+            _, name, description = actions['delete_selected']
+            actions[name] = (delete_selected_on_shards, name, description)
+        return actions
+
+    def get_search_results(self, request, queryset, search_term):
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if is_autocomplete(request):
+            if may_have_duplicates:
+                queryset = queryset.distinct()
+            return sharding.scatter(queryset), False
+        return queryset, may_have_duplicates
+
+    def get_object(self, request, object_id, from_field=None):
+        queryset = self.get_queryset(request)
+        field = self.model._meta.pk if from_field is None else self.model._meta.get_field(from_field)
+        try:
+            object_id = field.to_python(object_id)
+        except (ValidationError, ValueError):
+            return None
+        found = sharding.scatter(queryset.filter(**{field.name: object_id}))[:1]
+        return found[0] if found else None
+
+    def _shard(self, request, object_id=None):
+        """Shard the view of ``object_id``, or of the object being added, works on"""
+        if not sharding.is_enabled():
+            return None
+        if object_id is not None:
+            obj = self.get_object(request, object_id)
+            return obj._state.db if obj is not None else None
+        # Without a valid parent nothing is saved, so any shard will do
+        parent = sharding.SHARDED_MODELS[self.model._meta.label_lower]
+        value = request.POST.get(parent)
+        return (value and sharding.shard_for_lookups(self.model, {parent: value})) or DEFAULT_DB_ALIAS
+
+    def _on_shard(self, alias, view, *args, **kwargs):
+        if alias is None:
+            return view(*args, **kwargs)
+        with sharding.on_shard(alias):
+            return view(*args, **kwargs)
+
+    def add_view(self, request, form_url='', extra_context=None):
+        return self._on_shard(self._shard(request), super().add_view, request, form_url, extra_context)
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        return self._on_shard(
+            self._shard(request, object_id), super().change_view, request, object_id, form_url, extra_context
+        )
+
+    def delete_view(self, request, object_id, extra_context=None):
+        return self._on_shard(self._shard(request, object_id), super().delete_view, request, object_id, extra_context)
+
+    def history_view(self, request, object_id, extra_context=None):
+        return self._on_shard(self._shard(request, object_id), super().history_view, request, object_id, extra_context)
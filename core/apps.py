@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from artisan_marketplace import sharding
+
+        # Mirror global rows to the shards before other receivers read them there
+        sharding.install()
+
+        from . import querylog, signals  # noqa: F401
+
+        connection_created.connect(querylog.install)
@@ -0,0 +1,98 @@
+"""
+Cached statistics for public pages.
+
+The homepage, about, how-it-works, join and success-stories pages show the
+same counts and averages. These are computed once and kept in the cache
+for a few minutes; ``core.warmup`` fills them before a worker takes
+traffic. Categories, states and cities live in ``core.reference``.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Q
+
+from artisan_marketplace.sharding import count_by
+
+from . import reference
+
+STATS_TIMEOUT = getattr(settings, 'SITE_STATS_TIMEOUT', 60 * 5)
+HOMEPAGE_TIMEOUT = getattr(settings, 'HOMEPAGE_CACHE_TIMEOUT', 60 * 2)
+
+STATS_KEY = 'core:site_stats'
+HOMEPAGE_KEY = 'core:homepage'
+
+
+def _cached(key, build, timeout, refresh=False):
+    value = None if refresh else cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout)
+    return value
+
+
+def _build_stats():
+    from artisans.models import ArtisanProfile, Category
+    from reviews.models import Review
+
+    reviews = Review.objects.filter(is_hidden=False).aggregate(
+        total=Count('pk'),
+        average=Avg('rating'),
+        five_star=Count('pk', filter=Q(rating=5)),
+    )
+    return {
+        'total_artisans': ArtisanProfile.objects.filter(is_verified=True).count(),
+        'total_categories': Category.objects.count(),
+        'total_reviews': reviews['total'],
+        'avg_rating': reviews['average'] or 0,
+        'five_star_reviews': reviews['five_star'],
+    }
+
+
+def site_stats(refresh=False):
+    """Platform-wide counts shown on the marketing pages"""
+    return _cached(STATS_KEY, _build_stats, STATS_TIMEOUT, refresh)
+
+
+def _build_homepage():
+    from artisans.models import ArtisanProfile
+    from reviews.models import Review
+
+    # Top 6 categories by artisan count, counted on every shard
+    artisan_counts = count_by(ArtisanProfile.objects.all(), 'category')
+    featured_categories = sorted(
+        (
+            dict(category._asdict(), artisan_count=artisan_counts.get(category.id, 0))
+            for category in reference.get().categories
+        ),
+        key=lambda category: -category['artisan_count'],
+    )
+
+    # Top-rated artisans (at least 4.0 rating with 3+ reviews)
+    top_artisans = ArtisanProfile.objects.filter(
+        is_verified=True,
+        user__is_active=True
+    ).select_related('user', 'category').annotate(
+        avg_rating=Avg('reviews__rating', filter=Q(reviews__is_hidden=False)),
+        review_count=Count('reviews', filter=Q(reviews__is_hidden=False))
+    ).filter(
+        avg_rating__gte=4.0,
+        review_count__gte=3
+    ).order_by('-avg_rating', '-review_count', '-pk')
+
+    recent_reviews = Review.objects.filter(
+        is_hidden=False
+    ).select_related(
+        'client', 'artisan__user'
+    ).order_by('-created_at')
+
+    return {
+        'featured_categories': list(featured_categories[:6]),
+        'top_artisans': list(top_artisans[:8]),
+        'recent_reviews': list(recent_reviews[:6]),
+    }
+
+
+def homepage(refresh=False):
+    """Featured categories, top-rated artisans and recent reviews"""
+    return _cached(HOMEPAGE_KEY, _build_homepage, HOMEPAGE_TIMEOUT, refresh)
+
@@ -0,0 +1,205 @@
+"""
+Streaming CSV and JSON Lines exports.
+
+Each export is a ``values()`` projection read with ``.iterator()``, so rows
+are never materialized as model instances and memory use does not grow
+with the table. Rows are written in chunks of ``CHUNK_SIZE``; artisan skills
+are fetched once per chunk. With ``compress=True`` the output is gzipped on
+the fly.
+"""
+
+import csv
+import zlib
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.db.models import Avg, Count, Q
+
+from artisan_marketplace import sharding
+
+CHUNK_SIZE = 2000
+FORMATS = ('csv', 'jsonl')
+
+
+class Export:
+    """A named projection of a model with optional per-chunk enrichment"""
+
+    def __init__(self, name, get_queryset, fields, enrich=None):
+        self.name = name
+        self.get_queryset = get_queryset
+        self.fields = fields
+        self.enrich = enrich
+
+    def columns(self):
+        return [column for column, _ in self.fields]
+
+    def rows(self, queryset=None, chunk_size=CHUNK_SIZE):
+        """Yield chunks of row dicts keyed by column name"""
+        queryset = self.get_queryset(queryset)
+        lookups = [lookup for _, lookup in self.fields if lookup]
+        chunk = []
+        for part in sharding.per_shard(queryset):
+            for values in part.values(*lookups).order_by('pk').iterator(chunk_size=chunk_size):
+                chunk.append({column: values.get(lookup) for column, lookup in self.fields})
+                if len(chunk) == chunk_size:
+                    yield self._finish(chunk)
+                    chunk = []
+        if chunk:
+            yield self._finish(chunk)
+
+    def _finish(self, chunk):
+        if self.enrich is not None:
+            self.enrich(chunk)
+        return chunk
+
+
+def _artisans(queryset):
+    from artisans.models import ArtisanProfile
+
+    if queryset is None:
+        queryset = ArtisanProfile.objects.all()
+    return queryset.annotate(
+        review_count=Count('reviews', filter=Q(reviews__is_hidden=False)),
+        avg_rating=Avg('reviews__rating', filter=Q(reviews__is_hidden=False)),
+    )
+
+
+def _enrich_artisans(chunk):
+    """Add skills with one query per chunk and round ratings"""
+    from artisans.models import ArtisanProfile
+
+    skills = defaultdict(list)
+    for alias, ids in sharding.group_ids(ArtisanProfile, (row['id'] for row in chunk)).items():
+        for artisan_id, name in ArtisanProfile.skills.through.objects.using(alias).filter(
+            artisanprofile_id__in=ids
+        ).order_by('skill__name').values_list('artisanprofile_id', 'skill__name'):
+            skills[artisan_id].append(name)
+    for row in chunk:
+        row['skills'] = '; '.join(skills[row['id']])
+        if row['average_rating'] is not None:
+            row['average_rating'] = round(row['average_rating'], 2)
+
+
+def _reviews(queryset):
+    from reviews.models import Review
+
+    return Review.objects.all() if queryset is None else queryset
+
+
+def _contact_messages(queryset):
+    from .models import ContactMessage
+
+    return ContactMessage.objects.all() if queryset is None else queryset
+
+
+EXPORTS = {
+    export.name: export for export in (
+        Export('artisans', _artisans, [
+            ('id', 'pk'),
+            ('username', 'user__username'),
+            ('first_name', 'user__first_name'),
+            ('last_name', 'user__last_name'),
+            ('email', 'user__email'),
+            ('phone_number', 'user__phone_number'),
+            ('category', 'category__name'),
+            ('state', 'state__name'),
+            ('city', 'city__name'),
+            ('hourly_rate', 'hourly_rate'),
+            ('years_of_experience', 'years_of_experience'),
+            ('availability', 'availability'),
+            ('is_verified', 'is_verified'),
+            ('profile_views', 'profile_views'),
+            ('total_reviews', 'review_count'),
+            ('average_rating', 'avg_rating'),
+            ('skills', None),
+            ('created_at', 'created_at'),
+        ], enrich=_enrich_artisans),
+        Export('reviews', _reviews, [
+            ('id', 'pk'),
+            ('artisan_id', 'artisan_id'),
+            ('artisan', 'artisan__user__username'),
+            ('client_id', 'client_id'),
+            ('client', 'client__username'),
+            ('rating', 'rating'),
+            ('title', 'title'),
+            ('comment', 'comment'),
+            ('would_recommend', 'would_recommend'),
+            ('open_report_count', 'open_report_count'),
+            ('is_hidden', 'is_hidden'),
+            ('created_at', 'created_at'),
+        ]),
+        Export('contact_messages', _contact_messages, [
+            ('id', 'pk'),
+            ('name', 'name'),
+            ('email', 'email'),
+            ('subject', 'subject'),
+            ('message', 'message'),
+            ('is_read', 'is_read'),
+            ('created_at', 'created_at'),
+        ]),
+    )
+}
+
+
+class _Buffer:
+    """File-like object that hands back what is written to it"""
+
+    def write(self, value):
+        return value
+
+
+def _encode_csv(export, chunks):
+    writer = csv.writer(_Buffer())
+    yield writer.writerow(export.columns())
+    for chunk in chunks:
+        yield ''.join(writer.writerow([row[column] for column in export.columns()]) for row in chunk)
+
+
+def _encode_jsonl(export, chunks):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for chunk in chunks:
+        yield ''.join(encoder.encode(row) + '\n' for row in chunk)
+
+
+def _gzip(parts):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for part in parts:
+        data = compressor.compress(part)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(name, fmt='csv', compress=False, queryset=None, chunk_size=CHUNK_SIZE):
+    """Yield the encoded export ``name`` as bytes"""
+    export = EXPORTS[name]
+    encode = _encode_csv if fmt == 'csv' else _encode_jsonl
+    parts = (part.encode() for part in encode(export, export.rows(queryset, chunk_size)))
+    return _gzip(parts) if compress else parts
+
+
+def export_filename(name, fmt, compress=False):
+    return f'{name}.{fmt}.gz' if compress else f'{name}.{fmt}'
+
+
+def content_type(fmt):
+    return 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+
+
+def export_response(name, fmt='csv', compress=False, queryset=None):
+    """Return a streaming attachment response for the export ``name``"""
+    response = StreamingHttpResponse(
+        stream_export(name, fmt, compress=compress, queryset=queryset),
+        content_type='application/gzip' if compress else content_type(fmt),
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(name, fmt, compress)}"'
+    return response
+
+
+def export_action(name):
+    """Admin action streaming the selected rows as CSV"""
+    def export_selected(modeladmin, request, queryset):
+        return export_response(name, queryset=queryset)
+    export_selected.short_description = "Export selected as CSV"
+    return export_selected
@@ -0,0 +1,98 @@
+"""
+Artisan search filters shared by the listing page and the JSON API.
+"""
+
+from decimal import Decimal, InvalidOperation
+
+from artisans.models import ArtisanListing
+
+FILTER_PARAMS = (
+    'search', 'category', 'state', 'city', 'min_rate', 'max_rate',
+    'min_rating', 'verified_only',
+)
+
+# Longer searches are cut, as the suggest API cuts ``q``
+MAX_SEARCH_LENGTH = 100
+
+SORTS = {
+    'newest': ('-created_at', '-pk'),
+    'rating': ('-avg_rating', '-review_count', '-pk'),
+    'price_low': ('hourly_rate', 'pk'),
+    'price_high': ('-hourly_rate', '-pk'),
+}
+
+
+def listed_cards():
+    """Listed artisans as flat ``ArtisanListing`` rows, for the list page and the API"""
+    return ArtisanListing.objects.filter(is_listed=True)
+
+
+def _search(params):
+    return params.get('search', '')[:MAX_SEARCH_LENGTH].strip()
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _decimal(value):
+    try:
+        return Decimal(value)
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+
+
+def filter_artisans(artisans, params):
+    """Apply the search filters in ``params`` (a QueryDict or dict) to ``listed_cards()``"""
+    search_query = _search(params)
+    if search_query:
+        artisans = artisans.filter(search_text__contains=search_query.lower())
+
+    for param, lookup in (('category', 'category_id'), ('state', 'state_id'), ('city', 'city_id')):
+        value = _int(params.get(param))
+        if value is not None:
+            artisans = artisans.filter(**{lookup: value})
+
+    for param, lookup in (
+        ('min_rate', 'hourly_rate__gte'),
+        ('max_rate', 'hourly_rate__lte'),
+        ('min_rating', 'avg_rating__gte'),
+    ):
+        value = _decimal(params.get(param))
+        if value is not None:
+            artisans = artisans.filter(**{lookup: value})
+
+    if params.get('verified_only'):
+        artisans = artisans.filter(is_verified=True)
+
+    return artisans
+
+
+def sort_artisans(artisans, sort_by):
+    return artisans.order_by(*SORTS.get(sort_by, SORTS['newest']))
+
+
+def search_artisans(artisans, params):
+    """
+    Filter ``artisans`` by ``params``. When a search matches nothing, retry
+    it spelling-corrected; returns ``(artisans, corrected_search_or_None)``.
+    """
+    from . import spelling
+
+    filtered = filter_artisans(artisans, params)
+    search_query = _search(params)
+    if not search_query or filtered.exists():
+        return filtered, None
+
+    corrected = spelling.correct(search_query)
+    if not corrected:
+        return filtered, None
+    params = params.copy()
+    params['search'] = corrected
+    retried = filter_artisans(artisans, params)
+    if retried.exists():
+        return retried, corrected
+    return filtered, None
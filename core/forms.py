@@ -1,4 +1,5 @@
 from django import forms
+from . import reference
 from .models import ContactMessage
 
 
@@ -40,19 +41,17 @@ class ArtisanSearchForm(forms.Form):
         })
     )
 
-    category = forms.ModelChoiceField(
-        queryset=None,
+    category = forms.TypedChoiceField(
+        coerce=int,
         required=False,
-        empty_label="All Categories",
         widget=forms.Select(attrs={
             'class': 'w-full px-3 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-lime-500'
         })
     )
 
-    state = forms.ModelChoiceField(
-        queryset=None,
+    state = forms.TypedChoiceField(
+        coerce=int,
         required=False,
-        empty_label="All States",
         widget=forms.Select(attrs={
             'class': 'w-full px-3 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-lime-500'
         })
@@ -98,7 +97,6 @@ class ArtisanSearchForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        from artisans.models import Category, State
-
-        self.fields['category'].queryset = Category.objects.all()
-        self.fields['state'].queryset = State.objects.all()
\ No newline at end of file
+        data = reference.get()
+        self.fields['category'].choices = [('', 'All Categories')] + [(row.id, row.name) for row in data.categories]
+        self.fields['state'].choices = [('', 'All States')] + [(row.id, row.name) for row in data.states]
\ No newline at end of file
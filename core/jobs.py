@@ -0,0 +1,335 @@
+"""
+Database-backed job queue.
+
+Decorate a function in an app's ``tasks`` module with ``@task`` and call
+``func.delay(**kwargs)`` (or ``func.schedule(...)`` for priorities, delays
+and dedup keys) to run it later in ``manage.py run_jobs``. Jobs are rows of
+``core.Job``, so enqueueing inside a transaction only takes effect if the
+transaction commits. Keyword arguments must be JSON serializable.
+
+A job with a ``dedup_key`` is not enqueued again while another job with the
+same key is still queued, which coalesces bursts of identical work; the
+queued job then runs at the earlier of the two times.
+Failed jobs are retried with exponential backoff up to ``max_attempts``.
+
+A task declared with ``@task(every=seconds)`` is periodic: the worker keeps
+one run of it queued, due ``every`` seconds after the previous run finished,
+whether that run succeeded or failed for good.
+
+With ``settings.JOBS_EAGER = True`` jobs run inline instead.
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from . import querylog
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = getattr(settings, 'JOBS_RETRY_DELAY', 30)
+LOCK_TIMEOUT = getattr(settings, 'JOBS_LOCK_TIMEOUT', 60 * 15)
+PERIODIC_CHECK = getattr(settings, 'JOBS_PERIODIC_CHECK', 60)
+# Inserts of a deduplicated job whose queued duplicate keeps being claimed
+ENQUEUE_ATTEMPTS = 3
+
+_registry = {}
+_discovered = False
+
+
+class Task:
+    """A function that can be run later by the job worker"""
+
+    def __init__(self, func, priority=0, max_attempts=3, every=None):
+        self.func = func
+        self.name = f'{func.__module__}.{func.__name__}'
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.every = every
+        self.__doc__ = func.__doc__
+        _registry[self.name] = self
+
+    def __call__(self, **kwargs):
+        return self.func(**kwargs)
+
+    def delay(self, **kwargs):
+        """Enqueue the task with default options"""
+        return self.schedule(kwargs)
+
+    def schedule(self, kwargs=None, priority=None, countdown=None, run_at=None, dedup_key=None):
+        """Enqueue the task, optionally delayed by ``countdown`` seconds or until ``run_at``"""
+        return enqueue(
+            self.name,
+            kwargs,
+            priority=self.priority if priority is None else priority,
+            countdown=countdown,
+            run_at=run_at,
+            dedup_key=dedup_key,
+            max_attempts=self.max_attempts,
+        )
+
+
+def task(func=None, *, priority=0, max_attempts=3, every=None):
+    """Register ``func`` as a task, usable as ``@task`` or ``@task(priority=...)``"""
+    if func is None:
+        return lambda func: Task(func, priority=priority, max_attempts=max_attempts, every=every)
+    return Task(func, priority=priority, max_attempts=max_attempts, every=every)
+
+
+def _discover():
+    global _discovered
+    if not _discovered:
+        autodiscover_modules('tasks')
+        _discovered = True
+
+
+def get_task(name):
+    if name not in _registry:
+        _discover()
+    return _registry.get(name)
+
+
+def schedule_periodic():
+    """Queue the next run of each periodic task that has none queued or running"""
+    _discover()
+    scheduled = 0
+    for periodic in _registry.values():
+        if periodic.every is None:
+            continue
+        if Job.objects.filter(name=periodic.name, status__in=[Job.QUEUED, Job.RUNNING]).exists():
+            continue
+        last = Job.objects.filter(
+            name=periodic.name,
+            finished_at__isnull=False
+        ).order_by('-finished_at').values_list('finished_at', flat=True).first()
+        run_at = timezone.now()
+        if last is not None:
+            run_at = max(run_at, last + timedelta(seconds=periodic.every))
+        periodic.schedule(run_at=run_at, dedup_key=periodic.name)
+        scheduled += 1
+    return scheduled
+
+
+def enqueue(name, kwargs=None, priority=0, countdown=None, run_at=None,
+            dedup_key=None, max_attempts=3):
+    """Store a job for task ``name``; returns the job, or the queued duplicate"""
+    kwargs = kwargs or {}
+    if getattr(settings, 'JOBS_EAGER', False):
+        get_task(name)(**kwargs)
+        return None
+
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=countdown or 0)
+    job = Job(
+        name=name,
+        kwargs=kwargs,
+        priority=priority,
+        run_at=run_at,
+        dedup_key=dedup_key,
+        max_attempts=max_attempts,
+    )
+    if dedup_key is None:
+        job.save()
+        return job
+    for attempt in range(1, ENQUEUE_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                job.save()
+            return job
+        except IntegrityError:
+            queued = Job.objects.filter(dedup_key=dedup_key, status=Job.QUEUED).first()
+            if queued is not None:
+                break
+            # Claimed by a worker since the insert failed; it may have read
+            # its data already, so this job still has to run
+            if attempt == ENQUEUE_ATTEMPTS:
+                raise
+    if run_at < queued.run_at:
+        Job.objects.filter(pk=queued.pk, status=Job.QUEUED).update(run_at=run_at)
+        queued.run_at = run_at
+    return queued
+
+
+def run_job(job_id):
+    """Run one claimed job and record the outcome"""
+    close_old_connections()
+    token = None
+    try:
+        job = Job.objects.get(pk=job_id)
+        func = get_task(job.name)
+        token = querylog.current_view.set(f'job {job.name}')
+        try:
+            if func is None:
+                raise LookupError(f'Unknown task {job.name}')
+            func(**job.kwargs)
+        except Exception:
+            _record_failure(job, traceback.format_exc(), retry=func is not None)
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.DONE,
+                attempts=job.attempts + 1,
+                finished_at=timezone.now(),
+                locked_by='',
+            )
+    finally:
+        if token is not None:
+            querylog.current_view.reset(token)
+        querylog.flush_if_due()
+        close_old_connections()
+
+
+def _record_failure(job, error, retry=True):
+    attempts = job.attempts + 1
+    logger.warning('Job %s (%s) failed on attempt %s:\n%s', job.pk, job.name, attempts, error)
+    if retry and attempts < job.max_attempts:
+        try:
+            with transaction.atomic():
+                Job.objects.filter(pk=job.pk).update(
+                    status=Job.QUEUED,
+                    attempts=attempts,
+                    last_error=error,
+                    run_at=timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (attempts - 1)),
+                    locked_by='',
+                    locked_at=None,
+                )
+            return
+        except IntegrityError:
+            # A newer job with the same dedup key is queued and covers this one
+            error += '\nSuperseded by a queued job with the same dedup key.'
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.FAILED,
+        attempts=attempts,
+        last_error=error,
+        finished_at=timezone.now(),
+        locked_by='',
+    )
+
+
+class Worker:
+    """Claims due jobs and runs them in a thread or process pool"""
+
+    def __init__(self, concurrency=4, processes=False, poll_interval=1.0, stdout=None):
+        self.concurrency = concurrency
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.stdout = stdout
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def requeue_stale(self):
+        """Put back jobs whose worker died while running them"""
+        stale = Job.objects.filter(
+            status=Job.RUNNING,
+            locked_at__lt=timezone.now() - timedelta(seconds=LOCK_TIMEOUT),
+        )
+        queued_keys = Job.objects.filter(
+            status=Job.QUEUED,
+            dedup_key__isnull=False,
+        ).values('dedup_key')
+        # A queued job with the same dedup key already covers these
+        stale.filter(dedup_key__in=queued_keys).update(
+            status=Job.FAILED,
+            last_error='Lost by its worker and superseded by a queued job.',
+            finished_at=timezone.now(),
+        )
+        count = stale.update(status=Job.QUEUED, locked_by='', locked_at=None)
+        if count:
+            self.log(f'Requeued {count} stale job(s)')
+
+    def schedule_periodic(self):
+        count = schedule_periodic()
+        if count:
+            self.log(f'Queued {count} periodic job(s)')
+
+    def claim(self, limit):
+        """Mark up to ``limit`` due jobs as running by this worker"""
+        now = timezone.now()
+        ids = list(Job.objects.filter(
+            status=Job.QUEUED,
+            run_at__lte=now,
+        ).order_by('-priority', 'run_at').values_list('pk', flat=True)[:limit])
+        if not ids:
+            return []
+        Job.objects.filter(pk__in=ids, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            locked_by=self.name,
+            locked_at=now,
+        )
+        return list(Job.objects.filter(
+            pk__in=ids,
+            status=Job.RUNNING,
+            locked_by=self.name,
+        ).order_by('-priority', 'run_at').values_list('pk', flat=True))
+
+    def make_executor(self):
+        if self.processes:
+            # Children inherit the task registry; they must not share the
+            # parent's database connections, so all of them are forked
+            # now, while the parent has none open. With the fork context
+            # the first submit starts every process of the pool.
+            _discover()
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                max_workers=self.concurrency,
+                mp_context=multiprocessing.get_context('fork'),
+            )
+            executor.submit(os.getpid).result()
+            return executor
+        return ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def run(self, burst=False):
+        """Process jobs until stopped, or until none are due when ``burst``"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.requeue_stale()
+        last_requeue = time.monotonic()
+        self.schedule_periodic()
+        last_periodic = time.monotonic()
+        pending = set()
+
+        with self.make_executor() as executor:
+            while not self.stopping.is_set():
+                if time.monotonic() - last_requeue > LOCK_TIMEOUT / 2:
+                    self.requeue_stale()
+                    last_requeue = time.monotonic()
+                if time.monotonic() - last_periodic > PERIODIC_CHECK:
+                    self.schedule_periodic()
+                    last_periodic = time.monotonic()
+
+                free = self.concurrency - len(pending)
+                claimed = self.claim(free) if free else []
+                for job_id in claimed:
+                    pending.add(executor.submit(run_job, job_id))
+
+                if pending:
+                    done, pending = wait(pending, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception() is not None:
+                            logger.error('Job runner crashed: %s', future.exception())
+                elif burst:
+                    break
+                else:
+                    self.stopping.wait(self.poll_interval)
+
+            wait(pending)
+        self.log('Worker stopped')
@@ -0,0 +1,442 @@
+"""
+HTTP load generator replaying marketplace traffic mixes.
+
+Unlike the Django test client, requests go over real sockets to a running
+server, so the WSGI server, the full middleware stack and WhiteNoise are
+part of every measurement. Each virtual user is an asyncio task with its own
+keep-alive connection and cookie jar. Users that run the review scenarios
+are logged in as a client first. Paths come from ``reverse()`` on the real
+URL names; ids, search words and accounts are sampled from the database
+before the run starts. ``manage.py load_test`` drives it.
+"""
+
+import asyncio
+import bisect
+import random
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from http.cookies import CookieError, SimpleCookie
+from urllib.parse import urlencode
+
+from django.urls import reverse
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+MAX_HEADER_LINES = 100
+
+
+class ProtocolError(Exception):
+    pass
+
+
+@dataclass
+class Response:
+    status: int
+    headers: dict
+    body: bytes
+
+
+class Session:
+    """One keep-alive HTTP/1.1 connection with a cookie jar"""
+
+    def __init__(self, host, port, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.cookies = {}
+        self.reader = self.writer = None
+
+    @property
+    def csrf_token(self):
+        return self.cookies.get('csrftoken', '')
+
+    async def request(self, method, path, data=None, headers=None):
+        # A reused connection may have been closed by the server meanwhile
+        reused = self.writer is not None
+        try:
+            return await asyncio.wait_for(self._request(method, path, data, headers), self.timeout)
+        except (ConnectionError, asyncio.IncompleteReadError, ProtocolError):
+            self.close()
+            if not reused:
+                raise
+        return await asyncio.wait_for(self._request(method, path, data, headers), self.timeout)
+
+    async def _request(self, method, path, data, headers):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        body = urlencode(data).encode() if data is not None else b''
+        lines = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            'User-Agent: marketplace-load-test',
+            'Accept-Encoding: identity',
+        ]
+        if self.cookies:
+            lines.append('Cookie: ' + '; '.join(f'{k}={v}' for k, v in self.cookies.items()))
+        if data is not None:
+            lines.append('Content-Type: application/x-www-form-urlencoded')
+            lines.append(f'Content-Length: {len(body)}')
+        lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ProtocolError('Connection closed before the response')
+        version, status = status_line.decode('latin-1').split(' ', 2)[:2]
+        response_headers = defaultdict(list)
+        for _ in range(MAX_HEADER_LINES):
+            line = (await self.reader.readline()).decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            response_headers[name.strip().lower()].append(value.strip())
+        else:
+            raise ProtocolError('Too many response headers')
+
+        if method == 'HEAD' or status in ('204', '304'):
+            body = b''
+        elif 'chunked' in ','.join(response_headers.get('transfer-encoding', ())):
+            body = await self._read_chunked()
+        elif 'content-length' in response_headers:
+            body = await self.reader.readexactly(int(response_headers['content-length'][0]))
+        else:
+            body = await self.reader.read()
+            response_headers['connection'] = ['close']
+
+        for header in response_headers.get('set-cookie', ()):
+            self._store_cookie(header)
+        connection = ','.join(response_headers.get('connection', ())).lower()
+        if 'close' in connection or version == 'HTTP/1.0':
+            self.close()
+        return Response(int(status), dict(response_headers), body)
+
+    async def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                break
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+        # Trailers end with an empty line
+        while (await self.reader.readline()).strip():
+            pass
+        return b''.join(chunks)
+
+    def _store_cookie(self, header):
+        try:
+            cookie = SimpleCookie(header)
+        except CookieError:
+            return
+        for name, morsel in cookie.items():
+            if morsel['max-age'] == '0' or not morsel.value:
+                self.cookies.pop(name, None)
+            else:
+                self.cookies[name] = morsel.value
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+@dataclass
+class TrafficData:
+    """Ids and words the scenarios pick from"""
+    artisan_ids: list
+    review_ids: list
+    category_ids: list
+    cities_by_state: dict
+    search_terms: list
+    clients: list = field(default_factory=list)
+
+
+def _sample(queryset, size):
+    """Up to ``size`` random rows of ``queryset``, drawn from every shard"""
+    from artisan_marketplace.sharding import per_shard
+
+    rows = [row for part in per_shard(queryset) for row in part.order_by('?')[:size]]
+    random.shuffle(rows)
+    return rows[:size]
+
+
+def load_traffic_data(sample=2000, clients=100):
+    from django.contrib.auth import get_user_model
+    from django.db.models import Count
+
+    from artisans.models import ArtisanProfile, Category, City, Skill, State
+    from reviews.models import Review
+
+    cities_by_state = {state_id: [] for state_id in State.objects.values_list('pk', flat=True)}
+    for city_id, state_id in City.objects.values_list('pk', 'state_id'):
+        cities_by_state[state_id].append(city_id)
+
+    # Popular skills are searched more often
+    search_terms = list(Skill.objects.annotate(n=Count('artisans')).order_by('-n').values_list(
+        'name', flat=True
+    )[:50])
+    search_terms += list(Category.objects.values_list('name', flat=True))
+
+    return TrafficData(
+        artisan_ids=_sample(ArtisanProfile.objects.filter(
+            is_verified=True,
+            user__is_active=True
+        ).values_list('pk', flat=True), sample),
+        review_ids=_sample(Review.objects.filter(is_hidden=False).values_list('pk', flat=True), sample),
+        category_ids=list(Category.objects.values_list('pk', flat=True)),
+        cities_by_state=cities_by_state,
+        search_terms=search_terms,
+        clients=list(get_user_model().objects.filter(
+            role='client',
+            is_active=True,
+            is_staff=False
+        ).order_by('pk').values_list('username', flat=True)[:clients]),
+    )
+
+
+class VirtualUser:
+    def __init__(self, generator, number, username=None):
+        self.generator = generator
+        self.data = generator.data
+        self.rng = random.Random(generator.seed * 100003 + number)
+        self.session = generator.new_session()
+        self.username = username
+
+    async def call(self, route, method, path, data=None, headers=None, expect=(200,), session=None):
+        """Send a request and record it under ``route``"""
+        session = session or self.session
+        started = time.perf_counter()
+        try:
+            response = await session.request(method, path, data, headers)
+        except asyncio.TimeoutError:
+            self.generator.record(route, started, 'timeout')
+            session.close()
+            return None
+        except (OSError, asyncio.IncompleteReadError, ProtocolError, ValueError) as exc:
+            self.generator.record(route, started, type(exc).__name__)
+            session.close()
+            return None
+        self.generator.record(route, started, response.status, response.status in expect)
+        return response
+
+    async def login(self, session=None):
+        session = session or self.session
+        path = reverse('accounts:login')
+        if not await self.call('GET accounts:login', 'GET', path, session=session):
+            return False
+        response = await self.call('POST accounts:login', 'POST', path, {
+            'csrfmiddlewaretoken': session.csrf_token,
+            'username': self.username,
+            'password': self.generator.password,
+        }, expect=(302,), session=session)
+        return response is not None and 'sessionid' in session.cookies
+
+
+# Scenarios. Each takes a virtual user and issues one or more requests.
+
+async def home(vu):
+    await vu.call('GET core:home', 'GET', reverse('core:home'))
+
+
+async def artisan_list(vu):
+    rng, data = vu.rng, vu.data
+    params = {}
+    if data.search_terms and rng.random() < 0.4:
+        params['search'] = rng.choice(data.search_terms)
+    if data.category_ids and rng.random() < 0.3:
+        params['category'] = rng.choice(data.category_ids)
+    if data.cities_by_state and rng.random() < 0.5:
+        state_id = rng.choice(list(data.cities_by_state))
+        params['state'] = state_id
+        if data.cities_by_state[state_id] and rng.random() < 0.5:
+            params['city'] = rng.choice(data.cities_by_state[state_id])
+    if rng.random() < 0.2:
+        params['min_rating'] = rng.choice((3, 4))
+    if rng.random() < 0.3:
+        params['sort_by'] = rng.choice(('rating', 'price_low', 'price_high'))
+    if rng.random() < 0.2:
+        params['page'] = rng.randint(2, 4)
+    path = reverse('core:artisan_list')
+    await vu.call('GET core:artisan_list', 'GET', f'{path}?{urlencode(params)}' if params else path)
+
+
+async def artisan_detail(vu):
+    artisan_id = vu.rng.choice(vu.data.artisan_ids)
+    await vu.call('GET core:artisan_detail', 'GET', reverse('core:artisan_detail', args=[artisan_id]))
+
+
+async def add_review(vu):
+    artisan_id = vu.rng.choice(vu.data.artisan_ids)
+    # Redirects back to the profile, also when the client already reviewed
+    await vu.call('POST reviews:add_review', 'POST', reverse('reviews:add_review', args=[artisan_id]), {
+        'csrfmiddlewaretoken': vu.session.csrf_token,
+        'rating': vu.rng.choices((1, 2, 3, 4, 5), (1, 1, 2, 5, 8))[0],
+        'title': 'Load test review',
+        'comment': 'Written by the load generator.',
+        'would_recommend': 'on',
+    }, expect=(302,))
+
+
+async def mark_helpful(vu):
+    review_id = vu.rng.choice(vu.data.review_ids)
+    await vu.call(
+        'POST reviews:mark_helpful', 'POST', reverse('reviews:mark_helpful', args=[review_id]),
+        {'is_helpful': 'true' if vu.rng.random() < 0.8 else 'false'},
+        headers={'X-CSRFToken': vu.session.csrf_token, 'X-Requested-With': 'XMLHttpRequest'},
+    )
+
+
+async def login(vu):
+    """A visitor signing in from a new browser session"""
+    session = vu.generator.new_session()
+    try:
+        await vu.login(session)
+    finally:
+        session.close()
+
+
+@dataclass
+class Scenario:
+    run: object
+    weight: float
+    needs: tuple = ()
+    writes: bool = False
+
+
+SCENARIOS = {
+    'home': Scenario(home, 20),
+    'artisan_list': Scenario(artisan_list, 35),
+    'artisan_detail': Scenario(artisan_detail, 30, needs=('artisan_ids',)),
+    'add_review': Scenario(add_review, 2, needs=('artisan_ids', 'clients'), writes=True),
+    'mark_helpful': Scenario(mark_helpful, 8, needs=('review_ids', 'clients'), writes=True),
+    'login': Scenario(login, 5, needs=('clients',)),
+}
+
+LOGGED_IN = ('add_review', 'mark_helpful')
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.errors = Counter()
+        self.statuses = Counter()
+
+    def add(self, milliseconds, status, ok):
+        self.latencies.append(milliseconds)
+        self.buckets[bisect.bisect_left(BUCKETS_MS, milliseconds)] += 1
+        self.statuses[status] += 1
+        if not ok:
+            self.errors[status] += 1
+
+    def percentile(self, fraction):
+        ordered = sorted(self.latencies)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self, elapsed):
+        count = len(self.latencies)
+        return {
+            'requests': count,
+            'rps': count / elapsed if elapsed else 0.0,
+            'errors': sum(self.errors.values()),
+            'error_rate': sum(self.errors.values()) / count if count else 0.0,
+            'statuses': {str(status): n for status, n in self.statuses.items()},
+            'p50_ms': self.percentile(0.5),
+            'p90_ms': self.percentile(0.9),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': max(self.latencies, default=0.0),
+            'histogram': dict(zip([f'<={bound}' for bound in BUCKETS_MS] + [f'>{BUCKETS_MS[-1]}'], self.buckets)),
+        }
+
+
+class LoadGenerator:
+    def __init__(self, host, port, data, users=10, duration=30, max_requests=None,
+                 weights=None, think_time=0.0, ramp_up=0.0, seed=0,
+                 password='password123', timeout=30):
+        self.host = host
+        self.port = port
+        self.data = data
+        self.users = users
+        self.duration = duration
+        self.max_requests = max_requests
+        self.think_time = think_time
+        self.ramp_up = ramp_up
+        self.seed = seed
+        self.password = password
+        self.timeout = timeout
+        self.stats = defaultdict(RouteStats)
+        self.sent = 0
+        self.elapsed = 0.0
+
+        weights = weights or {name: scenario.weight for name, scenario in SCENARIOS.items()}
+        weights = {name: weight for name, weight in weights.items() if weight > 0}
+        self.scenarios = {
+            name: weight for name, weight in weights.items()
+            if all(getattr(data, need) for need in SCENARIOS[name].needs)
+        }
+        self.skipped = sorted(set(weights) - set(self.scenarios))
+        if not self.scenarios:
+            raise ValueError('No scenario can run against this database')
+
+    def new_session(self):
+        return Session(self.host, self.port, self.timeout)
+
+    def record(self, route, started, status, ok=False):
+        self.sent += 1
+        self.stats[route].add((time.perf_counter() - started) * 1000, status, ok)
+
+    def _done(self):
+        if self.max_requests is not None and self.sent >= self.max_requests:
+            return True
+        return time.monotonic() >= self.deadline
+
+    async def _user(self, number):
+        await asyncio.sleep(self.ramp_up * number / self.users)
+        clients = self.data.clients
+        username = clients[number % len(clients)] if clients else None
+        vu = VirtualUser(self, number, username)
+        names = list(self.scenarios)
+        # Users without a session only browse and sign in
+        needs_login = any(name in LOGGED_IN for name in names)
+        if needs_login and (username is None or not await vu.login()):
+            names = [name for name in names if name not in LOGGED_IN]
+        if not names:
+            return
+        weights = [self.scenarios[name] for name in names]
+        try:
+            while not self._done():
+                await SCENARIOS[vu.rng.choices(names, weights)[0]].run(vu)
+                if self.think_time:
+                    await asyncio.sleep(vu.rng.expovariate(1 / self.think_time))
+        finally:
+            vu.session.close()
+
+    async def run(self):
+        started = time.monotonic()
+        self.deadline = started + self.duration
+        await asyncio.gather(*(self._user(number) for number in range(self.users)))
+        self.elapsed = time.monotonic() - started
+        return self.report()
+
+    def report(self):
+        routes = {route: stats.summary(self.elapsed) for route, stats in sorted(self.stats.items())}
+        total = RouteStats()
+        for stats in self.stats.values():
+            total.latencies += stats.latencies
+            total.buckets = [a + b for a, b in zip(total.buckets, stats.buckets)]
+            total.statuses.update(stats.statuses)
+            total.errors.update(stats.errors)
+        return {
+            'elapsed': self.elapsed,
+            'users': self.users,
+            'scenarios': self.scenarios,
+            'skipped': self.skipped,
+            'routes': routes,
+            'total': total.summary(self.elapsed),
+        }
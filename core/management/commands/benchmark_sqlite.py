@@ -0,0 +1,123 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import OperationalError
+
+from artisan_marketplace.sqlite.base import immediate
+
+BACKENDS = [
+    ('stock', 'django.db.backends.sqlite3'),
+    ('tuned', 'artisan_marketplace.sqlite'),
+]
+
+
+def run_worker(alias, operations, seed, results):
+    """Run a mix of marketplace-like writes and reads against ``alias``"""
+    rng = random.Random(seed)
+    done = errors = 0
+    started = time.perf_counter()
+
+    for _ in range(operations):
+        counter_id = rng.randint(1, 100)
+        roll = rng.random()
+        try:
+            with connections[alias].cursor() as cursor:
+                if roll < 0.6:
+                    # Profile view counter, like ArtisanProfile.increment_views
+                    cursor.execute(
+                        'UPDATE bench_counter SET views = views + 1 WHERE id = %s',
+                        [counter_id],
+                    )
+                elif roll < 0.9:
+                    # Read-then-write transaction, like adding a review
+                    with immediate(using=alias):
+                        cursor.execute(
+                            'SELECT views FROM bench_counter WHERE id = %s',
+                            [counter_id],
+                        )
+                        cursor.fetchone()
+                        cursor.execute(
+                            'INSERT INTO bench_event (counter_id, payload) VALUES (%s, %s)',
+                            [counter_id, 'x' * 200],
+                        )
+                        cursor.execute(
+                            'UPDATE bench_counter SET events = events + 1 WHERE id = %s',
+                            [counter_id],
+                        )
+                else:
+                    cursor.execute(
+                        'SELECT COUNT(*) FROM bench_event WHERE counter_id = %s',
+                        [counter_id],
+                    )
+                    cursor.fetchone()
+            done += 1
+        except OperationalError:
+            errors += 1
+
+    connections[alias].close()
+    results.put((done, errors, time.perf_counter() - started))
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent write throughput of the stock and tuned SQLite backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=500,
+                            help='Operations per worker')
+
+    def setup_database(self, alias, engine, path):
+        connections.settings[alias] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {},
+            alias: {'ENGINE': engine, 'NAME': path},
+        })[alias]
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE bench_counter '
+                '(id INTEGER PRIMARY KEY, views INTEGER NOT NULL, events INTEGER NOT NULL)'
+            )
+            cursor.execute(
+                'CREATE TABLE bench_event '
+                '(id INTEGER PRIMARY KEY, counter_id INTEGER NOT NULL, payload TEXT NOT NULL)'
+            )
+            cursor.execute('CREATE INDEX bench_event_counter ON bench_event (counter_id)')
+            cursor.executemany(
+                'INSERT INTO bench_counter (id, views, events) VALUES (%s, 0, 0)',
+                [(i,) for i in range(1, 101)],
+            )
+        connections[alias].close()
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        operations = options['operations']
+        context = multiprocessing.get_context('fork')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name, engine in BACKENDS:
+                alias = f'benchmark_{name}'
+                self.setup_database(alias, engine, os.path.join(tmpdir, f'{name}.sqlite3'))
+
+                results = context.Queue()
+                processes = [
+                    context.Process(target=run_worker, args=(alias, operations, seed, results))
+                    for seed in range(workers)
+                ]
+                started = time.perf_counter()
+                for process in processes:
+                    process.start()
+                outcomes = [results.get() for _ in processes]
+                for process in processes:
+                    process.join()
+                elapsed = time.perf_counter() - started
+
+                done = sum(outcome[0] for outcome in outcomes)
+                errors = sum(outcome[1] for outcome in outcomes)
+                self.stdout.write(
+                    f'{name:>6}: {done / elapsed:8.1f} ops/s, '
+                    f'{done} ok, {errors} lock errors, {elapsed:.2f}s'
+                )
@@ -0,0 +1,163 @@
+import asyncio
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.loadgen import BUCKETS_MS, SCENARIOS, LoadGenerator, load_traffic_data
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = 'Replay a weighted marketplace traffic mix against a server and report latencies per route'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Server to load, e.g. http://127.0.0.1:8000; '
+                                          'by default one is started on a free port')
+        parser.add_argument('--server-workers', type=int, default=2,
+                            help='gunicorn workers for the started server')
+        parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+        parser.add_argument('--requests', type=int, help='Stop after this many requests')
+        parser.add_argument('--ramp-up', type=float, default=0, help='Seconds over which users start')
+        parser.add_argument('--think-time', type=float, default=0,
+                            help='Mean pause between a user\'s scenarios in seconds')
+        parser.add_argument('--scenario', action='append', default=[], metavar='NAME=WEIGHT',
+                            help=f'Override a scenario weight ({", ".join(SCENARIOS)})')
+        parser.add_argument('--read-only', action='store_true',
+                            help='Skip the scenarios that write reviews and votes')
+        parser.add_argument('--password', default='password123', help='Password of the client accounts')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout')
+        parser.add_argument('--json', dest='json_path', help='Also write the report to this file')
+
+    def scenario_weights(self, options):
+        weights = {name: scenario.weight for name, scenario in SCENARIOS.items()}
+        for item in options['scenario']:
+            name, _, weight = item.partition('=')
+            if name not in SCENARIOS:
+                raise CommandError(f'Unknown scenario {name!r}')
+            try:
+                weights[name] = float(weight)
+            except ValueError:
+                raise CommandError(f'Invalid weight in {item!r}')
+        if options['read_only']:
+            for name, scenario in SCENARIOS.items():
+                if scenario.writes:
+                    weights[name] = 0
+        return weights
+
+    def start_server(self, port, workers):
+        """Start gunicorn (or runserver without it) and wait until it accepts connections"""
+        if importlib.util.find_spec('gunicorn'):
+            command = [
+                sys.executable, '-m', 'gunicorn', 'artisan_marketplace.wsgi:application',
+                '--preload', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+            ]
+        else:
+            self.stderr.write('gunicorn is not installed, falling back to runserver')
+            command = [
+                sys.executable, str(settings.BASE_DIR / 'manage.py'),
+                'runserver', '--noreload', f'127.0.0.1:{port}',
+            ]
+        # A file rather than a pipe, so request logging never blocks the server
+        log = tempfile.TemporaryFile()
+        server = subprocess.Popen(
+            command, cwd=settings.BASE_DIR, env=os.environ.copy(),
+            stdout=subprocess.DEVNULL, stderr=log,
+        )
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                log.seek(0)
+                raise CommandError('Server exited on start:\n' + log.read().decode(errors='replace'))
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            except OSError:
+                time.sleep(0.2)
+            else:
+                return server
+        server.terminate()
+        raise CommandError('Server did not start within 60 seconds')
+
+    def handle(self, *args, **options):
+        weights = self.scenario_weights(options)
+        data = load_traffic_data()
+
+        server = None
+        if options['url']:
+            url = urlsplit(options['url'])
+            host, port = url.hostname, url.port or 80
+        else:
+            host, port = '127.0.0.1', free_port()
+            server = self.start_server(port, options['server_workers'])
+
+        try:
+            generator = LoadGenerator(
+                host, port, data,
+                users=options['users'],
+                duration=options['duration'],
+                max_requests=options['requests'],
+                weights=weights,
+                think_time=options['think_time'],
+                ramp_up=options['ramp_up'],
+                seed=options['seed'],
+                password=options['password'],
+                timeout=options['timeout'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        try:
+            report = asyncio.run(generator.run())
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(10)
+
+        self.print_report(report)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def print_report(self, report):
+        write = self.stdout.write
+        if report['skipped']:
+            write(f"Skipped scenarios without data: {', '.join(report['skipped'])}")
+        write(f"{report['users']} users for {report['elapsed']:.1f}s\n")
+
+        rows = list(report['routes'].items()) + [('total', report['total'])]
+        width = max(len(route) for route, _ in rows)
+        write(f"{'route':<{width}} {'reqs':>7} {'req/s':>8} {'err%':>6} "
+              f"{'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}  (ms)")
+        for route, stats in rows:
+            line = (
+                f"{route:<{width}} {stats['requests']:>7} {stats['rps']:>8.1f} "
+                f"{stats['error_rate'] * 100:>6.1f} {stats['p50_ms']:>8.1f} {stats['p90_ms']:>8.1f} "
+                f"{stats['p99_ms']:>8.1f} {stats['max_ms']:>8.1f}"
+            )
+            write(self.style.ERROR(line) if stats['errors'] else line)
+
+        labels = [f'<={bound}' for bound in BUCKETS_MS] + [f'>{BUCKETS_MS[-1]}']
+        write(f"\nLatency histogram (ms)\n{'route':<{width}} " + ' '.join(f'{label:>6}' for label in labels))
+        for route, stats in rows:
+            write(f'{route:<{width}} ' + ' '.join(f'{n:>6}' for n in stats['histogram'].values()))
+
+        failed = [(route, stats['statuses']) for route, stats in report['routes'].items() if stats['errors']]
+        if failed:
+            write('\nResponses of routes with errors')
+            for route, statuses in failed:
+                write(f'{route}: ' + ', '.join(f'{status} x{n}' for status, n in sorted(statuses.items())))
@@ -6,7 +6,6 @@ from core.models import FAQ
 from decimal import Decimal
 import random
 import os
-import requests
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 
@@ -19,6 +18,9 @@ class Command(BaseCommand):
     def download_profile_image(self, seed=None):
         """Download a random profile image from Lorem Picsum"""
         try:
+            # Only needed here, so the command loads without the network stack
+            import requests
+
             # Use Lorem Picsum for placeholder images
             # Adding seed for consistent images per artisan
             url = f"https://picsum.photos/300/300?random={seed or random.randint(1, 1000)}"
@@ -0,0 +1,31 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.outbox import BATCH_SIZE, RATE_PER_SECOND, Sender
+
+
+class Command(BaseCommand):
+    help = 'Send queued outbox emails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Emails sent over one SMTP connection')
+        parser.add_argument('--rate', type=float, default=RATE_PER_SECOND,
+                            help='Emails per second at most; 0 for no limit')
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help='Seconds to wait when no email is due')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no email is due')
+
+    def handle(self, *args, **options):
+        sender = Sender(
+            batch_size=options['batch_size'],
+            rate=options['rate'],
+            poll_interval=options['poll_interval'],
+            stdout=self.stdout,
+        )
+        signal.signal(signal.SIGTERM, sender.stop)
+        signal.signal(signal.SIGINT, sender.stop)
+        sender.run(burst=options['burst'])
+        self.stdout.write(f'Sent {sender.sent} email(s), {sender.failed} failed')
@@ -0,0 +1,28 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from artisan_marketplace import sharding
+
+
+class Command(BaseCommand):
+    help = 'Migrate the shard databases, start their id counters and copy the shared tables to them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebalance', action='store_true',
+                            help='Also move artisans stored on the wrong shard')
+
+    def handle(self, *args, **options):
+        if not sharding.is_enabled():
+            raise CommandError('No shards configured; set DATABASE_SHARD_NAMES')
+
+        for alias in sharding.shards()[1:]:
+            call_command('migrate', database=alias, interactive=False, verbosity=max(options['verbosity'] - 1, 0))
+            self.stdout.write(f'Migrated {alias}')
+
+        sharding.init_sequences()
+        fixed = sharding.repair(stdout=self.stdout)
+        self.stdout.write(f'Copied the shared tables and fixed {fixed} row(s)')
+
+        if options['rebalance']:
+            moved = sharding.rebalance(stdout=self.stdout)
+            self.stdout.write(self.style.SUCCESS(f'Moved {moved} artisan(s)'))
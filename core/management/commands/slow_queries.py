@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from core import querylog
+from core.models import QueryFingerprint, SlowQuery
+
+SORTS = {
+    'total': '-total_ms',
+    'mean': '-mean',
+    'max': '-max_ms',
+    'calls': '-calls',
+}
+
+
+class Command(BaseCommand):
+    help = 'Print the SQL fingerprints that take the most database time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=SORTS, default='total')
+        parser.add_argument('--limit', type=int, default=15)
+        parser.add_argument('--plans', action='store_true',
+                            help='Show the latest slow sample with its plan, view and stack')
+        parser.add_argument('--reset', action='store_true', help='Delete all collected statistics')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            SlowQuery.objects.all().delete()
+            QueryFingerprint.objects.all().delete()
+            self.stdout.write('Query statistics cleared.')
+            return
+
+        # Include what this process itself has not saved yet
+        querylog.flush()
+        fingerprints = QueryFingerprint.objects.annotate(
+            mean=F('total_ms') / F('calls')
+        ).order_by(SORTS[options['sort']])[:options['limit']]
+
+        labels = [f'<={bound}' for bound in querylog.BUCKETS_MS] + [f'>{querylog.BUCKETS_MS[-1]}']
+        for rank, row in enumerate(fingerprints, 1):
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{rank:>2}. {row.fingerprint}  {row.calls} calls, '
+                f'{row.total_ms / 1000:.2f} s total, {row.mean_ms:.2f} ms mean, {row.max_ms:.1f} ms max'
+            ))
+            self.stdout.write(f'    {row.sql[:500]}')
+            self.stdout.write('    ms: ' + '  '.join(
+                f'{label} {count}' for label, count in zip(labels, row.histogram) if count
+            ))
+
+            if options['plans']:
+                sample = row.slow_samples.first()
+                if sample is None:
+                    continue
+                self.stdout.write(f'    latest slow run: {sample.duration_ms:.1f} ms in {sample.view or "-"} '
+                                  f'at {sample.created_at:%Y-%m-%d %H:%M:%S}')
+                for label, text in (('plan', sample.plan), ('stack', sample.stack)):
+                    if text:
+                        self.stdout.write(f'    {label}:')
+                        for line in text.splitlines():
+                            self.stdout.write(f'      {line}')
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 
 
 class ContactMessage(models.Model):
@@ -34,3 +36,162 @@ class FAQ(models.Model):
     
     def __str__(self):
         return self.question
+
+
+
+class Job(models.Model):
+    """Deferred task stored in the database and run by ``manage.py run_jobs``"""
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=200, help_text="Dotted path of the task function")
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0, help_text="Higher runs first")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    dedup_key = models.CharField(
+        max_length=200,
+        blank=True,
+        null=True,
+        help_text="Only one queued job per key"
+    )
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-priority', 'run_at']
+        indexes = [
+            models.Index(fields=['status', 'run_at', 'priority']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=Q(status='queued'),
+                name='unique_queued_job_dedup_key',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.get_status_display()})"
+
+
+class QueryFingerprint(models.Model):
+    """Aggregated timings of one normalized SQL statement, kept by ``core.querylog``"""
+    
+    fingerprint = models.CharField(max_length=16, unique=True)
+    sql = models.TextField(help_text="Statement with literals and parameters replaced by ?")
+    calls = models.PositiveBigIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    histogram = models.JSONField(default=list, blank=True, help_text="Calls per latency bucket")
+    first_seen = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-total_ms']
+    
+    def __str__(self):
+        return f"{self.fingerprint}: {self.sql[:80]}"
+    
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.calls if self.calls else 0
+
+
+class SlowQuery(models.Model):
+    """One execution over ``SLOW_QUERY_MS`` with its plan and origin"""
+    
+    fingerprint = models.ForeignKey(QueryFingerprint, on_delete=models.CASCADE, related_name='slow_samples')
+    sql = models.TextField()
+    params = models.TextField(blank=True)
+    duration_ms = models.FloatField()
+    database = models.CharField(max_length=50)
+    view = models.CharField(max_length=200, blank=True)
+    stack = models.TextField(blank=True)
+    plan = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name_plural = 'slow queries'
+    
+    def __str__(self):
+        return f"{self.duration_ms:.0f} ms {self.sql[:80]}"
+
+
+class OutboxEmail(models.Model):
+    """Notification email stored with the change that caused it and sent by ``core.outbox``"""
+    
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+    
+    kind = models.CharField(max_length=50, help_text="Template the email was rendered from")
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['send_after']
+        indexes = [
+            models.Index(fields=['status', 'send_after']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} to {self.to} ({self.get_status_display()})"
+
+
+class ShardSequence(models.Model):
+    """Last primary key handed out for a sharded model, so ids are unique across shards"""
+    
+    name = models.CharField(max_length=100, unique=True)
+    last_id = models.PositiveBigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+
+class ShardLocation(models.Model):
+    """Shard holding one artisan or review, maintained by ``artisan_marketplace.sharding``"""
+    
+    model = models.CharField(max_length=100)
+    object_id = models.PositiveBigIntegerField()
+    shard = models.CharField(max_length=50)
+    
+    class Meta:
+        unique_together = ['model', 'object_id']
+    
+    def __str__(self):
+        return f"{self.model} {self.object_id} on {self.shard}"
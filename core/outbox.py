@@ -0,0 +1,256 @@
+"""
+Transactional outbox for notification emails.
+
+``queue_email()`` renders an email from ``templates/emails/<kind>.txt`` and
+``<kind>_subject.txt`` and stores it as an ``OutboxEmail`` row. Called inside
+the transaction of the change it reports, with ``using`` naming that
+change's database, the email exists exactly when the change does, and the
+request never waits for SMTP. With sharding, emails stored on other shards
+are moved to ``default`` by ``relay_emails()`` before each batch; one moved
+just before a crash may be sent twice, as with any at-least-once delivery.
+
+``Sender`` claims due emails in batches and sends each batch over one SMTP
+connection, at most ``EMAIL_RATE_PER_SECOND``. Temporary failures (4xx
+replies, dropped connections) are retried with exponential backoff up to
+``max_attempts``; permanent 5xx rejections fail the email at once. If the
+server cannot be reached the rest of the batch is put back untouched.
+
+Delivery runs in the ``core.tasks.send_outbox`` job, scheduled with each
+queued email and every few minutes, or in a dedicated
+``manage.py send_emails`` process. Emails
+are sent at least once: one whose sender died mid-send is retried after
+``EMAIL_LOCK_TIMEOUT``.
+"""
+
+import logging
+import os
+import smtplib
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Min
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from artisan_marketplace import sharding
+from artisan_marketplace.sqlite.base import immediate
+
+from .jobs import enqueue
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'EMAIL_BATCH_SIZE', 50)
+RATE_PER_SECOND = getattr(settings, 'EMAIL_RATE_PER_SECOND', 5)
+RETRY_DELAY = getattr(settings, 'EMAIL_RETRY_DELAY', 60)
+LOCK_TIMEOUT = getattr(settings, 'EMAIL_LOCK_TIMEOUT', 60 * 10)
+
+SEND_TASK = 'core.tasks.send_outbox'
+
+
+def schedule_delivery(run_at=None):
+    """Enqueue the delivery job; bursts of emails share one queued job"""
+    enqueue(SEND_TASK, run_at=run_at, dedup_key=SEND_TASK, priority=5, max_attempts=1)
+
+
+def queue_email(kind, to, context=None, using=DEFAULT_DB_ALIAS):
+    """
+    Store an email to ``to`` rendered from the ``kind`` templates in the
+    database ``using``; returns it, or None without an address.
+    """
+    if not to:
+        return None
+    context = dict(context or {}, site_name='ArtisanConnect')
+    email = OutboxEmail.objects.using(using).create(
+        kind=kind,
+        to=to,
+        subject=' '.join(render_to_string(f'emails/{kind}_subject.txt', context).split()),
+        body=render_to_string(f'emails/{kind}.txt', context),
+    )
+    if getattr(settings, 'JOBS_EAGER', False) or using != DEFAULT_DB_ALIAS:
+        # Eager jobs run inline, and jobs are stored on default; only deliver
+        # once the email is committed
+        transaction.on_commit(schedule_delivery, using=using)
+    else:
+        schedule_delivery()
+    return email
+
+
+def relay_emails(batch_size=BATCH_SIZE):
+    """Move the emails stored on shards other than default to default; returns the number moved"""
+    moved = 0
+    for alias in sharding.shards()[1:]:
+        while True:
+            with immediate(using=alias):
+                emails = list(OutboxEmail.objects.using(alias).select_for_update(
+                    skip_locked=True
+                ).order_by('pk')[:batch_size])
+                if not emails:
+                    break
+                ids = [email.pk for email in emails]
+                for email in emails:
+                    email.pk = None
+                    email._state.adding = True
+                # Copied first: a crash in between sends an email twice, never zero times
+                OutboxEmail.objects.using(DEFAULT_DB_ALIAS).bulk_create(emails)
+                OutboxEmail.objects.using(alias).filter(pk__in=ids).delete()
+            moved += len(emails)
+    return moved
+
+
+def _permanent(exc):
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code >= 500
+
+
+class Sender:
+    """Sends due outbox emails in batches over one SMTP connection each"""
+
+    def __init__(self, batch_size=BATCH_SIZE, rate=RATE_PER_SECOND, poll_interval=5.0, stdout=None):
+        self.batch_size = batch_size
+        self.rate = rate
+        self.poll_interval = poll_interval
+        self.stdout = stdout
+        self.name = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+        self.stopping = threading.Event()
+        self.sent = self.failed = 0
+        self._next_send = 0.0
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def requeue_stale(self):
+        """Put back emails whose sender died while sending them"""
+        count = OutboxEmail.objects.filter(
+            status=OutboxEmail.SENDING,
+            locked_at__lt=timezone.now() - timedelta(seconds=LOCK_TIMEOUT),
+        ).update(status=OutboxEmail.QUEUED, locked_by='', locked_at=None)
+        if count:
+            self.log(f'Requeued {count} stale email(s)')
+
+    def claim(self, limit):
+        """Mark up to ``limit`` due emails as being sent by this sender"""
+        now = timezone.now()
+        ids = list(OutboxEmail.objects.filter(
+            status=OutboxEmail.QUEUED,
+            send_after__lte=now,
+        ).order_by('send_after').values_list('pk', flat=True)[:limit])
+        if not ids:
+            return []
+        OutboxEmail.objects.filter(pk__in=ids, status=OutboxEmail.QUEUED).update(
+            status=OutboxEmail.SENDING,
+            locked_by=self.name,
+            locked_at=now,
+        )
+        return list(OutboxEmail.objects.filter(
+            pk__in=ids,
+            status=OutboxEmail.SENDING,
+            locked_by=self.name,
+        ).order_by('send_after'))
+
+    def throttle(self):
+        if not self.rate:
+            return
+        delay = self._next_send - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_send = max(self._next_send, time.monotonic()) + 1 / self.rate
+
+    def release(self, emails):
+        OutboxEmail.objects.filter(
+            pk__in=[email.pk for email in emails],
+            status=OutboxEmail.SENDING,
+            locked_by=self.name,
+        ).update(status=OutboxEmail.QUEUED, locked_by='', locked_at=None)
+
+    def record_failure(self, email, exc):
+        attempts = email.attempts + 1
+        error = f'{type(exc).__name__}: {exc}'
+        logger.warning('Email %s to %s failed on attempt %s: %s', email.pk, email.to, attempts, error)
+        update = {'attempts': attempts, 'last_error': error, 'locked_by': '', 'locked_at': None}
+        if not _permanent(exc) and attempts < email.max_attempts:
+            update.update(
+                status=OutboxEmail.QUEUED,
+                send_after=timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (attempts - 1)),
+            )
+        else:
+            update['status'] = OutboxEmail.FAILED
+            self.failed += 1
+        OutboxEmail.objects.filter(pk=email.pk).update(**update)
+
+    def send_batch(self):
+        """Send one claimed batch; returns the number of emails handled"""
+        relay_emails(self.batch_size)
+        emails = self.claim(self.batch_size)
+        if not emails:
+            return 0
+
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+        except (smtplib.SMTPException, OSError) as exc:
+            logger.warning('Cannot reach the mail server: %s', exc)
+            self.release(emails)
+            return 0
+
+        try:
+            for index, email in enumerate(emails):
+                if self.stopping.is_set():
+                    self.release(emails[index:])
+                    break
+                self.throttle()
+                message = EmailMessage(email.subject, email.body, to=[email.to], connection=connection)
+                try:
+                    # Reconnects if an earlier failure closed the connection
+                    connection.open()
+                    message.send()
+                except (smtplib.SMTPException, OSError) as exc:
+                    self.record_failure(email, exc)
+                    if not _permanent(exc):
+                        connection.close()
+                else:
+                    OutboxEmail.objects.filter(pk=email.pk).update(
+                        status=OutboxEmail.SENT,
+                        attempts=email.attempts + 1,
+                        sent_at=timezone.now(),
+                        locked_by='',
+                        locked_at=None,
+                    )
+                    self.sent += 1
+        finally:
+            connection.close()
+        return len(emails)
+
+    def run(self, burst=False):
+        """Send emails until stopped, or until none are due when ``burst``"""
+        self.requeue_stale()
+        last_requeue = time.monotonic()
+        while not self.stopping.is_set():
+            if time.monotonic() - last_requeue > LOCK_TIMEOUT / 2:
+                self.requeue_stale()
+                last_requeue = time.monotonic()
+            if self.send_batch():
+                continue
+            if burst:
+                break
+            self.stopping.wait(self.poll_interval)
+
+
+def schedule_retries():
+    """Schedule the delivery job for the earliest email still queued"""
+    due = OutboxEmail.objects.filter(status=OutboxEmail.QUEUED).aggregate(
+        due=Min('send_after')
+    )['due']
+    if due is not None:
+        # Emails still due now were put back because the server was unreachable
+        schedule_delivery(max(due, timezone.now() + timedelta(seconds=RETRY_DELAY)))
@@ -0,0 +1,256 @@
+"""
+On-demand request profiling for staff.
+
+A staff user who sends ``X-Profile: 1`` or adds ``?_profile=1`` to a URL
+gets that request profiled. A sampling thread records the stack of the
+request thread about every millisecond (in practice every GIL switch
+interval while Python code runs) and all SQL is timed through
+``connection.execute_wrapper``. ``?_profile=cprofile`` additionally runs
+the deterministic ``cProfile`` for exact call counts, at the price of
+inflating the times of call-heavy code.
+
+Each profile is written as JSON to ``PROFILES_ROOT`` and the newest
+``PROFILE_KEEP`` are kept. The staff pages under ``/profiles/`` list them
+and export the collapsed stacks (``a;b;c 12`` lines) that flamegraph.pl,
+speedscope and similar tools read.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import re
+import sys
+import sysconfig
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+PROFILES_ROOT = Path(getattr(settings, 'PROFILES_ROOT', settings.BASE_DIR / 'private' / 'profiles'))
+PROFILE_KEEP = getattr(settings, 'PROFILE_KEEP', 100)
+SAMPLE_INTERVAL = 0.001
+MAX_QUERIES = 2000
+TOP_FUNCTIONS = 40
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = '_profile'
+MODES = ('sample', 'cprofile')
+
+PROFILE_ID = re.compile(r'^[0-9]{14}-[0-9a-f]{8}$')
+
+_BASE_DIR = str(settings.BASE_DIR) + os.sep
+_STDLIB = sysconfig.get_paths()['stdlib'] + os.sep
+
+
+def _short_path(filename):
+    """Project- or stdlib-relative path, or the part after site-packages"""
+    for prefix in (_BASE_DIR, _STDLIB):
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    _, marker, rest = filename.rpartition('site-packages' + os.sep)
+    return rest if marker else filename
+
+
+def _label(code):
+    return f'{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})'
+
+
+class Sampler(threading.Thread):
+    """Count the stacks of one thread at a fixed interval"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+        self._labels = {}
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = self._labels.get(code)
+                if label is None:
+                    label = self._labels[code] = _label(code)
+                stack.append(label)
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.stacks[';'.join(stack)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class QueryLog:
+    """``execute_wrapper`` that times every query"""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+        self.dropped = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if len(self.queries) < MAX_QUERIES:
+                self.queries.append({
+                    'sql': sql,
+                    'ms': (time.perf_counter() - started) * 1000,
+                    'alias': self.alias,
+                    'many': many,
+                })
+            else:
+                self.dropped += 1
+
+
+def _sample_functions(stacks):
+    """Self and total sample counts per function"""
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    names = sorted(total, key=lambda name: (own[name], total[name]), reverse=True)[:TOP_FUNCTIONS]
+    return [{'function': name, 'self': own[name], 'total': total[name]} for name in names]
+
+
+def _cprofile_functions(profiler):
+    stats = pstats.Stats(profiler).stats
+    rows = []
+    for (filename, line, name), (_, calls, own, total, _) in stats.items():
+        rows.append({
+            'function': f'{name} ({_short_path(filename)}:{line})',
+            'calls': calls,
+            'self_ms': own * 1000,
+            'total_ms': total * 1000,
+        })
+    rows.sort(key=lambda row: row['self_ms'], reverse=True)
+    return rows[:TOP_FUNCTIONS]
+
+
+def profile_mode(request):
+    """The requested profiling mode, or None"""
+    value = request.GET.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER)
+    if not value or value in ('0', 'false'):
+        return None
+    return value if value in MODES else 'sample'
+
+
+def profile_request(request, get_response, mode):
+    """Run ``get_response(request)`` under the profiler and save the profile"""
+    sampler = Sampler(threading.get_ident())
+    profiler = cProfile.Profile() if mode == 'cprofile' else None
+    query_logs = [QueryLog(alias) for alias in connections]
+
+    with ExitStack() as stack:
+        for log in query_logs:
+            stack.enter_context(connections[log.alias].execute_wrapper(log))
+        sampler.start()
+        started = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            response = get_response(request)
+        finally:
+            if profiler:
+                profiler.disable()
+            elapsed = (time.perf_counter() - started) * 1000
+            sampler.stop()
+
+    queries = sorted(
+        (query for log in query_logs for query in log.queries),
+        key=lambda query: query['ms'], reverse=True
+    )
+    profile = {
+        'id': f'{timezone.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}',
+        'created_at': timezone.now().isoformat(),
+        'mode': mode,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'view': getattr(request.resolver_match, 'view_name', None),
+        'user': request.user.get_username(),
+        'status': response.status_code,
+        'duration_ms': elapsed,
+        'sql_count': len(queries) + sum(log.dropped for log in query_logs),
+        'sql_ms': sum(query['ms'] for query in queries),
+        'samples': sum(sampler.stacks.values()),
+        'functions': _sample_functions(sampler.stacks),
+        'cprofile': _cprofile_functions(profiler) if profiler else [],
+        'queries': queries,
+        'stacks': dict(sampler.stacks.most_common()),
+    }
+    save_profile(profile)
+    response['X-Profile-Id'] = profile['id']
+    return response
+
+
+def _path(profile_id):
+    return PROFILES_ROOT / f'{profile_id}.json'
+
+
+def save_profile(profile):
+    PROFILES_ROOT.mkdir(parents=True, exist_ok=True)
+    with open(_path(profile['id']), 'w') as f:
+        json.dump(profile, f)
+    # Ids start with a timestamp, so name order is age order
+    for old in sorted(PROFILES_ROOT.glob('*.json'))[:-PROFILE_KEEP]:
+        old.unlink(missing_ok=True)
+
+
+def load_profile(profile_id):
+    """The saved profile, or None"""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(_path(profile_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def recent_profiles(limit=50):
+    """Newest profiles without their query and stack lists"""
+    if not PROFILES_ROOT.is_dir():
+        return []
+    profiles = []
+    for path in sorted(PROFILES_ROOT.glob('*.json'), reverse=True)[:limit]:
+        profile = load_profile(path.stem)
+        if profile is not None:
+            profile.pop('queries')
+            profile.pop('stacks')
+            profile['functions'] = profile['functions'][:3]
+            profiles.append(profile)
+    return profiles
+
+
+def collapsed_stacks(profile):
+    """Stacks in the folded format of flamegraph.pl"""
+    return ''.join(f'{stack} {count}\n' for stack, count in profile['stacks'].items())
+
+
+class ProfilingMiddleware:
+    """Profile requests of staff users who ask for it"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = profile_mode(request)
+        if mode is None or not request.user.is_staff:
+            return self.get_response(request)
+        return profile_request(request, self.get_response, mode)
@@ -0,0 +1,267 @@
+"""
+Slow-query log with query fingerprints.
+
+With ``QUERY_LOG_ENABLED`` set, every database connection gets an execute
+wrapper (installed from ``CoreConfig.ready`` on ``connection_created``).
+Only SELECT, INSERT, UPDATE and DELETE statements are counted; schema
+changes, PRAGMAs and transaction control are left out. Each statement is reduced
+to a fingerprint by replacing literals and placeholders with ``?`` and
+collapsing ``IN (?, ?, ...)`` lists and multi-row ``VALUES``, so the same
+ORM query with different arguments counts as one. Per fingerprint the
+process keeps the call count, total and maximum time and a latency
+histogram.
+
+A statement slower than ``SLOW_QUERY_MS`` is also kept as a sample with its
+parameters, the view or job it ran for and the project frames of its stack.
+Its plan (``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN`` elsewhere) is taken
+when the sample is flushed, outside the request or job that ran it.
+
+Counters are merged into ``QueryFingerprint`` and ``SlowQuery`` rows every
+``QUERY_LOG_FLUSH_SECONDS`` by the request middleware and the job runner,
+and at exit. ``manage.py slow_queries`` prints the top offenders.
+"""
+
+import atexit
+import bisect
+import contextvars
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ENABLED = getattr(settings, 'QUERY_LOG_ENABLED', False)
+SLOW_QUERY_MS = getattr(settings, 'SLOW_QUERY_MS', 100)
+FLUSH_SECONDS = getattr(settings, 'QUERY_LOG_FLUSH_SECONDS', 30)
+SLOW_SAMPLES_KEEP = 20
+MAX_PENDING_SLOW = 200
+STACK_FRAMES = 10
+
+# Upper bounds of the histogram buckets in milliseconds; one more bucket
+# counts everything slower
+BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+_DML = re.compile(r'\s*(?:WITH|SELECT|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?(?![\w"])')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_VALUES = re.compile(r'(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+')
+_SPACE = re.compile(r'\s+')
+
+_BASE_DIR = str(settings.BASE_DIR) + os.sep
+_THIS_FILE = os.path.abspath(__file__)
+
+current_view = contextvars.ContextVar('querylog_view', default='')
+
+_lock = threading.Lock()
+_local = threading.local()
+_fingerprints = {}
+_pending = {}
+_pending_slow = []
+_last_flush = time.monotonic()
+
+
+def normalize(sql):
+    """The statement with literals, placeholders and value lists folded"""
+    sql = _STRING.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    # Rows first: the IN-list rule would turn each row into (...)
+    sql = _VALUES.sub(r'\1, ...', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    """``(fingerprint, normalized sql)``, memoized per raw statement"""
+    found = _fingerprints.get(sql)
+    if found is None:
+        normalized = normalize(sql)
+        found = (hashlib.md5(normalized.encode()).hexdigest()[:16], normalized)
+        if len(_fingerprints) > 5000:
+            _fingerprints.clear()
+        _fingerprints[sql] = found
+    return found
+
+
+def _project_stack():
+    frames = [
+        frame for frame in traceback.extract_stack()[:-3]
+        if frame.filename.startswith(_BASE_DIR)
+        and 'site-packages' not in frame.filename
+        and frame.filename != _THIS_FILE
+    ]
+    return '\n'.join(
+        f'{frame.filename[len(_BASE_DIR):]}:{frame.lineno} in {frame.name}'
+        for frame in frames[-STACK_FRAMES:]
+    )
+
+
+def _explain(sample):
+    """The plan of a slow SELECT, taken when its sample is flushed"""
+    sql, params = sample.pop('sql_params')
+    if sample.pop('many') or not sql.lstrip()[:6].upper() == 'SELECT':
+        return ''
+    connection = connections[sample['database']]
+    sql = f'{connection.ops.explain_query_prefix()} {sql}'
+    try:
+        if not connection.in_atomic_block:
+            return _plan(connection, sql, params)
+        # A savepoint keeps a failing EXPLAIN from breaking the caller's transaction
+        savepoint = transaction.savepoint(using=connection.alias)
+        try:
+            plan = _plan(connection, sql, params)
+        except DatabaseError:
+            transaction.savepoint_rollback(savepoint, using=connection.alias)
+            raise
+        transaction.savepoint_commit(savepoint, using=connection.alias)
+        return plan
+    except DatabaseError as exc:
+        return f'EXPLAIN failed: {exc}'
+
+
+def _plan(connection, sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return '\n'.join(' '.join(str(value) for value in row) for row in cursor.fetchall())
+
+
+class _Disabled:
+    def __enter__(self):
+        self.previous = getattr(_local, 'disabled', False)
+        _local.disabled = True
+
+    def __exit__(self, *exc_info):
+        _local.disabled = self.previous
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    if getattr(_local, 'disabled', False) or not _DML.match(sql):
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    elapsed = (time.perf_counter() - started) * 1000
+
+    with _Disabled():
+        key, normalized = fingerprint(sql)
+        slow = None
+        if elapsed >= SLOW_QUERY_MS and len(_pending_slow) < MAX_PENDING_SLOW:
+            slow = {
+                'fingerprint': key,
+                'sql': sql,
+                'params': '' if params is None else repr(params)[:2000],
+                'duration_ms': elapsed,
+                'database': context['connection'].alias,
+                'view': current_view.get()[:200],
+                'stack': _project_stack(),
+                'created_at': timezone.now(),
+                # Explained at flush time, not while the caller waits
+                'sql_params': (sql, params),
+                'many': many,
+            }
+        bucket = bisect.bisect_left(BUCKETS_MS, elapsed)
+        with _lock:
+            stats = _pending.get(key)
+            if stats is None:
+                stats = _pending[key] = [normalized, 0, 0.0, 0.0, [0] * (len(BUCKETS_MS) + 1)]
+            stats[1] += 1
+            stats[2] += elapsed
+            stats[3] = max(stats[3], elapsed)
+            stats[4][bucket] += 1
+            if slow:
+                _pending_slow.append(slow)
+    return result
+
+
+def install(sender, connection, **kwargs):
+    """``connection_created`` receiver"""
+    if ENABLED and execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+def flush():
+    """Merge this process's counters into the database"""
+    from .models import QueryFingerprint, SlowQuery
+
+    global _pending, _pending_slow, _last_flush
+    with _lock:
+        pending, slow = _pending, _pending_slow
+        _pending, _pending_slow = {}, []
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+
+    now = timezone.now()
+    try:
+        with _Disabled():
+            for sample in slow:
+                sample['plan'] = _explain(sample)
+        with _Disabled(), transaction.atomic(using=DEFAULT_DB_ALIAS):
+            QueryFingerprint.objects.bulk_create([
+                QueryFingerprint(fingerprint=key, sql=stats[0], histogram=[0] * len(stats[4]))
+                for key, stats in pending.items()
+            ], ignore_conflicts=True)
+            rows = QueryFingerprint.objects.select_for_update().in_bulk(
+                list(pending), field_name='fingerprint'
+            )
+            for key, (_, calls, total, worst, buckets) in pending.items():
+                row = rows[key]
+                row.calls += calls
+                row.total_ms += total
+                row.max_ms = max(row.max_ms, worst)
+                histogram = row.histogram + [0] * (len(buckets) - len(row.histogram))
+                row.histogram = [a + b for a, b in zip(histogram, buckets)]
+                row.last_seen = now
+            QueryFingerprint.objects.bulk_update(
+                rows.values(), ['calls', 'total_ms', 'max_ms', 'histogram', 'last_seen']
+            )
+
+            if slow:
+                SlowQuery.objects.bulk_create([
+                    SlowQuery(**dict(sample, fingerprint=rows[sample['fingerprint']]))
+                    for sample in slow
+                ])
+                for key in {sample['fingerprint'] for sample in slow}:
+                    old = SlowQuery.objects.filter(fingerprint=rows[key]).values_list(
+                        'pk', flat=True
+                    )[SLOW_SAMPLES_KEEP:]
+                    SlowQuery.objects.filter(pk__in=list(old)).delete()
+    except DatabaseError:
+        # E.g. before the tables are migrated
+        logger.debug('Could not save query statistics', exc_info=True)
+
+
+def flush_if_due():
+    if time.monotonic() - _last_flush >= FLUSH_SECONDS:
+        flush()
+
+
+atexit.register(flush)
+
+
+class QueryLogMiddleware:
+    """Attribute queries to the view that ran them and flush periodically"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = current_view.set(request.path)
+        try:
+            return self.get_response(request)
+        finally:
+            current_view.reset(token)
+            flush_if_due()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        current_view.set(request.resolver_match.view_name or request.path)
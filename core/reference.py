@@ -0,0 +1,141 @@
+"""
+Process-local registry of reference data.
+
+Categories, skills, states, cities and active FAQs are small, change rarely
+and are read by almost every page: filter dropdowns, registration and
+profile forms, the contact page, the API and the ``__str__`` of skills and
+cities. ``get()`` returns them as tuples of named tuples with lookup dicts,
+loaded once per process instead of queried per request.
+
+The copy is tagged with a version token kept in the cache. ``core.signals``
+calls ``invalidate()`` when one of these tables changes, which drops this
+process's copy and stores a new token; other workers compare tokens at most
+every ``REFERENCE_CHECK_SECONDS`` and reload when theirs is outdated. With
+the default local-memory cache every process has its own token, so only
+the process that made the change reloads at once; use ``REDIS_URL`` to
+share it. Whatever the cache, a copy older than ``REFERENCE_MAX_AGE``
+seconds is reloaded, which bounds how long other processes show stale
+data.
+"""
+
+import threading
+import time
+import uuid
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = 'core:reference:version'
+CHECK_SECONDS = getattr(settings, 'REFERENCE_CHECK_SECONDS', 1.0)
+MAX_AGE = getattr(settings, 'REFERENCE_MAX_AGE', 60)
+
+CategoryRow = namedtuple('CategoryRow', 'id name description icon')
+SkillRow = namedtuple('SkillRow', 'id name category_id')
+StateRow = namedtuple('StateRow', 'id name code')
+CityRow = namedtuple('CityRow', 'id name state_id')
+FAQRow = namedtuple('FAQRow', 'id question answer')
+
+
+class ReferenceData:
+    """One consistent load of the reference tables"""
+
+    def __init__(self, version, categories, skills, states, cities, faqs):
+        self.version = version
+        # Sorted by name, as the dropdowns show them
+        self.categories = categories
+        self.skills = skills
+        self.states = states
+        self.cities = cities
+        # In display order
+        self.faqs = faqs
+
+        self.category_by_id = {row.id: row for row in categories}
+        self.skill_by_id = {row.id: row for row in skills}
+        self.state_by_id = {row.id: row for row in states}
+        self.city_by_id = {row.id: row for row in cities}
+
+        skills_by_category = defaultdict(list)
+        for row in skills:
+            skills_by_category[row.category_id].append(row)
+        self.skills_by_category = {key: tuple(rows) for key, rows in skills_by_category.items()}
+        cities_by_state = defaultdict(list)
+        for row in cities:
+            cities_by_state[row.state_id].append(row)
+        self.cities_by_state = {key: tuple(rows) for key, rows in cities_by_state.items()}
+
+    def lookup(self, kind, value):
+        """The ``kind`` row (``'category'``, ``'skill'``, ``'state'``, ``'city'``) with id ``value``, or None"""
+        try:
+            key = int(value)
+        except (TypeError, ValueError):
+            return None
+        return getattr(self, f'{kind}_by_id').get(key)
+
+
+def _load(version):
+    from artisans.models import Category, City, Skill, State
+    from .models import FAQ
+
+    return ReferenceData(
+        version,
+        categories=tuple(CategoryRow._make(row) for row in Category.objects.order_by('name').values_list(
+            'pk', 'name', 'description', 'icon'
+        )),
+        skills=tuple(SkillRow._make(row) for row in Skill.objects.order_by('name').values_list(
+            'pk', 'name', 'category_id'
+        )),
+        states=tuple(StateRow._make(row) for row in State.objects.order_by('name').values_list(
+            'pk', 'name', 'code'
+        )),
+        cities=tuple(CityRow._make(row) for row in City.objects.order_by('name').values_list(
+            'pk', 'name', 'state_id'
+        )),
+        faqs=tuple(FAQRow._make(row) for row in FAQ.objects.filter(is_active=True).order_by(
+            'order', 'created_at'
+        ).values_list('pk', 'question', 'answer')),
+    )
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._checked = 0.0
+        self._loaded = 0.0
+
+    def _shared_version(self):
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(VERSION_KEY)
+        return version
+
+    def _expired(self):
+        return time.monotonic() - self._loaded >= MAX_AGE
+
+    def get(self):
+        data = self._data
+        if data is not None and self._expired():
+            data = None
+        if data is not None and time.monotonic() - self._checked < CHECK_SECONDS:
+            return data
+        version = self._shared_version()
+        self._checked = time.monotonic()
+        if data is not None and data.version == version:
+            return data
+        with self._lock:
+            if self._data is None or self._data.version != version or self._expired():
+                self._data = _load(version)
+                self._loaded = time.monotonic()
+            return self._data
+
+    def invalidate(self):
+        """Drop this process's copy and make other processes reload theirs"""
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+        self._data = None
+
+
+registry = Registry()
+get = registry.get
+invalidate = registry.invalidate
@@ -0,0 +1,166 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from artisan_marketplace.sharding import scatter
+from artisans.listings import refresh_listings, refresh_listings_of
+from artisans.models import ArtisanProfile, Category, City, Skill, State
+from reviews.models import Review
+from .models import FAQ
+from . import reference, typeahead
+from .tracking import fields_changed
+
+User = get_user_model()
+
+# Columns that make up a typeahead artisan entry
+ARTISAN_ENTRY_FIELDS = ('user', 'is_verified', 'profile_views')
+USER_ENTRY_FIELDS = ('first_name', 'last_name', 'username', 'is_active')
+
+# Columns copied into the list page's ArtisanListing rows
+ARTISAN_LISTING_FIELDS = (
+    'user', 'category', 'state', 'city', 'bio', 'hourly_rate', 'availability',
+    'is_verified', 'created_at',
+)
+USER_LISTING_FIELDS = ('first_name', 'last_name', 'profile_picture', 'is_active')
+REVIEW_LISTING_FIELDS = ('artisan', 'rating', 'is_hidden')
+
+
+@receiver(post_save, sender=ArtisanProfile)
+def artisan_saved(sender, instance, raw=False, update_fields=None, using=None, **kwargs):
+    if raw:
+        return
+    if fields_changed(update_fields, *ARTISAN_ENTRY_FIELDS):
+        transaction.on_commit(lambda: typeahead.refresh_artisan(instance.pk))
+    if fields_changed(update_fields, *ARTISAN_LISTING_FIELDS):
+        transaction.on_commit(lambda: refresh_listings([instance.pk]), using=using)
+
+
+@receiver(post_delete, sender=ArtisanProfile)
+def artisan_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: typeahead.remove(typeahead.ARTISAN, instance.pk))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Names, the picture and is_active live on the user
+    if raw or instance.role != 'artisan':
+        return
+    entry = fields_changed(update_fields, *USER_ENTRY_FIELDS)
+    listing = fields_changed(update_fields, *USER_LISTING_FIELDS)
+    if entry or listing:
+        profile_id = getattr(instance, '_artisan_profile_id', None)
+        transaction.on_commit(lambda: _refresh_user(instance.pk, profile_id, entry, listing))
+
+
+def _refresh_user(user_id, profile_id, entry=True, listing=True):
+    if profile_id is None:
+        profile_id = ArtisanProfile.objects.filter(user_id=user_id).values_list('pk', flat=True).first()
+    if profile_id is None:
+        return
+    if entry:
+        typeahead.refresh_artisan(profile_id)
+    if listing:
+        refresh_listings([profile_id])
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, raw=False, update_fields=None, using=None, **kwargs):
+    # Rating stats of the artisan's listing, after the artisan's shard commits
+    if not raw and fields_changed(update_fields, *REVIEW_LISTING_FIELDS):
+        transaction.on_commit(lambda: refresh_listings([instance.artisan_id]), using=using)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, using=None, **kwargs):
+    transaction.on_commit(lambda: refresh_listings([instance.artisan_id]), using=using)
+
+
+def _skill_artisan_ids(skill_id):
+    # The link model has a plain manager, which reads one database only
+    return list(scatter(
+        ArtisanProfile.skills.through.objects.filter(skill_id=skill_id).values_list('artisanprofile_id', flat=True)
+    ))
+
+
+@receiver(m2m_changed, sender=ArtisanProfile.skills.through)
+def artisan_skills_changed(sender, instance, action, reverse, pk_set, using=None, **kwargs):
+    if reverse and action == 'pre_clear':
+        # Clearing a skill does not say which artisans had it
+        instance._cleared_artisan_ids = _skill_artisan_ids(instance.pk)
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # From the skill side the changed artisans are in pk_set
+    if reverse:
+        artisan_ids = list(pk_set or getattr(instance, '_cleared_artisan_ids', ()))
+    else:
+        artisan_ids = [instance.pk]
+    if artisan_ids:
+        transaction.on_commit(lambda: refresh_listings(artisan_ids), using=using)
+
+
+@receiver(pre_delete, sender=Skill)
+def skill_deleting(sender, instance, **kwargs):
+    # The delete cascades to the artisans' skill links without m2m_changed
+    instance._deleted_artisan_ids = _skill_artisan_ids(instance.pk)
+
+
+@receiver(post_delete, sender=Skill)
+def skill_deleted(sender, instance, **kwargs):
+    # Registered after the shards' copies of the skill are deleted on commit
+    artisan_ids = getattr(instance, '_deleted_artisan_ids', ())
+    if artisan_ids:
+        transaction.on_commit(lambda: refresh_listings(artisan_ids))
+
+
+def _named(kind, label=lambda instance: instance.name, extra=lambda instance: None):
+    def saved(sender, instance, raw=False, **kwargs):
+        if not raw:
+            transaction.on_commit(lambda: typeahead.refresh_named(
+                kind, instance.pk, label(instance), extra(instance)
+            ))
+
+    def deleted(sender, instance, **kwargs):
+        transaction.on_commit(lambda: typeahead.remove(kind, instance.pk))
+
+    return saved, deleted
+
+
+for model, handlers in (
+    (Skill, _named(typeahead.SKILL)),
+    (Category, _named(typeahead.CATEGORY)),
+    (State, _named(typeahead.STATE)),
+    (City, _named(
+        typeahead.CITY,
+        label=lambda city: f'{city.name}, {city.state.name}',
+        extra=lambda city: city.state_id,
+    )),
+):
+    post_save.connect(handlers[0], sender=model, weak=False)
+    post_delete.connect(handlers[1], sender=model, weak=False)
+
+
+def _reference_changed(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(reference.invalidate)
+
+
+for model in (Category, Skill, State, City, FAQ):
+    post_save.connect(_reference_changed, sender=model)
+    post_delete.connect(_reference_changed, sender=model)
+
+
+def _listed_names(lookup):
+    # Listings copy these names; deletes cascade to the artisans and their listings
+    def saved(sender, instance, created=False, raw=False, **kwargs):
+        if not raw and not created:
+            transaction.on_commit(lambda: refresh_listings_of(
+                ArtisanProfile.objects.filter(**{lookup: instance.pk})
+            ))
+
+    return saved
+
+
+for model, lookup in ((Category, 'category'), (Skill, 'skills'), (State, 'state'), (City, 'city')):
+    post_save.connect(_listed_names(lookup), sender=model, weak=False)
@@ -0,0 +1,160 @@
+"""
+"Did you mean" corrections for marketplace searches.
+
+The vocabulary is every word of skill, category, city and state names plus
+the words that appear in at least ``MIN_BIO_COUNT`` artisan bios. Following
+SymSpell, each word is stored under every string obtained by deleting up to
+``MAX_DISTANCE`` characters from it. A query word is corrected by generating
+its own deletes and looking them up, so finding candidates costs a few dict
+lookups regardless of the vocabulary size. Candidates are ranked by edit
+distance (with transpositions), then by how common the word is.
+
+Like the typeahead index, it is built at worker start or on first use and
+rebuilt every ``TYPEAHEAD_REFRESH`` seconds.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from artisan_marketplace import sharding
+
+from .typeahead import REFRESH_SECONDS, normalize
+
+logger = logging.getLogger(__name__)
+
+MAX_DISTANCE = 2
+MIN_WORD_LENGTH = 3
+# Longer words are left alone; their deletes grow with the square of the length
+MAX_WORD_LENGTH = 30
+MIN_BIO_COUNT = 3
+NAME_WEIGHT = 1000
+
+
+def _deletes(word, distance=MAX_DISTANCE):
+    """Every string made by deleting up to ``distance`` characters of ``word``"""
+    results = {word}
+    edge = {word}
+    for _ in range(distance):
+        edge = {
+            variant[:index] + variant[index + 1:]
+            for variant in edge if len(variant) > 1
+            for index in range(len(variant))
+        }
+        results |= edge
+    return results
+
+
+def edit_distance(a, b, limit=MAX_DISTANCE):
+    """Optimal string alignment distance, or ``limit + 1`` once it is exceeded"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        # A transposition can reach back two rows
+        if min(current) > limit and min(previous) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SpellingIndex:
+    """SymSpell-style deletion dictionary over a word -> frequency vocabulary"""
+
+    def __init__(self, frequencies):
+        self.frequencies = frequencies
+        self.deletes = defaultdict(list)
+        for word in frequencies:
+            for variant in _deletes(word):
+                self.deletes[variant].append(word)
+        self.built_at = time.monotonic()
+
+    def correct_word(self, word):
+        """Best vocabulary word within ``MAX_DISTANCE`` of ``word``, or ``word``"""
+        if (
+            word in self.frequencies
+            or not MIN_WORD_LENGTH <= len(word) <= MAX_WORD_LENGTH
+            or word.isdigit()
+        ):
+            return word
+        best, best_key = word, None
+        seen = set()
+        for variant in _deletes(word):
+            for candidate in self.deletes.get(variant, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(word, candidate)
+                if distance > MAX_DISTANCE:
+                    continue
+                key = (distance, -self.frequencies[candidate])
+                if best_key is None or key < best_key:
+                    best, best_key = candidate, key
+        return best
+
+    def correct(self, text):
+        """Return the corrected query, or None if nothing changed"""
+        words = normalize(text).split()
+        corrected = [self.correct_word(word) for word in words]
+        return ' '.join(corrected) if corrected != words else None
+
+
+def _vocabulary():
+    from artisans.models import ArtisanProfile, Category, City, Skill, State
+
+    frequencies = Counter()
+    for model in (Skill, Category, City, State):
+        for name in model.objects.values_list('name', flat=True).iterator():
+            for word in normalize(name).split():
+                if len(word) >= MIN_WORD_LENGTH:
+                    frequencies[word] += NAME_WEIGHT
+
+    bio_words = Counter()
+    for _ in sharding.each_shard():
+        bios = ArtisanProfile.objects.filter(is_verified=True).values_list('bio', flat=True)
+        for bio in bios.iterator(chunk_size=2000):
+            bio_words.update({word for word in normalize(bio).split() if len(word) >= MIN_WORD_LENGTH})
+    for word, count in bio_words.items():
+        if count >= MIN_BIO_COUNT and not word.isdigit():
+            frequencies[word] += count
+    return frequencies
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def build_index():
+    global _index
+    _index = SpellingIndex(_vocabulary())
+    return _index
+
+
+def get_index():
+    index = _index
+    if index is not None and time.monotonic() - index.built_at < REFRESH_SECONDS:
+        return index
+    with _build_lock:
+        if _index is index:
+            build_index()
+        return _index
+
+
+def warm_index():
+    try:
+        build_index()
+    except Exception:
+        logger.exception('Could not build the spelling index')
+
+
+def correct(text):
+    """Corrected form of a search query, or None"""
+    return get_index().correct(text)
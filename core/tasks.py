@@ -0,0 +1,9 @@
+from core.jobs import task
+from .outbox import Sender, schedule_retries
+
+
+@task(priority=5, max_attempts=1, every=300)
+def send_outbox():
+    """Send the due outbox emails and schedule the next retry"""
+    Sender().run(burst=True)
+    schedule_retries()
@@ -1,3 +1,991 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import smtplib
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache as django_cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, connections, router, transaction
+from django.db.models import Avg, Count
+from django.http import HttpResponse
+from django.template import engines
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from artisan_marketplace import sharding
+from artisan_marketplace.middleware import PIN_COOKIE, ReplicaPinningMiddleware
+from artisan_marketplace.sqlite.base import PRAGMAS, Database, SQLiteCursorWrapper, immediate
+from artisan_marketplace.test_runner import TEST_REPLICA, TEST_SHARD
+from accounts.models import User
+from artisans.models import ArtisanProfile, Category, City, Skill, State
+from reviews.models import Review
+from . import cache as core_cache, jobs, outbox, profiling, querylog, reference, spelling, typeahead, warmup
+from .exports import stream_export
+from .models import ContactMessage, Job, OutboxEmail, SlowQuery
+
+calls = []
+
+
+@jobs.task
+def record_call(**kwargs):
+    calls.append(kwargs)
+
+
+@jobs.task(max_attempts=2)
+def always_fails():
+    raise RuntimeError('boom')
+
+
+@jobs.task(every=60)
+def every_minute():
+    pass
+
+
+def _pragma(alias, name):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f'PRAGMA {name}')
+        return cursor.fetchone()[0]
+
+
+class SQLiteBackendTests(TransactionTestCase):
+    databases = {DEFAULT_DB_ALIAS, TEST_REPLICA}
+
+    def test_pragmas_set_on_new_connections(self):
+        self.assertEqual(_pragma(DEFAULT_DB_ALIAS, 'busy_timeout'), PRAGMAS['busy_timeout'])
+        self.assertEqual(_pragma(DEFAULT_DB_ALIAS, 'cache_size'), PRAGMAS['cache_size'])
+        self.assertEqual(_pragma(DEFAULT_DB_ALIAS, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(_pragma(DEFAULT_DB_ALIAS, 'temp_store'), 2)  # MEMORY
+
+    def test_database_file_uses_wal(self):
+        # In-memory databases cannot use WAL; the replica is a file
+        self.assertEqual(_pragma(TEST_REPLICA, 'journal_mode'), 'wal')
+
+    def begins(self, block):
+        with CaptureQueriesContext(connection) as queries:
+            with block():
+                Category.objects.exists()
+                with block():
+                    Category.objects.update(icon='wrench')
+        return [query['sql'] for query in queries if query['sql'].startswith('BEGIN')]
+
+    def test_transactions_start_deferred(self):
+        self.assertEqual(self.begins(transaction.atomic), ['BEGIN'])
+
+    def test_immediate_blocks_take_the_write_lock(self):
+        self.assertEqual(self.begins(immediate), ['BEGIN IMMEDIATE'])
+        # The next plain transaction is deferred again
+        self.assertEqual(self.begins(transaction.atomic), ['BEGIN'])
+
+    def test_failed_immediate_block_resets_the_flag(self):
+        with self.assertRaises(RuntimeError), immediate():
+            raise RuntimeError
+        self.assertFalse(connection.begin_immediate)
+
+    def lock_test_cursor(self):
+        # A connection of its own, outside the test's databases
+        conn = Database.connect(':memory:')
+        self.addCleanup(conn.close)
+        cursor = conn.cursor(factory=SQLiteCursorWrapper)
+        cursor.retries = 5
+        cursor.retry_delay = 0
+        return cursor
+
+    def test_locked_statements_are_retried(self):
+        calls = []
+
+        def locked_twice():
+            calls.append(1)
+            if len(calls) < 3:
+                raise Database.OperationalError('database is locked')
+            return 'done'
+
+        self.assertEqual(self.lock_test_cursor()._retry(locked_twice), 'done')
+        self.assertEqual(len(calls), 3)
+
+    def test_other_errors_are_not_retried(self):
+        failing = mock.Mock(side_effect=Database.OperationalError('no such table: missing'))
+        with self.assertRaises(Database.OperationalError):
+            self.lock_test_cursor()._retry(failing)
+        self.assertEqual(failing.call_count, 1)
+
+
+@override_settings(DATABASE_REPLICAS=[TEST_REPLICA])
+class ReplicaRoutingTests(TestCase):
+    """Reads go to the replica file until a request writes or is pinned"""
+
+    databases = {DEFAULT_DB_ALIAS, TEST_REPLICA}
+
+    @classmethod
+    def setUpTestData(cls):
+        # Only on the primary; the replica never gets it
+        Category.objects.create(name='Plumbing')
+
+    def request(self, method='get', write=False, pinned=False):
+        seen = {}
+
+        def view(request):
+            if write:
+                Category.objects.create(name='Tiling')
+            seen['db'] = router.db_for_read(Category)
+            seen['found'] = Category.objects.filter(name='Plumbing').exists()
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)('/')
+        if pinned:
+            request.COOKIES[PIN_COOKIE] = '1'
+        response = ReplicaPinningMiddleware(view)(request)
+        return seen, response
+
+    def test_outside_requests_read_the_primary(self):
+        self.assertEqual(router.db_for_read(Category), DEFAULT_DB_ALIAS)
+        self.assertTrue(Category.objects.filter(name='Plumbing').exists())
+
+    def test_safe_request_reads_the_replica(self):
+        seen, response = self.request()
+        self.assertEqual(seen['db'], TEST_REPLICA)
+        self.assertFalse(seen['found'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_read_after_write_uses_the_primary_and_pins(self):
+        seen, response = self.request('post', write=True)
+        self.assertEqual(seen['db'], DEFAULT_DB_ALIAS)
+        self.assertTrue(seen['found'])
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_unsafe_request_without_write_does_not_pin(self):
+        seen, response = self.request('post')
+        self.assertEqual(seen['db'], TEST_REPLICA)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_write_in_safe_request_does_not_pin(self):
+        seen, response = self.request(write=True)
+        self.assertEqual(seen['db'], TEST_REPLICA)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_pinned_client_reads_the_primary(self):
+        seen, response = self.request(pinned=True)
+        self.assertEqual(seen['db'], DEFAULT_DB_ALIAS)
+        self.assertTrue(seen['found'])
+
+    def test_queue_and_outbox_read_the_primary(self):
+        def view(request):
+            self.assertEqual(router.db_for_read(Review), TEST_REPLICA)
+            self.assertEqual(router.db_for_read(Job), DEFAULT_DB_ALIAS)
+            self.assertEqual(router.db_for_read(OutboxEmail), DEFAULT_DB_ALIAS)
+            return HttpResponse()
+
+        ReplicaPinningMiddleware(view)(RequestFactory().get('/'))
+
+
+@mock.patch('core.jobs.close_old_connections')
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def run_due(self, worker=None):
+        worker = worker or jobs.Worker()
+        for job_id in worker.claim(10):
+            jobs.run_job(job_id)
+
+    def test_delay_queues_and_worker_runs(self, _):
+        job = record_call.delay(value=1)
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(calls, [])
+        self.run_due()
+        self.assertEqual(calls, [{'value': 1}])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.attempts, 1)
+
+    def test_claim_takes_due_jobs_by_priority(self, _):
+        low = record_call.schedule(priority=0)
+        high = record_call.schedule(priority=9)
+        record_call.schedule(countdown=3600)
+        worker = jobs.Worker()
+        self.assertEqual(worker.claim(10), [high.pk, low.pk])
+        self.assertEqual(
+            set(Job.objects.filter(status=Job.RUNNING).values_list('locked_by', flat=True)), {worker.name}
+        )
+        # Running jobs are not claimed again
+        self.assertEqual(jobs.Worker().claim(10), [])
+
+    def test_failures_back_off_then_fail(self, _):
+        job = always_fails.delay()
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.run_due()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('boom', job.last_error)
+        self.assertGreaterEqual(job.run_at, timezone.now() + timedelta(seconds=jobs.RETRY_DELAY - 5))
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.run_due()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_dedup_keeps_one_queued_job_at_the_earlier_time(self, _):
+        later = record_call.schedule(countdown=600, dedup_key='refresh')
+        sooner = record_call.schedule(countdown=60, dedup_key='refresh')
+        self.assertEqual(sooner.pk, later.pk)
+        self.assertEqual(Job.objects.filter(dedup_key='refresh').count(), 1)
+        later.refresh_from_db()
+        self.assertLess(later.run_at, timezone.now() + timedelta(seconds=120))
+
+    def test_dedup_queues_again_once_the_job_runs(self, _):
+        running = record_call.schedule(dedup_key='refresh')
+        Job.objects.filter(pk=running.pk).update(status=Job.RUNNING)
+        queued = record_call.schedule(dedup_key='refresh')
+        self.assertNotEqual(queued.pk, running.pk)
+
+    def test_duplicate_claimed_during_enqueue_is_queued_again(self, _):
+        claimed = record_call.schedule(dedup_key='refresh')
+        Job.objects.filter(pk=claimed.pk).update(status=Job.RUNNING)
+        save = Job.save
+        conflicts = []
+
+        def conflict_once(job, *args, **kwargs):
+            # The insert met the duplicate while it was still queued
+            if not conflicts:
+                conflicts.append(job)
+                raise IntegrityError('UNIQUE constraint failed: core_job.dedup_key')
+            return save(job, *args, **kwargs)
+
+        with mock.patch.object(Job, 'save', conflict_once):
+            job = record_call.schedule(dedup_key='refresh')
+        self.assertIsNotNone(job)
+        self.assertEqual(Job.objects.get(dedup_key='refresh', status=Job.QUEUED).pk, job.pk)
+
+    def test_periodic_task_keeps_one_run_queued(self, _):
+        name = every_minute.name
+        jobs.schedule_periodic()
+        jobs.schedule_periodic()
+        self.assertEqual(Job.objects.filter(name=name).count(), 1)
+
+        finished = timezone.now()
+        Job.objects.filter(name=name).update(status=Job.DONE, finished_at=finished)
+        jobs.schedule_periodic()
+        job = Job.objects.get(name=name, status=Job.QUEUED)
+        self.assertEqual(job.run_at, finished + timedelta(seconds=60))
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_jobs_run_inline(self, _):
+        self.assertIsNone(record_call.delay(value=2))
+        self.assertEqual(calls, [{'value': 2}])
+        self.assertFalse(Job.objects.exists())
+
+
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Plumbing')
+        state = State.objects.create(name='Lagos', code='LA')
+        city = City.objects.create(name='Ikeja', state=state)
+        skills = [Skill.objects.create(name=name, category=category) for name in ('Drains', 'Pipes')]
+        cls.client_user = User.objects.create_user('client', role='client')
+        cls.artisans = []
+        for name in ('ada', 'bola', 'chidi'):
+            artisan = ArtisanProfile.objects.create(
+                user=User.objects.create_user(name, first_name=name.title(), role='artisan'),
+                category=category,
+                bio='Pipes and drains',
+                hourly_rate=5000,
+                state=state,
+                city=city,
+            )
+            artisan.skills.set(skills[:len(cls.artisans) + 1])
+            cls.artisans.append(artisan)
+        ada = cls.artisans[0]
+        Review.objects.create(client=cls.client_user, artisan=ada, rating=5, title='Great', comment='Quick, "tidy"')
+        Review.objects.create(
+            client=User.objects.create_user('other', role='client'), artisan=ada, rating=1,
+            title='Spam', comment='Spam', is_hidden=True,
+        )
+        ContactMessage.objects.create(name='Ngozi', email='ngozi@example.com', subject='Hi', message='Hello')
+
+    def export(self, name, fmt='csv', **kwargs):
+        return b''.join(stream_export(name, fmt, **kwargs)).decode()
+
+    def test_artisans_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('artisans', chunk_size=2))))
+        self.assertEqual([row['username'] for row in rows], ['ada', 'bola', 'chidi'])
+        self.assertEqual([row['skills'] for row in rows], ['Drains', 'Drains; Pipes', 'Drains; Pipes'])
+        # Hidden reviews are left out of the aggregates
+        self.assertEqual((rows[0]['total_reviews'], rows[0]['average_rating']), ('1', '5.0'))
+        self.assertEqual(rows[0]['category'], 'Plumbing')
+
+    def test_skills_are_fetched_per_chunk(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.export('artisans', chunk_size=3)
+        self.assertEqual(len(queries), 2)
+
+    def test_reviews_jsonl(self):
+        rows = [json.loads(line) for line in self.export('reviews', 'jsonl').splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['artisan'], 'ada')
+        self.assertEqual(rows[0]['comment'], 'Quick, "tidy"')
+        self.assertEqual([row['is_hidden'] for row in rows], [False, True])
+
+    def test_gzip_output_matches_the_plain_one(self):
+        compressed = b''.join(stream_export('contact_messages', 'jsonl', compress=True))
+        self.assertEqual(gzip.decompress(compressed).decode(), self.export('contact_messages', 'jsonl'))
+
+    def test_view_is_for_staff_and_streams(self):
+        url = reverse('core:export', args=['contact_messages'])
+        self.client.force_login(self.client_user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(url, {'format': 'jsonl'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['email'], 'ngozi@example.com')
+        self.assertEqual(self.client.get(reverse('core:export', args=['users'])).status_code, 404)
+
+    def test_command_writes_a_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'reviews.csv.gz')
+            call_command('export_data', 'reviews', '--gzip', '-o', path, stderr=io.StringIO())
+            with gzip.open(path) as output:
+                self.assertEqual(output.read().decode(), self.export('reviews'))
+
+
+class PrefixIndexTests(TestCase):
+
+    def index(self, *rows):
+        index = typeahead.PrefixIndex()
+        index.load(rows)
+        return index
+
+    def labels(self, index, query, limit=8):
+        return [entry['label'] for entry in index.search(query, limit)]
+
+    def test_every_word_starts_a_key(self):
+        index = self.index(
+            (typeahead.SKILL, 1, 'Solar Installation', 3, None),
+            (typeahead.SKILL, 2, 'Tiling', 3, None),
+        )
+        self.assertEqual(self.labels(index, 'inst'), ['Solar Installation'])
+        self.assertEqual(self.labels(index, 'SOLAR  inst'), ['Solar Installation'])
+        self.assertEqual(self.labels(index, 'lation'), [])
+        self.assertEqual(self.labels(index, '  '), [])
+
+    def test_labels_are_normalized(self):
+        self.assertEqual(typeahead.normalize('  Crème-Brûlée '), 'creme brulee')
+        index = self.index((typeahead.ARTISAN, 1, 'Chloé Adé', 0, None))
+        self.assertEqual(self.labels(index, 'ade'), ['Chloé Adé'])
+
+    def test_heavier_and_whole_label_matches_rank_first(self):
+        index = self.index(
+            (typeahead.SKILL, 1, 'Pipe fitting', 1, None),
+            (typeahead.CATEGORY, 2, 'Plumbing', 9, None),
+            (typeahead.SKILL, 3, 'Lead pipes', 1, None),
+            (typeahead.CITY, 4, 'Pleasant, Lagos', 2, 7),
+        )
+        self.assertEqual(self.labels(index, 'p'), ['Plumbing', 'Pleasant, Lagos', 'Pipe fitting', 'Lead pipes'])
+        self.assertEqual(self.labels(index, 'p', limit=2), ['Plumbing', 'Pleasant, Lagos'])
+        self.assertEqual(index.search('plea')[0]['url'], f"{reverse('core:artisan_list')}?state=7&city=4")
+
+    def test_upsert_and_remove_patch_the_keys(self):
+        index = self.index((typeahead.SKILL, 1, 'Tiling', 1, None), (typeahead.SKILL, 2, 'Roofing', 1, None))
+        index.upsert(typeahead.SKILL, 1, 'Floor tiling', 5)
+        self.assertEqual(self.labels(index, 'til'), ['Floor tiling'])
+        self.assertEqual(self.labels(index, 'floor'), ['Floor tiling'])
+        self.assertEqual(index.weight(typeahead.SKILL, 1), 5)
+        index.remove(typeahead.SKILL, 2)
+        self.assertEqual(self.labels(index, 'roof'), [])
+        self.assertEqual(len(index.sorted[0]), len(index.sorted[1]))
+
+
+class TypeaheadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Plumbing')
+        cls.pipes = Skill.objects.create(name='Pipe fitting', category=cls.category)
+        state = State.objects.create(name='Lagos', code='LA')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.artisan = ArtisanProfile.objects.create(
+                user=User.objects.create_user('ada', first_name='Ada', last_name='Pike', role='artisan'),
+                category=cls.category,
+                bio='Pipes',
+                hourly_rate=5000,
+                state=state,
+                city=City.objects.create(name='Ikeja', state=state),
+                is_verified=True,
+            )
+            cls.artisan.skills.add(cls.pipes)
+
+    def setUp(self):
+        patcher = mock.patch.object(typeahead, '_index', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def suggested(self, query):
+        return [(entry['type'], entry['label']) for entry in typeahead.suggest(query)]
+
+    def test_index_covers_names_skills_categories_and_places(self):
+        typeahead.build_index()
+        self.assertEqual(self.suggested('pi'), [('skill', 'Pipe fitting'), ('artisan', 'Ada Pike')])
+        self.assertEqual(self.suggested('ike'), [('city', 'Ikeja, Lagos')])
+        self.assertEqual(self.suggested('lag'), [('state', 'Lagos'), ('city', 'Ikeja, Lagos')])
+        self.assertEqual(self.suggested('plumb'), [('category', 'Plumbing')])
+
+    def test_signals_patch_a_built_index(self):
+        typeahead.build_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pipes.name = 'Pipe laying'
+            self.pipes.save()
+        self.assertEqual(self.suggested('pipe l'), [('skill', 'Pipe laying')])
+        self.assertEqual(self.suggested('fitting'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.artisan.is_verified = False
+            self.artisan.save()
+        self.assertEqual(self.suggested('ada'), [])
+
+    def test_suggest_api(self):
+        response = self.client.get(reverse('api:suggest'), {'q': 'ada', 'limit': 3})
+        self.assertEqual(response.json()['results'], [{
+            'type': 'artisan',
+            'id': self.artisan.pk,
+            'label': 'Ada Pike',
+            'url': reverse('core:artisan_detail', args=[self.artisan.pk]),
+        }])
+        self.assertEqual(self.client.get(reverse('api:suggest'), {'limit': 'x'}).status_code, 400)
+
+
+class SpellingTests(TestCase):
+
+    def test_edit_distance_counts_transpositions(self):
+        self.assertEqual(spelling.edit_distance('plumber', 'plumbar'), 1)
+        self.assertEqual(spelling.edit_distance('ikeja', 'ikjea'), 1)
+        self.assertEqual(spelling.edit_distance('carpenter', 'carpntr'), 2)
+        self.assertEqual(spelling.edit_distance('tiling', 'roofing'), spelling.MAX_DISTANCE + 1)
+
+    def test_words_are_corrected_to_the_closest_common_word(self):
+        index = spelling.SpellingIndex({'plumber': 1000, 'plumbing': 1000, 'ikeja': 1000, 'lumber': 3})
+        self.assertEqual(index.correct_word('plumbar'), 'plumber')
+        self.assertEqual(index.correct_word('ikejia'), 'ikeja')
+        # Equally close: the more frequent word wins
+        self.assertEqual(index.correct_word('pumber'), 'plumber')
+        self.assertEqual(index.correct('Plumbar in Ikejia'), 'plumber in ikeja')
+        self.assertIsNone(index.correct('plumber in ikeja'))
+
+    def test_short_long_and_numeric_words_are_left_alone(self):
+        index = spelling.SpellingIndex({'tap': 1000, 'taps': 1000})
+        self.assertEqual(index.correct_word('tp'), 'tp')
+        self.assertEqual(index.correct_word('2000'), '2000')
+        self.assertEqual(index.correct_word('t' * (spelling.MAX_WORD_LENGTH + 1)), 't' * (spelling.MAX_WORD_LENGTH + 1))
+
+
+class SearchCorrectionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Plumbing')
+        state = State.objects.create(name='Lagos', code='LA')
+        city = City.objects.create(name='Ikeja', state=state)
+        with cls.captureOnCommitCallbacks(execute=True):
+            for name in ('ada', 'bola', 'chidi'):
+                ArtisanProfile.objects.create(
+                    user=User.objects.create_user(name, role='artisan'),
+                    category=category,
+                    bio='Burst pipes fixed fast',
+                    hourly_rate=5000,
+                    state=state,
+                    city=city,
+                    is_verified=True,
+                )
+
+    def setUp(self):
+        patcher = mock.patch.object(spelling, '_index', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, query):
+        response = self.client.get(reverse('core:artisan_list'), {'search': query})
+        return len(response.context['artisans']), response.context['corrected_query']
+
+    def test_empty_search_is_retried_corrected(self):
+        self.assertEqual(self.search('plumbng'), (3, 'plumbing'))
+        # Frequent bio words are in the vocabulary too
+        self.assertEqual(self.search('bursst'), (3, 'burst'))
+
+    def test_searches_with_results_are_not_corrected(self):
+        self.assertEqual(self.search('plumbing'), (3, None))
+
+    def test_unknown_words_stay_empty(self):
+        self.assertEqual(self.search('xylophone'), (0, None))
+
+
+class WarmUpTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Plumbing')
+        state = State.objects.create(name='Lagos', code='LA')
+        with cls.captureOnCommitCallbacks(execute=True):
+            ArtisanProfile.objects.create(
+                user=User.objects.create_user('ada', first_name='Ada', role='artisan'),
+                category=category,
+                bio='Pipes',
+                hourly_rate=5000,
+                state=state,
+                city=City.objects.create(name='Ikeja', state=state),
+                is_verified=True,
+            )
+
+    def setUp(self):
+        django_cache.clear()
+        for module in (typeahead, spelling):
+            patcher = mock.patch.object(module, '_index', None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_project_templates_are_compiled_into_the_cached_loader(self):
+        engine = engines['django'].engine
+        loader = engine.template_loaders[0]
+        loader.reset()
+        self.assertGreater(warmup.compile_templates(), 10)
+        with mock.patch('django.template.loaders.filesystem.Loader.get_contents') as get_contents:
+            engine.get_template('core/artisan_list.html')
+        get_contents.assert_not_called()
+
+    def test_urls_are_counted(self):
+        self.assertGreater(warmup.compile_urls(), 10)
+
+    def test_warm_up_fills_caches_and_indexes(self):
+        with self.assertLogs('core.warmup', 'INFO') as logs:
+            warmup.warm_up()
+        self.assertIsNotNone(typeahead._index)
+        self.assertIsNotNone(spelling._index)
+        self.assertIsNotNone(django_cache.get(core_cache.STATS_KEY))
+        self.assertIsNotNone(django_cache.get(core_cache.HOMEPAGE_KEY))
+        self.assertIn('templates', logs.output[-1])
+        self.assertIn('indexes', logs.output[-1])
+        with self.assertNumQueries(0):
+            typeahead.suggest('ada')
+            spelling.correct('plumbng')
+
+    def test_failed_step_is_logged_and_the_rest_still_run(self):
+        def broken():
+            raise RuntimeError('no templates')
+
+        steps = (('templates', broken), ('indexes', warmup.build_indexes))
+        with mock.patch.object(warmup, 'STEPS', steps), self.assertLogs('core.warmup', 'INFO') as logs:
+            warmup.warm_up()
+        self.assertIn('Warm-up step templates failed', logs.output[0])
+        self.assertIsNotNone(typeahead._index)
+
+    def test_only_the_first_request_is_reported(self):
+        def application(environ, start_response):
+            return [b'ok']
+
+        wrapped = warmup.FirstRequestReporter(application)
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+        with mock.patch.object(warmup, '_first_request_pending', True):
+            with self.assertLogs('core.warmup', 'INFO') as logs:
+                self.assertEqual(wrapped(environ, None), [b'ok'])
+                self.assertEqual(wrapped(environ, None), [b'ok'])
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('GET /', logs.output[0])
+
+
+class ProfilingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+        cls.visitor = User.objects.create_user('visitor')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(profiling, 'PROFILES_ROOT', Path(directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def saved(self):
+        return sorted(path.stem for path in profiling.PROFILES_ROOT.glob('*.json'))
+
+    def test_anonymous_and_non_staff_requests_are_not_profiled(self):
+        for user in (None, self.visitor):
+            with self.subTest(user=user):
+                if user:
+                    self.client.force_login(user)
+                response = self.client.get(reverse('core:about'), {'_profile': '1'}, HTTP_X_PROFILE='1')
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.saved(), [])
+
+    def test_staff_requests_are_profiled_only_on_request(self):
+        self.client.force_login(self.staff)
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('core:about')))
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('core:about'), {'_profile': '0'}))
+
+        response = self.client.get(reverse('core:about'), HTTP_X_PROFILE='1')
+        profile_id = response['X-Profile-Id']
+        self.assertEqual(self.saved(), [profile_id])
+        profile = profiling.load_profile(profile_id)
+        self.assertEqual(profile['mode'], 'sample')
+        self.assertEqual(profile['user'], 'staff')
+        self.assertEqual(profile['view'], 'core:about')
+        self.assertEqual(profile['sql_count'], len(profile['queries']))
+
+    def test_cprofile_mode_counts_calls(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('core:about'), {'_profile': 'cprofile'})
+        profile = profiling.load_profile(response['X-Profile-Id'])
+        self.assertEqual(profile['mode'], 'cprofile')
+        self.assertTrue(profile['cprofile'])
+
+    def test_profile_pages_are_staff_only(self):
+        self.client.force_login(self.staff)
+        profile_id = self.client.get(reverse('core:about'), {'_profile': '1'})['X-Profile-Id']
+        urls = [
+            reverse('core:profile_list'),
+            reverse('core:profile_detail', args=[profile_id]),
+            reverse('core:profile_stacks', args=[profile_id]),
+        ]
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(reverse('core:profile_detail', args=['..secrets'])).status_code, 404)
+
+        self.client.force_login(self.visitor)
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_only_the_newest_profiles_are_kept(self):
+        with mock.patch.object(profiling, 'PROFILE_KEEP', 2):
+            for index in range(3):
+                profiling.save_profile({'id': f'2026010100000{index}-0000000{index}'})
+        self.assertEqual(self.saved(), ['20260101000001-00000001', '20260101000002-00000002'])
+
+
+class QueryLogTests(TestCase):
+
+    def setUp(self):
+        for name, value in (('_pending', {}), ('_pending_slow', []), ('SLOW_QUERY_MS', 100)):
+            patcher = mock.patch.object(querylog, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def logged(self):
+        return {stats[0]: stats[1] for stats in querylog._pending.values()}
+
+    def test_literals_and_value_lists_are_folded(self):
+        self.assertEqual(
+            querylog.normalize("SELECT  \"t\".\"col1\" FROM t2 WHERE a = 'it''s' AND b = -1.5\n AND c IN (%s, %s, %s)"),
+            'SELECT "t"."col1" FROM t2 WHERE a = ? AND b = ? AND c IN (...)',
+        )
+        self.assertEqual(
+            querylog.normalize('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)'),
+            querylog.normalize('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)'),
+        )
+        self.assertEqual(
+            querylog.normalize('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)'),
+            'INSERT INTO t (a, b) VALUES (...), ...',
+        )
+
+    def test_same_query_with_other_arguments_shares_a_fingerprint(self):
+        def sql(*pks):
+            return str(Category.objects.filter(pk__in=pks, name='x').query)
+
+        key, normalized = querylog.fingerprint(sql(1, 2))
+        self.assertEqual(querylog.fingerprint(sql(3, 4, 5, 6))[0], key)
+        self.assertIn('IN (...)', normalized)
+        self.assertNotEqual(querylog.fingerprint(str(Skill.objects.filter(pk=1).query))[0], key)
+
+    def test_only_dml_is_logged(self):
+        with connection.execute_wrapper(querylog.execute_wrapper):
+            list(Category.objects.filter(name='Plumbing'))
+            Category.objects.create(name='Tiling')
+            with connection.cursor() as cursor:
+                cursor.execute('CREATE TABLE querylog_test (id integer)')
+                cursor.execute('DROP TABLE querylog_test')
+                cursor.execute('PRAGMA foreign_keys')
+        statements = list(self.logged())
+        self.assertEqual([sql.split()[0] for sql in statements], ['SELECT', 'INSERT'])
+
+    def test_slow_queries_are_explained_when_flushed(self):
+        querylog.SLOW_QUERY_MS = 0
+        with connection.execute_wrapper(querylog.execute_wrapper):
+            with CaptureQueriesContext(connection) as queries:
+                list(Category.objects.filter(name='Plumbing'))
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('plan', querylog._pending_slow[0])
+
+        querylog.flush()
+        sample = SlowQuery.objects.get()
+        self.assertIn('artisans_category', sample.sql)
+        self.assertIn('USING INDEX', sample.plan)
+        self.assertEqual(sample.fingerprint.calls, 1)
+        self.assertEqual(querylog._pending_slow, [])
+
+    def test_off_unless_enabled(self):
+        wrappers = []
+        with mock.patch.object(querylog, 'ENABLED', False):
+            querylog.install(None, mock.Mock(execute_wrappers=wrappers))
+        self.assertEqual(wrappers, [])
+        with mock.patch.object(querylog, 'ENABLED', True):
+            querylog.install(None, mock.Mock(execute_wrappers=wrappers))
+        self.assertEqual(wrappers, [querylog.execute_wrapper])
+
+
+class OutboxTests(TestCase):
+    context = {'message': {'name': 'Ada', 'subject': 'Hello', 'message': 'Hi there'}}
+
+    def test_queue_email_renders_and_schedules_delivery(self):
+        email = outbox.queue_email('contact_ack', 'ada@example.com', self.context)
+        self.assertEqual(email.subject, 'We received your message: Hello')
+        self.assertIn('Hello Ada,', email.body)
+        self.assertEqual(email.status, OutboxEmail.QUEUED)
+        self.assertTrue(Job.objects.filter(name=outbox.SEND_TASK, status=Job.QUEUED).exists())
+
+    def test_no_address_no_email(self):
+        self.assertIsNone(outbox.queue_email('contact_ack', '', self.context))
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_email_rolls_back_with_the_change(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            outbox.queue_email('contact_ack', 'ada@example.com', self.context)
+            raise RuntimeError
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_delivery_job_keeps_the_earliest_run_at(self):
+        outbox.schedule_delivery(run_at=timezone.now() + timedelta(minutes=5))
+        outbox.queue_email('contact_ack', 'ada@example.com', self.context)
+        job = Job.objects.get(name=outbox.SEND_TASK)
+        self.assertLessEqual(job.run_at, timezone.now())
+
+    def test_sender_sends_due_emails(self):
+        email = outbox.queue_email('contact_ack', 'ada@example.com', self.context)
+        self.assertEqual(outbox.Sender(rate=0).send_batch(), 1)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['ada@example.com'])
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.SENT)
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(outbox.Sender(rate=0).send_batch(), 0)
+
+    def test_temporary_failure_is_retried_later(self):
+        email = outbox.queue_email('contact_ack', 'ada@example.com', self.context)
+        with mock.patch('core.outbox.EmailMessage.send', side_effect=smtplib.SMTPServerDisconnected('gone')), \
+                self.assertLogs('core.outbox', 'WARNING'):
+            outbox.Sender(rate=0).send_batch()
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.QUEUED)
+        self.assertEqual(email.attempts, 1)
+        self.assertGreater(email.send_after, email.created_at)
+        self.assertEqual(mail.outbox, [])
+
+    def test_permanent_failure_fails_at_once(self):
+        email = outbox.queue_email('contact_ack', 'ada@example.com', self.context)
+        refused = smtplib.SMTPRecipientsRefused({'ada@example.com': (550, b'No such user')})
+        with mock.patch('core.outbox.EmailMessage.send', side_effect=refused), \
+                self.assertLogs('core.outbox', 'WARNING'):
+            outbox.Sender(rate=0).send_batch()
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.FAILED)
+
+
+class ReferenceRegistryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Plumbing')
+
+    def setUp(self):
+        django_cache.clear()
+        self.now = 1000.0
+        patcher = mock.patch('core.reference.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.registry = reference.Registry()
+
+    def names(self):
+        return [row.name for row in self.registry.get().categories]
+
+    def test_copy_is_reused_between_checks(self):
+        self.names()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ['Plumbing'])
+            self.now += reference.CHECK_SECONDS
+            self.assertEqual(self.names(), ['Plumbing'])
+
+    def test_other_processes_reload_after_a_new_version(self):
+        self.names()
+        Category.objects.filter(pk=self.category.pk).update(name='Tiling')
+        reference.Registry().invalidate()
+        self.assertEqual(self.names(), ['Plumbing'])
+        self.now += reference.CHECK_SECONDS
+        self.assertEqual(self.names(), ['Tiling'])
+
+    def test_copy_is_reloaded_after_max_age_without_a_new_version(self):
+        # E.g. a change made by a process with its own local-memory cache
+        self.names()
+        Category.objects.filter(pk=self.category.pk).update(name='Tiling')
+        self.now += reference.MAX_AGE - 1
+        self.assertEqual(self.names(), ['Plumbing'])
+        self.now += 1
+        self.assertEqual(self.names(), ['Tiling'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ['Tiling'])
+
+    def test_saving_reference_rows_invalidates_this_process(self):
+        self.assertEqual(reference.get().category_by_id[self.category.pk].name, 'Plumbing')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Tiling'
+            self.category.save()
+        self.assertEqual(reference.get().category_by_id[self.category.pk].name, 'Tiling')
+
+
+@override_settings(
+    DATABASE_SHARDS=[DEFAULT_DB_ALIAS, TEST_SHARD],
+    DATABASE_SHARD_STATES={'LA': DEFAULT_DB_ALIAS, 'AB': TEST_SHARD},
+)
+class ShardingTests(TransactionTestCase):
+    databases = {DEFAULT_DB_ALIAS, TEST_SHARD}
+
+    def setUp(self):
+        django_cache.clear()
+        reference.invalidate()
+        self.category = Category.objects.create(name='Plumbing')
+        self.lagos = State.objects.create(name='Lagos', code='LA')
+        self.abia = State.objects.create(name='Abia', code='AB')
+        self.ikeja = City.objects.create(name='Ikeja', state=self.lagos)
+        self.aba = City.objects.create(name='Aba', state=self.abia)
+        self.client_user = User.objects.create_user('client', role='client')
+        self.lagos_artisan = self.make_artisan('lagos', self.ikeja)
+        self.abia_artisan = self.make_artisan('abia', self.aba)
+
+    def make_artisan(self, username, city):
+        return ArtisanProfile.objects.create(
+            user=User.objects.create_user(username, role='artisan'),
+            category=self.category,
+            bio='Pipes and drains',
+            hourly_rate=5000,
+            state_id=city.state_id,
+            city=city,
+            is_verified=True,
+        )
+
+    def review(self, artisan, rating=5):
+        return Review.objects.create(
+            client=self.client_user, artisan=artisan, rating=rating, title='Great', comment='Fixed the leak'
+        )
+
+    def stored_on(self, model, pk):
+        return [alias for alias in (DEFAULT_DB_ALIAS, TEST_SHARD) if model._base_manager.using(alias).filter(pk=pk).exists()]
+
+    def test_artisans_are_stored_on_the_shard_of_their_state(self):
+        self.assertEqual(self.lagos_artisan._state.db, DEFAULT_DB_ALIAS)
+        self.assertEqual(self.abia_artisan._state.db, TEST_SHARD)
+        self.assertEqual(self.stored_on(ArtisanProfile, self.abia_artisan.pk), [TEST_SHARD])
+        self.assertEqual(sharding.locate(ArtisanProfile, self.abia_artisan.pk), TEST_SHARD)
+        self.assertNotEqual(self.lagos_artisan.pk, self.abia_artisan.pk)
+
+    def test_global_rows_are_copied_to_every_shard(self):
+        self.assertTrue(State.objects.using(TEST_SHARD).filter(code='AB').exists())
+        self.assertTrue(User.objects.using(TEST_SHARD).filter(username='abia').exists())
+
+    def test_reviews_follow_their_artisan(self):
+        review = self.review(self.abia_artisan)
+        self.assertEqual(review._state.db, TEST_SHARD)
+        self.assertEqual(router.db_for_read(Review, instance=review), TEST_SHARD)
+        self.assertEqual(Review.objects.get(pk=review.pk)._state.db, TEST_SHARD)
+        self.assertEqual(list(self.abia_artisan.reviews.all()), [review])
+        self.assertFalse(self.lagos_artisan.reviews.exists())
+        self.assertFalse(router.allow_relation(self.lagos_artisan, self.abia_artisan))
+        self.assertTrue(router.allow_relation(self.abia_artisan, self.client_user))
+
+    def test_unscoped_reads_cover_every_shard(self):
+        self.review(self.lagos_artisan, rating=4)
+        self.review(self.abia_artisan, rating=2)
+        artisans = ArtisanProfile.objects.order_by('-pk')
+        expected = sorted([self.lagos_artisan.pk, self.abia_artisan.pk], reverse=True)
+        self.assertEqual([artisan.pk for artisan in artisans], expected)
+        self.assertEqual([artisan.pk for artisan in artisans[1:]], expected[1:])
+        self.assertEqual(ArtisanProfile.objects.filter(is_verified=True).count(), 2)
+        self.assertEqual(ArtisanProfile.objects.get(user__username='abia'), self.abia_artisan)
+        self.assertEqual(Review.objects.aggregate(Avg('rating'))['rating__avg'], 3)
+        self.assertEqual(list(Review.objects.order_by('rating').values_list('rating', flat=True)), [2, 4])
+        self.assertEqual(list(Review.objects.dates('created_at', 'year')), [timezone.localdate().replace(month=1, day=1)])
+
+    def test_queries_that_cannot_be_merged_raise(self):
+        with self.assertRaises(sharding.ShardingError):
+            list(Review.objects.values('rating').annotate(n=Count('pk')))
+        # The skill links have a plain manager
+        with self.assertRaises(sharding.ShardingError):
+            list(ArtisanProfile.skills.through.objects.all())
+        self.assertEqual(sharding.count_by(Review.objects.none(), 'rating'), {})
+
+    def test_unscoped_writes_apply_on_every_shard(self):
+        self.review(self.lagos_artisan)
+        self.review(self.abia_artisan)
+        self.assertEqual(ArtisanProfile.objects.update(is_verified=False), 2)
+        self.assertFalse(ArtisanProfile.objects.using(TEST_SHARD).get().is_verified)
+
+        other = User.objects.create_user('other', role='client')
+        reviews = Review.objects.bulk_create([
+            Review(client=other, artisan=artisan, rating=3, title='Again', comment='Fine')
+            for artisan in (self.lagos_artisan, self.abia_artisan)
+        ])
+        self.assertEqual([review._state.db for review in reviews], [DEFAULT_DB_ALIAS, TEST_SHARD])
+        for review in reviews:
+            review.rating = 1
+        self.assertEqual(Review.objects.bulk_update(reviews, ['rating']), 2)
+        deleted, counts = Review.objects.filter(rating=1).delete()
+        self.assertEqual(counts['reviews.Review'], 2)
+        self.assertEqual(Review.objects.count(), 2)
+
+    def test_atomic_rolls_back_every_shard(self):
+        with self.assertRaises(RuntimeError), sharding.atomic():
+            ArtisanProfile.objects.update(bio='Changed')
+            raise RuntimeError
+        self.assertEqual(set(ArtisanProfile.objects.values_list('bio', flat=True)), {'Pipes and drains'})
+
+    def test_relocate_moves_the_artisan_and_its_rows(self):
+        review = self.review(self.abia_artisan)
+        self.abia_artisan.skills.add(Skill.objects.create(name='Pipes', category=self.category))
+        self.abia_artisan.state, self.abia_artisan.city = self.lagos, self.ikeja
+        self.abia_artisan.save()
+
+        moved = sharding.relocate(self.abia_artisan)
+        self.assertEqual(moved._state.db, DEFAULT_DB_ALIAS)
+        self.assertEqual(self.stored_on(ArtisanProfile, moved.pk), [DEFAULT_DB_ALIAS])
+        self.assertEqual(self.stored_on(Review, review.pk), [DEFAULT_DB_ALIAS])
+        self.assertEqual(sharding.locate(Review, review.pk), DEFAULT_DB_ALIAS)
+        self.assertEqual(moved.skills.count(), 1)
+
+    def test_failed_relocate_leaves_everything_in_place(self):
+        review = self.review(self.abia_artisan)
+        self.abia_artisan.state, self.abia_artisan.city = self.lagos, self.ikeja
+        self.abia_artisan.save()
+
+        with mock.patch.object(sharding, '_purge', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            sharding.relocate(self.abia_artisan)
+        self.assertEqual(self.stored_on(ArtisanProfile, self.abia_artisan.pk), [TEST_SHARD])
+        self.assertEqual(self.stored_on(Review, review.pk), [TEST_SHARD])
+        self.assertEqual(sharding.locate(Review, review.pk), TEST_SHARD)
+
+    def test_on_shard_pins_unscoped_queries(self):
+        with sharding.on_shard(TEST_SHARD):
+            self.assertEqual(list(ArtisanProfile.objects.all()), [self.abia_artisan])
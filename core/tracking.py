@@ -0,0 +1,102 @@
+"""
+Dirty-field tracking for models that are edited a few fields at a time.
+
+``DirtyFieldsMixin`` remembers the values an instance was loaded with.
+``save()`` on a loaded instance then writes only the fields whose value
+changed (plus ``auto_now`` fields), so ``post_save`` receivers see the
+changed fields in ``update_fields``. When none did it skips the query but
+still sends ``pre_save`` and ``post_save``, with an empty ``update_fields``.
+Values are compared after ``field.to_python()``, so ``'5000'`` from a form
+equals ``Decimal('5000.00')``, and ``None`` equals ``''`` for string
+fields. Saves of new instances and saves that pass ``update_fields`` or
+positional arguments behave as usual.
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import router
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import post_save, pre_save
+
+
+def _snapshot(value):
+    # File fields compare by name; the FieldFile object is mutated in place
+    return value.name if isinstance(value, FieldFile) else value
+
+
+def fields_changed(update_fields, *names):
+    """Whether a ``post_save`` with ``update_fields`` may have changed ``names``"""
+    return update_fields is None or not update_fields.isdisjoint(names)
+
+
+class DirtyFieldsMixin:
+    """Save only the fields that changed since the instance was loaded"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_values()
+        return instance
+
+    def _remember_values(self, fields=None):
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (fields is None or field.name in fields):
+                loaded[field.attname] = _snapshot(self.__dict__[field.attname])
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._remember_values(fields)
+
+    @staticmethod
+    def _same_value(field, old, new):
+        new = _snapshot(new)
+        if old is new:
+            return True
+        try:
+            new = field.to_python(new)
+        except ValidationError:
+            return False
+        if field.empty_strings_allowed and old in (None, '') and new in (None, ''):
+            return True
+        return old == new
+
+    def get_dirty_fields(self):
+        """Names of fields changed since loading, or None if not loaded from the database"""
+        loaded = self.__dict__.get('_loaded_values')
+        if loaded is None or self._state.adding:
+            return None
+        dirty = []
+        for field in self._meta.concrete_fields:
+            # Deferred fields are not in __dict__ and cannot have changed
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if field.attname not in loaded or not self._same_value(
+                field, loaded[field.attname], self.__dict__[field.attname]
+            ):
+                dirty.append(field.name)
+        return dirty
+
+    def _save_unchanged(self, using):
+        using = using or router.db_for_write(self.__class__, instance=self)
+        update_fields = frozenset()
+        pre_save.send(
+            sender=self.__class__, instance=self, raw=False, using=using, update_fields=update_fields
+        )
+        post_save.send(
+            sender=self.__class__, instance=self, created=False, update_fields=update_fields,
+            raw=False, using=using
+        )
+
+    def save(self, *args, **kwargs):
+        if not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            dirty = self.get_dirty_fields()
+            if dirty is not None:
+                if not dirty:
+                    self._save_unchanged(kwargs.get('using'))
+                    return
+                kwargs['update_fields'] = dirty + [
+                    field.name for field in self._meta.concrete_fields
+                    if getattr(field, 'auto_now', False) and field.name not in dirty
+                ]
+        super().save(*args, **kwargs)
+        self._remember_values(kwargs.get('update_fields'))
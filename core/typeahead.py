@@ -0,0 +1,293 @@
+"""
+In-process prefix index for search-box suggestions.
+
+Every artisan name, skill, category, city and state is an entry with a
+popularity weight (listed artisans it covers, or reviews and views for an
+artisan). Each word of an entry's normalized label starts a key, so
+"inst" finds "Solar Installation". Keys live in one sorted list of interned
+strings with a parallel ``array`` of entry numbers; a lookup is a bisect
+plus a scan of the matching run.
+
+The index is built when the worker starts (see ``wsgi.py``) or on first use,
+patched in place from model signals, and rebuilt from scratch every
+``TYPEAHEAD_REFRESH`` seconds so that weights and changes made by other
+processes catch up. Patches copy the key arrays and swap them in as one
+tuple, so readers never take a lock.
+"""
+
+import bisect
+import heapq
+import logging
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.urls import reverse
+
+from artisan_marketplace import sharding
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = getattr(settings, 'TYPEAHEAD_REFRESH', 60 * 10)
+SCAN_LIMIT = 5000
+
+ARTISAN, SKILL, CATEGORY, CITY, STATE = range(5)
+KIND_NAMES = ('artisan', 'skill', 'category', 'city', 'state')
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    """Lowercase ASCII words separated by single spaces"""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+def _keys(label):
+    """The label from each word start: 'solar installation', 'installation'"""
+    words = normalize(label).split(' ')
+    return [' '.join(words[index:]) for index in range(len(words)) if words[index]]
+
+
+class PrefixIndex:
+    """Append-only entry table with a sorted key -> entry lookup"""
+
+    def __init__(self):
+        self.kinds = array('B')
+        self.object_ids = array('Q')  # shard ids reach past 2**32
+        self.weights = array('I')
+        self.label_lengths = array('H')
+        self.labels = []
+        self.extra = []
+        self.live = {}
+        self.lock = threading.Lock()
+        self.built_at = time.monotonic()
+        self.sorted = ([], array('I'))
+
+    def _append(self, kind, object_id, label, weight, extra=None):
+        number = len(self.labels)
+        self.kinds.append(kind)
+        self.object_ids.append(object_id)
+        self.weights.append(weight)
+        self.labels.append(sys.intern(label))
+        self.label_lengths.append(min(len(normalize(label)), 65535))
+        self.extra.append(extra)
+        self.live[kind, object_id] = number
+        return number
+
+    def load(self, rows):
+        """Bulk-load ``(kind, id, label, weight, extra)`` rows and sort once"""
+        pairs = []
+        for row in rows:
+            number = self._append(*row)
+            pairs.extend((sys.intern(key), number) for key in _keys(row[2]))
+        pairs.sort()
+        self.sorted = ([key for key, _ in pairs], array('I', (number for _, number in pairs)))
+
+    def upsert(self, kind, object_id, label, weight, extra=None):
+        with self.lock:
+            keys, postings = self.sorted
+            keys, postings = list(keys), array('I', postings)
+            old = self.live.pop((kind, object_id), None)
+            if old is not None:
+                self._remove_keys(keys, postings, old)
+            number = self._append(kind, object_id, label, weight, extra)
+            for key in _keys(label):
+                position = bisect.bisect_left(keys, key)
+                keys.insert(position, sys.intern(key))
+                postings.insert(position, number)
+            self.sorted = (keys, postings)
+
+    def remove(self, kind, object_id):
+        with self.lock:
+            old = self.live.pop((kind, object_id), None)
+            if old is None:
+                return
+            keys, postings = list(self.sorted[0]), array('I', self.sorted[1])
+            self._remove_keys(keys, postings, old)
+            self.sorted = (keys, postings)
+
+    def _remove_keys(self, keys, postings, number):
+        for key in _keys(self.labels[number]):
+            position = bisect.bisect_left(keys, key)
+            while position < len(keys) and keys[position] == key:
+                if postings[position] == number:
+                    del keys[position]
+                    del postings[position]
+                    break
+                position += 1
+
+    def weight(self, kind, object_id):
+        number = self.live.get((kind, object_id))
+        return self.weights[number] if number is not None else 0
+
+    def search(self, query, limit=8):
+        """Return the ``limit`` heaviest entries with a word starting with ``query``"""
+        query = normalize(query)
+        if not query:
+            return []
+        keys, postings = self.sorted
+        position = bisect.bisect_left(keys, query)
+        best = {}
+        end = min(len(keys), position + SCAN_LIMIT)
+        while position < end and keys[position].startswith(query):
+            number = postings[position]
+            # Matches at the start of the label rank above mid-label ones
+            whole = len(keys[position]) == self.label_lengths[number]
+            score = (self.weights[number] + 1) * (2 if whole else 1)
+            if score > best.get(number, 0):
+                best[number] = score
+            position += 1
+        top = heapq.nlargest(limit, best.items(), key=lambda item: (item[1], -item[0]))
+        return [self.entry(number) for number, _ in top]
+
+    def entry(self, number):
+        kind = self.kinds[number]
+        return {
+            'type': KIND_NAMES[kind],
+            'id': self.object_ids[number],
+            'label': self.labels[number],
+            'url': _url(kind, self.object_ids[number], self.labels[number], self.extra[number]),
+        }
+
+
+def _url(kind, object_id, label, extra):
+    if kind == ARTISAN:
+        return reverse('core:artisan_detail', args=[object_id])
+    if kind == SKILL:
+        params = {'search': label}
+    elif kind == CATEGORY:
+        params = {'category': object_id}
+    elif kind == CITY:
+        params = {'state': extra, 'city': object_id}
+    else:
+        params = {'state': object_id}
+    return f"{reverse('core:artisan_list')}?{urlencode(params)}"
+
+
+def _listed():
+    return Q(artisans__is_verified=True, artisans__user__is_active=True)
+
+
+def _artisan_row(artisan_id):
+    """Entry row of a listed artisan, or None"""
+    from artisans.models import ArtisanProfile
+
+    row = ArtisanProfile.objects.filter(
+        pk=artisan_id,
+        is_verified=True,
+        user__is_active=True
+    ).annotate(review_count=Count('reviews', filter=Q(reviews__is_hidden=False))).values_list(
+        'pk', 'user__first_name', 'user__last_name', 'user__username', 'review_count', 'profile_views'
+    ).first()
+    return _artisan_entry(*row) if row else None
+
+
+def _artisan_entry(pk, first_name, last_name, username, review_count, views):
+    label = f'{first_name} {last_name}'.strip() or username
+    return (ARTISAN, pk, label, review_count * 5 + views // 10, None)
+
+
+def _rows():
+    from artisans.models import ArtisanProfile, Category, City, Skill, State
+
+    for _ in sharding.each_shard():
+        artisans = ArtisanProfile.objects.filter(
+            is_verified=True,
+            user__is_active=True
+        ).annotate(review_count=Count('reviews', filter=Q(reviews__is_hidden=False))).values_list(
+            'pk', 'user__first_name', 'user__last_name', 'user__username', 'review_count', 'profile_views'
+        )
+        for row in artisans.iterator(chunk_size=5000):
+            yield _artisan_entry(*row)
+
+    listed = Count('artisans', filter=_listed())
+    for pk, name, count in _counted(Skill.objects.all(), listed, 'pk', 'name'):
+        yield (SKILL, pk, name, count, None)
+    for pk, name, count in _counted(Category.objects.all(), listed, 'pk', 'name'):
+        yield (CATEGORY, pk, name, count, None)
+
+    in_place = Count('artisanprofile', filter=Q(
+        artisanprofile__is_verified=True,
+        artisanprofile__user__is_active=True
+    ))
+    for pk, name, count in _counted(State.objects.all(), in_place, 'pk', 'name'):
+        yield (STATE, pk, name, count, None)
+    for pk, name, state_id, state_name, count in _counted(
+        City.objects.all(), in_place, 'pk', 'name', 'state_id', 'state__name'
+    ):
+        yield (CITY, pk, f'{name}, {state_name}', count, state_id)
+
+
+def _counted(queryset, count, *fields):
+    """``fields`` of each row and its ``count`` of artisans, summed over the shards"""
+    totals = {}
+    for alias in sharding.shards() or [None]:
+        for *values, n in queryset.using(alias).annotate(n=count).values_list(*fields, 'n'):
+            key = tuple(values)
+            totals[key] = totals.get(key, 0) + n
+    return [(*key, n) for key, n in totals.items()]
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def build_index():
+    """Build a fresh index from the database and make it current"""
+    global _index
+    index = PrefixIndex()
+    index.load(_rows())
+    _index = index
+    return index
+
+
+def get_index():
+    """The current index, built on first use and rebuilt when stale"""
+    index = _index
+    if index is not None and time.monotonic() - index.built_at < REFRESH_SECONDS:
+        return index
+    with _build_lock:
+        if _index is index:
+            index = build_index()
+        return _index
+
+
+def warm_index():
+    """Build the index at worker start without failing the worker"""
+    try:
+        build_index()
+    except Exception:
+        logger.exception('Could not build the typeahead index')
+
+
+def suggest(query, limit=8):
+    return get_index().search(query, limit)
+
+
+# Signal hooks; they only patch an index this process has already built
+
+def refresh_artisan(artisan_id):
+    if _index is None:
+        return
+    row = _artisan_row(artisan_id)
+    if row is None:
+        _index.remove(ARTISAN, artisan_id)
+    else:
+        _index.upsert(*row)
+
+
+def refresh_named(kind, object_id, label, extra=None):
+    if _index is not None:
+        _index.upsert(kind, object_id, label, _index.weight(kind, object_id), extra)
+
+
+def remove(kind, object_id):
+    if _index is not None:
+        _index.remove(kind, object_id)
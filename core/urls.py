@@ -2,7 +2,8 @@ from django.urls import path
 from .views import (
     HomeView, ArtisanListView, artisan_detail_view,
     ContactView, about_view, join_as_artisan_view,
-    how_it_works_view, success_stories_view, help_center_view
+    how_it_works_view, success_stories_view, help_center_view,
+    export_view, profile_list_view, profile_detail_view, profile_stacks_view
 )
 
 app_name = 'core'
@@ -17,4 +18,8 @@ urlpatterns = [
     path('how-it-works/', how_it_works_view, name='how_it_works'),
     path('success-stories/', success_stories_view, name='success_stories'),
     path('help-center/', help_center_view, name='help_center'),
+    path('export/<str:name>/', export_view, name='export'),
+    path('profiles/', profile_list_view, name='profile_list'),
+    path('profiles/<str:profile_id>/', profile_detail_view, name='profile_detail'),
+    path('profiles/<str:profile_id>/stacks/', profile_stacks_view, name='profile_stacks'),
 ]
\ No newline at end of file
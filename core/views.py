@@ -1,13 +1,19 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.db.models import Q, Avg, Count
+from django.db import transaction
 from django.core.paginator import Paginator
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse
 from django.views.generic import TemplateView, FormView
 from django.urls import reverse
-from artisans.models import ArtisanProfile, Category, State, City
-from reviews.models import Review
-from .models import FAQ
+from artisans.models import ArtisanProfile, SimilarArtisan
+from reviews.models import Recommendation, Review
+from . import profiling, reference
+from .cache import homepage, site_stats
+from .exports import EXPORTS, FORMATS, export_response
+from .filters import listed_cards, search_artisans, sort_artisans
 from .forms import ContactForm, ArtisanSearchForm
+from .outbox import queue_email
 
 
 class HomeView(TemplateView):
@@ -17,34 +23,24 @@ class HomeView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Get featured categories (top 6 by artisan count)
-        featured_categories = Category.objects.annotate(
-            artisan_count=Count('artisans')
-        ).order_by('-artisan_count')[:6]
-        
-        # Get top-rated artisans (at least 4.0 rating with 3+ reviews)
-        top_artisans = ArtisanProfile.objects.filter(
-            is_verified=True,
-            user__is_active=True
-        ).annotate(
-            avg_rating=Avg('reviews__rating'),
-            review_count=Count('reviews')
-        ).filter(
-            avg_rating__gte=4.0,
-            review_count__gte=3
-        ).order_by('-avg_rating', '-review_count')[:8]
-        
-        # Recent reviews
-        recent_reviews = Review.objects.select_related(
-            'client', 'artisan__user'
-        ).order_by('-created_at')[:6]
+        # Personal recommendations, precomputed by compute_recommendations
+        recommended_artisans = []
+        if self.request.user.is_authenticated and self.request.user.is_client:
+            ranks = dict(Recommendation.objects.filter(
+                client=self.request.user
+            ).values_list('artisan_id', 'rank'))
+            # The cards come from the listings, which are on default too
+            recommended_artisans = sorted(
+                listed_cards().filter(pk__in=list(ranks)),
+                key=lambda listing: ranks[listing.pk],
+            )[:4]
         
+        stats = site_stats()
+        context.update(homepage())
         context.update({
-            'featured_categories': featured_categories,
-            'top_artisans': top_artisans,
-            'recent_reviews': recent_reviews,
-            'total_artisans': ArtisanProfile.objects.filter(is_verified=True).count(),
-            'total_categories': Category.objects.count(),
+            'recommended_artisans': recommended_artisans,
+            'total_artisans': stats['total_artisans'],
+            'total_categories': stats['total_categories'],
         })
         
         return context
@@ -57,14 +53,8 @@ class ArtisanListView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Base queryset
-        artisans = ArtisanProfile.objects.filter(
-            is_verified=True,
-            user__is_active=True
-        ).select_related('user', 'category', 'state', 'city').annotate(
-            avg_rating=Avg('reviews__rating'),
-            review_count=Count('reviews')
-        )
+        # One flat table holds everything the cards and filters need
+        artisans = listed_cards()
         
         # Search and filtering
         search_query = self.request.GET.get('search', '')
@@ -77,46 +67,8 @@ class ArtisanListView(TemplateView):
         verified_only = self.request.GET.get('verified_only', '')
         sort_by = self.request.GET.get('sort_by', 'newest')
         
-        # Apply filters
-        if search_query:
-            artisans = artisans.filter(
-                Q(user__first_name__icontains=search_query) |
-                Q(user__last_name__icontains=search_query) |
-                Q(category__name__icontains=search_query) |
-                Q(skills__name__icontains=search_query) |
-                Q(bio__icontains=search_query)
-            ).distinct()
-        
-        if category_id:
-            artisans = artisans.filter(category_id=category_id)
-        
-        if state_id:
-            artisans = artisans.filter(state_id=state_id)
-        
-        if city_id:
-            artisans = artisans.filter(city_id=city_id)
-        
-        if min_rate:
-            artisans = artisans.filter(hourly_rate__gte=min_rate)
-        
-        if max_rate:
-            artisans = artisans.filter(hourly_rate__lte=max_rate)
-        
-        if min_rating:
-            artisans = artisans.filter(avg_rating__gte=min_rating)
-        
-        if verified_only:
-            artisans = artisans.filter(is_verified=True)
-        
-        # Sorting
-        if sort_by == 'rating':
-            artisans = artisans.order_by('-avg_rating', '-review_count')
-        elif sort_by == 'price_low':
-            artisans = artisans.order_by('hourly_rate')
-        elif sort_by == 'price_high':
-            artisans = artisans.order_by('-hourly_rate')
-        else:  # newest
-            artisans = artisans.order_by('-created_at')
+        artisans, corrected_query = search_artisans(artisans, self.request.GET)
+        artisans = sort_artisans(artisans, sort_by)
         
         # Pagination
         paginator = Paginator(artisans, 12)
@@ -124,12 +76,14 @@ class ArtisanListView(TemplateView):
         page_obj = paginator.get_page(page_number)
         
         # Context data
+        data = reference.get()
         context.update({
             'artisans': page_obj,
-            'categories': Category.objects.all().order_by('name'),
-            'states': State.objects.all().order_by('name'),
-            'cities': City.objects.all().order_by('name'),
+            'categories': data.categories,
+            'states': data.states,
+            'cities': data.cities,
             'search_query': search_query,
+            'corrected_query': corrected_query,
             'category_id': category_id,
             'state_id': state_id,
             'city_id': city_id,
@@ -157,7 +111,7 @@ def artisan_detail_view(request, pk):
     artisan.increment_views()
     
     # Get reviews with pagination
-    reviews = Review.objects.filter(artisan=artisan).select_related(
+    reviews = Review.objects.filter(artisan=artisan, is_hidden=False).select_related(
         'client'
     ).order_by('-created_at')
     
@@ -172,15 +126,8 @@ def artisan_detail_view(request, pk):
         not Review.objects.filter(client=request.user, artisan=artisan).exists()
     )
     
-    # Related artisans (same category, same state)
-    related_artisans = ArtisanProfile.objects.filter(
-        category=artisan.category,
-        state=artisan.state,
-        is_verified=True,
-        user__is_active=True
-    ).exclude(pk=artisan.pk).annotate(
-        avg_rating=Avg('reviews__rating')
-    ).order_by('-avg_rating')[:4]
+    # Related artisans and their cards, precomputed by compute_similar_artisans
+    related_artisans = SimilarArtisan.objects.filter(artisan_id=artisan.pk).order_by('rank')[:4]
     
     context = {
         'artisan': artisan,
@@ -201,7 +148,9 @@ class ContactView(FormView):
     success_url = '/contact/'
     
     def form_valid(self, form):
-        form.save()
+        with transaction.atomic():
+            message = form.save()
+            queue_email('contact_ack', message.email, {'message': message})
         messages.success(
             self.request,
             'Thank you for your message! We\'ll get back to you soon.'
@@ -210,35 +159,38 @@ class ContactView(FormView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['faqs'] = FAQ.objects.filter(is_active=True)
+        context['faqs'] = reference.get().faqs
         return context
 
 
 def about_view(request):
     """About us page"""
+    stats = site_stats()
     context = {
-        'total_artisans': ArtisanProfile.objects.filter(is_verified=True).count(),
-        'total_reviews': Review.objects.count(),
-        'total_categories': Category.objects.count(),
+        'total_artisans': stats['total_artisans'],
+        'total_reviews': stats['total_reviews'],
+        'total_categories': stats['total_categories'],
     }
     return render(request, 'core/about.html', context)
 
 
 def join_as_artisan_view(request):
     """Join as Artisan page with benefits and call-to-action"""
+    stats = site_stats()
     context = {
-        'total_artisans': ArtisanProfile.objects.filter(is_verified=True).count(),
-        'avg_rating': Review.objects.aggregate(Avg('rating'))['rating__avg'] or 0,
-        'total_reviews': Review.objects.count(),
+        'total_artisans': stats['total_artisans'],
+        'avg_rating': stats['avg_rating'],
+        'total_reviews': stats['total_reviews'],
     }
     return render(request, 'core/join_as_artisan.html', context)
 
 
 def how_it_works_view(request):
     """How it Works page explaining platform functionality"""
+    stats = site_stats()
     context = {
-        'total_categories': Category.objects.count(),
-        'total_artisans': ArtisanProfile.objects.filter(is_verified=True).count(),
+        'total_categories': stats['total_categories'],
+        'total_artisans': stats['total_artisans'],
     }
     return render(request, 'core/how_it_works.html', context)
 
@@ -247,15 +199,17 @@ def success_stories_view(request):
     """Success Stories page showcasing reviews and testimonials"""
     # Get top-rated reviews (4 stars and above)
     featured_reviews = Review.objects.filter(
-        rating__gte=4
+        rating__gte=4,
+        is_hidden=False
     ).select_related(
         'client', 'artisan__user', 'artisan__category'
     ).order_by('-rating', '-created_at')[:12]
     
     # Get some statistics
-    total_reviews = Review.objects.count()
-    avg_rating = Review.objects.aggregate(Avg('rating'))['rating__avg'] or 0
-    five_star_reviews = Review.objects.filter(rating=5).count()
+    stats = site_stats()
+    total_reviews = stats['total_reviews']
+    avg_rating = stats['avg_rating']
+    five_star_reviews = stats['five_star_reviews']
     
     context = {
         'featured_reviews': featured_reviews,
@@ -270,3 +224,47 @@ def success_stories_view(request):
 def help_center_view(request):
     """Redirect Help Center to Contact page"""
     return redirect('core:contact')
+
+
+@staff_member_required
+def export_view(request, name):
+    """Stream an export as CSV or JSON Lines, gzipped with ?gzip=1"""
+    fmt = request.GET.get('format', 'csv')
+    if name not in EXPORTS or fmt not in FORMATS:
+        raise Http404("Unknown export")
+    return export_response(name, fmt, compress=request.GET.get('gzip') == '1')
+
+
+@staff_member_required
+def profile_list_view(request):
+    """Recently saved request profiles"""
+    return render(request, 'core/profile_list.html', {
+        'profiles': profiling.recent_profiles(),
+    })
+
+
+@staff_member_required
+def profile_detail_view(request, profile_id):
+    """Top functions, SQL and heaviest stacks of one profile"""
+    profile = profiling.load_profile(profile_id)
+    if profile is None:
+        raise Http404("Profile not found")
+    return render(request, 'core/profile_detail.html', {
+        'profile': profile,
+        # The innermost frames; the full stacks are in the export
+        'stacks': [
+            (' ; '.join(stack.split(';')[-8:]), count)
+            for stack, count in list(profile['stacks'].items())[:20]
+        ],
+    })
+
+
+@staff_member_required
+def profile_stacks_view(request, profile_id):
+    """Collapsed stacks for flame graph tools"""
+    profile = profiling.load_profile(profile_id)
+    if profile is None:
+        raise Http404("Profile not found")
+    response = HttpResponse(profiling.collapsed_stacks(profile), content_type='text/plain; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{profile_id}.folded"'
+    return response
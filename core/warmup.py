@@ -0,0 +1,155 @@
+"""
+Worker warm-up and start-up timing.
+
+``wsgi.py`` calls :func:`warm_up` once the application is loaded, so the
+first request of a worker does not pay for parsing templates, compiling URL
+patterns, building the search indexes or filling the page caches. With
+``gunicorn --preload`` (see ``start.sh``) this happens once in the master
+and every forked worker inherits the result.
+
+:class:`FirstRequestReporter` wraps the WSGI application and logs, per
+worker process, how long after start (or fork) the first request arrived
+and how long it took.
+"""
+
+import logging
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_SUFFIXES = ('.html', '.txt')
+
+_started = time.monotonic()
+_first_request_pending = True
+
+
+def _forked():
+    global _started, _first_request_pending
+    _started = time.monotonic()
+    _first_request_pending = True
+
+
+os.register_at_fork(after_in_child=_forked)
+
+
+def compile_templates():
+    """Load every project template into the cached template loader"""
+    from django.template import TemplateSyntaxError, engines
+    from django.template.backends.django import DjangoTemplates
+
+    base_dir = Path(settings.BASE_DIR).resolve()
+    compiled = 0
+    for engine in engines.all():
+        if not isinstance(engine, DjangoTemplates):
+            continue
+        for directory in engine.template_dirs:
+            directory = Path(directory).resolve()
+            # Admin and other third-party templates load on demand
+            if base_dir not in directory.parents:
+                continue
+            for path in sorted(directory.rglob('*')):
+                if path.suffix not in TEMPLATE_SUFFIXES:
+                    continue
+                name = path.relative_to(directory).as_posix()
+                try:
+                    engine.get_template(name)
+                except TemplateSyntaxError:
+                    logger.exception('Could not compile template %s', name)
+                else:
+                    compiled += 1
+    return compiled
+
+
+def compile_urls():
+    """Compile every URL pattern and build the reverse lookup tables"""
+    from django.urls import URLResolver, get_resolver
+
+    # Both are computed on first access and then cached on the objects
+    def walk(resolver):
+        count = 0
+        for pattern in resolver.url_patterns:
+            pattern.pattern.regex
+            if isinstance(pattern, URLResolver):
+                count += walk(pattern)
+            else:
+                count += 1
+        resolver.reverse_dict
+        return count
+
+    return walk(get_resolver())
+
+
+def fill_caches():
+    from . import cache, reference
+
+    reference.get()
+    cache.site_stats(refresh=True)
+    cache.homepage(refresh=True)
+
+
+def build_indexes():
+    from . import spelling, typeahead
+
+    typeahead.warm_index()
+    spelling.warm_index()
+
+
+STEPS = (
+    ('templates', compile_templates),
+    ('urls', compile_urls),
+    ('caches', fill_caches),
+    ('indexes', build_indexes),
+)
+
+
+def warm_up():
+    """Run every warm-up step, logging failures instead of raising"""
+    from django.db import connections
+
+    timings = []
+    begin = time.monotonic()
+    for name, step in STEPS:
+        step_begin = time.monotonic()
+        try:
+            count = step()
+        except Exception:
+            logger.exception('Warm-up step %s failed', name)
+            count = None
+        if count is not None:
+            name = f'{count} {name}'
+        timings.append(f'{name} {(time.monotonic() - step_begin) * 1000:.0f} ms')
+    # Forked workers must not share the master's database connections
+    connections.close_all()
+    logger.info(
+        'Process %d warmed up in %.0f ms (%s), ready %.0f ms after start',
+        os.getpid(), (time.monotonic() - begin) * 1000, ', '.join(timings),
+        (time.monotonic() - _started) * 1000,
+    )
+
+
+class FirstRequestReporter:
+    """WSGI middleware that logs each worker's first request"""
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        global _first_request_pending
+        if not _first_request_pending:
+            return self.application(environ, start_response)
+
+        _first_request_pending = False
+        arrived = time.monotonic()
+        try:
+            return self.application(environ, start_response)
+        finally:
+            logger.info(
+                'Worker %d got its first request %.0f ms after start; %s %s took %.1f ms',
+                os.getpid(), (arrived - _started) * 1000,
+                environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'),
+                (time.monotonic() - arrived) * 1000,
+            )
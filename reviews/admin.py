@@ -1,63 +1,88 @@
 from django.contrib import admin
-from django.utils import timezone
 from .models import Review, ReviewHelpful, ReviewReport
+from . import moderation
+from core.admin_mixins import RelatedLabelsMixin, ShardedAdminMixin
+from core.exports import export_action
+
+REVIEW_LABEL = ('client', 'artisan__user')
 
 
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(ShardedAdminMixin, RelatedLabelsMixin, admin.ModelAdmin):
     list_display = (
         'client', 'artisan', 'rating', 'title', 'would_recommend',
-        'created_at'
+        'open_report_count', 'is_hidden', 'created_at'
     )
     list_filter = (
-        'rating', 'would_recommend', 'created_at',
+        'rating', 'would_recommend', 'is_hidden', 'created_at',
         'artisan__category', 'artisan__state'
     )
     search_fields = (
         'client__username', 'artisan__user__username',
         'title', 'comment'
     )
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('open_report_count', 'auto_hidden', 'created_at', 'updated_at')
     date_hierarchy = 'created_at'
+    actions = [export_action('reviews')]
+    autocomplete_fields = ('client', 'artisan')
+    list_select_related = ('client', 'artisan__user', 'artisan__category')
+    label_related = REVIEW_LABEL
+    autocomplete_search_fields = ('^title', '^client__username', '^artisan__user__username')
+    choice_related = {'artisan': ('user', 'category')}
     
     fieldsets = (
         ('Review Information', {
             'fields': ('client', 'artisan', 'rating', 'title', 'comment', 'would_recommend')
         }),
+        ('Moderation', {
+            'fields': ('open_report_count', 'is_hidden', 'auto_hidden')
+        }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
+    
+    def save_model(self, request, obj, form, change):
+        # A moderator changed the visibility; dismissing reports keeps it
+        if 'is_hidden' in form.changed_data:
+            obj.auto_hidden = False
+        super().save_model(request, obj, form, change)
 
 
 @admin.register(ReviewHelpful)
-class ReviewHelpfulAdmin(admin.ModelAdmin):
+class ReviewHelpfulAdmin(ShardedAdminMixin, RelatedLabelsMixin, admin.ModelAdmin):
     list_display = ('review', 'user', 'is_helpful', 'created_at')
     list_filter = ('is_helpful', 'created_at')
     search_fields = ('review__title', 'user__username')
+    autocomplete_fields = ('review', 'user')
+    list_select_related = ('user', 'review__client', 'review__artisan__user')
+    choice_related = {'review': REVIEW_LABEL}
 
 
 @admin.register(ReviewReport)
-class ReviewReportAdmin(admin.ModelAdmin):
+class ReviewReportAdmin(ShardedAdminMixin, RelatedLabelsMixin, admin.ModelAdmin):
     list_display = (
-        'review', 'reporter', 'reason', 'is_resolved',
+        'review', 'reporter', 'reason', 'is_resolved', 'is_dismissed',
         'created_at', 'resolved_by'
     )
-    list_filter = ('reason', 'is_resolved', 'created_at')
+    list_filter = ('reason', 'is_resolved', 'is_dismissed', 'created_at')
     search_fields = (
         'review__title', 'reporter__username',
         'details', 'resolved_by__username'
     )
     readonly_fields = ('created_at', 'resolved_at')
     date_hierarchy = 'created_at'
+    autocomplete_fields = ('review', 'reporter', 'resolved_by')
+    list_select_related = ('reporter', 'resolved_by', 'review__client', 'review__artisan__user')
+    choice_related = {'review': REVIEW_LABEL}
     
     fieldsets = (
         ('Report Information', {
             'fields': ('review', 'reporter', 'reason', 'details')
         }),
         ('Resolution', {
-            'fields': ('is_resolved', 'resolved_at', 'resolved_by'),
+            'fields': ('is_resolved', 'is_dismissed', 'resolved_at', 'resolved_by'),
             'classes': ('collapse',)
         }),
         ('Timestamps', {
@@ -66,14 +91,16 @@ class ReviewReportAdmin(admin.ModelAdmin):
         }),
     )
     
-    actions = ['resolve_reports']
+    actions = ['resolve_reports', 'dismiss_reports']
     
     def resolve_reports(self, request, queryset):
-        """Resolve selected reports"""
-        count = 0
-        for report in queryset.filter(is_resolved=False):
-            report.resolve_report(request.user)
-            count += 1
-        
+        """Resolve selected reports and hide their reviews"""
+        count = moderation.resolve_reports(queryset, request.user)
         self.message_user(request, f'{count} report(s) resolved successfully.')
-    resolve_reports.short_description = "Resolve selected reports"
+    resolve_reports.short_description = "Resolve selected reports and hide reviews"
+    
+    def dismiss_reports(self, request, queryset):
+        """Dismiss selected reports"""
+        count = moderation.resolve_reports(queryset, request.user, dismiss=True)
+        self.message_user(request, f'{count} report(s) dismissed.')
+    dismiss_reports.short_description = "Dismiss selected reports"
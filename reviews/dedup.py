@@ -0,0 +1,247 @@
+"""
+Near-duplicate review detection with MinHash and locality-sensitive hashing.
+
+The title and comment of a review are normalized and cut into character
+shingles. A MinHash signature of ``NUM_PERM`` values estimates the Jaccard
+similarity of two shingle sets as the share of equal positions. Signatures
+are split into ``BANDS`` bands of ``ROWS`` values; each band is hashed into
+a bucket stored in ``ReviewBucket``, so candidate duplicates of a review are
+the reviews sharing at least one bucket, found with indexed lookups instead
+of comparing against every review. Candidates whose estimated similarity is
+at least ``DUPLICATE_THRESHOLD`` count as duplicates. Fingerprints and
+buckets of the reviews on every shard are kept on ``default``.
+"""
+
+import hashlib
+import heapq
+import itertools
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+
+from artisan_marketplace import sharding
+from artisan_marketplace.sqlite.base import immediate
+
+from .models import Review, ReviewBucket, ReviewFingerprint, ReviewReport
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+DUPLICATE_THRESHOLD = 0.8
+# Ids or buckets per ``__in`` lookup, below SQLite's variable limit
+LOOKUP_CHUNK = 500
+
+_PRIME = (1 << 31) - 1
+_random = np.random.RandomState(20240531)
+_A = _random.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+_B = _random.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def shingles(text):
+    """Return the hashed character shingles of ``text``"""
+    text = _NON_WORD.sub(' ', text.lower()).strip()
+    if len(text) <= SHINGLE_SIZE:
+        return {zlib.crc32(text.encode())}
+    return {
+        zlib.crc32(text[i:i + SHINGLE_SIZE].encode())
+        for i in range(len(text) - SHINGLE_SIZE + 1)
+    }
+
+
+def signature(text):
+    """Return the MinHash signature of ``text`` as a uint32 array"""
+    values = np.fromiter(shingles(text), dtype=np.uint64) % _PRIME
+    hashed = (values[:, None] * _A[None, :] + _B[None, :]) % _PRIME
+    return hashed.min(axis=0).astype(np.uint32)
+
+
+def review_signature(review):
+    return signature(f'{review.title} {review.comment}')
+
+
+def band_buckets(sig):
+    """Return the bucket id of each band of ``sig``"""
+    return [
+        int.from_bytes(
+            hashlib.blake2b(sig[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).digest(),
+            'big',
+            signed=True,
+        )
+        for band in range(BANDS)
+    ]
+
+
+def similarity(sig, other):
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.count_nonzero(sig == other)) / NUM_PERM
+
+
+def find_duplicates(review, sig=None):
+    """Return ``[(review_id, similarity)]`` of indexed near-duplicates of ``review``"""
+    if sig is None:
+        sig = review_signature(review)
+
+    lookup = Q()
+    for band, bucket in enumerate(band_buckets(sig)):
+        lookup |= Q(band=band, bucket=bucket)
+
+    duplicates = []
+    candidates = ReviewBucket.objects.filter(lookup).exclude(
+        review_id=review.pk
+    ).values_list('review_id', flat=True).distinct()
+    for review_id, stored in ReviewFingerprint.objects.filter(
+        review_id__in=candidates
+    ).values_list('review_id', 'signature'):
+        score = similarity(sig, np.frombuffer(stored, dtype=np.uint32))
+        if score >= DUPLICATE_THRESHOLD:
+            duplicates.append((review_id, score))
+    duplicates.sort(key=lambda item: -item[1])
+    return duplicates
+
+
+def index_review(review, sig=None):
+    """Store or refresh the signature and buckets of ``review``"""
+    if sig is None:
+        sig = review_signature(review)
+    with immediate():
+        ReviewFingerprint.objects.update_or_create(
+            review=review,
+            defaults={'signature': sig.tobytes()},
+        )
+        ReviewBucket.objects.filter(review=review).delete()
+        ReviewBucket.objects.bulk_create([
+            ReviewBucket(review=review, band=band, bucket=bucket)
+            for band, bucket in enumerate(band_buckets(sig))
+        ])
+
+
+def report_duplicate(review_id, duplicates):
+    """File an automatic ``fake`` report for a review with duplicates"""
+    original_id, score = duplicates[0]
+    # One automatic report per review, see unique_automatic_report
+    _, created = ReviewReport.objects.get_or_create(
+        review_id=review_id,
+        reporter=None,
+        defaults={
+            'reason': 'fake',
+            'details': (
+                f'Automatically flagged: {score:.0%} similar to review #{original_id}'
+                f' and {len(duplicates) - 1} other(s).'
+                if len(duplicates) > 1 else
+                f'Automatically flagged: {score:.0%} similar to review #{original_id}.'
+            ),
+        },
+    )
+    return created
+
+
+def check_review(review):
+    """Index a new review and report it if it duplicates an earlier one"""
+    sig = review_signature(review)
+    duplicates = find_duplicates(review, sig)
+    index_review(review, sig)
+    if duplicates:
+        report_duplicate(review.pk, duplicates)
+    return duplicates
+
+
+def scan_reviews(chunk_size=2000, stdout=None):
+    """
+    Rebuild the index from every review, oldest first, and report each
+    review that duplicates an earlier one. Returns ``(scanned, reported)``.
+
+    The index is rebuilt in one transaction, so lookups keep seeing the old
+    one until the new one is complete. Candidates among earlier reviews are
+    read back from the rows written so far; only a chunk is held in memory.
+    """
+    scanned = reported = 0
+
+    # Reviews of every shard in id order, so "earlier" means the same everywhere
+    reviews = heapq.merge(*(
+        part.iterator(chunk_size=chunk_size)
+        for part in sharding.per_shard(Review.objects.order_by('pk').values_list('pk', 'title', 'comment'))
+    ))
+    with transaction.atomic():
+        ReviewBucket.objects.all().delete()
+        ReviewFingerprint.objects.all().delete()
+        while chunk := list(itertools.islice(reviews, chunk_size)):
+            reported += _scan_chunk(chunk)
+            scanned += len(chunk)
+            if stdout is not None:
+                stdout.write(f'Scanned {scanned} reviews, {reported} reported')
+    return scanned, reported
+
+
+def _slices(values):
+    values = sorted(values)
+    for start in range(0, len(values), LOOKUP_CHUNK):
+        yield values[start:start + LOOKUP_CHUNK]
+
+
+def _indexed(keys):
+    """``(buckets, signatures)`` of the indexed reviews in the ``(band, bucket)`` pairs ``keys``"""
+    by_band = defaultdict(set)
+    for band, bucket in keys:
+        by_band[band].add(bucket)
+    buckets = defaultdict(list)
+    for band, band_keys in by_band.items():
+        for part in _slices(band_keys):
+            for review_id, bucket in ReviewBucket.objects.filter(
+                band=band, bucket__in=part
+            ).values_list('review_id', 'bucket'):
+                buckets[band, bucket].append(review_id)
+
+    signatures = {}
+    for part in _slices({review_id for ids in buckets.values() for review_id in ids}):
+        for review_id, stored in ReviewFingerprint.objects.filter(
+            review_id__in=part
+        ).values_list('review_id', 'signature'):
+            signatures[review_id] = np.frombuffer(stored, dtype=np.uint32)
+    return buckets, signatures
+
+
+def _scan_chunk(rows):
+    fingerprints = []
+    review_buckets = []
+    flagged = []
+
+    signed = []
+    for review_id, title, comment in rows:
+        sig = signature(f'{title} {comment}')
+        signed.append((review_id, sig, band_buckets(sig)))
+    buckets, signatures = _indexed({
+        (band, bucket) for _, _, keys in signed for band, bucket in enumerate(keys)
+    })
+
+    for review_id, sig, keys in signed:
+        candidates = set()
+        for band, bucket in enumerate(keys):
+            candidates.update(buckets[band, bucket])
+        duplicates = sorted(
+            (
+                (candidate, score) for candidate in candidates
+                if (score := similarity(sig, signatures[candidate])) >= DUPLICATE_THRESHOLD
+            ),
+            key=lambda item: -item[1],
+        )
+        if duplicates:
+            flagged.append((review_id, duplicates))
+
+        # Earlier reviews of the same chunk are not written yet
+        signatures[review_id] = sig
+        for band, bucket in enumerate(keys):
+            buckets[band, bucket].append(review_id)
+            review_buckets.append(ReviewBucket(review_id=review_id, band=band, bucket=bucket))
+        fingerprints.append(ReviewFingerprint(review_id=review_id, signature=sig.tobytes()))
+
+    with sharding.atomic():
+        ReviewFingerprint.objects.bulk_create(fingerprints, batch_size=1000)
+        ReviewBucket.objects.bulk_create(review_buckets, batch_size=1000)
+        return sum(report_duplicate(review_id, duplicates) for review_id, duplicates in flagged)
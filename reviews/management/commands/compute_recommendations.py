@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from reviews.recommendations import BATCH_SIZE, TOP_N, rebuild_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Rebuild artisan recommendations for clients from reviews and helpful votes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Rescore every client instead of only affected ones')
+        parser.add_argument('--top-n', type=int, default=TOP_N,
+                            help='Recommendations to keep per client')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Clients scored per batch')
+
+    def handle(self, *args, **options):
+        run = rebuild_recommendations(
+            full=options['full'],
+            n=options['top_n'],
+            batch_size=options['batch_size'],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(str(run)))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from reviews.dedup import scan_reviews
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the near-duplicate index and report copy-pasted reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        scanned, reported = scan_reviews(
+            chunk_size=options['chunk_size'],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Scanned {scanned} reviews, reported {reported} suspected duplicates'
+        ))
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('reviews', '0002_recommendations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reviewreport',
+            name='reporter',
+            field=models.ForeignKey(blank=True, help_text='Empty for reports filed automatically', null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='ReviewFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signature', models.BinaryField()),
+                ('review', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='reviews.review')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReviewBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lsh_buckets', to='reviews.review')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['band', 'bucket'], name='reviews_rev_band_d3ba9f_idx')],
+            },
+        ),
+    ]
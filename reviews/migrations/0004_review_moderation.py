@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0003_review_dedup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='is_hidden',
+            field=models.BooleanField(default=False, help_text='Hidden from public pages by moderation'),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='open_report_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of unresolved reports'),
+        ),
+        migrations.AddField(
+            model_name='reviewreport',
+            name='is_dismissed',
+            field=models.BooleanField(default=False, help_text='Resolved without action against the review'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['artisan', 'is_hidden', '-created_at'], name='reviews_rev_artisan_568d43_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['is_hidden', '-created_at'], name='reviews_rev_is_hidd_ec7bbc_idx'),
+        ),
+    ]
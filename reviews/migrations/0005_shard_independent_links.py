@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artisans', '0007_shard_independent_links'),
+        ('reviews', '0004_review_moderation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recommendation',
+            name='artisan',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='recommended_to', to='artisans.artisanprofile'),
+        ),
+        migrations.AlterField(
+            model_name='reviewbucket',
+            name='review',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='lsh_buckets', to='reviews.review'),
+        ),
+        migrations.AlterField(
+            model_name='reviewfingerprint',
+            name='review',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='reviews.review'),
+        ),
+    ]
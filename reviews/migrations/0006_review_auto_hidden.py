@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 19:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_auto_hidden(apps, schema_editor):
+    """Hidden reviews still at the report threshold were hidden automatically"""
+    Review = apps.get_model('reviews', 'Review')
+    Review.objects.using(schema_editor.connection.alias).filter(
+        is_hidden=True,
+        open_report_count__gte=getattr(settings, 'REVIEW_HIDE_THRESHOLD', 3),
+    ).update(auto_hidden=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0005_shard_independent_links'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='auto_hidden',
+            field=models.BooleanField(default=False, help_text='Hidden by reaching the report threshold rather than by a moderator'),
+        ),
+        migrations.RunPython(mark_auto_hidden, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-19 19:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('artisans', '0011_similar_artisan_cards'),
+        ('reviews', '0006_review_auto_hidden'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InteractionTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('removed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='recommendationrun',
+            name='last_review_id',
+        ),
+        migrations.RemoveField(
+            model_name='recommendationrun',
+            name='last_vote_id',
+        ),
+        migrations.AddField(
+            model_name='recommendationrun',
+            name='changes_until',
+            field=models.DateTimeField(help_text='Start of the run; later runs rescore changes made after it', null=True),
+        ),
+        migrations.AddField(
+            model_name='reviewhelpful',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['updated_at'], name='reviews_rev_updated_3ebe01_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reviewhelpful',
+            index=models.Index(fields=['updated_at'], name='reviews_rev_updated_08c437_idx'),
+        ),
+        migrations.AddField(
+            model_name='interactiontombstone',
+            name='artisan',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='artisans.artisanprofile'),
+        ),
+        migrations.AddField(
+            model_name='interactiontombstone',
+            name='client',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 19:20
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_automatic_reports(apps, schema_editor):
+    """Keep the oldest automatic report of each review and recount the open ones"""
+    alias = schema_editor.connection.alias
+    Review = apps.get_model('reviews', 'Review')
+    ReviewReport = apps.get_model('reviews', 'ReviewReport')
+    automatic = ReviewReport.objects.using(alias).filter(reporter__isnull=True)
+    keep = automatic.values('review_id').annotate(first=models.Min('pk')).values('first')
+    review_ids = list(automatic.exclude(pk__in=keep).values_list('review_id', flat=True).distinct())
+    if not review_ids:
+        return
+    automatic.exclude(pk__in=keep).delete()
+    open_reports = ReviewReport.objects.using(alias).filter(
+        review=models.OuterRef('pk'), is_resolved=False
+    ).order_by().values('review').annotate(n=models.Count('pk')).values('n')
+    Review.objects.using(alias).filter(pk__in=review_ids).update(
+        open_report_count=Coalesce(models.Subquery(open_reports), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0007_recommendation_changes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_automatic_reports, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reviewreport',
+            constraint=models.UniqueConstraint(condition=models.Q(('reporter__isnull', True)), fields=('review',), name='unique_automatic_report'),
+        ),
+    ]
@@ -2,12 +2,14 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from artisan_marketplace.sharding import ShardedManager
 from artisans.models import ArtisanProfile
+from core.tracking import DirtyFieldsMixin
 
 User = get_user_model()
 
 
-class Review(models.Model):
+class Review(DirtyFieldsMixin, models.Model):
     """Reviews and ratings for artisans"""
     
     client = models.ForeignKey(
@@ -34,12 +36,31 @@ class Review(models.Model):
         default=True,
         help_text="Would you recommend this artisan to others?"
     )
+    open_report_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of unresolved reports"
+    )
+    is_hidden = models.BooleanField(
+        default=False,
+        help_text="Hidden from public pages by moderation"
+    )
+    auto_hidden = models.BooleanField(
+        default=False,
+        help_text="Hidden by reaching the report threshold rather than by a moderator"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ShardedManager()
+    
     class Meta:
         ordering = ['-created_at']
         unique_together = ['client', 'artisan']  # One review per client per artisan
+        indexes = [
+            models.Index(fields=['artisan', 'is_hidden', '-created_at']),
+            models.Index(fields=['is_hidden', '-created_at']),
+            models.Index(fields=['updated_at']),
+        ]
     
     def __str__(self):
         return f"{self.client.get_full_name()} → {self.artisan.user.get_full_name()} ({self.rating}★)"
@@ -67,9 +88,15 @@ class ReviewHelpful(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     is_helpful = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = ShardedManager()
     
     class Meta:
         unique_together = ['review', 'user']
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
     
     def __str__(self):
         helpful_text = "helpful" if self.is_helpful else "not helpful"
@@ -88,10 +115,20 @@ class ReviewReport(models.Model):
     ]
     
     review = models.ForeignKey(Review, on_delete=models.CASCADE, related_name='reports')
-    reporter = models.ForeignKey(User, on_delete=models.CASCADE)
+    reporter = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        help_text="Empty for reports filed automatically"
+    )
     reason = models.CharField(max_length=20, choices=REPORT_REASONS)
     details = models.TextField(blank=True, max_length=500)
     is_resolved = models.BooleanField(default=False)
+    is_dismissed = models.BooleanField(
+        default=False,
+        help_text="Resolved without action against the review"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     resolved_at = models.DateTimeField(null=True, blank=True)
     resolved_by = models.ForeignKey(
@@ -102,15 +139,113 @@ class ReviewReport(models.Model):
         related_name='resolved_reports'
     )
     
+    objects = ShardedManager()
+    
     class Meta:
         unique_together = ['review', 'reporter']
+        constraints = [
+            # NULLs never conflict in unique_together, so one automatic
+            # report per review needs its own constraint
+            models.UniqueConstraint(
+                fields=['review'],
+                condition=models.Q(reporter__isnull=True),
+                name='unique_automatic_report',
+            ),
+        ]
     
     def __str__(self):
         return f"Report: {self.review} - {self.get_reason_display()}"
     
-    def resolve_report(self, admin_user):
-        """Mark report as resolved"""
-        self.is_resolved = True
-        self.resolved_at = timezone.now()
-        self.resolved_by = admin_user
-        self.save()
+    def resolve_report(self, admin_user, dismiss=False):
+        """Mark report as resolved, hiding the review unless dismissed"""
+        from .moderation import resolve_reports
+        resolve_reports(ReviewReport.objects.using(self._state.db).filter(pk=self.pk), admin_user, dismiss=dismiss)
+        self.refresh_from_db()
+
+
+
+class ReviewFingerprint(models.Model):
+    """MinHash signature of a review's title and comment"""
+    
+    review = models.OneToOneField(
+        Review, on_delete=models.CASCADE, related_name='fingerprint', db_constraint=False
+    )
+    signature = models.BinaryField()
+    
+    def __str__(self):
+        return f"Fingerprint of review {self.review_id}"
+
+
+class ReviewBucket(models.Model):
+    """LSH bucket of one signature band, used to find near-duplicate reviews"""
+    
+    review = models.ForeignKey(
+        Review, on_delete=models.CASCADE, related_name='lsh_buckets', db_constraint=False
+    )
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['band', 'bucket']),
+        ]
+    
+    def __str__(self):
+        return f"Review {self.review_id} band {self.band}"
+
+
+class Recommendation(models.Model):
+    """Precomputed artisan recommendations for a client"""
+    
+    client = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    artisan = models.ForeignKey(
+        ArtisanProfile,
+        on_delete=models.CASCADE,
+        related_name='recommended_to',
+        db_constraint=False
+    )
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['client', 'rank']
+        unique_together = ['client', 'artisan']
+        indexes = [
+            models.Index(fields=['client', 'rank']),
+        ]
+    
+    def __str__(self):
+        return f"{self.client_id} → {self.artisan_id} ({self.score:.2f})"
+
+
+class RecommendationRun(models.Model):
+    """Watermark of a recommendation rebuild"""
+    
+    changes_until = models.DateTimeField(
+        null=True,
+        help_text="Start of the run; later runs rescore changes made after it"
+    )
+    is_full = models.BooleanField(default=False)
+    clients_updated = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-finished_at']
+    
+    def __str__(self):
+        kind = "Full" if self.is_full else "Incremental"
+        return f"{kind} run at {self.finished_at:%Y-%m-%d %H:%M} ({self.clients_updated} clients)"
+
+
+class InteractionTombstone(models.Model):
+    """A deleted review or helpful vote, read by incremental recommendation runs"""
+    
+    client = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name='+', db_constraint=False)
+    artisan = models.ForeignKey(
+        ArtisanProfile, on_delete=models.DO_NOTHING, related_name='+', db_constraint=False
+    )
+    removed_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    def __str__(self):
+        return f"{self.client_id} ✕ {self.artisan_id} at {self.removed_at:%Y-%m-%d %H:%M}"
@@ -0,0 +1,122 @@
+"""
+Review moderation.
+
+``Review.open_report_count`` mirrors the number of unresolved reports of a
+review and ``Review.is_hidden`` keeps it off public pages. Filing a report
+bumps the count and hides the review once it reaches
+``settings.REVIEW_HIDE_THRESHOLD`` in a single UPDATE, so concurrent reports
+cannot lose increments. Resolving reports recounts from the reports table
+for all affected reviews at once.
+
+``Review.auto_hidden`` marks reviews hidden by the threshold. Dismissing
+reports only unhides those; a review a moderator hid stays hidden.
+
+These updates send no signals, so hiding or unhiding a review also bumps
+its ``updated_at`` for the next recommendations run and schedules it, and
+marks its day for the rollups to recount.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from artisan_marketplace import sharding
+from artisan_marketplace.sqlite.base import immediate
+from artisans.listings import refresh_listings
+from artisans.rollups import mark_stale
+
+from .models import Review, ReviewReport
+from .tasks import schedule_recommendations_update
+
+HIDE_THRESHOLD = getattr(settings, 'REVIEW_HIDE_THRESHOLD', 3)
+
+
+def report_filed(review_id):
+    """Count a new open report and auto-hide the review at the threshold"""
+    # Every expression reads the row as it was before the UPDATE
+    reaches_threshold = Q(open_report_count__gte=HIDE_THRESHOLD - 1)
+    reviews = Review.objects.filter(pk=review_id)
+    reviews.update(
+        open_report_count=F('open_report_count') + 1,
+        is_hidden=Case(
+            When(reaches_threshold, then=Value(True)),
+            default=F('is_hidden'),
+        ),
+        auto_hidden=Case(
+            When(reaches_threshold & Q(is_hidden=False), then=Value(True)),
+            default=F('auto_hidden'),
+        ),
+        updated_at=Case(
+            When(reaches_threshold & Q(is_hidden=False), then=Value(timezone.now())),
+            default=F('updated_at'),
+        ),
+    )
+    # The report that reaches the threshold takes the review out of the
+    # listing and the recommendations
+    hidden = reviews.filter(open_report_count=HIDE_THRESHOLD).values_list('artisan_id', 'created_at').first()
+    if hidden is not None:
+        artisan_id = hidden[0]
+        mark_stale([hidden], reviews.db)
+        transaction.on_commit(lambda: refresh_listings([artisan_id]), using=reviews.db)
+        transaction.on_commit(schedule_recommendations_update, using=reviews.db)
+
+
+def refresh_report_counts(reviews):
+    """Recount open reports for ``reviews`` (a Review queryset)"""
+    open_reports = ReviewReport.objects.filter(
+        review=OuterRef('pk'),
+        is_resolved=False
+    ).order_by().values('review').annotate(count=Count('pk')).values('count')
+    return reviews.update(open_report_count=Coalesce(
+        Subquery(open_reports, output_field=IntegerField()),
+        Value(0),
+    ))
+
+
+def resolve_reports(queryset, admin_user, dismiss=False):
+    """
+    Resolve the open reports in ``queryset`` with set-based updates.
+
+    Upheld reports hide their reviews. Dismissed reports unhide reviews that
+    were auto-hidden, drop below the threshold and have no upheld report.
+    Returns the number of reports resolved.
+    """
+    count = 0
+    # Reports live on the shard of their review
+    for reports in sharding.per_shard(queryset):
+        with sharding.on_shard(reports._db), immediate(using=reports._db):
+            count += _resolve(reports, admin_user, dismiss)
+    return count
+
+
+def _resolve(queryset, admin_user, dismiss):
+    reports = queryset.filter(is_resolved=False)
+    review_ids = list(reports.values_list('review_id', flat=True).distinct())
+    count = reports.update(
+        is_resolved=True,
+        is_dismissed=dismiss,
+        resolved_at=timezone.now(),
+        resolved_by=admin_user,
+    )
+    reviews = Review.objects.filter(pk__in=review_ids)
+    refresh_report_counts(reviews)
+    if dismiss:
+        upheld = ReviewReport.objects.filter(
+            is_resolved=True,
+            is_dismissed=False
+        ).values('review_id')
+        reviews.filter(auto_hidden=True, open_report_count__lt=HIDE_THRESHOLD).exclude(
+            pk__in=upheld
+        ).update(is_hidden=False, auto_hidden=False, updated_at=timezone.now())
+    else:
+        # Upheld: hidden by a moderator's decision now
+        reviews.filter(is_hidden=False).update(updated_at=timezone.now())
+        reviews.update(is_hidden=True, auto_hidden=False)
+    days = list(reviews.values_list('artisan_id', 'created_at'))
+    mark_stale(days, queryset.db)
+    artisan_ids = list({artisan_id for artisan_id, _ in days})
+    transaction.on_commit(lambda: refresh_listings(artisan_ids), using=queryset.db)
+    transaction.on_commit(schedule_recommendations_update, using=queryset.db)
+    return count
@@ -0,0 +1,229 @@
+"""
+Item-item collaborative filtering over reviews and helpful votes.
+
+Each client is a row of a sparse client x artisan matrix ``R``. A visible
+review contributes its centred rating (``rating - 2.5``) and a helpful vote
+on a visible review of an artisan contributes ``HELPFUL_WEIGHT``. With ``N`` holding the
+columns of ``R`` scaled to unit length, artisan-artisan cosine similarity is
+``N.T @ N`` and the scores of a batch of clients are::
+
+    R[batch] @ N.T @ N
+
+which never materializes the artisan x artisan matrix. The top ``TOP_N``
+unseen, listed artisans per client are stored as ``Recommendation`` rows.
+
+An incremental run only rescores clients whose scores can change: those who
+interacted with an artisan that shares a client with an artisan touched by
+a review or vote changed since the last ``RecommendationRun``, and the
+clients who changed them. Reviews and votes are found by ``updated_at``,
+deletions by the ``InteractionTombstone`` rows written when they go. The
+window starts ``CHANGE_LAG`` before the last run began, so rows committed by
+a transaction that was still open then are not missed. Such a run only
+loads the columns its scores read: the artisans of those clients, and the
+artisans of every client who shares one of them.
+
+With shards, reviews and votes are read from every shard, so a client's
+interactions with artisans anywhere count together; recommendations and
+runs are stored on ``default``.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from artisan_marketplace import sharding
+from artisans.models import ArtisanListing
+from .models import InteractionTombstone, Recommendation, RecommendationRun, Review, ReviewHelpful
+
+TOP_N = 8
+BATCH_SIZE = 1000
+# Ids per ``__in`` lookup, below SQLite's variable limit
+ID_CHUNK = 500
+HELPFUL_WEIGHT = 0.5
+CHANGE_LAG = timedelta(seconds=getattr(settings, 'RECOMMENDATION_CHANGE_LAG', 300))
+
+
+def _changes(since):
+    """``(client_ids, artisan_ids)`` of reviews and votes changed or deleted since ``since``"""
+    clients, artisans = set(), set()
+    for client_id, artisan_id in Review.objects.filter(
+        updated_at__gte=since
+    ).order_by().values_list('client_id', 'artisan_id'):
+        clients.add(client_id)
+        artisans.add(artisan_id)
+    for user_id, artisan_id in ReviewHelpful.objects.filter(
+        updated_at__gte=since
+    ).order_by().values_list('user_id', 'review__artisan_id'):
+        clients.add(user_id)
+        artisans.add(artisan_id)
+    for client_id, artisan_id in InteractionTombstone.objects.filter(
+        removed_at__gte=since
+    ).values_list('client_id', 'artisan_id'):
+        clients.add(client_id)
+        artisans.add(artisan_id)
+    return clients, artisans
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), ID_CHUNK):
+        yield ids[start:start + ID_CHUNK]
+
+
+def _entries(client_ids=None, artisan_ids=None):
+    """
+    Yield ``(client_id, artisan_id, weight)`` for visible reviews and helpful
+    votes, only those of ``client_ids`` or of ``artisan_ids`` when given
+    """
+    reviews = Review.objects.filter(is_hidden=False).values_list('client_id', 'artisan_id', 'rating')
+    votes = ReviewHelpful.objects.filter(
+        is_helpful=True,
+        user__role='client',
+        review__is_hidden=False,
+    ).values_list('user_id', 'review__artisan_id')
+    if client_ids is not None:
+        parts = [(reviews.filter(client_id__in=chunk), votes.filter(user_id__in=chunk))
+                 for chunk in _chunks(client_ids)]
+    elif artisan_ids is not None:
+        parts = [(reviews.filter(artisan_id__in=chunk), votes.filter(review__artisan_id__in=chunk))
+                 for chunk in _chunks(artisan_ids)]
+    else:
+        parts = [(reviews, votes)]
+
+    for reviews, votes in parts:
+        for shard_reviews in sharding.per_shard(reviews):
+            for client_id, artisan_id, rating in shard_reviews.iterator(chunk_size=10000):
+                yield client_id, artisan_id, rating - 2.5
+        for shard_votes in sharding.per_shard(votes):
+            for user_id, artisan_id in shard_votes.iterator(chunk_size=10000):
+                yield user_id, artisan_id, HELPFUL_WEIGHT
+
+
+def _clients_of(artisan_ids):
+    return {entry[0] for entry in _entries(artisan_ids=artisan_ids)} if artisan_ids else set()
+
+
+def _artisans_of(client_ids):
+    return {entry[1] for entry in _entries(client_ids=client_ids)} if client_ids else set()
+
+
+def affected_clients(artisan_ids, client_ids=()):
+    """``client_ids`` and the clients whose scores depend on any of ``artisan_ids``"""
+    # Clients of the artisans, their other artisans, then those artisans' clients
+    return _clients_of(_artisans_of(_clients_of(artisan_ids))) | set(client_ids)
+
+
+class Interactions:
+    """
+    Client x artisan interaction matrix with its id mappings, over every
+    artisan or only the columns of ``artisan_ids``
+    """
+
+    def __init__(self, artisan_ids=None):
+        entries = list(_entries(artisan_ids=artisan_ids))
+        entries = np.asarray(entries, dtype=np.float64).reshape(-1, 3)
+        self.client_ids, rows = np.unique(entries[:, 0].astype(np.int64), return_inverse=True)
+        self.artisan_ids, columns = np.unique(entries[:, 1].astype(np.int64), return_inverse=True)
+        weights = entries[:, 2]
+        self.matrix = sparse.csr_matrix(
+            (weights.astype(np.float32), (rows, columns)),
+            shape=(len(self.client_ids), len(self.artisan_ids)),
+        )
+
+        norms = np.sqrt(np.asarray(self.matrix.multiply(self.matrix).sum(axis=0)).ravel())
+        norms[norms == 0] = 1
+        self.normalized = (self.matrix @ sparse.diags(1 / norms)).tocsr()
+        self.normalized_t = self.normalized.T.tocsr()
+
+        listed = set()
+        for chunk in _chunks(self.artisan_ids.tolist()):
+            listed.update(ArtisanListing.objects.filter(
+                is_listed=True, pk__in=chunk
+            ).values_list('pk', flat=True))
+        self.listed = np.fromiter(
+            (artisan_id in listed for artisan_id in self.artisan_ids.tolist()),
+            dtype=bool,
+            count=len(self.artisan_ids),
+        )
+
+    def top_artisans(self, rows, n=TOP_N):
+        """Yield ``(row, artisan_columns, scores)`` for ``rows``, best first"""
+        batch = self.matrix[rows]
+        scores = ((batch @ self.normalized_t) @ self.normalized).tocsr()
+
+        for offset, row in enumerate(rows):
+            begin, end = scores.indptr[offset], scores.indptr[offset + 1]
+            columns = scores.indices[begin:end]
+            values = scores.data[begin:end]
+
+            seen = batch.indices[batch.indptr[offset]:batch.indptr[offset + 1]]
+            keep = (values > 0) & self.listed[columns] & ~np.isin(columns, seen)
+            columns, values = columns[keep], values[keep]
+            if len(values) > n:
+                best = np.argpartition(-values, n - 1)[:n]
+                columns, values = columns[best], values[best]
+            order = np.lexsort((columns, -values))
+            yield row, columns[order], values[order]
+
+
+def rebuild_recommendations(full=False, n=TOP_N, batch_size=BATCH_SIZE, stdout=None):
+    """
+    Recompute recommendations, for every client when ``full`` or else only
+    for clients affected by reviews and votes changed since the last run.
+    Returns the run.
+    """
+    last_run = None if full else RecommendationRun.objects.first()
+    if last_run is not None and last_run.changes_until is None:
+        last_run = None
+    started = timezone.now()
+
+    if last_run is None:
+        interactions = Interactions()
+        rows = np.arange(len(interactions.client_ids))
+        gone = set(Recommendation.objects.values_list('client_id', flat=True))
+    else:
+        since = last_run.changes_until - CHANGE_LAG
+        client_ids, artisan_ids = _changes(since)
+        affected = affected_clients(artisan_ids, client_ids)
+        # Their own columns and every column their neighbours' rows reach,
+        # each loaded whole so the column norms are exact
+        seen = _artisans_of(affected)
+        interactions = Interactions(artisan_ids=seen | _artisans_of(_clients_of(seen)))
+        rows = np.flatnonzero(np.isin(interactions.client_ids, list(affected)))
+        gone = client_ids
+    # Clients without any interactions left
+    gone = set(gone).difference(interactions.client_ids.tolist())
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        recommendations = [
+            Recommendation(
+                client_id=int(interactions.client_ids[row]),
+                artisan_id=int(interactions.artisan_ids[column]),
+                score=float(score),
+                rank=rank,
+            )
+            for row, columns, scores in interactions.top_artisans(batch, n)
+            for rank, (column, score) in enumerate(zip(columns, scores), start=1)
+        ]
+        with transaction.atomic():
+            Recommendation.objects.filter(
+                client_id__in=interactions.client_ids[batch].tolist()
+            ).delete()
+            Recommendation.objects.bulk_create(recommendations, batch_size=1000)
+        if stdout is not None:
+            stdout.write(f'Processed {start + len(batch)}/{len(rows)} clients')
+
+    Recommendation.objects.filter(client_id__in=gone).delete()
+    # Tombstones every later window starts after
+    InteractionTombstone.objects.filter(removed_at__lt=started - CHANGE_LAG).delete()
+
+    return RecommendationRun.objects.create(
+        changes_until=started,
+        is_full=last_run is None,
+        clients_updated=len(rows),
+    )
@@ -0,0 +1,92 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from artisans.rollups import mark_stale
+from core.tracking import fields_changed
+from .models import InteractionTombstone, Review, ReviewHelpful, ReviewReport
+from .moderation import refresh_report_counts, report_filed
+from .tasks import check_duplicate_review, reindex_review, schedule_recommendations_update
+
+# Fields the duplicate-detection signature and the recommendations read
+SIGNATURE_FIELDS = ('title', 'comment')
+INTERACTION_FIELDS = ('client', 'artisan', 'rating', 'is_hidden')
+# Fields the daily rollups count
+ROLLUP_FIELDS = ('artisan', 'rating', 'is_hidden')
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, raw=False, using=None, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        check_duplicate_review.delay(review_id=instance.pk)
+        schedule_recommendations_update()
+        return
+    if fields_changed(update_fields, *SIGNATURE_FIELDS):
+        reindex_review.delay(review_id=instance.pk)
+    if fields_changed(update_fields, *INTERACTION_FIELDS):
+        schedule_recommendations_update()
+    if fields_changed(update_fields, *ROLLUP_FIELDS):
+        artisan_ids = {instance.artisan_id, instance.__dict__.get('_loaded_values', {}).get('artisan_id')}
+        mark_stale(
+            [(artisan_id, instance.created_at) for artisan_id in artisan_ids if artisan_id is not None],
+            using,
+        )
+
+
+def _removed(client_id, artisan_id, using):
+    # Tombstones are on default; write them once the row's shard commits
+    transaction.on_commit(
+        lambda: InteractionTombstone.objects.create(client_id=client_id, artisan_id=artisan_id),
+        using=using,
+    )
+    schedule_recommendations_update()
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, using=None, **kwargs):
+    _removed(instance.client_id, instance.artisan_id, using)
+    mark_stale([(instance.artisan_id, instance.created_at)], using)
+
+
+def _vote_artisan(vote, using):
+    # The review is still there when its votes go first in a cascade
+    return Review.objects.using(using).filter(
+        pk=vote.review_id
+    ).values_list('artisan_id', flat=True).first()
+
+
+@receiver(post_save, sender=ReviewHelpful)
+def review_vote_saved(sender, instance, created, raw=False, using=None, **kwargs):
+    # New votes reach the rollups by id; edits may flip is_helpful
+    if raw or created:
+        return
+    artisan_id = _vote_artisan(instance, using)
+    if artisan_id is not None:
+        mark_stale([(artisan_id, instance.created_at)], using)
+
+
+@receiver(post_delete, sender=ReviewHelpful)
+def review_vote_deleted(sender, instance, using=None, **kwargs):
+    if not instance.is_helpful:
+        return
+    artisan_id = _vote_artisan(instance, using)
+    if artisan_id is not None:
+        _removed(instance.user_id, artisan_id, using)
+        mark_stale([(artisan_id, instance.created_at)], using)
+
+
+@receiver(post_save, sender=ReviewReport)
+def review_report_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created and not instance.is_resolved:
+        report_filed(instance.review_id)
+    elif not created:
+        refresh_report_counts(Review.objects.filter(pk=instance.review_id))
+
+
+@receiver(post_delete, sender=ReviewReport)
+def review_report_deleted(sender, instance, **kwargs):
+    refresh_report_counts(Review.objects.filter(pk=instance.review_id))
@@ -0,0 +1,31 @@
+from core.jobs import task
+from .dedup import check_review, index_review
+from .models import Review
+from .recommendations import rebuild_recommendations
+
+
+@task
+def check_duplicate_review(review_id):
+    """Index a new review and report it if it duplicates an earlier one"""
+    review = Review.objects.filter(pk=review_id).first()
+    if review is not None:
+        check_review(review)
+
+
+@task
+def reindex_review(review_id):
+    """Refresh the duplicate-detection signature of an edited review"""
+    review = Review.objects.filter(pk=review_id).first()
+    if review is not None:
+        index_review(review)
+
+
+@task(priority=-1)
+def update_recommendations():
+    """Rescore clients affected by reviews and votes since the last run"""
+    rebuild_recommendations()
+
+
+def schedule_recommendations_update():
+    """Coalesce recommendation updates into one run every few minutes"""
+    update_recommendations.schedule(countdown=300, dedup_key='reviews.update_recommendations')
@@ -1,3 +1,358 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from artisans.models import ArtisanListing, ArtisanProfile, Category, City, State
+from core.models import Job
+from . import dedup, moderation
+from .models import Recommendation, Review, ReviewBucket, ReviewFingerprint, ReviewReport
+from .moderation import resolve_reports
+from .recommendations import rebuild_recommendations
+from .tasks import reindex_review, update_recommendations
+
+ORIGINAL = (
+    'Excellent plumber',
+    'Fixed the burst pipe under our kitchen sink within an hour, cleaned up afterwards '
+    'and charged exactly what he quoted. Would definitely hire again.',
+)
+NEAR_COPY = (
+    'Excellent plumber!',
+    'Fixed the burst pipe under our kitchen sink within an hour, cleaned up afterwards '
+    'and charged exactly what he quoted. Would definitely hire him again.',
+)
+UNRELATED = (
+    'Late and rude',
+    'Arrived two days after the agreed date and left the tiles unfinished.',
+)
+
+
+class ReviewTestData:
+    """Listed artisans and clients to review them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Plumbing')
+        cls.state = State.objects.create(name='Lagos', code='LA')
+        cls.city = City.objects.create(name='Ikeja', state=cls.state)
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.ada, cls.bola, cls.chidi, cls.dayo = (
+                ArtisanProfile.objects.create(
+                    user=User.objects.create_user(name, first_name=name.title(), role='artisan'),
+                    category=cls.category,
+                    bio='Pipes and drains',
+                    hourly_rate=5000,
+                    state=cls.state,
+                    city=cls.city,
+                    is_verified=True,
+                )
+                for name in ('ada', 'bola', 'chidi', 'dayo')
+            )
+        cls.clients = [User.objects.create_user(f'client{index}', role='client') for index in range(4)]
+
+    def review(self, client, artisan, rating=5, **kwargs):
+        kwargs.setdefault('title', 'Review')
+        kwargs.setdefault('comment', 'Good')
+        with self.captureOnCommitCallbacks(execute=True):
+            return Review.objects.create(client=client, artisan=artisan, rating=rating, **kwargs)
+
+
+class RecommendationTests(ReviewTestData, TestCase):
+
+    def recommended(self, client):
+        return list(Recommendation.objects.filter(client=client).order_by('rank').values_list('artisan_id', flat=True))
+
+    def stored(self):
+        return sorted(
+            (row.client_id, row.artisan_id, row.rank, round(row.score, 5))
+            for row in Recommendation.objects.all()
+        )
+
+    def test_clients_get_artisans_liked_by_similar_clients(self):
+        first, second = self.clients[:2]
+        self.review(first, self.ada)
+        self.review(first, self.bola)
+        self.review(second, self.ada)
+        rebuild_recommendations(full=True)
+        self.assertEqual(self.recommended(second), [self.bola.pk])
+        self.assertEqual(self.recommended(first), [])
+
+    def test_hidden_reviews_are_left_out(self):
+        first, second = self.clients[:2]
+        self.review(first, self.ada)
+        self.review(first, self.bola, is_hidden=True)
+        self.review(second, self.ada)
+        rebuild_recommendations(full=True)
+        self.assertEqual(self.recommended(second), [])
+
+    def test_incremental_run_matches_a_full_run(self):
+        # A chain: changed artisan, then clients and artisans further away
+        first, second, third, fourth = self.clients
+        self.review(second, self.chidi)
+        self.review(second, self.ada)
+        self.review(third, self.ada)
+        self.review(third, self.bola, rating=4)
+        self.review(fourth, self.bola)
+        self.review(fourth, self.dayo)
+        # Older than the window of the next run
+        Review.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        rebuild_recommendations(full=True)
+
+        self.review(first, self.chidi, rating=2)
+        run = rebuild_recommendations()
+        self.assertFalse(run.is_full)
+        self.assertEqual(run.clients_updated, 3)
+        incremental = self.stored()
+
+        rebuild_recommendations(full=True)
+        self.assertEqual(incremental, self.stored())
+        self.assertIn(self.dayo.pk, self.recommended(third))
+
+    def test_deleted_review_drops_its_recommendations(self):
+        first, second = self.clients[:2]
+        self.review(first, self.ada)
+        self.review(first, self.bola)
+        own = self.review(second, self.ada)
+        rebuild_recommendations(full=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            own.delete()
+        rebuild_recommendations()
+        self.assertFalse(Recommendation.objects.filter(client=second).exists())
+
+    def test_home_page_shows_listing_cards(self):
+        first, second = self.clients[:2]
+        self.review(first, self.ada)
+        self.review(first, self.bola)
+        self.review(second, self.ada)
+        rebuild_recommendations(full=True)
+
+        self.client.force_login(second)
+        response = self.client.get(reverse('core:home'))
+        cards = response.context['recommended_artisans']
+        self.assertEqual([card.pk for card in cards], [self.bola.pk])
+        self.assertEqual(cards[0].display_name, 'Bola')
+        self.assertEqual(cards[0].review_count, 1)
+
+
+class DuplicateReviewTests(ReviewTestData, TestCase):
+
+    def written(self, index, text):
+        title, comment = text
+        artisans = [self.ada, self.bola, self.chidi, self.dayo]
+        return self.review(self.clients[index], artisans[index], title=title, comment=comment)
+
+    def test_signatures_estimate_similarity(self):
+        original = dedup.signature(' '.join(ORIGINAL))
+        self.assertEqual(dedup.similarity(original, dedup.signature(' '.join(ORIGINAL))), 1.0)
+        self.assertGreaterEqual(
+            dedup.similarity(original, dedup.signature(' '.join(NEAR_COPY))), dedup.DUPLICATE_THRESHOLD
+        )
+        self.assertLess(dedup.similarity(original, dedup.signature(' '.join(UNRELATED))), 0.2)
+
+    def test_near_copy_is_reported(self):
+        original = self.written(0, ORIGINAL)
+        self.assertEqual(dedup.check_review(original), [])
+
+        copy = self.written(1, NEAR_COPY)
+        duplicates = dedup.check_review(copy)
+        self.assertEqual([review_id for review_id, _ in duplicates], [original.pk])
+        report = ReviewReport.objects.get(review=copy)
+        self.assertEqual(report.reason, 'fake')
+        self.assertIsNone(report.reporter)
+        self.assertIn(f'#{original.pk}', report.details)
+        self.assertFalse(ReviewReport.objects.filter(review=original).exists())
+
+    def test_unrelated_review_is_not_reported(self):
+        dedup.check_review(self.written(0, ORIGINAL))
+        self.assertEqual(dedup.check_review(self.written(1, UNRELATED)), [])
+        self.assertFalse(ReviewReport.objects.exists())
+
+    def test_reindexing_replaces_the_signature(self):
+        review = self.written(0, ORIGINAL)
+        dedup.index_review(review)
+        review.title, review.comment = UNRELATED
+        review.save()
+        dedup.index_review(review)
+
+        self.assertEqual(ReviewBucket.objects.filter(review=review).count(), dedup.BANDS)
+        self.assertEqual(
+            ReviewFingerprint.objects.get(review=review).signature,
+            dedup.review_signature(review).tobytes(),
+        )
+        self.assertEqual(dedup.find_duplicates(self.written(1, ORIGINAL)), [])
+
+    def test_one_automatic_report_per_review(self):
+        copy = self.written(1, NEAR_COPY)
+        self.assertTrue(dedup.report_duplicate(copy.pk, [(self.ada.pk, 0.9)]))
+        self.assertFalse(dedup.report_duplicate(copy.pk, [(self.ada.pk, 0.9)]))
+        with self.assertRaises(IntegrityError):
+            ReviewReport.objects.create(review=copy, reporter=None, reason='spam')
+
+    def test_scan_reports_later_copies_only(self):
+        for chunk_size in (1, 2, 10):
+            with self.subTest(chunk_size=chunk_size):
+                ReviewReport.objects.all().delete()
+                original = self.written(0, ORIGINAL)
+                copy = self.written(1, NEAR_COPY)
+                self.written(2, UNRELATED)
+
+                self.assertEqual(dedup.scan_reviews(chunk_size=chunk_size), (3, 1))
+                self.assertEqual(list(ReviewReport.objects.values_list('review_id', flat=True)), [copy.pk])
+                self.assertEqual(ReviewFingerprint.objects.count(), 3)
+                self.assertEqual(ReviewBucket.objects.count(), 3 * dedup.BANDS)
+                self.assertEqual([review_id for review_id, _ in dedup.find_duplicates(copy)], [original.pk])
+                Review.objects.all().delete()
+
+    def test_rescan_files_no_new_reports(self):
+        self.written(0, ORIGINAL)
+        self.written(1, NEAR_COPY)
+        self.assertEqual(dedup.scan_reviews(), (2, 1))
+        self.assertEqual(dedup.scan_reviews(), (2, 0))
+        self.assertEqual(ReviewReport.objects.count(), 1)
+
+
+class ModerationTests(ReviewTestData, TestCase):
+
+    def setUp(self):
+        self.target = self.review(self.clients[0], self.ada)
+        self.moderator = User.objects.create_user('moderator', is_staff=True)
+
+    def report(self, count, review=None):
+        review = review or self.target
+        for index in range(count):
+            reporter = User.objects.create_user(f'reporter{ReviewReport.objects.count()}-{index}')
+            with self.captureOnCommitCallbacks(execute=True):
+                ReviewReport.objects.create(review=review, reporter=reporter, reason='spam')
+        review.refresh_from_db()
+        return review
+
+    def resolve(self, dismiss):
+        with self.captureOnCommitCallbacks(execute=True):
+            resolve_reports(ReviewReport.objects.filter(review=self.target), self.moderator, dismiss=dismiss)
+        self.target.refresh_from_db()
+
+    def test_reports_are_counted(self):
+        review = self.report(moderation.HIDE_THRESHOLD - 1)
+        self.assertEqual(review.open_report_count, moderation.HIDE_THRESHOLD - 1)
+        self.assertFalse(review.is_hidden)
+
+    def test_threshold_hides_the_review(self):
+        review = self.report(moderation.HIDE_THRESHOLD)
+        self.assertTrue(review.is_hidden)
+        self.assertTrue(review.auto_hidden)
+        self.assertEqual(ArtisanListing.objects.get(pk=self.ada.pk).review_count, 0)
+        self.assertTrue(Job.objects.filter(name=update_recommendations.name).exists())
+
+    def test_dismissing_unhides_auto_hidden_reviews(self):
+        self.report(moderation.HIDE_THRESHOLD)
+        self.resolve(dismiss=True)
+        self.assertEqual(self.target.open_report_count, 0)
+        self.assertFalse(self.target.is_hidden)
+        self.assertFalse(self.target.auto_hidden)
+        self.assertEqual(ArtisanListing.objects.get(pk=self.ada.pk).review_count, 1)
+
+    def test_dismissing_keeps_reviews_a_moderator_hid(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.target.is_hidden = True
+            self.target.save()
+        self.report(moderation.HIDE_THRESHOLD)
+        self.assertFalse(self.target.auto_hidden)
+        self.resolve(dismiss=True)
+        self.assertTrue(self.target.is_hidden)
+
+    def test_upholding_hides_for_good(self):
+        self.report(1)
+        before = self.target.updated_at
+        self.resolve(dismiss=False)
+        self.assertTrue(self.target.is_hidden)
+        self.assertFalse(self.target.auto_hidden)
+        self.assertGreater(self.target.updated_at, before)
+        self.assertTrue(ReviewReport.objects.get(review=self.target).is_resolved)
+
+        # A later dismissal does not bring it back
+        self.report(1)
+        self.resolve(dismiss=True)
+        self.assertTrue(self.target.is_hidden)
+
+
+class ReviewSignalTests(ReviewTestData, TestCase):
+
+    def setUp(self):
+        self.target = self.review(self.clients[0], self.ada)
+        Job.objects.all().delete()
+
+    def queued(self):
+        return set(Job.objects.values_list('name', flat=True))
+
+    def edit(self, **changes):
+        review = Review.objects.get(pk=self.target.pk)
+        for name, value in changes.items():
+            setattr(review, name, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            review.save()
+        return self.queued()
+
+    def test_text_edit_reindexes_only(self):
+        self.assertEqual(self.edit(comment='Changed my mind'), {reindex_review.name})
+
+    def test_rating_edit_updates_recommendations_only(self):
+        self.assertEqual(self.edit(rating=2), {update_recommendations.name})
+
+    def test_unchanged_save_queues_nothing(self):
+        self.assertEqual(self.edit(), set())
+
+
+class AdminAutocompleteTests(ReviewTestData, TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def autocomplete(self, model_name, field_name, term):
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'reviews', 'model_name': model_name, 'field_name': field_name, 'term': term,
+        })
+        return [item['text'] for item in response.json()['results']]
+
+    def more_artisans(self, count):
+        for index in range(count):
+            with self.captureOnCommitCallbacks(execute=True):
+                ArtisanProfile.objects.create(
+                    user=User.objects.create_user(f'extra{index}', first_name='Extra', role='artisan'),
+                    category=self.category, bio='Pipes', hourly_rate=5000, state=self.state, city=self.city,
+                )
+
+    def test_autocomplete_matches_prefixes(self):
+        self.assertEqual(self.autocomplete('review', 'artisan', 'bo'), ['Bola - Plumbing'])
+        self.assertEqual(self.autocomplete('review', 'artisan', 'ola'), [])
+        self.assertEqual(self.autocomplete('review', 'client', 'client3'), ['client3 (Client)'])
+        # The changelist keeps the substring search
+        response = self.client.get(reverse('admin:artisans_artisanprofile_changelist'), {'q': 'ola'})
+        self.assertEqual([artisan.pk for artisan in response.context['cl'].result_list], [self.bola.pk])
+
+    def test_autocomplete_queries_do_not_grow_with_results(self):
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(len(self.autocomplete('review', 'artisan', 'e')), 0)
+            self.autocomplete('review', 'artisan', '')
+        self.more_artisans(5)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(len(self.autocomplete('review', 'artisan', 'e')), 5)
+            self.autocomplete('review', 'artisan', '')
+        self.assertEqual(len(many), len(few))
 
-# Create your tests here.
+    def test_review_forms_run_a_fixed_number_of_queries(self):
+        review = self.review(self.clients[0], self.ada)
+        url = reverse('admin:reviews_review_change', args=[review.pk])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            self.assertContains(self.client.get(url), 'Ada - Plumbing')
+        self.more_artisans(5)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+        self.assertEqual(len(many), len(few))
+        # Autocomplete widgets render the selected option only
+        self.assertNotContains(self.client.get(url), 'Bola - Plumbing')
@@ -1,11 +1,15 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.db import router, transaction
 from django.core.paginator import Paginator
 from django.http import JsonResponse
+from django.urls import reverse
 from artisans.models import ArtisanProfile
 from .models import Review, ReviewHelpful
 from .forms import ReviewForm
+from .tasks import schedule_recommendations_update
+from core.outbox import queue_email
 
 
 @login_required
@@ -28,7 +32,16 @@ def add_review_view(request, artisan_id):
             review = form.save(commit=False)
             review.client = request.user
             review.artisan = artisan
-            review.save()
+            # The email is stored in the review's transaction, on its shard
+            using = router.db_for_write(Review, instance=review)
+            with transaction.atomic(using=using):
+                review.save(using=using)
+                queue_email('new_review', artisan.user.email, {
+                    'review': review,
+                    'artisan_url': request.build_absolute_uri(
+                        reverse('core:artisan_detail', args=[artisan.pk])
+                    ),
+                }, using=using)
             
             messages.success(request, 'Thank you for your review!')
             return redirect('core:artisan_detail', pk=artisan_id)
@@ -46,7 +59,7 @@ def review_list_view(request, artisan_id):
     """List all reviews for an artisan"""
     artisan = get_object_or_404(ArtisanProfile, pk=artisan_id, is_verified=True)
     
-    reviews = Review.objects.filter(artisan=artisan).select_related(
+    reviews = Review.objects.filter(artisan=artisan, is_hidden=False).select_related(
         'client'
     ).order_by('-created_at')
     
@@ -88,6 +101,7 @@ def mark_review_helpful(request, review_id):
             user=request.user,
             is_helpful=is_helpful
         )
+        schedule_recommendations_update()
         
         # Count helpful votes
         helpful_count = ReviewHelpful.objects.filter(
@@ -1,2 +1,3 @@
 #!/usr/bin/env bash
-gunicorn artisan_marketplace.wsgi:application --bind 0.0.0.0:$PORT
\ No newline at end of file
+# --preload warms the app once in the master (see core/warmup.py)
+gunicorn artisan_marketplace.wsgi:application --preload --bind 0.0.0.0:$PORT